@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime, Boolean, BigInteger, Numeric, Date
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime, Boolean, BigInteger, Numeric, Date, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.conn import Base
@@ -131,9 +131,19 @@ class Factura(Base):
     
     cliente_id = Column(Integer, ForeignKey("clientes.id"), nullable=True)
     
+    # ⭐ Puntero a la última comparativa OK (evita ORDER BY created_at DESC sobre comparativas)
+    ultima_comparativa_id = Column(
+        Integer,
+        ForeignKey("comparativas.id", use_alter=True, name="fk_facturas_ultima_comparativa"),
+        nullable=True,
+    )
+    
     # Relación: Una factura pertenece a un cliente
     cliente = relationship("Cliente", back_populates="facturas")
-    comparativas = relationship("Comparativa", back_populates="factura", cascade="all, delete-orphan")
+    comparativas = relationship(
+        "Comparativa", back_populates="factura", cascade="all, delete-orphan",
+        foreign_keys="Comparativa.factura_id",
+    )
 
 
 class Comparativa(Base):
@@ -154,7 +164,12 @@ class Comparativa(Base):
     status = Column(String, default="ok")
     error_json = Column(Text, nullable=True)
     
-    factura = relationship("Factura", back_populates="comparativas")
+    # ⭐ Huella de inputs + versión de catálogo/comisiones (memoización del comparador)
+    fingerprint = Column(String(64), nullable=True)
+    # ⭐ Sube cuando el delta de Step 2 reajusta los ahorros (ETag = id + revision)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    factura = relationship("Factura", back_populates="comparativas", foreign_keys=[factura_id])
     ofertas = relationship("OfertaCalculada", back_populates="comparativa", cascade="all, delete-orphan")
 
 
@@ -169,8 +184,12 @@ class OfertaCalculada(Base):
     ahorro_mensual = Column(Float, nullable=True)
     ahorro_anual = Column(Float, nullable=True)
     detalle_json = Column(Text, nullable=True)
+    # ⭐ Columnas ya existentes en Neon (versionado + comisión resuelta)
+    tarifa_version_id = Column(Integer, nullable=True)
+    comision_eur = Column(Numeric(12, 2), nullable=True)
+    comision_source = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    
+
     # Relación: Una oferta pertenece a una comparativa
     comparativa = relationship("Comparativa", back_populates="ofertas")
 
@@ -379,3 +398,86 @@ class TareaCliente(Base):
     # Relaciones
     cliente = relationship("Cliente")
     comercial = relationship("User", foreign_keys=[comercial_id])
+
+
+# ⭐ HISTÓRICO DE CONSUMO POR CUPS (anualización estacional)
+
+class ConsumoCupsMensual(Base):
+    """
+    Rollup mensual de consumo por CUPS: aportación de cada factura a cada mes
+    natural que cubre (kWh y días, prorrateados por días). Se reescribe al subir
+    o editar la factura; el comparador lee solo los 12 meses de la ventana.
+    """
+    __tablename__ = "consumo_cups_mensual"
+    __table_args__ = (UniqueConstraint("cups", "mes", "factura_id", name="unique_consumo_cups_mes_factura"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    cups = Column(String, nullable=False, index=True)
+    mes = Column(Date, nullable=False)  # Siempre día 1 del mes
+    factura_id = Column(Integer, ForeignKey("facturas.id", ondelete="CASCADE"), nullable=False, index=True)
+    kwh = Column(Float, nullable=False)
+    dias = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# ⭐ CACHÉ DE EXTRACCIÓN OCR (contenido direccionado por sha256 del archivo)
+
+class OcrExtraccion(Base):
+    """
+    Textos de los motores (pypdf / Vision) y resultado del parser por
+    (file_hash, parser_version). No depende de facturas: sobrevive al borrado
+    de la factura para que resubir o re-parsear no vuelva a pagar Vision.
+    """
+    __tablename__ = "ocr_extracciones"
+    __table_args__ = (UniqueConstraint("file_hash", "parser_version", name="unique_ocr_extraccion_hash_version"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_hash = Column(String(64), nullable=False, index=True)
+    parser_version = Column(String, nullable=False)
+    es_pdf = Column(Boolean, nullable=False, default=True)
+    motor = Column(String, nullable=False)  # pypdf | vision
+    texto_pypdf = Column(Text, nullable=True)
+    texto_vision = Column(Text, nullable=True)
+    resultado = Column(Text, nullable=False)  # JSON de extract_data_from_pdf
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_hit_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# ⭐ COLA DE SUBIDAS (OCR fuera del event loop)
+
+class FacturaJob(Base):
+    """
+    Subida de factura encolada: la ejecuta el pool de ocr_jobs y el frontend
+    consulta estado/resultado por id. Persistida para que cualquier worker
+    responda al polling, aunque el archivo solo viva en el proceso que la aceptó.
+    """
+    __tablename__ = "factura_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    estado = Column(String, nullable=False, default="en_cola", index=True)  # en_cola | procesando | completado | error
+    filename = Column(String, nullable=False)
+    file_hash = Column(String(64), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    factura_id = Column(Integer, nullable=True)  # Sin FK: la factura puede borrarse después
+    resultado = Column(Text, nullable=True)  # JSON de la respuesta de /upload
+    error_status = Column(Integer, nullable=True)  # status HTTP equivalente (409 duplicada, 500...)
+    error = Column(Text, nullable=True)  # JSON del detail
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# ⭐ GENERACIÓN DEL CATÁLOGO (invalidación de la caché de tarifas entre workers)
+
+class CatalogoGeneracion(Base):
+    """
+    Fila única (id=1) con un contador que sube en cada invalidar_catalogo(db=...).
+    Cada worker lo compara con la última generación vista antes de servir su caché.
+    """
+    __tablename__ = "catalogo_generacion"
+
+    id = Column(Integer, primary_key=True)
+    generacion = Column(BigInteger, nullable=False, default=0)
+    motivo = Column(String, nullable=True)  # Último motivo de invalidación
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
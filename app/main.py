@@ -62,6 +62,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ⭐ TIEMPOS POR ETAPA: traza por petición (Server-Timing con X-Debug-Tiempos: 1)
+from app.services.metricas import METRICAS_ACTIVAS, MiddlewareTiempos
+if METRICAS_ACTIVAS:
+    app.add_middleware(MiddlewareTiempos)
+
 # ⭐ GLOBAL ERROR HANDLER FOR 500s (To reveal the real issue in logs and fix CORS on errors)
 from fastapi import Request
 from fastapi.responses import JSONResponse
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, joinedload
 from app.db.conn import get_db
 from app.db.models import Cliente
@@ -127,6 +127,28 @@ def get_cliente(cliente_id: int, db: Session = Depends(get_db)):
     return cliente
 
 
+@router.post("/{cliente_id}/propuesta")
+def propuesta_multisuministro(
+    cliente_id: int,
+    top_k: Optional[int] = Query(None, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Propuesta agregada (todos los CUPS del cliente): última factura de cada
+    suministro valorada en bloque contra el catálogo vigente, con ranking por
+    comercializadora y reparto por CUPS. No persiste comparativas.
+    """
+    from app.services.propuesta_multisuministro import propuesta_cliente
+
+    cliente = db.query(Cliente).filter(
+        Cliente.id == cliente_id,
+        Cliente.deleted_at.is_(None)  # ⭐ Excluir eliminados
+    ).first()
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return propuesta_cliente(db, cliente_id, top_k=top_k)
+
+
 @router.post("/", response_model=ClienteDetail)
 def create_cliente(cliente: ClienteCreate, db: Session = Depends(get_db)):
     # Verificar si CUPS ya existe
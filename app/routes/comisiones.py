@@ -2,6 +2,7 @@ from fastapi import APIRouter, UploadFile, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.db.conn import get_db
+from app.services.catalogo_tarifas import invalidar_catalogo
 from datetime import datetime
 import pandas as pd
 import io
@@ -165,6 +166,8 @@ async def upload_comisiones(file: UploadFile, db: Session = Depends(get_db)):
         if importados > 0:
             db.commit()
             logger.info(f"[COMISIONES] Commit exitoso: {importados} filas importadas")
+            # Las comisiones por tarifa viajan en el catálogo cacheado del comparador
+            invalidar_catalogo("comisiones_upload", db)
         else:
             db.rollback()
             logger.warning(f"[COMISIONES] Rollback: 0 filas importadas")
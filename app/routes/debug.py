@@ -122,14 +122,90 @@ def tarifas_stats(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/tarifas/cache")
+def tarifas_cache_stats():
+    """
+    Contadores de la caché de catálogo del comparador (hits, misses, entradas).
+    Los valores son por worker: cada proceso uvicorn tiene su propia caché.
+    
+    Disponible en: GET /debug/tarifas/cache
+    """
+    from app.services.catalogo_tarifas import catalogo_stats
+    return catalogo_stats()
+
+
+@router.post("/tarifas/cache/invalidar")
+def tarifas_cache_invalidar(db: Session = Depends(get_db)):
+    """
+    Invalida la caché de catálogo tras cargar tarifas/precios por SQL o scripts,
+    en este worker y en el resto (generación compartida).
+    
+    Disponible en: POST /debug/tarifas/cache/invalidar
+    """
+    from app.services.catalogo_tarifas import invalidar_catalogo, catalogo_stats
+    invalidar_catalogo("debug_endpoint", db)
+    return {"status": "ok", "cache": catalogo_stats()}
+
+
+@router.get("/metricas")
+def metricas_comparador():
+    """
+    Histogramas de tiempos por etapa del comparador (catalogo, valoracion,
+    insert_ofertas, commit...). Por worker, como la caché de catálogo.
+    
+    Disponible en: GET /debug/metricas
+    """
+    from app.services.metricas import metricas_stats
+    return metricas_stats()
+
+
+@router.get("/metricas/prometheus")
+def metricas_comparador_prometheus():
+    """
+    Mismos histogramas en formato de exposición de Prometheus.
+    
+    Disponible en: GET /debug/metricas/prometheus
+    """
+    from fastapi.responses import PlainTextResponse
+    from app.services.metricas import metricas_prometheus
+    return PlainTextResponse(metricas_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/ocr/comercializadoras")
+def ocr_comercializadoras_stats():
+    """
+    Facturas parseadas por comercializadora detectada: aciertos del juego de
+    estrategias específico, fallbacks a la cascada genérica y latencia del parseo.
+    Por worker, como la caché de catálogo.
+
+    Disponible en: GET /debug/ocr/comercializadoras
+    """
+    from app.services.ocr_comercializadoras import comercializadoras_stats
+    return comercializadoras_stats()
+
+
+@router.get("/ocr/cache")
+def ocr_extraccion_cache():
+    """
+    Contadores de la caché de extracción OCR (hits, re-parseos de textos
+    guardados, extracciones completas). Por worker; la tabla ocr_extracciones
+    guarda además hits y last_hit_at por archivo.
+
+    Disponible en: GET /debug/ocr/cache
+    """
+    from app.services.ocr_cache import ocr_cache_stats
+    return ocr_cache_stats()
+
+
 @router.post("/comparador/factura/{factura_id}")
-def debug_comparador(factura_id: int, db: Session = Depends(get_db)):
+def debug_comparador(factura_id: int, preview: bool = False, db: Session = Depends(get_db)):
     """
     Ejecuta el comparador en modo debug y retorna anÃ¡lisis detallado.
     
     Ãštil para investigar por quÃ© no hay ofertas o por quÃ© el ahorro es negativo.
     
     Disponible en: POST /debug/comparador/factura/{factura_id}
+    Con ?preview=true no guarda Comparativa ni ofertas_calculadas.
     """
     from app.db.models import Factura
     from app.services.comparador import compare_factura
@@ -140,12 +216,14 @@ def debug_comparador(factura_id: int, db: Session = Depends(get_db)):
     
     try:
         # Ejecutar comparador con logging completo
-        result = compare_factura(factura, db)
+        result = compare_factura(factura, db, persistir=not preview)
         
         # Enriquecer resultado con anÃ¡lisis
         analysis = {
             "factura_id": factura_id,
             "success": True,
+            "preview": preview,
+            "comparativa_id": result.get('comparativa_id'),
             "ofertas_totales": len(result.get('offers', [])),
             "ofertas_con_ahorro": len([o for o in result.get('offers', []) if o.get('saving_amount_annual', 0) > 0]),
             "ofertas_sin_ahorro": len([o for o in result.get('offers', []) if o.get('saving_amount_annual', 0) <= 0]),
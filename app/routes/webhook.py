@@ -1,12 +1,17 @@
-from fastapi import APIRouter, UploadFile, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy import func
 from sqlalchemy.orm import Session, joinedload
 from app.db.conn import get_db
-from app.db.models import Factura, Cliente, Comparativa
+from app.db.models import Factura, Cliente, Comparativa, ConsumoCupsMensual, FacturaJob, User
 from app.exceptions import DomainError
-from app.auth import get_current_user, CurrentUser
-from pydantic import BaseModel
-from typing import Optional
+from app.auth import get_current_user, require_ceo, CurrentUser
+from app.services.ocr_jobs import ESTADOS_FINALES, ejecutar_en_pool, encolar_job, estado_job, leer_job
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import asyncio
+import hashlib
 import json
 import logging
 import inspect
@@ -18,6 +23,10 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/webhook", tags=["webhook"])
 
+# Polling interno del stream SSE de jobs de subida
+JOB_EVENTOS_INTERVALO_S = 0.5
+JOB_EVENTOS_TIMEOUT_S = 300
+
 
 # ════════════════════════════════════════════════════════════
 # HELPERS SEGUROS PARA PDF
@@ -172,6 +181,24 @@ class OfferSelection(BaseModel):
     breakdown: Optional[dict] = None
 
 
+class ComparacionPreviewRequest(BaseModel):
+    """Cambios what-if para POST /comparar/facturas/{id}?preview=true (no se guardan)."""
+    cambios: Optional[dict] = None
+
+
+COMPARAR_LOTE_MAX_FACTURAS = 1000
+COMPARAR_TOP_K_MAX = 100
+
+
+class ComparacionLoteRequest(BaseModel):
+    """Selección de facturas para POST /comparar/batch: ids explícitos o filtro."""
+    factura_ids: Optional[List[int]] = None
+    company_id: Optional[int] = None
+    estado_factura: Optional[str] = None
+    incluir_ofertas: bool = False
+    top_k: Optional[int] = Field(None, ge=1, le=COMPARAR_TOP_K_MAX)
+
+
 REQUIRED_FACTURA_FIELDS = [
     "atr",
     "consumo_p1_kwh",
@@ -237,26 +264,24 @@ def _normalize_periodo_dias(value):
     return parsed if parsed > 0 else None
 
 
-@router.post("/upload_v2")
-@router.post("/upload")  # Alias para compatibilidad con frontend
-async def process_factura(
-    file: UploadFile, 
-    db: Session = Depends(get_db),
-    current_user: CurrentUser = Depends(get_current_user)
-):
-    # --- LOGS DE DIAGNÓSTICO (OBJETIVO 1) ---
-    print(f"\n🚀 [UPLOAD] Recibiendo archivo: {file.filename}")
-    print(f"📁 Tipo: {file.content_type}")
-    print(f"👤 Usuario: {current_user.name} (ID={current_user.id}, role={current_user.role})")
-    
-    # 1. Leer el archivo
-    file_bytes = await file.read()
-    print(f"📊 Tamaño: {len(file_bytes)} bytes")
-    
+def _actualizar_historico_consumo(db: Session, factura: Factura) -> None:
+    """Rollup mensual de consumo del CUPS (anualización estacional). Nunca tumba la subida."""
+    from app.services.historico_consumo import actualizar_historico_factura
+
+    try:
+        actualizar_historico_factura(db, factura)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"[HISTORICO] No se pudo actualizar el histórico de factura_id={factura.id}: {e}")
+
+
+def _procesar_subida(db: Session, file_bytes: bytes, filename: str, file_hash: str, current_user: CurrentUser) -> dict:
+    """
+    OCR + dedupe + upsert de cliente + alta de factura. Síncrono: se ejecuta en el
+    pool de ocr_jobs (nunca en el event loop). Los duplicados salen como HTTPException 409.
+    """
     # --- DEDUPLICACION POR HASH ---
-    import hashlib
-    file_hash = hashlib.sha256(file_bytes).hexdigest()
-    
     existing_by_hash = (
         db.query(Factura)
         .options(joinedload(Factura.cliente)) # Eager load cliente
@@ -286,16 +311,19 @@ async def process_factura(
             }
         )
 
-    # 2. OCR y extraccion de datos
-    from app.services.ocr import extract_data_from_pdf, build_raw_data_payload, merge_raw_data_audit
-    ocr_data = extract_data_from_pdf(file_bytes)
+    # 2. OCR y extraccion de datos (caché por hash: resubidas/re-parseos no repiten Vision)
+    from app.services.ocr import build_raw_data_payload, merge_raw_data_audit
+    from app.services.ocr_cache import extraer_con_cache
+    ocr_data = extraer_con_cache(db, file_bytes, file_hash)
+    # La sesión solo tiene la fila de caché: persistirla aunque la subida acabe en 409/500
+    db.commit()
     
     # --- LOGS DE DEBUG QA (TEST_MODE) ---
     import os
     if os.getenv("TEST_MODE") == "true":
         print(f"\n--- [DEBUG OCR] ---")
         print(f"Motor: {ocr_data.get('ocr_engine', 'Standard/Vision')}")
-        print(f"Archivo: {file.filename}")
+        print(f"Archivo: {filename}")
         print(f"Hash: {file_hash}")
         print(f"CUPS Detectado: {ocr_data.get('cups')}")
         print(f"Total Detectado: {ocr_data.get('total_factura')}")
@@ -473,7 +501,7 @@ async def process_factura(
     servicios_vinculados_clean = _to_bool(ocr_data.get("servicios_vinculados"), "servicios_vinculados")
 
     nueva_factura = Factura(
-        filename=file.filename,
+        filename=filename,
         cups=cups_final_db,
         consumo_kwh=ocr_data.get("consumo_kwh"),
         importe=ocr_data.get("importe"), # Base imponible fallback?
@@ -533,6 +561,7 @@ async def process_factura(
     db.add(nueva_factura)
     db.commit()
     db.refresh(nueva_factura)
+    _actualizar_historico_consumo(db, nueva_factura)
 
     return {
         "id": nueva_factura.id,
@@ -542,6 +571,106 @@ async def process_factura(
     }
 
 
+@router.post("/upload_v2")
+@router.post("/upload")  # Alias para compatibilidad con frontend
+async def process_factura(
+    file: UploadFile, 
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    # --- LOGS DE DIAGNÓSTICO (OBJETIVO 1) ---
+    print(f"\n🚀 [UPLOAD] Recibiendo archivo: {file.filename}")
+    print(f"📁 Tipo: {file.content_type}")
+    print(f"👤 Usuario: {current_user.name} (ID={current_user.id}, role={current_user.role})")
+    
+    # 1. Leer el archivo
+    file_bytes = await file.read()
+    print(f"📊 Tamaño: {len(file_bytes)} bytes")
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+
+    # ⭐ OCR y commits en el pool de subidas (con sesión propia del hilo): la petición espera sin bloquear el event loop
+    return await ejecutar_en_pool(_procesar_subida, file_bytes, file.filename, file_hash, current_user)
+
+
+@router.post("/upload/jobs", status_code=202)
+async def encolar_factura(
+    file: UploadFile,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Acepta la factura al instante y la procesa en el pool de ocr_jobs.
+    El frontend consulta GET /webhook/upload/jobs/{job_id} (o /eventos) hasta
+    estado completado (resultado = respuesta de /upload) o error (status_code + detail).
+    """
+    file_bytes = await file.read()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    filename = file.filename
+    print(f"\n🚀 [UPLOAD-JOB] {filename} ({len(file_bytes)} bytes) usuario={current_user.id}")
+
+    def _tarea(sesion: Session) -> dict:
+        return _procesar_subida(sesion, file_bytes, filename, file_hash, current_user)
+
+    job = await run_in_threadpool(encolar_job, db, filename, file_hash, current_user.id, _tarea)
+    return {
+        "job_id": job.id,
+        "estado": job.estado,
+        "status_url": f"/webhook/upload/jobs/{job.id}",
+        "eventos_url": f"/webhook/upload/jobs/{job.id}/eventos",
+    }
+
+
+def _job_visible(db: Session, job_id: str, current_user: CurrentUser) -> FacturaJob:
+    """El autor ve su job; el CEO, los de usuarios de su company; DEV, todos."""
+    job = db.get(FacturaJob, job_id)
+    if job and (job.user_id == current_user.id or current_user.is_dev()):
+        return job
+    if job and current_user.is_ceo() and current_user.company_id is not None and job.user_id is not None:
+        company_autor = db.query(User.company_id).filter(User.id == job.user_id).scalar()
+        if company_autor == current_user.company_id:
+            return job
+    raise HTTPException(status_code=404, detail="Job no encontrado")
+
+
+@router.get("/upload/jobs/{job_id}")
+def get_job_factura(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """Estado de una subida encolada: en_cola | procesando | completado | error."""
+    return estado_job(_job_visible(db, job_id, current_user))
+
+
+@router.get("/upload/jobs/{job_id}/eventos")
+async def eventos_job_factura(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Server-Sent Events con cada cambio de estado del job; se cierra al llegar a
+    completado/error (o tras JOB_EVENTOS_TIMEOUT_S, y el frontend vuelve al polling).
+    """
+    await run_in_threadpool(_job_visible, db, job_id, current_user)
+
+    async def _eventos():
+        ultimo = None
+        bucle = asyncio.get_running_loop()
+        limite = bucle.time() + JOB_EVENTOS_TIMEOUT_S
+        while bucle.time() < limite:
+            data = await run_in_threadpool(leer_job, job_id)
+            if data is None:
+                return
+            if data["estado"] != ultimo:
+                ultimo = data["estado"]
+                yield f"event: estado\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            if ultimo in ESTADOS_FINALES:
+                return
+            await asyncio.sleep(JOB_EVENTOS_INTERVALO_S)
+
+    return StreamingResponse(_eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @router.get("/facturas")
 def list_facturas(
     db: Session = Depends(get_db),
@@ -652,6 +781,7 @@ def update_factura(factura_id: int, factura_update: FacturaUpdate, db: Session =
 
     db.commit()
     db.refresh(factura)
+    _actualizar_historico_consumo(db, factura)
 
     logger.info(
         "✅ [AUDIT STEP2] Guardado FINAL factura_id=%s: periodo_dias=%s (type=%s, valid=%s), "
@@ -736,6 +866,7 @@ def validar_comercialmente(
     
     # Validar comercialmente
     response, warnings = validar_factura_comercialmente(factura, ajustes, modo)
+    total_anterior = factura.total_ajustado if factura.validado_step2 else None
     
     # Persistir en la factura
     try:
@@ -761,15 +892,64 @@ def validar_comercialmente(
         logger.error(f"[STEP2] Error persistiendo validación: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error guardando validación: {str(e)}")
     
-    return response.model_dump()
+    resultado = response.model_dump()
+    # ⭐ DELTA: si ya había comparativa, reajustar sus ahorros al nuevo total (sin re-comparar)
+    resultado["comparativa_actualizada"] = None
+    if factura.ultima_comparativa_id and factura.total_ajustado != total_anterior:
+        from app.services.comparador import recalcular_ahorros_step2
+        try:
+            comparacion = recalcular_ahorros_step2(db, factura)
+            db.commit()
+            resultado["comparativa_actualizada"] = comparacion
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[STEP2] No se pudieron reajustar los ahorros de factura {factura_id}: {e}")
+    return resultado
 
 
 @router.post("/comparar/facturas/{factura_id}")
-def comparar_factura(factura_id: int, db: Session = Depends(get_db)):
+def comparar_factura(
+    factura_id: int,
+    preview: bool = False,
+    top_k: Optional[int] = Query(None, ge=1, le=COMPARAR_TOP_K_MAX),
+    as_of: Optional[str] = Query(None, description="YYYY-MM-DD o 'factura': tarifas vigentes en esa fecha"),
+    payload: Optional[ComparacionPreviewRequest] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Compara y persiste (Comparativa + ofertas_calculadas).
+    
+    ?preview=true: mismo cálculo sin escribir nada, opcionalmente con cambios
+    what-if en el body ({"cambios": {"total_ajustado": 95.0, ...}}). Para guardar,
+    volver a llamar sin preview una vez persistidos los cambios (Step 2).
+    
+    ?top_k=N: solo las N mejores ofertas (sin top_k, lista completa para auditoría).
+    
+    ?as_of=YYYY-MM-DD | factura: re-comparación contra el catálogo vigente en esa
+    fecha ("factura" = último día facturado). Siempre en modo preview.
+    """
+    from app.services.comparador import factura_con_cambios, resolver_as_of
+
     factura = db.query(Factura).filter(Factura.id == factura_id).first()
     if not factura:
         raise HTTPException(status_code=404, detail="Factura no encontrada")
 
+    try:
+        fecha_as_of = resolver_as_of(factura, as_of)
+    except DomainError as e:
+        raise HTTPException(status_code=422, detail={"code": e.code, "message": e.message})
+    if fecha_as_of is not None:
+        preview = True
+
+    if payload and payload.cambios and not preview:
+        raise HTTPException(status_code=400, detail="Los cambios what-if solo se admiten con preview=true")
+    if preview:
+        # Copia desacoplada de la sesión: nada de lo que sigue puede escribir en BD
+        try:
+            factura = factura_con_cambios(factura, payload.cambios if payload else None)
+        except DomainError as e:
+            raise HTTPException(status_code=400, detail={"code": e.code, "message": e.message})
+
     # ═══════════════════════════════════════════════════════════════
     # P1-STEP2-01: VALIDACIÓN STEP2 OBLIGATORIA
     # ═══════════════════════════════════════════════════════════════
@@ -820,14 +1000,16 @@ def comparar_factura(factura_id: int, db: Session = Depends(get_db)):
         atr_inferred = True
         # ⭐ IMPORTANTE: Actualizar la factura con el ATR inferido
         factura.atr = atr
-        db.commit()
+        if not preview:
+            db.commit()
         logger.warning(f"[ATR] ATR no presente. Inferido atr={atr} por potencia_p1_kw={potencia_p1}.")
     else:
         atr = atr.strip().upper()
         # Actualizar a uppercase por si acaso
         if factura.atr != atr:
             factura.atr = atr
-            db.commit()
+            if not preview:
+                db.commit()
     
     # Validación específica por ATR
     if atr == "3.0TD":
@@ -875,7 +1057,7 @@ def comparar_factura(factura_id: int, db: Session = Depends(get_db)):
     from app.services.comparador import compare_factura
     
     try:
-        result = compare_factura(factura, db)
+        result = compare_factura(factura, db, persistir=not preview, top_k=top_k, as_of=fecha_as_of)
         return result
     except DomainError as e:
         # P1 PRODUCCIÓN: Mapear errores de dominio a HTTP 422
@@ -889,6 +1071,191 @@ def comparar_factura(factura_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error generando ofertas: {str(e)}")
 
 
+@router.post("/comparar/facturas/{factura_id}/horaria")
+def comparar_factura_horaria(
+    factura_id: int,
+    top_k: Optional[int] = Query(None, ge=1, le=COMPARAR_TOP_K_MAX),
+    db: Session = Depends(get_db),
+):
+    """
+    Simulación horaria (2.0TD): reparte el consumo P1-P3 con el perfil estándar
+    de REE y lo valora contra las tarifas con precio horario (indexadas/PVPC).
+    Misma forma de respuesta que /comparar/facturas/{id}; no persiste nada.
+    """
+    from app.services.simulacion_horaria import simular_factura_horaria
+
+    factura = db.query(Factura).filter(Factura.id == factura_id).first()
+    if not factura:
+        raise HTTPException(status_code=404, detail="Factura no encontrada")
+
+    try:
+        return simular_factura_horaria(factura, top_k=top_k, db=db)
+    except DomainError as e:
+        raise HTTPException(status_code=422, detail={"code": e.code, "message": e.message})
+
+
+@router.post("/comparar/facturas/{factura_id}/potencia")
+def optimizar_potencia_factura_endpoint(
+    factura_id: int,
+    maximetro_p1_kw: Optional[float] = Query(None, ge=0),
+    maximetro_p2_kw: Optional[float] = Query(None, ge=0),
+    top_k: Optional[int] = Query(None, ge=1, le=COMPARAR_TOP_K_MAX),
+    db: Session = Depends(get_db),
+):
+    """
+    Potencia contratada óptima (2.0TD) para cada oferta vigente: busca entre los
+    escalones normalizados la pareja P1/P2 que minimiza el total con los precios
+    de potencia de la oferta y, si se indican, las lecturas de maxímetro.
+    Sin maxímetro no se propone bajar de la potencia actual. No persiste nada.
+    """
+    from app.services.optimizador_potencia import optimizar_potencia_factura
+
+    factura = db.query(Factura).filter(Factura.id == factura_id).first()
+    if not factura:
+        raise HTTPException(status_code=404, detail="Factura no encontrada")
+
+    try:
+        return optimizar_potencia_factura(factura, db, maximetro_p1_kw, maximetro_p2_kw, top_k=top_k)
+    except DomainError as e:
+        raise HTTPException(status_code=422, detail={"code": e.code, "message": e.message})
+
+
+@router.post("/comparar/batch")
+def comparar_facturas_batch(
+    payload: ComparacionLoteRequest,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(require_ceo),
+):
+    """
+    Compara un lote de facturas (revisión de cartera) contra UN snapshot del
+    catálogo por ATR y devuelve los resultados en streaming (NDJSON):
+    una línea por factura según se calculan y una línea final con el resumen.
+    
+    Cada factura se valida como en /comparar/facturas/{id} (Step2, total_ajustado,
+    campos por ATR); los errores se devuelven en su línea sin abortar el lote.
+    """
+    from app.services.comparador import compare_facturas_lote
+
+    if not payload.factura_ids and payload.company_id is None and not payload.estado_factura:
+        raise HTTPException(status_code=400, detail="Indica factura_ids o un filtro (company_id / estado_factura)")
+
+    query = db.query(Factura)
+    if payload.factura_ids:
+        query = query.filter(Factura.id.in_(payload.factura_ids))
+    if payload.estado_factura:
+        query = query.filter(Factura.estado_factura == payload.estado_factura)
+
+    # CEO solo puede lanzar lotes sobre su propia company
+    if current_user.is_dev():
+        company_id = payload.company_id
+    elif current_user.company_id is None:
+        # Sin company no hay cartera que revisar (nunca todas las companies)
+        raise HTTPException(status_code=403, detail="Usuario sin company asignada")
+    else:
+        company_id = current_user.company_id
+    if company_id is not None:
+        query = query.join(Cliente).filter(Cliente.company_id == company_id, Cliente.company_id.isnot(None))
+
+    facturas = query.order_by(Factura.id).limit(COMPARAR_LOTE_MAX_FACTURAS + 1).all()
+    if len(facturas) > COMPARAR_LOTE_MAX_FACTURAS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote supera el máximo de {COMPARAR_LOTE_MAX_FACTURAS} facturas; acota el filtro"
+        )
+
+    encontradas = {f.id for f in facturas}
+    no_encontradas = [fid for fid in (payload.factura_ids or []) if fid not in encontradas]
+    factura_ids = [f.id for f in facturas]
+    incluir_ofertas = payload.incluir_ofertas
+    top_k = payload.top_k
+    logger.info(f"[LOTE] Usuario {current_user.id}: comparando {len(factura_ids)} facturas")
+
+    # La sesión de la dependencia se cierra antes de enviar el cuerpo:
+    # el generador abre la suya sobre el mismo engine
+    bind = db.get_bind()
+
+    def _stream():
+        ok = 0
+        errores = 0
+        for fid in no_encontradas:
+            errores += 1
+            yield json.dumps({"ok": False, "factura_id": fid, "error_code": "NOT_FOUND",
+                              "message": "Factura no encontrada"}) + "\n"
+
+        with Session(bind=bind) as session:
+            lote = session.query(Factura).filter(Factura.id.in_(factura_ids)).order_by(Factura.id).all() if factura_ids else []
+            for item in compare_facturas_lote(session, lote, incluir_ofertas=incluir_ofertas, top_k=top_k):
+                if item.get("ok"):
+                    ok += 1
+                else:
+                    errores += 1
+                yield json.dumps(item, default=str) + "\n"
+
+        yield json.dumps({"resumen": {"total": ok + errores, "ok": ok, "errores": errores}}) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+@router.get("/facturas/{factura_id}/comparativa")
+def get_ultima_comparativa(factura_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Última comparativa guardada de la factura, sin recalcular (paso 3 del wizard).
+    
+    Se resuelve con facturas.ultima_comparativa_id. Una comparativa solo cambia
+    por el delta de Step 2, que sube su revision, así que el ETag es id + revision:
+    si el cliente manda If-None-Match con el mismo valor se responde 304 con una
+    única consulta (factura JOIN comparativa por PK).
+    """
+    row = (
+        db.query(Factura.ultima_comparativa_id, Comparativa.revision)
+        .outerjoin(Comparativa, Comparativa.id == Factura.ultima_comparativa_id)
+        .filter(Factura.id == factura_id)
+        .first()
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Factura no encontrada")
+    comparativa_id, revision = row
+    if not comparativa_id:
+        raise HTTPException(
+            status_code=404,
+            detail={"code": "NO_COMPARATIVA", "message": f"La factura {factura_id} todavía no tiene comparativa"}
+        )
+    
+    etag = f'"comparativa-{comparativa_id}-{revision or 0}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    comparativa = db.get(Comparativa, comparativa_id)
+    if comparativa.offers_json:
+        offers = json.loads(comparativa.offers_json)
+    else:
+        # Comparativas antiguas sin offers_json: reconstruir desde ofertas_calculadas
+        from app.db.models import OfertaCalculada
+        filas = (
+            db.query(OfertaCalculada.detalle_json)
+            .filter(OfertaCalculada.comparativa_id == comparativa_id)
+            .order_by(OfertaCalculada.coste_estimado)
+            .all()
+        )
+        offers = [
+            json.loads(detalle) if isinstance(detalle, str) else detalle
+            for (detalle,) in filas if detalle
+        ]
+    
+    body = {
+        "factura_id": factura_id,
+        "comparativa_id": comparativa.id,
+        "created_at": comparativa.created_at.isoformat() if comparativa.created_at else None,
+        "periodo_dias": comparativa.periodo_dias,
+        "current_total": comparativa.current_total,
+        "inputs": json.loads(comparativa.inputs_json) if comparativa.inputs_json else None,
+        "offers": offers,
+    }
+    return JSONResponse(content=body, headers=headers)
+
+
 @router.post("/facturas/{factura_id}/seleccion")
 def guardar_seleccion_oferta(factura_id: int, offer: OfferSelection, db: Session = Depends(get_db)):
     """
@@ -907,23 +1274,18 @@ def guardar_seleccion_oferta(factura_id: int, offer: OfferSelection, db: Session
     
     # ⭐ BLOQUE 1 CRM: Persistir selección con FK
     # Buscar el ID real en ofertas_calculadas (no confundir con tarifa_id)
-    from app.db.models import OfertaCalculada, Comparativa
+    from app.db.models import OfertaCalculada
     
     tarifa_id_seleccionada = offer_dict.get("tarifa_id")
     
-    # Obtener la última comparativa de esta factura
-    ultima_comparativa = (
-        db.query(Comparativa)
-        .filter(Comparativa.factura_id == factura_id)
-        .order_by(Comparativa.created_at.desc())
-        .first()
-    )
+    # Última comparativa de esta factura (puntero mantenido por el comparador)
+    ultima_comparativa_id = factura.ultima_comparativa_id
     
-    if ultima_comparativa and tarifa_id_seleccionada:
+    if ultima_comparativa_id and tarifa_id_seleccionada:
         # Buscar la oferta calculada correspondiente
         oferta_calculada = (
             db.query(OfertaCalculada)
-            .filter(OfertaCalculada.comparativa_id == ultima_comparativa.id)
+            .filter(OfertaCalculada.comparativa_id == ultima_comparativa_id)
             .filter(OfertaCalculada.tarifa_id == tarifa_id_seleccionada)
             .first()
         )
@@ -1136,6 +1498,7 @@ async def delete_factura(factura_id: int, db: Session = Depends(get_db)):
     try:
         # Primero borrar comparativas asociadas (por si acaso)
         db.query(Comparativa).filter(Comparativa.factura_id == factura_id).delete()
+        db.query(ConsumoCupsMensual).filter(ConsumoCupsMensual.factura_id == factura_id).delete()
         
         db.delete(factura)
         db.commit()
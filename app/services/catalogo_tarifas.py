@@ -0,0 +1,493 @@
+"""
+Caché en proceso del catálogo de tarifas (tarifa_versiones + tarifa_precios).
+
+El catálogo cambia pocas veces al mes: cada worker guarda en memoria las versiones
+vigentes y sus precios por (ATR, fecha) para que compare_factura no vuelva a Neon
+en cada comparación. Se invalida explícitamente al cargar tarifas o comisiones;
+el TTL es solo una red de seguridad para cargas hechas directamente por SQL.
+
+Invalidación entre workers: invalidar_catalogo(motivo, db) sube el contador de
+la tabla catalogo_generacion y get_catalogo lo consulta como mucho cada
+CATALOGO_GENERACION_CHECK_S; si cambió, el worker vacía su caché e índices.
+Contrato: tras una invalidación con db, ningún worker sirve el catálogo anterior
+más de CATALOGO_GENERACION_CHECK_S segundos. Sin db solo se vacía el proceso actual;
+sin la tabla (migración pendiente) se avisa una vez y la caché queda solo con el TTL.
+
+Por debajo, un IndiceVigencias por ATR guarda TODAS las versiones (pasadas,
+vigentes y futuras) con sus intervalos de vigencia: un (ATR, fecha) que no está
+en caché se resuelve con una búsqueda binaria sobre los cortes de vigencia, sin
+volver a BD. Comparar "as of" una fecha pasada cuesta lo mismo que hoy.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, inspect, text
+
+from app.services.metricas import span
+from app.services.motor_vectorizado import MatricesCatalogo, PreciosVersion, construir_matrices, normalizar_precios
+
+logger = logging.getLogger(__name__)
+
+CATALOGO_CACHE_TTL_S = float(os.getenv("CATALOGO_CACHE_TTL_S", "300"))
+CATALOGO_CACHE_MAX_ENTRADAS = 64
+CATALOGO_GENERACION_CHECK_S = float(os.getenv("CATALOGO_GENERACION_CHECK_S", "5"))
+
+
+class CatalogoTarifas:
+    """
+    Snapshot del catálogo vigente para un ATR en una fecha.
+
+    - tarifas: filas de tarifa_versiones JOIN tarifas (orden comercializadora, nombre)
+    - precios_map: {version_id: PreciosVersion} (arrays fijos, normalizados al cargar)
+    - comisiones_tarifa: {tarifa_id: Decimal} comisiones por tarifa vigentes
+    - matrices: precios en forma matricial para el motor vectorizado (lazy)
+    - version: huella del contenido para la memoización del comparador (lazy)
+
+    Se comparte entre peticiones: tratarlo como solo lectura.
+    """
+
+    def __init__(
+        self,
+        atr: str,
+        fecha: date,
+        tarifas: List[Dict[str, Any]],
+        precios_map: Dict[int, PreciosVersion],
+        comisiones_tarifa: Dict[int, Decimal],
+        generacion: int,
+    ):
+        self.atr = atr
+        self.fecha = fecha
+        self.tarifas = tarifas
+        self.precios_map = precios_map
+        self.comisiones_tarifa = comisiones_tarifa
+        self.generacion = generacion
+        self.cargado_en = time.monotonic()
+        self._matrices = None
+        self._version = None
+
+    @property
+    def version_ids(self) -> List[int]:
+        return [t["tarifa_version_id"] for t in self.tarifas]
+
+    @property
+    def version(self) -> str:
+        """
+        Huella del contenido (versiones, precios y comisiones por tarifa).
+        Estable entre workers y reinicios, a diferencia de `generacion`.
+        """
+        if self._version is None:
+            contenido = {
+                "tarifas": [
+                    [t["tarifa_version_id"], t.get("tarifa_id"), t.get("nombre"), t.get("comercializadora")]
+                    for t in self.tarifas
+                ],
+                "precios": sorted([vid, _precios_dict(precios)] for vid, precios in self.precios_map.items()),
+                "comisiones_tarifa": sorted([tid, str(c)] for tid, c in self.comisiones_tarifa.items()),
+            }
+            raw = json.dumps(contenido, sort_keys=True, default=str)
+            self._version = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+        return self._version
+
+    @property
+    def matrices(self) -> MatricesCatalogo:
+        # Construcción idempotente: si dos hilos coinciden, el segundo pisa con lo mismo
+        if self._matrices is None:
+            self._matrices = construir_matrices(self.tarifas, self.precios_map, self.atr)
+        return self._matrices
+
+    def subcatalogo(self, version_ids) -> "CatalogoTarifas":
+        """
+        Catálogo restringido a `version_ids` (en el orden del catálogo), reutilizando
+        las filas ya construidas de las matrices. Para revalorizar solo unas versiones.
+        """
+        version_ids = set(version_ids)
+        filas = [i for i, t in enumerate(self.tarifas) if t["tarifa_version_id"] in version_ids]
+        sub = CatalogoTarifas(
+            self.atr,
+            self.fecha,
+            [self.tarifas[i] for i in filas],
+            {vid: p for vid, p in self.precios_map.items() if vid in version_ids},
+            self.comisiones_tarifa,
+            self.generacion,
+        )
+        sub._matrices = self.matrices.filas(np.array(filas, dtype=np.intp))
+        return sub
+
+
+def _precios_dict(precios) -> Dict[str, Any]:
+    # Los tests y scripts construyen catálogos con el formato dict
+    return precios.como_dict() if isinstance(precios, PreciosVersion) else precios
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class IndiceVigencias:
+    """
+    Todas las versiones de un ATR indexadas por intervalo de vigencia.
+
+    Los cortes (vigente_desde y vigente_hasta + 1 día de cada versión, en
+    ordinales) parten el calendario en tramos donde el conjunto de versiones
+    vigentes no cambia. catalogo(fecha) localiza el tramo con bisect en
+    O(log n) y construye su snapshot una sola vez (mismas reglas que la query:
+    vigente_desde <= fecha <= vigente_hasta, hasta NULL = abierta). El snapshot
+    de un tramo se comparte entre todas sus fechas; su .fecha es el inicio del tramo.
+    """
+
+    def __init__(
+        self,
+        atr: str,
+        versiones: List[Dict[str, Any]],
+        precios_map: Dict[int, PreciosVersion],
+        comisiones_tarifa: Dict[int, Decimal],
+        generacion: int,
+    ):
+        self.atr = atr
+        self.precios_map = precios_map
+        self.comisiones_tarifa = comisiones_tarifa
+        self.generacion = generacion
+        self.cargado_en = time.monotonic()
+        self.tarifas = []
+        desde, hasta = [], []
+        for version in versiones:
+            version = dict(version)
+            inicio = _as_date(version.pop("vigente_desde"))
+            fin = _as_date(version.pop("vigente_hasta", None))
+            self.tarifas.append(version)
+            desde.append(inicio.toordinal())
+            hasta.append(fin.toordinal() + 1 if fin is not None else date.max.toordinal())
+        self._desde = np.array(desde, dtype=np.int64)
+        self._hasta = np.array(hasta, dtype=np.int64)
+        self.cortes = sorted(set(desde) | {h for h in hasta if h < date.max.toordinal()})
+        self._tramos: Dict[int, CatalogoTarifas] = {}
+
+    def tramo(self, fecha: date) -> int:
+        """Índice del tramo que contiene `fecha` (-1 = antes de la primera versión)."""
+        return bisect_right(self.cortes, fecha.toordinal()) - 1
+
+    def catalogo(self, fecha: date) -> CatalogoTarifas:
+        tramo = self.tramo(fecha)
+        catalogo = self._tramos.get(tramo)
+        if catalogo is None:
+            if tramo < 0:
+                filas, inicio = [], fecha
+            else:
+                corte = self.cortes[tramo]
+                filas = np.flatnonzero((self._desde <= corte) & (self._hasta > corte)).tolist()
+                inicio = date.fromordinal(corte)
+            tarifas = [self.tarifas[i] for i in filas]
+            version_ids = {t["tarifa_version_id"] for t in tarifas}
+            catalogo = CatalogoTarifas(
+                self.atr,
+                inicio,
+                tarifas,
+                {vid: p for vid, p in self.precios_map.items() if vid in version_ids},
+                self.comisiones_tarifa,
+                self.generacion,
+            )
+            catalogo.cargado_en = self.cargado_en  # el TTL cuenta desde la carga de BD
+            # Idempotente: si dos hilos coinciden, el segundo pisa con lo mismo
+            self._tramos[tramo] = catalogo
+        return catalogo
+
+
+_cache: "OrderedDict[Tuple[str, date], CatalogoTarifas]" = OrderedDict()
+_indices: Dict[str, IndiceVigencias] = {}
+_lock = threading.Lock()
+_generacion = 0
+# Última generación compartida vista (catalogo_generacion) y cuándo se consultó
+_generacion_bd: Optional[int] = None
+_generacion_comprobada_en = float("-inf")
+_aviso_generacion = False  # warning de tabla ausente ya emitido
+_stats = {"hits": 0, "misses": 0, "expirados": 0, "invalidaciones": 0, "sincronizaciones": 0, "cargas_bd": 0}
+
+
+def _fetch_precios_versiones(db, version_ids: list) -> Dict[int, PreciosVersion]:
+    """
+    Prefetch de precios de energía y potencia para múltiples versiones de tarifas.
+    Query única para evitar N+1. Cada versión se normaliza aquí una sola vez
+    (reglas 24H / solo-P1 resueltas), no en cada acceso.
+
+    Returns:
+        {version_id: PreciosVersion}; .como_dict() da la forma
+        {'energia': {'P1': 0.15, 'P2': 0.12}, 'potencia': {'P1': 0.08, 'P2': 0.04}}
+    """
+    if not version_ids:
+        return {}
+
+    # IN expandido en vez de ANY(:ids) para que funcione también en SQLite
+    result = db.execute(
+        text("""
+            SELECT
+                tarifa_version_id,
+                concepto,
+                periodo,
+                valor
+            FROM tarifa_precios
+            WHERE tarifa_version_id IN :version_ids
+        """).bindparams(bindparam("version_ids", expanding=True)),
+        {"version_ids": list(version_ids)}
+    )
+
+    rows = result.fetchall()
+    precios_map = {}
+
+    for row in rows:
+        vid = row[0]
+        concepto = row[1]  # 'energia' o 'potencia'
+        periodo = row[2]  # 'P1', 'P2', '24H', etc.
+        precio = float(row[3])
+
+        if vid not in precios_map:
+            precios_map[vid] = {'energia': {}, 'potencia': {}}
+
+        precios_map[vid][concepto][periodo] = precio
+
+    logger.info(f"[VERSIONADO] Prefetch precios: {len(precios_map)} versiones")
+    return {vid: normalizar_precios(precios) for vid, precios in precios_map.items()}
+
+
+def _fetch_comisiones_tarifa(db, tarifa_ids: list) -> Dict[int, Decimal]:
+    """
+    Comisiones por tarifa activas (vigente_hasta IS NULL), la más reciente por tarifa.
+    ESQUEMA REAL: SÍ tiene vigente_desde/vigente_hasta
+    """
+    if not tarifa_ids:
+        return {}
+
+    # En SQLite local la tabla puede no existir: sin comisiones (manual 0.00)
+    if not inspect(db.get_bind()).has_table("comisiones_tarifa"):
+        return {}
+
+    rows = db.execute(
+        text("""
+            WITH ranked AS (
+                SELECT
+                    tarifa_id,
+                    comision_eur,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY tarifa_id
+                        ORDER BY vigente_desde DESC, created_at DESC, id DESC
+                    ) as rn
+                FROM comisiones_tarifa
+                WHERE tarifa_id IN :tids AND vigente_hasta IS NULL
+            )
+            SELECT tarifa_id, comision_eur
+            FROM ranked
+            WHERE rn = 1
+        """).bindparams(bindparam("tids", expanding=True)),
+        {"tids": list(tarifa_ids)}
+    ).fetchall()
+    return {row[0]: Decimal(str(row[1])) for row in rows}
+
+
+def _cargar_indice(db, atr: str, generacion: int) -> IndiceVigencias:
+    """Todas las versiones del ATR (cualquier vigencia) con precios y comisiones: 3 queries."""
+    with span("catalogo_bd"):
+        versiones = _fetch_versiones(db, atr)
+    with span("precios_bd"):
+        precios_map = _fetch_precios_versiones(db, [v["tarifa_version_id"] for v in versiones])
+    tarifa_ids = sorted({v["tarifa_id"] for v in versiones if v.get("tarifa_id") is not None})
+    with span("comisiones_bd"):
+        comisiones_tarifa = _fetch_comisiones_tarifa(db, tarifa_ids)
+
+    indice = IndiceVigencias(atr, versiones, precios_map, comisiones_tarifa, generacion)
+    logger.info(
+        f"[CATALOGO] Cargado atr={atr}: {len(versiones)} versiones en {len(indice.cortes)} cortes de vigencia, "
+        f"{len(comisiones_tarifa)} comisiones tarifa (generacion={generacion})"
+    )
+    return indice
+
+
+def _fetch_versiones(db, atr: str) -> List[Dict[str, Any]]:
+    result = db.execute(
+        text("""
+            SELECT
+                tv.id as tarifa_version_id,
+                t.id as tarifa_id,
+                t.nombre,
+                t.comercializadora,
+                t.atr,
+                t.tipo,
+                tv.vigente_desde,
+                tv.vigente_hasta
+            FROM tarifa_versiones tv
+            JOIN tarifas t ON tv.tarifa_id = t.id
+            WHERE t.atr = :atr
+            ORDER BY t.comercializadora, t.nombre, tv.vigente_desde, tv.id
+        """),
+        {"atr": atr}
+    )
+
+    try:
+        return [dict(row) for row in result.mappings().all()]
+    except AttributeError:
+        return [dict(row._mapping) for row in result.fetchall()]
+
+
+def get_catalogo(db, atr: str, fecha: Optional[date] = None) -> CatalogoTarifas:
+    """
+    Devuelve el catálogo vigente para (atr, fecha). En miss se resuelve con el
+    IndiceVigencias del ATR (bisect) y solo se va a BD si no hay índice vigente.
+
+    La carga se hace fuera del lock: dos peticiones concurrentes en miss pueden
+    cargar a la vez, pero nunca se guarda un snapshot de una generación anterior
+    a una invalidación producida durante la carga.
+    """
+    fecha = fecha or date.today()
+    key = (atr, fecha)
+    _sincronizar_generacion(db)
+
+    with _lock:
+        catalogo = _cache.get(key)
+        if catalogo is not None:
+            if time.monotonic() - catalogo.cargado_en <= CATALOGO_CACHE_TTL_S:
+                _cache.move_to_end(key)
+                _stats["hits"] += 1
+                return catalogo
+            del _cache[key]
+            _stats["expirados"] += 1
+        _stats["misses"] += 1
+        generacion = _generacion
+        indice = _indices.get(atr)
+        if indice is not None and time.monotonic() - indice.cargado_en > CATALOGO_CACHE_TTL_S:
+            del _indices[atr]
+            indice = None
+
+    if indice is None:
+        indice = _cargar_indice(db, atr, generacion)
+        with _lock:
+            _stats["cargas_bd"] += 1
+            if generacion == _generacion:
+                _indices[atr] = indice
+    catalogo = indice.catalogo(fecha)
+
+    with _lock:
+        if generacion == _generacion:
+            _cache[key] = catalogo
+            _cache.move_to_end(key)
+            while len(_cache) > CATALOGO_CACHE_MAX_ENTRADAS:
+                _cache.popitem(last=False)
+    return catalogo
+
+
+def _leer_generacion_compartida(db) -> Optional[int]:
+    """
+    Generación compartida, o None si no se puede leer (migración 20261018 sin
+    aplicar): la lectura va en un savepoint para no abortar la transacción del
+    llamador y la caché sigue funcionando solo con el TTL.
+    """
+    global _aviso_generacion
+    try:
+        with db.begin_nested():
+            fila = db.execute(text("SELECT generacion FROM catalogo_generacion WHERE id = 1")).first()
+        return int(fila[0]) if fila else 0
+    except Exception as e:
+        with _lock:
+            avisar, _aviso_generacion = not _aviso_generacion, True
+        if avisar:
+            logger.warning(f"[CATALOGO] No se pudo leer catalogo_generacion, caché solo con TTL: {e}")
+        return None
+
+
+def _publicar_generacion(db, motivo: str) -> Optional[int]:
+    """
+    Sube la generación compartida. Hace commit de la sesión: llamar tras el commit
+    de la carga. None si no se pudo publicar (solo se invalida este proceso).
+    """
+    params = {"motivo": motivo}
+    try:
+        with db.begin_nested():
+            result = db.execute(
+                text("""
+                    UPDATE catalogo_generacion
+                    SET generacion = generacion + 1, motivo = :motivo, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = 1
+                """),
+                params,
+            )
+            if result.rowcount == 0:
+                # Sin la fila semilla de la migración (BD nueva o tests)
+                db.execute(text("INSERT INTO catalogo_generacion (id, generacion, motivo) VALUES (1, 1, :motivo)"), params)
+    except Exception as e:
+        logger.warning(f"[CATALOGO] No se pudo publicar la invalidación ({motivo}) a otros workers: {e}")
+        return None
+    generacion = _leer_generacion_compartida(db)
+    db.commit()
+    return generacion
+
+
+def _sincronizar_generacion(db) -> None:
+    """Vacía la caché del proceso si otro worker invalidó el catálogo (como mucho cada CHECK_S)."""
+    global _generacion, _generacion_bd, _generacion_comprobada_en
+    ahora = time.monotonic()
+    with _lock:
+        if ahora - _generacion_comprobada_en < CATALOGO_GENERACION_CHECK_S:
+            return
+
+    compartida = _leer_generacion_compartida(db)
+
+    with _lock:
+        _generacion_comprobada_en = ahora
+        if compartida is None:
+            return
+        if _generacion_bd is None or compartida == _generacion_bd:
+            # Primera lectura tras arrancar o invalidar: la caché ya está vacía o al día
+            _generacion_bd = compartida
+            return
+        anterior, _generacion_bd = _generacion_bd, compartida
+        _cache.clear()
+        _indices.clear()
+        _generacion += 1
+        _stats["sincronizaciones"] += 1
+    logger.info(f"[CATALOGO] Caché vaciada por invalidación de otro worker (generacion compartida {anterior} -> {compartida})")
+
+
+def invalidar_catalogo(motivo: str = "manual", db=None) -> None:
+    """
+    Vacía la caché. Llamar tras cargar tarifas, precios o comisiones.
+    Con `db` publica la invalidación al resto de workers (catalogo_generacion).
+    """
+    global _generacion, _generacion_bd, _generacion_comprobada_en
+    compartida = _publicar_generacion(db, motivo) if db is not None else None
+    with _lock:
+        _cache.clear()
+        _indices.clear()
+        _generacion += 1
+        _stats["invalidaciones"] += 1
+        generacion = _generacion
+        # La siguiente get_catalogo relee la generación compartida sin volver a vaciar
+        _generacion_bd = compartida
+        _generacion_comprobada_en = time.monotonic() if compartida is not None else float("-inf")
+    logger.info(f"[CATALOGO] Caché invalidada (motivo={motivo}, generacion={generacion}, compartida={compartida})")
+
+
+def catalogo_stats() -> Dict[str, Any]:
+    """Contadores de la caché para /debug/tarifas/cache."""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_ratio": round(_stats["hits"] / total, 4) if total else 0.0,
+            "entradas": len(_cache),
+            "claves": [f"{atr}@{fecha.isoformat()}" for atr, fecha in _cache.keys()],
+            "indices": {atr: len(indice.cortes) for atr, indice in _indices.items()},
+            "generacion": _generacion,
+            "generacion_compartida": _generacion_bd,
+            "ttl_s": CATALOGO_CACHE_TTL_S,
+            "generacion_check_s": CATALOGO_GENERACION_CHECK_S,
+        }
@@ -2,16 +2,34 @@
 Tariff comparison service for 2.0TD (MVP).
 """
 
-from datetime import date, datetime
+import csv
+from dataclasses import replace
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+import hashlib
+import io
 import json
 import logging
 import re  # ⭐ AÑADIDO: usado en _parse_date()
-from typing import Dict, Any, Optional
+import time
+from types import SimpleNamespace
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
-from sqlalchemy import inspect, text
+from sqlalchemy import Numeric, bindparam, inspect, text
 from app.exceptions import DomainError
-from app.db.models import Comparativa
+from app.db.models import Comparativa, Factura
+from app.services.catalogo_tarifas import get_catalogo, _fetch_comisiones_tarifa
+from app.services.comparador_core import (
+    FacturaComparable,
+    calcular_baseline,
+    calcular_comparacion,
+    componer_resultado,
+    reajustar_ahorros,
+    referencia_ahorro,
+    reconstruir_factura as _reconstruir_factura,  # noqa: F401 (compat: tests y QA lo importan desde aquí)
+)
+from app.services.historico_consumo import anotar_anualizacion
+from app.services.metricas import span, traza_actual
 
 logger = logging.getLogger(__name__)
 _TABLE_COLUMNS_CACHE: Dict[str, Dict[str, Any]] = {}
@@ -106,6 +124,39 @@ def _get_days(factura) -> int:
     return None  # P1: NO fallback
 
 
+def _ventana_factura(factura, periodo_dias: Optional[int]) -> Tuple[Optional[date], Optional[date]]:
+    """(inicio, fin exclusivo) del periodo facturado, completando una fecha con periodo_dias."""
+    inicio = _parse_date(getattr(factura, "fecha_inicio", None))
+    fin = _parse_date(getattr(factura, "fecha_fin", None))
+    if periodo_dias and periodo_dias > 0:
+        if fin is None and inicio is not None:
+            fin = inicio + timedelta(days=periodo_dias)
+        elif inicio is None and fin is not None:
+            inicio = fin - timedelta(days=periodo_dias)
+    return inicio, fin
+
+
+def resolver_as_of(factura, as_of) -> Optional[date]:
+    """
+    Fecha de vigencia del catálogo para una comparación histórica: None (hoy),
+    una fecha ISO o "factura" (último día facturado; si no hay periodo, la fecha
+    de emisión). Lanza DomainError AS_OF_INVALID si no se puede resolver.
+    """
+    if as_of is None or isinstance(as_of, date):
+        return as_of
+    raw = str(as_of).strip()
+    if raw.lower() == "factura":
+        _, fin = _ventana_factura(factura, getattr(factura, "periodo_dias", None))
+        fecha = fin - timedelta(days=1) if fin else _parse_date(getattr(factura, "fecha", None))
+        if fecha is None:
+            raise DomainError("AS_OF_INVALID", f"Factura {factura.id} sin fechas para as_of=factura")
+        return fecha
+    try:
+        return date.fromisoformat(raw)
+    except ValueError:
+        raise DomainError("AS_OF_INVALID", f"as_of debe ser YYYY-MM-DD o 'factura' (recibido '{raw}')")
+
+
 def _pick_value(mapping, keys, default):
     for key in keys:
         value = mapping.get(key)
@@ -131,49 +182,6 @@ def _resolve_energy_prices(mapping):
     return None, None
 
 
-def _fetch_precios_versiones(db, version_ids: list) -> Dict[int, Dict[str, Any]]:
-    """
-    Prefetch de precios de energía y potencia para múltiples versiones de tarifas.
-    Query única para evitar N+1.
-    
-    Returns:
-        {version_id: {'energia': {'P1': 0.15, 'P2': 0.12, '24H': None}, 
-                     'potencia': {'P1': 0.08, 'P2': 0.04}}}
-    """
-    if not version_ids:
-        return {}
-    
-    result = db.execute(
-        text("""
-            SELECT 
-                tarifa_version_id,
-                concepto,
-                periodo,
-                valor
-            FROM tarifa_precios
-            WHERE tarifa_version_id = ANY(:version_ids)
-        """),
-        {"version_ids": version_ids}
-    )
-    
-    rows = result.fetchall()
-    precios_map = {}
-    
-    for row in rows:
-        vid = row[0]
-        concepto = row[1]  # 'energia' o 'potencia'
-        periodo = row[2]  # 'P1', 'P2', '24H', etc.
-        precio = float(row[3])
-        
-        if vid not in precios_map:
-            precios_map[vid] = {'energia': {}, 'potencia': {}}
-        
-        precios_map[vid][concepto][periodo] = precio
-    
-    logger.info(f"[VERSIONADO] Prefetch precios: {len(precios_map)} versiones")
-    return precios_map
-
-
 def _get_precio_energia(precios_dict: Dict, periodo_idx: int) -> Optional[float]:
     """
     Obtiene precio de energía para periodo (1-6) desde dict de precios.
@@ -327,10 +335,211 @@ def _insert_comparativa(db, factura_id: int) -> Optional[int]:
     return comparativa_id
 
 
-def _insert_ofertas(db, factura_id: int, comparativa_id: int, offers) -> bool:
+def _fetch_comisiones_cliente(db, cliente_ids, tarifa_ids) -> Dict[Tuple[int, int], Decimal]:
+    """
+    Prefetch comisiones_cliente (ORDER BY determinista) para varios clientes a la vez.
+    ESQUEMA REAL: NO tiene vigente_desde, solo created_at + id
+
+    Returns:
+        {(cliente_id, tarifa_id): Decimal}
+    """
+    cliente_ids = sorted({c for c in cliente_ids if c is not None})
+    tarifa_ids = sorted({t for t in tarifa_ids if t is not None})
+    if not cliente_ids or not tarifa_ids:
+        return {}
+    
+    # En SQLite local la tabla puede no existir (columnas cacheadas por proceso)
+    if not _get_table_columns(db, "comisiones_cliente"):
+        return {}
+
+    rows = db.execute(
+        text("""
+            WITH ranked AS (
+                SELECT 
+                    cliente_id,
+                    tarifa_id,
+                    comision_eur,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY cliente_id, tarifa_id 
+                        ORDER BY created_at DESC, id DESC
+                    ) as rn
+                FROM comisiones_cliente
+                WHERE cliente_id IN :cids AND tarifa_id IN :tids
+            )
+            SELECT cliente_id, tarifa_id, comision_eur
+            FROM ranked
+            WHERE rn = 1
+        """).bindparams(bindparam("cids", expanding=True), bindparam("tids", expanding=True)),
+        {"cids": cliente_ids, "tids": tarifa_ids}
+    ).fetchall()
+    return {(row[0], row[1]): Decimal(str(row[2])) for row in rows}
+
+
+def _filas_ofertas(
+    factura_id: int,
+    comparativa_id: int,
+    offers,
+    cliente_id: Optional[int],
+    comisiones_cliente_map: Dict[Tuple[int, int], Decimal],
+    comisiones_tarifa_map: Dict[int, Decimal],
+) -> list:
+    """
+    Resuelve la comisión de cada oferta y devuelve los payloads de ofertas_calculadas.
+    Añade comision_eur/comision_source al dict de cada oferta (van en detalle_json).
+    """
+    filas = []
+    for idx, offer in enumerate(offers):
+        tid = offer.get("tarifa_id")
+        if tid is None:
+            logger.warning(f"[OFERTAS] Skipping offer {idx+1} (no tarifa_id): {offer.get('plan_name', 'unknown')}")
+            continue
+        
+        # ⭐ RESOLUCIÓN DE COMISIÓN (usando diccionarios prefetcheados)
+        comision_eur = Decimal("0.00")
+        comision_source = "manual"
+        
+        # Prioridad 1: Comisión por cliente específico
+        if (cliente_id, tid) in comisiones_cliente_map:
+            comision_eur = comisiones_cliente_map[(cliente_id, tid)]
+            comision_source = "cliente"
+        # Prioridad 2: Comisión por tarifa activa
+        elif tid in comisiones_tarifa_map:
+            comision_eur = comisiones_tarifa_map[tid]
+            comision_source = "tarifa"
+        # Prioridad 3: Manual (0.0) - ya es el default
+        
+        # Agregar comisión al offer JSON
+        offer["comision_eur"] = str(comision_eur)  # JSON exacto, sin artefactos
+        offer["comision_source"] = comision_source
+        
+        filas.append({
+            "comparativa_id": comparativa_id,
+            "tarifa_id": tid,
+            "tarifa_version_id": offer.get("tarifa_version_id"),  # ⭐ VERSIONADO
+            "coste_estimado": offer.get("estimated_total_periodo"),
+            "ahorro_mensual": offer.get("saving_amount_monthly"),
+            "ahorro_anual": offer.get("saving_amount_annual"),
+            "comision_eur": comision_eur,  # Decimal directo para DB
+            "comision_source": comision_source,
+            "detalle_json": json.dumps(offer, ensure_ascii=False)
+        })
+    return filas
+
+
+_OFERTAS_COLUMNAS = (
+    "comparativa_id", "tarifa_id", "tarifa_version_id", "coste_estimado",
+    "ahorro_mensual", "ahorro_anual", "comision_eur", "comision_source", "detalle_json",
+)
+# Filas por sentencia en el INSERT multi-fila (9 columnas → 900 parámetros, bajo el límite de SQLite)
+OFERTAS_INSERT_PAGINA = 100
+
+
+def _es_psycopg2(db) -> bool:
+    dialect = db.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def _insert_filas_execute_values(db, filas) -> None:
+    """Postgres: psycopg2 execute_values (un INSERT multi-fila por página, una ida y vuelta)."""
+    from psycopg2.extras import execute_values
+
+    columnas = ", ".join(_OFERTAS_COLUMNAS)
+    plantilla = "(" + ", ".join(["%s"] * (len(_OFERTAS_COLUMNAS) - 1)) + ", %s::jsonb)"
+    valores = [tuple(fila[c] for c in _OFERTAS_COLUMNAS) for fila in filas]
+    cursor = db.connection().connection.cursor()
+    try:
+        execute_values(
+            cursor,
+            f"INSERT INTO ofertas_calculadas ({columnas}) VALUES %s",
+            valores,
+            template=plantilla,
+            page_size=max(len(valores), 1),
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_filas_copy(db, filas) -> None:
+    """Postgres: COPY ... FROM STDIN en CSV. Para lotes grandes (jobs de cartera)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for fila in filas:
+        # None → campo vacío sin comillas = NULL en COPY CSV
+        writer.writerow([fila[c] for c in _OFERTAS_COLUMNAS])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY ofertas_calculadas ({', '.join(_OFERTAS_COLUMNAS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_filas_multivalues(db, filas) -> None:
+    """Resto de dialectos (SQLite local): INSERT ... VALUES (...), (...) por páginas."""
+    if db.get_bind().dialect.name == "postgresql":
+        detalle_sql = "CAST(:detalle_json_{i} AS jsonb)"
+    else:
+        detalle_sql = ":detalle_json_{i}"
+    
+    for inicio in range(0, len(filas), OFERTAS_INSERT_PAGINA):
+        pagina = filas[inicio:inicio + OFERTAS_INSERT_PAGINA]
+        values_sql = []
+        params = {}
+        tipos = []
+        for i, fila in enumerate(pagina):
+            placeholders = [f":{c}_{i}" for c in _OFERTAS_COLUMNAS[:-1]] + [detalle_sql.format(i=i)]
+            values_sql.append("(" + ", ".join(placeholders) + ")")
+            params.update({f"{c}_{i}": fila[c] for c in _OFERTAS_COLUMNAS})
+            # Decimal → tipo del driver (SQLite no acepta Decimal)
+            tipos.append(bindparam(f"comision_eur_{i}", type_=Numeric(12, 2)))
+        stmt = text(
+            f"INSERT INTO ofertas_calculadas ({', '.join(_OFERTAS_COLUMNAS)}) VALUES "
+            + ", ".join(values_sql)
+        ).bindparams(*tipos)
+        db.execute(stmt, params)
+
+
+def _insert_filas_ofertas(db, filas, usar_copy: bool = False) -> int:
+    """
+    INSERT en bloque de ofertas_calculadas: todas las filas de una comparativa
+    (o de un trozo de lote) en una sola sentencia.
+    
+    - Postgres/psycopg2: execute_values, o COPY si usar_copy (jobs por lotes)
+    - Resto (SQLite): INSERT multi-fila por páginas de OFERTAS_INSERT_PAGINA
+    """
+    if not filas:
+        return 0
+    
+    t0 = time.perf_counter()
+    if _es_psycopg2(db):
+        if usar_copy:
+            metodo = "copy"
+            _insert_filas_copy(db, filas)
+        else:
+            metodo = "execute_values"
+            _insert_filas_execute_values(db, filas)
+    else:
+        metodo = "multivalues"
+        _insert_filas_multivalues(db, filas)
+    
+    logger.info(f"[OFERTAS] Insert bloque: {len(filas)} filas en {(time.perf_counter() - t0) * 1000:.1f} ms (metodo={metodo})")
+    return len(filas)
+
+
+def _insert_ofertas(
+    db, factura_id: int, comparativa_id: int, offers,
+    comisiones_tarifa_map=None, comisiones_cliente_map=None,
+) -> bool:
     """
     Persiste ofertas en 'ofertas_calculadas' siguiendo esquema estricto Neon.
     Borra ofertas previas del mismo comparativa_id.
+    
+    comisiones_tarifa_map: {tarifa_id: Decimal} ya resuelto (catálogo cacheado).
+    comisiones_cliente_map: {(cliente_id, tarifa_id): Decimal} ya prefetcheado.
+    Si son None se consultan en BD.
     """
     if comparativa_id is None:
         return False
@@ -342,11 +551,7 @@ def _insert_ofertas(db, factura_id: int, comparativa_id: int, offers) -> bool:
             {"cid": comparativa_id}
         )
         
-        # 2. Insert new
-        count = 0
-        is_postgres = db.get_bind().dialect.name == "postgresql"
-        
-        logger.info(f"[OFERTAS] _insert_ofertas ENTER: comparativa_id={comparativa_id}, received {len(offers)} offers")
+        logger.debug(f"[OFERTAS] _insert_ofertas ENTER: comparativa_id={comparativa_id}, received {len(offers)} offers")
         
         # ⭐ PREFETCH: Obtener cliente_id y todas las comisiones (evita N+1 queries)
         factura_row = db.execute(
@@ -358,126 +563,23 @@ def _insert_ofertas(db, factura_id: int, comparativa_id: int, offers) -> bool:
         # Extraer todos los tarifa_id de las ofertas
         tarifa_ids = [o.get("tarifa_id") for o in offers if o.get("tarifa_id") is not None]
         
-        # Prefetch comisiones_cliente (ORDER BY determinista)
-        # ESQUEMA REAL: NO tiene vigente_desde, solo created_at + id
-        comisiones_cliente_map = {}
-        if cliente_id and tarifa_ids:
-            rows = db.execute(
-                text("""
-                    WITH ranked AS (
-                        SELECT 
-                            tarifa_id,
-                            comision_eur,
-                            ROW_NUMBER() OVER (
-                                PARTITION BY tarifa_id 
-                                ORDER BY created_at DESC, id DESC
-                            ) as rn
-                        FROM comisiones_cliente
-                        WHERE cliente_id = :cid AND tarifa_id = ANY(:tids)
-                    )
-                    SELECT tarifa_id, comision_eur
-                    FROM ranked
-                    WHERE rn = 1
-                """),
-                {"cid": cliente_id, "tids": tarifa_ids}
-            ).fetchall()
-            comisiones_cliente_map = {row[0]: Decimal(str(row[1])) for row in rows}
+        if comisiones_cliente_map is None:
+            comisiones_cliente_map = _fetch_comisiones_cliente(db, [cliente_id], tarifa_ids)
         
-        # Prefetch comisiones_tarifa activas (ORDER BY determinista)
-        # ESQUEMA REAL: SÍ tiene vigente_desde/vigente_hasta
-        comisiones_tarifa_map = {}
-        if tarifa_ids:
-            rows = db.execute(
-                text("""
-                    WITH ranked AS (
-                        SELECT 
-                            tarifa_id,
-                            comision_eur,
-                            ROW_NUMBER() OVER (
-                                PARTITION BY tarifa_id 
-                                ORDER BY vigente_desde DESC, created_at DESC, id DESC
-                            ) as rn
-                        FROM comisiones_tarifa
-                        WHERE tarifa_id = ANY(:tids) AND vigente_hasta IS NULL
-                    )
-                    SELECT tarifa_id, comision_eur
-                    FROM ranked
-                    WHERE rn = 1
-                """),
-                {"tids": tarifa_ids}
-            ).fetchall()
-            comisiones_tarifa_map = {row[0]: Decimal(str(row[1])) for row in rows}
+        # Comisiones_tarifa activas: vienen del catálogo cacheado si se pasan
+        if comisiones_tarifa_map is None:
+            comisiones_tarifa_map = _fetch_comisiones_tarifa(db, tarifa_ids)
         
         logger.info(f"[COMISION] Prefetch: cliente_id={cliente_id}, {len(comisiones_cliente_map)} cliente, {len(comisiones_tarifa_map)} tarifa")
         
-        for idx, offer in enumerate(offers):
-            tid = offer.get("tarifa_id")
-            if tid is None:
-                logger.warning(f"[OFERTAS] Skipping offer {idx+1} (no tarifa_id): {offer.get('plan_name', 'unknown')}")
-                continue
-            
-            # ⭐ RESOLUCIÓN DE COMISIÓN (usando diccionarios prefetcheados)
-            comision_eur = Decimal("0.00")
-            comision_source = "manual"
-            
-            # Prioridad 1: Comisión por cliente específico
-            if tid in comisiones_cliente_map:
-                comision_eur = comisiones_cliente_map[tid]
-                comision_source = "cliente"
-            # Prioridad 2: Comisión por tarifa activa
-            elif tid in comisiones_tarifa_map:
-                comision_eur = comisiones_tarifa_map[tid]
-                comision_source = "tarifa"
-            # Prioridad 3: Manual (0.0) - ya es el default
-            
-            logger.debug(f"[COMISION] factura_id={factura_id} tarifa_id={tid} comision={comision_eur:.2f} source={comision_source}")  # DEBUG no INFO
-            
-            # Agregar comisión al offer JSON
-            offer["comision_eur"] = str(comision_eur)  # JSON exacto, sin artefactos
-            offer["comision_source"] = comision_source
-                
-            payload = {
-                "comparativa_id": comparativa_id,
-                "tarifa_id": tid,
-                "tarifa_version_id": offer.get("tarifa_version_id"),  # ⭐ NUEVO
-                "coste_estimado": offer.get("estimated_total_periodo"),
-                "ahorro_mensual": offer.get("ahorro_mensual_equiv"),
-                "ahorro_anual": offer.get("ahorro_anual_equiv"),
-                "comision_eur": comision_eur,  # Decimal directo para DB
-                "comision_source": comision_source,
-                "detalle_json": json.dumps(offer, ensure_ascii=False)
-            }
-            
-            logger.debug(f"[OFERTAS] Inserting offer {idx+1}/{len(offers)}: tarifa_id={tid}, coste={payload['coste_estimado']}, comision={comision_eur:.2f}")  # DEBUG
-            
-            # ⭐ VERSIONADO: Incluir tarifa_version_id
-            if is_postgres:
-                stmt = text("""
-                    INSERT INTO ofertas_calculadas 
-                    (comparativa_id, tarifa_id, tarifa_version_id, coste_estimado, ahorro_mensual, ahorro_anual, comision_eur, comision_source, detalle_json)
-                    VALUES 
-                    (:comparativa_id, :tarifa_id, :tarifa_version_id, :coste_estimado, :ahorro_mensual, :ahorro_anual, :comision_eur, :comision_source, CAST(:detalle_json AS jsonb))
-                """)
-            else:
-                stmt = text("""
-                    INSERT INTO ofertas_calculadas 
-                    (comparativa_id, tarifa_id, tarifa_version_id, coste_estimado, ahorro_mensual, ahorro_anual, comision_eur, comision_source, detalle_json)
-                    VALUES 
-                    (:comparativa_id, :tarifa_id, :tarifa_version_id, :coste_estimado, :ahorro_mensual, :ahorro_anual, :comision_eur, :comision_source, :detalle_json)
-                """)
-                
-            try:
-                db.execute(stmt, payload)
-                count += 1
-                logger.debug(f"[OFERTAS] ✅ Offer {idx+1} inserted successfully")  # DEBUG
-            except Exception as insert_error:
-                logger.error(
-                    f"[OFERTAS] ❌ FAILED inserting offer {idx+1}: {insert_error}\nPayload: {payload}",
-                    exc_info=True
-                )
-                raise
+        # 2. Insert new
+        filas = _filas_ofertas(
+            factura_id, comparativa_id, offers, cliente_id,
+            comisiones_cliente_map, comisiones_tarifa_map,
+        )
+        count = _insert_filas_ofertas(db, filas)
             
-        logger.info(f"Inserted {count} offers for comparativa_id={comparativa_id}")
+        logger.debug(f"Inserted {count} offers for comparativa_id={comparativa_id}")
         return count > 0
         
     except Exception as e:
@@ -492,56 +594,12 @@ def _insert_ofertas(db, factura_id: int, comparativa_id: int, offers) -> bool:
 # ⭐ _persist_results ELIMINADA - ahora todo se hace en una sola transacción en compare_factura
 
 
-
-
-def _reconstruir_factura(
-    subtotal_sin_impuestos: float,
-    iva_pct: float,
-    alquiler_total: float = 0.0,
-    impuesto_electrico_pct: float = 0.0511269632
-) -> float:
-    """
-    Reconstruye el total de una factura siguiendo el método PO/NodoÁmbar.
-    
-    ESQUEMA OBLIGATORIO:
-    1. Subtotal sin impuestos (energía + potencia, ya calculado)
-    2. Impuesto eléctrico = subtotal × 5.11269632%
-    3. Alquiler contador (importe total del periodo)
-    4. Base IVA = subtotal + IEE + alquiler
-    5. IVA = base_IVA × iva_pct
-    6. TOTAL = base_IVA + IVA
-    
-    Args:
-        subtotal_sin_impuestos: Coste energía + potencia antes de impuestos
-        iva_pct: Porcentaje IVA (ej: 0.21 para 21%)
-        alquiler_total: Importe total alquiler del periodo (default 0)
-        impuesto_electrico_pct: Porcentaje IEE (default 5.11269632%)
-    
-    Returns:
-        Total factura reconstruida
-    """
-    # 1. Impuesto eléctrico
-    impuesto_electrico = subtotal_sin_impuestos * impuesto_electrico_pct
-    
-    # 2. Base IVA
-    base_iva = subtotal_sin_impuestos + impuesto_electrico + alquiler_total
-    
-    # 3. IVA
-    iva = base_iva * iva_pct
-    
-    # 4. TOTAL
-    total = base_iva + iva
-    
-    return total
-
-
-def compare_factura(factura, db) -> Dict[str, Any]:
+def _preparar_entrada(factura) -> FacturaComparable:
     """
-    P1 PRODUCCIÓN: Compara ofertas usando el periodo REAL de la factura.
-    NO usa fallback a 30 días. Lanza DomainError si falta periodo.
+    Valida la factura y extrae los inputs del comparador. No toca BD.
     
-    ⭐ STEP 2 INTEGRATION: Si la factura pasó por validación comercial,
-    usa total_ajustado en vez de total_factura como línea base.
+    Lanza DomainError (TOTAL_INVALID, FIELDS_MISSING, PERIOD_REQUIRED, PERIOD_INVALID)
+    si la factura no se puede comparar.
     """
     # Prioridad 1: Total ajustado (si pasó por Step 2)
     # Prioridad 2: Total factura (si no hay Step 2)
@@ -550,7 +608,7 @@ def compare_factura(factura, db) -> Dict[str, Any]:
         logger.info(f"[STEP2] Usando total_ajustado={current_total:.2f} como línea base (factura_id={factura.id})")
     else:
         current_total = _to_float(getattr(factura, "total_factura", None))
-        logger.info(f"[STEP2] Usando total_factura={current_total:.2f} como línea base (factura_id={factura.id})")
+        logger.info(f"[STEP2] Usando total_factura={current_total} como línea base (factura_id={factura.id})")
     
     if current_total is None or current_total <= 0:
         raise DomainError("TOTAL_INVALID", "La factura no tiene un total válido para comparar")
@@ -644,54 +702,7 @@ def compare_factura(factura, db) -> Dict[str, Any]:
         for i in range(1, num_periodos_potencia + 1):
             potencias.append(_to_float(getattr(factura, f"potencia_p{i}_kw", None)) or 0.0)
 
-    # ⭐ VERSIONADO: Query a tarifa_versiones vigentes HOY (JOIN con tarifas)
-    fecha_hoy = date.today()
-    
-    result = db.execute(
-        text("""
-            SELECT 
-                tv.id as tarifa_version_id,
-                t.id as tarifa_id,
-                t.nombre,
-                t.comercializadora,
-                t.atr,
-                t.tipo
-            FROM tarifa_versiones tv
-            JOIN tarifas t ON tv.tarifa_id = t.id
-            WHERE t.atr = :atr
-              AND tv.vigente_desde <= :fecha
-              AND (tv.vigente_hasta IS NULL OR tv.vigente_hasta >= :fecha)
-            ORDER BY t.comercializadora, t.nombre
-        """),
-        {"atr": atr, "fecha": fecha_hoy}
-    )
-    
-    try:
-        tarifas = result.mappings().all()
-    except AttributeError:
-        tarifas = [row._mapping for row in result.fetchall()]
-    
-    if not tarifas:
-        logger.warning(f"[VERSIONADO] No hay tarifas vigentes para {atr}")
-        return {
-            "ok": False,
-            "error_code": "NO_TARIFAS_VIGENTES",
-            "message": f"No hay tarifas disponibles para {atr}",
-            "factura_id": factura.id,
-            "ofertas": []
-        }
-    
-    # Prefetch precios
-    version_ids = [t['tarifa_version_id'] for t in tarifas]
-    precios_map = _fetch_precios_versiones(db, version_ids)
-    
-    logger.info(f"[VERSIONADO] {len(tarifas)} tarifas vigentes para {atr}")
-    
-    # ⭐ MÉTODO PO/NODOÁMBAR: Calcular subtotal sin impuestos de factura ACTUAL
-    # mediante BACKSOLVE desde los importes totales (NO inventar precios)
-    
     # Obtener valores de la factura
-    total_factura = current_total  # Ya validado antes
     iva_importe = _to_float(getattr(factura, 'iva', None))
     iee_importe = _to_float(getattr(factura, 'impuesto_electrico', None))
     alquiler_importe = _to_float(getattr(factura, 'alquiler_contador', None)) or 0.0
@@ -706,9 +717,9 @@ def compare_factura(factura, db) -> Dict[str, Any]:
     
     # Determinar IVA %
     if hasattr(factura, 'iva_porcentaje') and factura.iva_porcentaje is not None:
-        iva_pct_reconstruccion = float(factura.iva_porcentaje) / 100.0
+        iva_pct = float(factura.iva_porcentaje) / 100.0
     else:
-        iva_pct_reconstruccion = 0.21  # 21% por defecto
+        iva_pct = 0.21  # 21% por defecto
     
     # ✅ VALIDACIÓN: periodo_dias obligatorio para cálculos de comparador
     periodo_dias = getattr(factura, 'periodo_dias', None)
@@ -719,311 +730,197 @@ def compare_factura(factura, db) -> Dict[str, Any]:
             "El período de facturación (días) es obligatorio y debe ser mayor a 0 para calcular el comparador"
         )
     
-    # BACKSOLVE: Calcular subtotal sin impuestos
-    baseline_method = "backsolve_subtotal_si"
+    # ===== ALQUILER CONTADOR (ofertas) =====
+    # PRIORIDAD 1: Usar valor real de la factura si existe
+    # PRIORIDAD 2: Si NO está en factura, NO lo incluimos (asumimos que no aplica)
+    alquiler_equipo = float(factura.alquiler_contador) if getattr(factura, 'alquiler_contador', None) is not None else 0.0
     
-    if iva_importe is not None and iva_importe > 0:
-        # Método principal: usar importes directos
-        base_iva = total_factura - iva_importe
-        iee_used = iee_importe if iee_importe is not None else 0.0
-        subtotal_si_actual = base_iva - iee_used - alquiler_importe
-        
-        logger.info(
-            f"[PO] Backsolve: total={total_factura:.2f} iva_imp={iva_importe:.2f} "
-            f"base_iva={base_iva:.2f} iee={iee_used:.2f} alq={alquiler_importe:.2f} "
-            f"subtotal_si={subtotal_si_actual:.2f}"
-        )
-    else:
-        # Fallback: calcular IVA desde porcentaje
-        base_iva = total_factura / (1 + iva_pct_reconstruccion)
-        iva_importe = total_factura - base_iva
-        iee_used = iee_importe if iee_importe is not None else 0.0
-        subtotal_si_actual = base_iva - iee_used - alquiler_importe
-        
-        logger.info(
-            f"[PO] Backsolve (desde %): total={total_factura:.2f} iva_pct={iva_pct_reconstruccion} "
-            f"base_iva={base_iva:.2f} iee={iee_used:.2f} alq={alquiler_importe:.2f} "
-            f"subtotal_si={subtotal_si_actual:.2f}"
-        )
+    # Snapshot de inputs para auditoría (comparativas.inputs_json)
+    inputs_snapshot = {
+        "cups": factura.cups,
+        "atr": atr,
+    }
+    for i in range(1, num_periodos_energia + 1):
+        inputs_snapshot[f"consumo_p{i}"] = getattr(factura, f"consumo_p{i}_kwh", None)
+    for i in range(1, num_periodos_potencia + 1):
+        inputs_snapshot[f"potencia_p{i}"] = getattr(factura, f"potencia_p{i}_kw", None)
     
-    # Validación: si subtotal resultante es negativo o muy bajo, usar fallback
-    if subtotal_si_actual < 0 or subtotal_si_actual < (total_factura * 0.3):
-        logger.warning(
-            f"[PO] Subtotal backsolve sospechoso ({subtotal_si_actual:.2f}€), "
-            f"activando fallback a current_total"
-        )
-        baseline_method = "fallback_current_total"
-        total_actual_reconstruido = current_total
-    else:
-        # Reconstruir factura actual con la MISMA lógica que ofertas
-        total_actual_reconstruido = _reconstruir_factura(
-            subtotal_sin_impuestos=subtotal_si_actual,
-            iva_pct=iva_pct_reconstruccion,
-            alquiler_total=alquiler_importe,
-            impuesto_electrico_pct=0.0511269632
-        )
-        
-        diff_vs_original = abs(total_actual_reconstruido - current_total)
-        logger.info(
-            f"[PO] Factura actual reconstruida: {total_actual_reconstruido:.2f}€ "
-            f"vs original: {current_total:.2f}€ (diff: {diff_vs_original:.2f}€) "
-            f"method={baseline_method}"
-        )
+    return FacturaComparable(
+        factura_id=factura.id,
+        cliente_id=getattr(factura, "cliente_id", None),
+        atr=atr,
+        num_periodos_energia=num_periodos_energia,
+        num_periodos_potencia=num_periodos_potencia,
+        current_total=current_total,
+        periodo_dias=periodo_dias,
+        consumos=consumos,
+        potencias=potencias,
+        iva_importe=iva_importe,
+        iee_importe=iee_importe,
+        alquiler_importe=alquiler_importe,
+        alquiler_equipo=alquiler_equipo,
+        iva_pct=iva_pct,
+        coste_energia_actual=getattr(factura, 'coste_energia_actual', None),
+        coste_potencia_actual=getattr(factura, 'coste_potencia_actual', None),
+        cups=(factura.cups or "").strip().upper() or None,
+        fecha_fin=_ventana_factura(factura, periodo_dias)[1],
+        inputs_snapshot=inputs_snapshot,
+    )
 
 
+def _sin_tarifas_vigentes(factura_id: int, atr: str) -> Dict[str, Any]:
+    logger.warning(f"[VERSIONADO] No hay tarifas vigentes para {atr}")
+    return {
+        "ok": False,
+        "error_code": "NO_TARIFAS_VIGENTES",
+        "message": f"No hay tarifas disponibles para {atr}",
+        "factura_id": factura_id,
+        "ofertas": []
+    }
 
 
-    offers = []
-    for tarifa in tarifas:
-        # ⭐ VERSIONADO: Obtener precios desde tarifa_precios
-        version_id = tarifa['tarifa_version_id']
-        precios_version = precios_map.get(version_id)
-        
-        if not precios_version:
-            logger.warning(f"[VERSIONADO] Skip version_id={version_id}: sin precios")
-            continue
-        
-        # LOGICA DE PRECIOS ENERGÍA DINÁMICA
-        precios_energia = []
-        for i in range(1, num_periodos_energia + 1):
-            precio = _get_precio_energia(precios_version['energia'], i)
-            precios_energia.append(precio)
-        
-        # Validar que al menos P1 tenga precio
-        if precios_energia[0] is None:
-            logger.warning(f"[VERSIONADO] Skip {tarifa['nombre']}: sin precio P1")
-            continue
-        
-        # Calcular coste de energía
-        coste_energia = sum(
-            consumos[i] * (precios_energia[i] or 0.0)
-            for i in range(num_periodos_energia)
-        )
-        modo_energia = f"{num_periodos_energia}p_dinamico"
+def _inputs_calculo(entrada: FacturaComparable, top_k: Optional[int] = None) -> Dict[str, Any]:
+    """Inputs de la factura que determinan el resultado, y el modo de salida (lista completa o top-K)."""
+    return {
+        "atr": entrada.atr,
+        "consumos": entrada.consumos,
+        "potencias": entrada.potencias,
+        "periodo_dias": entrada.periodo_dias,
+        "iva_pct": entrada.iva_pct,
+        "iva": entrada.iva_importe,
+        "iee": entrada.iee_importe,
+        "alquiler": entrada.alquiler_equipo,
+        "total_base": entrada.current_total,
+        "coste_energia_actual": entrada.coste_energia_actual,
+        "coste_potencia_actual": entrada.coste_potencia_actual,
+        "factor_anual": entrada.factor_anual,
+        "top_k": top_k,
+    }
 
-        # LOGICA DE PRECIOS POTENCIA DINÁMICA
-        precios_potencia = []
-        tiene_precios_potencia = True
-        
-        for i in range(1, num_periodos_potencia + 1):
-            precio = _get_precio_potencia(precios_version['potencia'], i)
-            
-            # Fallback BOE 2025 SOLO para 2.0TD si no hay precio
-            if precio is None and atr == "2.0TD":
-                if i == 1:
-                    precio = 0.073777  # BOE 2025 P1
-                elif i == 2:
-                    precio = 0.001911  # BOE 2025 P2
-                tiene_precios_potencia = False
-            
-            precios_potencia.append(precio or 0.0)
-        
-        # Calcular coste de potencia
-        coste_potencia = periodo_dias * sum(
-            potencias[i] * precios_potencia[i]
-            for i in range(num_periodos_potencia)
-        )
-        
-        # Determinar modo de potencia
-        if tiene_precios_potencia:
-            modo_potencia = "tarifa"
-        else:
-            modo_potencia = "boe_2025_regulado"
 
-        # TOTALIZACIÓN CON IMPUESTOS (Para igualar factura real)
-        subtotal = coste_energia + coste_potencia
-        
-        # ===== IMPUESTO ELÉCTRICO (IEE) =====
-        # PRIORIDAD 1: Usar valor real de la factura si existe
-        if hasattr(factura, 'impuesto_electrico') and factura.impuesto_electrico is not None:
-            impuesto_electrico = float(factura.impuesto_electrico)
-            modo_iee = "factura_real"
-        else:
-            # FALLBACK: Calcular con porcentaje fijo 5.11269632%
-            impuesto_electrico = subtotal * 0.0511269632
-            modo_iee = "calculado_5.11%"
-        
-        # ===== ALQUILER CONTADOR =====
-        # PRIORIDAD 1: Usar valor real de la factura si existe
-        # PRIORIDAD 2: Si NO está en factura, NO lo incluimos (asumimos que no aplica)
-        if hasattr(factura, 'alquiler_contador') and factura.alquiler_contador is not None:
-            alquiler_equipo = float(factura.alquiler_contador)
-            modo_alquiler = "factura_real"
-        else:
-            # NO incluir alquiler si no está en la factura
-            alquiler_equipo = 0.0
-            modo_alquiler = "no_aplica"
-        
-        base_imponible = subtotal + impuesto_electrico + alquiler_equipo
-        
-        # ===== IVA =====
-        # PRIORIDAD 1: Usar el valor que viene de la factura (seleccionado por el usuario o extraído)
-        if hasattr(factura, 'iva_porcentaje') and factura.iva_porcentaje is not None:
-            iva_pct = float(factura.iva_porcentaje) / 100.0
-            modo_iva = f"usuario_{int(factura.iva_porcentaje)}%"
-        else:
-            # FALLBACK: 21% por defecto (Estándar actual)
-            iva_pct = 0.21
-            modo_iva = "defecto_21%"
-        
-        iva_importe = base_imponible * iva_pct
-        
-        # ⭐ MÉTODO PO: Calcular subtotal sin impuestos para esta oferta
-        subtotal_sin_impuestos_oferta = coste_energia + coste_potencia
-        
-        # Reconstruir total de oferta con la MISMA función que la actual
-        estimated_total_periodo = _reconstruir_factura(
-            subtotal_sin_impuestos=subtotal_sin_impuestos_oferta,
-            iva_pct=iva_pct,
-            alquiler_total=alquiler_equipo,  # Usar mismo alquiler que factura actual
-            impuesto_electrico_pct=0.0511269632
-        )
-        
-        # ⭐ CALCULAR BREAKDOWN CORRECTO (mismo esquema que _reconstruir_factura)
-        iee_oferta = subtotal_sin_impuestos_oferta * 0.0511269632
-        base_iva_oferta = subtotal_sin_impuestos_oferta + iee_oferta + alquiler_equipo
-        iva_oferta = base_iva_oferta * iva_pct
-        impuestos_oferta = iee_oferta + iva_oferta  # Para breakdown del PDF
-        
-        # ⭐ MÉTODO PO: Comparar reconstrucción actual vs reconstrucción oferta
-        # Calculamos el ahorro ESTRUCTURAL (Sin impuestos ni alquileres)
-        subtotal_actual = subtotal_si_actual if baseline_method != "fallback_current_total" else (current_total / 1.25) # estimacion si falla
-        ahorro_estructural = subtotal_actual - subtotal_sin_impuestos_oferta
-        
-        # Ahorro con impuestos (para el total de la factura)
-        if baseline_method == "fallback_current_total":
-            ahorro_periodo = current_total - estimated_total_periodo
-        else:
-            ahorro_periodo = total_actual_reconstruido - estimated_total_periodo
-        
-        # ⭐ CÁLCULOS NORMALIZADOS (Regla P0: Normalización a 30 días)
-        # total_30 = total_periodo * (30 / dias)
-        # ahorro_anual = (total_30_actual - total_30_oferta) * 12
-        factor_normalizacion = 30.0 / float(periodo_dias)
-        
-        # Cifra reina: Ahorro anual normalizado (360 días)
-        ahorro_anual_norm = ahorro_periodo * factor_normalizacion * 12.0
-        ahorro_mensual_norm = ahorro_periodo * factor_normalizacion
-        
-        # Flag de comparabilidad estructural
-        # Se considera comparable si existen coste_energia_actual y coste_potencia_actual
-        b_e = getattr(factura, 'coste_energia_actual', None)
-        b_p = getattr(factura, 'coste_potencia_actual', None)
-        is_structural_comparable = (b_e is not None and b_p is not None)
-
-        # El porcentaje de ahorro se calcula sobre el total de referencia
-        total_referencia = total_actual_reconstruido if baseline_method != "fallback_current_total" else current_total
-        saving_percent = (ahorro_periodo / total_referencia * 100) if total_referencia > 0 else 0.0
-
-        # PRECIO MEDIO ESTRUCTURAL (E+P / kWh)
-        total_kwh = sum(consumos)
-        precio_medio_estructural = (subtotal_sin_impuestos_oferta / total_kwh) if total_kwh > 0 else 0.0
-
-        # ⭐ VERSIONADO: Mapeo desde dict de versiones
-        tarifa_version_id = version_id
-        tarifa_id = tarifa.get("id") or tarifa.get("tarifa_id") or version_id  # Legacy compat
-        provider = tarifa.get("comercializadora") or "Proveedor genérico"
-        plan_name = tarifa.get("nombre") or "Tarifa 2.0TD"
-
-        # ⭐ DEBUG: Logs especiales para factura 287
-        if factura.id == 287:
-            logger.warning(f"[DEBUG-287] Oferta {provider}/{plan_name}: periodo={periodo_dias}d, consumos={consumos}, potencias={potencias}")
-            logger.warning(f"[DEBUG-287] coste_energia={coste_energia:.4f}, coste_potencia={coste_potencia:.4f}, total_est={estimated_total_periodo:.2f}")
-        
-        offer = {
-            "tarifa_id": tarifa_id,
-            "tarifa_version_id": tarifa_version_id,  # ⭐ NUEVO
-            "provider": provider,
-            "plan_name": plan_name,
-            "estimated_total": round(estimated_total_periodo, 2),
-            "estimated_total_periodo": round(estimated_total_periodo, 2), # Requerido para sorting
-            "saving_amount": round(ahorro_periodo, 2),  # ahorro en el periodo factura
-            "ahorro_periodo": round(ahorro_periodo, 2), # Requerido para tags
-            "saving_amount_annual": round(ahorro_anual_norm, 2), # CIFRA REINA
-            "saving_amount_monthly": round(ahorro_mensual_norm, 2),
-            "is_structural_comparable": is_structural_comparable,
-            "saving_percent": round(saving_percent, 2),
-            "commission": 0,
-            "tag": "balanced",
-            "breakdown": {
-                "periodo_dias": int(periodo_dias),
-                "consumo_p1": round(consumos[0], 2),
-                "consumo_p2": round(consumos[1], 2),
-                "consumo_p3": round(consumos[2], 2),
-                "consumo_p4": round(consumos[3], 2) if len(consumos) > 3 else 0,
-                "consumo_p5": round(consumos[4], 2) if len(consumos) > 4 else 0,
-                "consumo_p6": round(consumos[5], 2) if len(consumos) > 5 else 0,
-                "potencia_p1": round(potencias[0], 4),
-                "potencia_p2": round(potencias[1], 4),
-                "coste_energia": round(coste_energia, 2),
-                "coste_potencia": round(coste_potencia, 2),
-                "impuestos": round(impuestos_oferta, 2),
-                "alquiler_contador": round(alquiler_equipo, 2),
-                "modo_energia": modo_energia,
-                "modo_potencia": modo_potencia,
-                "is_structural_comparable": is_structural_comparable,
-                "precio_medio_estructural": round(precio_medio_estructural, 4) if is_structural_comparable else None,
-                "ahorro_estructural": round(ahorro_estructural, 2) if is_structural_comparable else None,
-            },
-        }
-
-        offers.append(offer)
-
-    completas = [item for item in offers if item["breakdown"]["modo_potencia"] == "tarifa"]
-    parciales = [item for item in offers if item["breakdown"]["modo_potencia"] != "tarifa"]
-
-    # Ordenar por precio total estimado
-    completas.sort(key=lambda item: item["estimated_total"])
-    parciales.sort(key=lambda item: item["estimated_total"])
-
-    for item in parciales:
-        item["tag"] = "partial"
-
-    if completas:
-        max_saving = max(item["ahorro_periodo"] for item in completas)
-        for item in completas:
-            if item["ahorro_periodo"] == max_saving:
-                item["tag"] = "best_saving"
-            else:
-                item["tag"] = "balanced"
-
-    offers = completas + parciales
-
-    # ⭐ FIX CRÍTICO: PERSISTIR COMPARATIVA + OFERTAS EN UNA SOLA TRANSACCIÓN
+def _fingerprint_comparacion(
+    entrada: FacturaComparable,
+    catalogo,
+    comisiones_cliente_map: Dict[Tuple[int, int], Decimal],
+    top_k: Optional[int] = None,
+) -> str:
+    """
+    sha256 de todo lo que determina el resultado: inputs de la factura
+    (consumos, potencias, periodo, IVA, IEE, alquiler, total base, ATR),
+    versión del catálogo, versión de las comisiones que aplican al cliente
+    y modo de salida (lista completa o top-K).
+    """
+    cliente_id = entrada.cliente_id
+    comisiones_cliente = sorted(
+        [tid, str(valor)]
+        for (cid, tid), valor in comisiones_cliente_map.items()
+        if cid == cliente_id
+    )
+    contenido = {
+        **_inputs_calculo(entrada, top_k),
+        "catalogo": [catalogo.atr, catalogo.version],
+        "comisiones": [cliente_id, comisiones_cliente],
+    }
+    raw = json.dumps(contenido, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _sellar_entrada(entrada: FacturaComparable, catalogo, comisiones_cliente_map, top_k: Optional[int] = None) -> None:
+    """
+    Huella para la memoización y snapshot de los inputs de cálculo en
+    comparativas.inputs_json["calculo"] (lo usa la revalorización incremental).
+    """
+    entrada.fingerprint = _fingerprint_comparacion(entrada, catalogo, comisiones_cliente_map, top_k)
+    entrada.inputs_snapshot["calculo"] = _inputs_calculo(entrada, top_k)
+
+
+def _ultimas_comparativas(db, factura_ids) -> Dict[int, Comparativa]:
+    """Última comparativa de cada factura vía facturas.ultima_comparativa_id (lookup por PK)."""
+    factura_ids = list({fid for fid in factura_ids if fid is not None})
+    if not factura_ids:
+        return {}
+    comparativas = (
+        db.query(Comparativa)
+        .join(Factura, Factura.ultima_comparativa_id == Comparativa.id)
+        .filter(Factura.id.in_(factura_ids))
+        .all()
+    )
+    return {c.factura_id: c for c in comparativas}
+
+
+def _apuntar_ultima_comparativa(db, pares) -> None:
+    """Actualiza facturas.ultima_comparativa_id; pares = [(factura_id, comparativa_id)]. Sin commit."""
+    if not pares:
+        return
+    db.execute(
+        text("UPDATE facturas SET ultima_comparativa_id = :cid WHERE id = :fid"),
+        [{"fid": fid, "cid": cid} for fid, cid in pares],
+    )
+
+
+def _resultado_memoizado(entrada: FacturaComparable, comparativa: Optional[Comparativa]) -> Optional[Dict[str, Any]]:
+    """
+    Si la última comparativa de la factura tiene la misma huella, reconstruye la
+    respuesta desde ella (baseline recalculado, ofertas de offers_json) sin tocar BD.
+    """
+    if (
+        comparativa is None
+        or comparativa.status != "ok"
+        or not comparativa.fingerprint
+        or comparativa.fingerprint != entrada.fingerprint
+        or not comparativa.offers_json
+    ):
+        return None
+    resultado = componer_resultado(entrada, calcular_baseline(entrada), json.loads(comparativa.offers_json))
+    resultado["comparativa_id"] = comparativa.id
+    logger.info(f"[MEMO] Reutilizada comparativa_id={comparativa.id} para factura_id={entrada.factura_id}")
+    return resultado
+
+
+def _nueva_comparativa(entrada: FacturaComparable, resultado: Dict[str, Any]) -> Comparativa:
+    return Comparativa(
+        factura_id=entrada.factura_id,
+        periodo_dias=entrada.periodo_dias,
+        current_total=entrada.current_total,
+        inputs_json=json.dumps(entrada.inputs_snapshot, default=str),
+        offers_json=json.dumps(resultado["offers"]),
+        status="ok",
+        fingerprint=entrada.fingerprint,
+    )
+
+
+def _persistir_comparativa(db, entrada, resultado, catalogo, comisiones_cliente_map=None) -> Optional[Dict[str, Any]]:
+    """
+    ⭐ FIX CRÍTICO: PERSISTIR COMPARATIVA + OFERTAS EN UNA SOLA TRANSACCIÓN
+    
+    Rellena resultado["comparativa_id"]. Devuelve un dict de error (ZERO_OFFERS)
+    si no se pudo insertar ninguna oferta, None si todo fue bien.
+    """
+    factura_id = entrada.factura_id
+    offers = resultado["offers"]
     comparativa_id = None
+    t0 = time.perf_counter()
     try:
-        logger.info(f"[OFERTAS] ENTER persistence for factura_id={factura.id}")
+        logger.debug(f"[OFERTAS] ENTER persistence for factura_id={factura_id}")
         
         # 1. Crear comparativa
-        inputs_snapshot = {
-            "cups": factura.cups,
-            "atr": atr,
-        }
-        
-        for i in range(1, num_periodos_energia + 1):
-            inputs_snapshot[f"consumo_p{i}"] = getattr(factura, f"consumo_p{i}_kwh", None)
-        
-        for i in range(1, num_periodos_potencia + 1):
-            inputs_snapshot[f"potencia_p{i}"] = getattr(factura, f"potencia_p{i}_kw", None)
-        
-        comparativa = Comparativa(
-            factura_id=factura.id,
-            periodo_dias=periodo_dias,
-            current_total=current_total,
-            inputs_json=json.dumps(inputs_snapshot),
-            offers_json=json.dumps(offers),
-            status="ok"
-        )
+        comparativa = _nueva_comparativa(entrada, resultado)
         db.add(comparativa)
         db.flush()  # ⭐ FLUSH (no COMMIT) para obtener ID sin cerrar transacción
         comparativa_id = comparativa.id
+        resultado["comparativa_id"] = comparativa_id
         
-        logger.info(f"[OFERTAS] Comparativa created with id={comparativa_id}")
+        logger.debug(f"[OFERTAS] Comparativa created with id={comparativa_id}")
         
         # 2. Insertar ofertas_calculadas (dentro de la MISMA transacción)
-        logger.info(f"[OFERTAS] comparativa_id={comparativa_id} offers_count={len(offers)}")
-        logger.info(f"[OFERTAS] tarifa_ids={[o.get('tarifa_id') for o in offers][:20]}")
-        inserted = _insert_ofertas(db, factura.id, comparativa_id, offers)
+        logger.debug(f"[OFERTAS] comparativa_id={comparativa_id} offers_count={len(offers)}")
+        logger.debug(f"[OFERTAS] tarifa_ids={[o.get('tarifa_id') for o in offers][:20]}")
+        with span("insert_ofertas"):
+            inserted = _insert_ofertas(
+                db, factura_id, comparativa_id, offers,
+                comisiones_tarifa_map=catalogo.comisiones_tarifa,
+                comisiones_cliente_map=comisiones_cliente_map,
+            )
         
         if not inserted:
             logger.error(f"[OFERTAS] ZERO offers inserted for comparativa_id={comparativa_id}")
@@ -1047,18 +944,25 @@ def compare_factura(factura, db) -> Dict[str, Any]:
                 "ok": False,
                 "error_code": "ZERO_OFFERS",
                 "message": "No se pudieron generar ofertas. Posible problema con comisiones o tarifas.",
-                "factura_id": factura.id,
+                "factura_id": factura_id,
                 "comparativa_id": comparativa_id,
             }
         else:
+            # offers_json con la comisión ya resuelta (es lo que devuelve la memoización)
+            comparativa.offers_json = json.dumps(offers)
+            _apuntar_ultima_comparativa(db, [(factura_id, comparativa_id)])
             # 3. COMMIT ÚNICO para ambas operaciones (solo si hubo inserción exitosa)
-            db.commit()
-            logger.info(f"[OFERTAS] Transaction committed successfully for comparativa_id={comparativa_id}")
+            with span("commit"):
+                db.commit()
+            logger.info(
+                f"[OFERTAS] Transaction committed successfully for comparativa_id={comparativa_id} "
+                f"({len(offers)} ofertas, {(time.perf_counter() - t0) * 1000:.1f} ms)"
+            )
         
     except Exception as e:
         db.rollback()  # ⭐ ROLLBACK INMEDIATO
         logger.error(
-            f"[OFERTAS] ROLLBACK - Error persisting comparativa+offers for factura_id={factura.id}: {e}",
+            f"[OFERTAS] ROLLBACK - Error persisting comparativa+offers for factura_id={factura_id}: {e}",
             exc_info=True
         )
         
@@ -1074,23 +978,347 @@ def compare_factura(factura, db) -> Dict[str, Any]:
             except Exception as update_error:
                 logger.warning(f"[OFERTAS] Could not update comparativa status: {update_error}")
                 db.rollback()
+    return None
+
+
+# Campos que se pueden sobrescribir en una previsualización (what-if de Step 2)
+CAMPOS_PREVIEW = (
+    "atr",
+    "consumo_p1_kwh", "consumo_p2_kwh", "consumo_p3_kwh",
+    "consumo_p4_kwh", "consumo_p5_kwh", "consumo_p6_kwh",
+    "potencia_p1_kw", "potencia_p2_kw",
+    "periodo_dias", "iva", "iva_porcentaje", "impuesto_electrico", "alquiler_contador",
+    "total_factura", "total_ajustado",
+)
 
-    # DETERMINAR EL "BASELINE" REAL PARA LA UI
-    # Si hemos reconstruido la factura (IVA 21%), ese debe ser el baseline visual
-    # para que la resta (Baseline - Oferta) coincida con lo que el usuario ve.
-    ui_current_total = total_actual_reconstruido if baseline_method == "backsolve_subtotal_si" else current_total
 
+def factura_con_cambios(factura, cambios: Optional[Dict[str, Any]] = None) -> SimpleNamespace:
+    """
+    Copia desacoplada de la factura (solo columnas) con los cambios aplicados.
+    No pertenece a la sesión: editarla nunca provoca un flush ni un UPDATE.
+    """
+    cambios = cambios or {}
+    invalidos = sorted(set(cambios) - set(CAMPOS_PREVIEW))
+    if invalidos:
+        raise DomainError("PREVIEW_FIELDS_INVALID", "Campos no modificables en previsualización: " + ", ".join(invalidos))
+    datos = {attr.key: getattr(factura, attr.key) for attr in inspect(type(factura)).column_attrs}
+    datos.update(cambios)
+    return SimpleNamespace(**datos)
+
+
+def compare_factura(
+    factura,
+    db,
+    persistir: bool = True,
+    top_k: Optional[int] = None,
+    as_of: Optional[date] = None,
+) -> Dict[str, Any]:
+    """
+    P1 PRODUCCIÓN: Compara ofertas usando el periodo REAL de la factura.
+    NO usa fallback a 30 días. Lanza DomainError si falta periodo.
+    
+    ⭐ STEP 2 INTEGRATION: Si la factura pasó por validación comercial,
+    usa total_ajustado en vez de total_factura como línea base.
+    
+    persistir=False (previsualización): mismo cálculo, sin escrituras ni
+    memoización; comparativa_id queda a None y la respuesta lleva preview=True.
+    Lee BD para el histórico de consumo del CUPS (anualización, una consulta) y
+    para el catálogo solo si no está en caché.
+    
+    top_k: devolver (y guardar) solo las K mejores ofertas. None = lista completa.
+
+    as_of: comparar contra las tarifas vigentes en esa fecha (re-comparación
+    histórica). Sale del mismo índice de vigencias que la comparación de hoy y
+    nunca se persiste: no debe desplazar a la última comparativa de la factura.
+
+    ⭐ TIEMPOS: cada etapa va en un span (ver app.services.metricas); con traza
+    activa se registra una línea [TIEMPOS] por comparación.
+    """
+    with span("comparar"):
+        resultado = _comparar_factura(factura, db, persistir, top_k, as_of)
+    traza = traza_actual()
+    if traza is not None:
+        logger.info(f"[TIEMPOS] factura_id={factura.id} {traza.resumen()}")
+    return resultado
+
+
+def _comparar_factura(factura, db, persistir: bool, top_k: Optional[int], as_of: Optional[date]) -> Dict[str, Any]:
+    if as_of is not None:
+        persistir = False
+    with span("preparar"):
+        entrada = _preparar_entrada(factura)
+    atr = entrada.atr
+    # ⭐ ANUALIZACIÓN ESTACIONAL: histórico mensual del CUPS (12 filas como mucho)
+    with span("historico"):
+        anotar_anualizacion(db, [entrada])
+
+    # ⭐ VERSIONADO: Catálogo vigente HOY (o en as_of) resuelto con el índice de
+    # vigencias en proceso; solo va a BD la primera vez por ATR o tras invalidación
+    with span("catalogo"):
+        catalogo = get_catalogo(db, atr, as_of or date.today())
+    if not catalogo.tarifas:
+        return _sin_tarifas_vigentes(factura.id, atr)
+    
+    logger.info(f"[VERSIONADO] {len(catalogo.tarifas)} tarifas vigentes para {atr} a {as_of or 'hoy'}")
+    
+    if not persistir:
+        with span("valoracion"):
+            resultado = calcular_comparacion(entrada, catalogo, top_k)
+        resultado["preview"] = True
+        if as_of is not None:
+            resultado["as_of"] = as_of.isoformat()
+        logger.info(f"[PREVIEW] factura_id={factura.id}: {len(resultado['offers'])} ofertas sin persistir")
+        return resultado
+    
+    # ⭐ MEMOIZACIÓN: misma huella que la última comparativa → devolverla sin recalcular ni insertar
+    with span("memo"):
+        comisiones_cliente_map = _fetch_comisiones_cliente(db, [entrada.cliente_id], _tarifa_ids_catalogo(catalogo))
+        _sellar_entrada(entrada, catalogo, comisiones_cliente_map, top_k)
+        memoizado = _resultado_memoizado(entrada, _ultimas_comparativas(db, [factura.id]).get(factura.id))
+    if memoizado is not None:
+        return memoizado
+    
+    with span("valoracion"):
+        resultado = calcular_comparacion(entrada, catalogo, top_k)
+    
+    error = _persistir_comparativa(db, entrada, resultado, catalogo, comisiones_cliente_map)
+    if error:
+        return error
+    return resultado
+
+
+def _tarifa_ids_catalogo(catalogo) -> List[int]:
+    return [t["tarifa_id"] for t in catalogo.tarifas if t.get("tarifa_id") is not None]
+
+
+def recalcular_ahorros_step2(db, factura) -> Optional[Dict[str, Any]]:
+    """
+    ⭐ DELTA STEP 2: Al cambiar total_ajustado, reajusta los ahorros de la
+    última comparativa de la factura sin volver a valorar el catálogo: un UPDATE
+    de conjunto sobre sus ofertas_calculadas y la comparativa con revision + 1
+    (el ETag de GET /facturas/{id}/comparativa cambia sin duplicar filas).
+
+    Solo si el resto de inputs de cálculo (consumos, potencias, IVA, IEE,
+    alquiler, anualización, top_k) coincide con los guardados en
+    inputs_json["calculo"]; si no, devuelve None y hace falta comparar de nuevo.
+    La huella se re-sella solo si la anterior sigue cuadrando con el catálogo y
+    las comisiones actuales (si no, se anula y la próxima comparación recalcula).
+    Sin commit.
+    """
+    comparativa = _ultimas_comparativas(db, [factura.id]).get(factura.id)
+    if comparativa is None or comparativa.status != "ok" or not comparativa.offers_json:
+        return None
+    try:
+        calculo = json.loads(comparativa.inputs_json or "{}").get("calculo")
+        entrada = _preparar_entrada(factura)
+    except (TypeError, ValueError, AttributeError, DomainError):
+        return None
+    if not calculo or calculo.get("total_base") is None:
+        return None
+    anotar_anualizacion(db, [entrada])
+
+    top_k = calculo.get("top_k")
+    actual = json.loads(json.dumps(_inputs_calculo(entrada, top_k), default=str))
+    if {k: v for k, v in actual.items() if k != "total_base"} != {k: v for k, v in calculo.items() if k != "total_base"}:
+        logger.info(f"[STEP2-DELTA] factura_id={factura.id}: inputs distintos de comparativa_id={comparativa.id}, sin delta")
+        return None
+    if actual["total_base"] == calculo["total_base"]:
+        return None
+
+    # Huella: catálogo en caché (sin valorar) + comisiones del cliente (1 query)
+    catalogo = get_catalogo(db, entrada.atr, date.today())
+    comisiones_cliente_map = _fetch_comisiones_cliente(db, [entrada.cliente_id], _tarifa_ids_catalogo(catalogo))
+    anterior = replace(entrada, current_total=float(calculo["total_base"]), inputs_snapshot={})
+    _sellar_entrada(anterior, catalogo, comisiones_cliente_map, top_k)
+    _sellar_entrada(entrada, catalogo, comisiones_cliente_map, top_k)
+    huella_vigente = anterior.fingerprint == comparativa.fingerprint
+
+    baseline = calcular_baseline(entrada)
+    offers = reajustar_ahorros(entrada, baseline, json.loads(comparativa.offers_json))
+    if not huella_vigente:
+        entrada.fingerprint = None
+    resultado = componer_resultado(entrada, baseline, offers)
+
+    # ⭐ Un único UPDATE de conjunto sobre las ofertas de la comparativa (sin
+    # duplicar filas): ahorro = referencia - coste estimado, con la misma
+    # anualización que reajustar_ahorros. detalle_json conserva la valoración
+    # (costes y desglose); los ahorros vigentes están en ahorro_* y offers_json.
+    _, total_referencia = referencia_ahorro(baseline, entrada.current_total)
+    factor_anual = entrada.factor_anual if entrada.factor_anual is not None else 360.0 / float(entrada.periodo_dias)
+    db.execute(
+        text("""
+            UPDATE ofertas_calculadas
+            SET ahorro_anual = ROUND(CAST((:referencia - coste_estimado) * :factor AS NUMERIC), 2),
+                ahorro_mensual = ROUND(CAST((:referencia - coste_estimado) * :factor / 12.0 AS NUMERIC), 2)
+            WHERE comparativa_id = :comparativa_id
+        """),
+        {"referencia": total_referencia, "factor": factor_anual, "comparativa_id": comparativa.id},
+    )
+    # La revisión forma parte del ETag de GET /facturas/{id}/comparativa
+    comparativa.current_total = entrada.current_total
+    comparativa.offers_json = json.dumps(offers)
+    comparativa.inputs_json = json.dumps(entrada.inputs_snapshot, default=str)
+    comparativa.fingerprint = entrada.fingerprint
+    comparativa.revision = (comparativa.revision or 0) + 1
+    resultado["comparativa_id"] = comparativa.id
+    logger.info(
+        f"[STEP2-DELTA] factura_id={factura.id} comparativa_id={comparativa.id} (revision {comparativa.revision}): "
+        f"total base {calculo['total_base']} → {entrada.current_total}, {len(offers)} ofertas reajustadas "
+        f"(huella {'re-sellada' if huella_vigente else 'anulada'})"
+    )
+    return resultado
+
+
+# ════════════════════════════════════════════════════════════
+# COMPARACIÓN POR LOTES (revisiones de cartera)
+# ════════════════════════════════════════════════════════════
+
+def _validar_step2(factura) -> None:
+    """Mismas precondiciones que POST /comparar/facturas/{id}, como DomainError."""
+    if not getattr(factura, "validado_step2", False):
+        raise DomainError("STEP2_REQUIRED", f"Factura {factura.id} NO pasó validación comercial (Step2)")
+    total_ajustado = getattr(factura, "total_ajustado", None)
+    if not total_ajustado or total_ajustado <= 0:
+        raise DomainError("TOTAL_AJUSTADO_MISSING", f"Factura {factura.id}: total_ajustado no definido o inválido")
+
+
+def _persistir_lote(db, items, comisiones_cliente_map) -> None:
+    """
+    Escribe comparativas y ofertas de un trozo del lote en bloque:
+    un flush para todas las comparativas y un único COPY de ofertas_calculadas
+    (INSERT multi-fila fuera de Postgres), y actualiza los punteros
+    facturas.ultima_comparativa_id. No hace commit (lo decide el llamador).
+    """
+    comparativas = [_nueva_comparativa(entrada, resultado) for entrada, resultado, _ in items]
+    db.add_all(comparativas)
+    db.flush()
+
+    filas = []
+    for comparativa, (entrada, resultado, catalogo) in zip(comparativas, items):
+        resultado["comparativa_id"] = comparativa.id
+        filas.extend(_filas_ofertas(
+            entrada.factura_id, comparativa.id, resultado["offers"], entrada.cliente_id,
+            comisiones_cliente_map, catalogo.comisiones_tarifa,
+        ))
+        # offers_json con la comisión ya resuelta
+        comparativa.offers_json = json.dumps(resultado["offers"])
+    _insert_filas_ofertas(db, filas, usar_copy=True)
+    _apuntar_ultima_comparativa(db, [(c.factura_id, c.id) for c in comparativas])
+
+
+def _resumen_oferta(offer: Dict[str, Any]) -> Dict[str, Any]:
     return {
-        "factura_id": factura.id,
-        "comparativa_id": comparativa_id,
-        "periodo_dias": periodo_dias,
-        "current_total": round(ui_current_total, 2),  # ← Baseline alineado para la UI
-        "total_actual_reconstruido": round(total_actual_reconstruido, 2) if baseline_method != "fallback_current_total" else None,
-        "subtotal_si_actual": round(subtotal_si_actual, 2) if baseline_method != "fallback_current_total" else None,
-        "coste_energia_actual": getattr(factura, 'coste_energia_actual', None),
-        "coste_potencia_actual": getattr(factura, 'coste_potencia_actual', None),
-        "baseline_method": baseline_method,
-        "metodo_calculo": "PO/NodoAmbar" if baseline_method == "backsolve_subtotal_si" else "Fallback",
-        "diff_vs_current_total": round(abs(total_actual_reconstruido - current_total), 2) if baseline_method != "fallback_current_total" else 0.0,
-        "offers": offers,
+        "tarifa_id": offer["tarifa_id"],
+        "tarifa_version_id": offer["tarifa_version_id"],
+        "provider": offer["provider"],
+        "plan_name": offer["plan_name"],
+        "estimated_total": offer["estimated_total"],
+        "saving_amount": offer["saving_amount"],
+        "saving_amount_annual": offer["saving_amount_annual"],
+        "tag": offer["tag"],
     }
+
+
+def _item_lote(entrada, resultado, reutilizada: bool, incluir_ofertas: bool) -> Dict[str, Any]:
+    item = {
+        "ok": True,
+        "factura_id": resultado["factura_id"],
+        "comparativa_id": resultado["comparativa_id"],
+        "reutilizada": reutilizada,
+        "atr": entrada.atr,
+        "current_total": resultado["current_total"],
+        "baseline_method": resultado["baseline_method"],
+        "ofertas_count": len(resultado["offers"]),
+        "mejor_oferta": _resumen_oferta(resultado["offers"][0]),
+    }
+    if incluir_ofertas:
+        item["offers"] = resultado["offers"]
+    return item
+
+
+def compare_facturas_lote(
+    db,
+    facturas,
+    fecha: Optional[date] = None,
+    tamano_trozo: int = 50,
+    incluir_ofertas: bool = False,
+    top_k: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Compara muchas facturas contra UN snapshot del catálogo por ATR (el vigente
+    al empezar el lote, aunque la caché se invalide a mitad).
+    
+    Procesa en trozos de `tamano_trozo`: calcula, persiste el trozo en bloque con
+    un commit y emite un dict por factura. Las facturas cuya huella coincide con
+    su última comparativa se devuelven sin recalcular (reutilizada=True). Los
+    DomainError por factura (PERIOD_REQUIRED, FIELDS_MISSING, ...) se emiten como
+    ok=False sin abortar. top_k: guardar solo las K mejores ofertas por factura.
+    """
+    fecha = fecha or date.today()
+    catalogos: Dict[str, Any] = {}
+
+    for inicio in range(0, len(facturas), tamano_trozo):
+        trozo = facturas[inicio:inicio + tamano_trozo]
+        preparadas = []
+        salida: List[Dict[str, Any]] = []
+
+        for factura in trozo:
+            try:
+                _validar_step2(factura)
+                entrada = _preparar_entrada(factura)
+                atr = entrada.atr
+                if atr not in catalogos:
+                    catalogos[atr] = get_catalogo(db, atr, fecha)
+                catalogo = catalogos[atr]
+                if not catalogo.tarifas:
+                    salida.append(_sin_tarifas_vigentes(factura.id, atr))
+                    continue
+                preparadas.append((entrada, catalogo))
+            except DomainError as e:
+                salida.append({"ok": False, "factura_id": factura.id, "error_code": e.code, "message": e.message})
+
+        # Un prefetch de comisiones_cliente, últimas comparativas e histórico de consumo para todo el trozo
+        anotar_anualizacion(db, [entrada for entrada, _ in preparadas])
+        comisiones_cliente_map = _fetch_comisiones_cliente(
+            db,
+            [entrada.cliente_id for entrada, _ in preparadas],
+            {tid for _, catalogo in preparadas for tid in _tarifa_ids_catalogo(catalogo)},
+        )
+        ultimas = _ultimas_comparativas(db, [entrada.factura_id for entrada, _ in preparadas])
+
+        calculados = []
+        reutilizadas = 0
+        for entrada, catalogo in preparadas:
+            _sellar_entrada(entrada, catalogo, comisiones_cliente_map, top_k)
+            memoizado = _resultado_memoizado(entrada, ultimas.get(entrada.factura_id))
+            if memoizado is not None:
+                reutilizadas += 1
+                salida.append(_item_lote(entrada, memoizado, True, incluir_ofertas))
+                continue
+            resultado = calcular_comparacion(entrada, catalogo, top_k)
+            if not resultado["offers"]:
+                salida.append({"ok": False, "factura_id": entrada.factura_id, "error_code": "ZERO_OFFERS",
+                               "message": "Ninguna tarifa del catálogo tiene precios completos"})
+                continue
+            calculados.append((entrada, resultado, catalogo))
+
+        if calculados:
+            try:
+                _persistir_lote(db, calculados, comisiones_cliente_map)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"[LOTE] ROLLBACK trozo de {len(calculados)} facturas: {e}", exc_info=True)
+                salida.extend(
+                    {"ok": False, "factura_id": entrada.factura_id, "error_code": "PERSIST_ERROR", "message": str(e)}
+                    for entrada, _, _ in calculados
+                )
+                calculados = []
+
+        salida.extend(_item_lote(entrada, resultado, False, incluir_ofertas) for entrada, resultado, _ in calculados)
+
+        logger.info(
+            f"[LOTE] Trozo {inicio // tamano_trozo + 1}: {len(calculados)} nuevas, {reutilizadas} reutilizadas, "
+            f"{len(salida) - len(calculados) - reutilizadas} con error"
+        )
+        yield from salida
@@ -0,0 +1,424 @@
+"""
+Núcleo puro del comparador: precios, baseline PO y ranking de ofertas.
+
+Sin sesión de BD, sin escrituras y sin DomainError: recibe una FacturaComparable
+ya validada (ver comparador._preparar_entrada) y un snapshot CatalogoTarifas, y
+devuelve el resultado con las ofertas. Ambos son picklables, así que se puede
+ejecutar en un ProcessPoolExecutor, en scripts batch o en benchmarks.
+compare_factura y compare_facturas_lote son los envoltorios con E/S.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+import logging
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from app.services.motor_vectorizado import CAPAS_DOMINANCIA_MAX, calcular_ofertas_vectorizado
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class FacturaComparable:
+    """
+    Inputs del comparador extraídos de una factura (sin referencias a la sesión).
+
+    consumos/potencias ya vienen con los periodos del ATR (en 3.0TD la potencia
+    P2 replicada a P3-P6). iva_pct en tanto por uno. fingerprint lo rellena el
+    envoltorio con E/S para la memoización. factor_anual (anualización
+    estacional del ahorro) lo rellena historico_consumo; None = lineal.
+    """
+
+    factura_id: int
+    atr: str
+    num_periodos_energia: int
+    num_periodos_potencia: int
+    current_total: float
+    periodo_dias: int
+    consumos: List[float]
+    potencias: List[float]
+    iva_pct: float
+    cliente_id: Optional[int] = None
+    iva_importe: Optional[float] = None
+    iee_importe: Optional[float] = None
+    alquiler_importe: float = 0.0
+    alquiler_equipo: float = 0.0
+    coste_energia_actual: Optional[float] = None
+    coste_potencia_actual: Optional[float] = None
+    cups: Optional[str] = None
+    fecha_fin: Optional[date] = None
+    factor_anual: Optional[float] = None
+    inputs_snapshot: Dict[str, Any] = field(default_factory=dict)
+    fingerprint: Optional[str] = None
+
+
+def reconstruir_factura(
+    subtotal_sin_impuestos: float,
+    iva_pct: float,
+    alquiler_total: float = 0.0,
+    impuesto_electrico_pct: float = 0.0511269632
+) -> float:
+    """
+    Reconstruye el total de una factura siguiendo el método PO/NodoÁmbar.
+    
+    ESQUEMA OBLIGATORIO:
+    1. Subtotal sin impuestos (energía + potencia, ya calculado)
+    2. Impuesto eléctrico = subtotal × 5.11269632%
+    3. Alquiler contador (importe total del periodo)
+    4. Base IVA = subtotal + IEE + alquiler
+    5. IVA = base_IVA × iva_pct
+    6. TOTAL = base_IVA + IVA
+    
+    Args:
+        subtotal_sin_impuestos: Coste energía + potencia antes de impuestos
+        iva_pct: Porcentaje IVA (ej: 0.21 para 21%)
+        alquiler_total: Importe total alquiler del periodo (default 0)
+        impuesto_electrico_pct: Porcentaje IEE (default 5.11269632%)
+    
+    Returns:
+        Total factura reconstruida
+    """
+    # 1. Impuesto eléctrico
+    impuesto_electrico = subtotal_sin_impuestos * impuesto_electrico_pct
+    
+    # 2. Base IVA
+    base_iva = subtotal_sin_impuestos + impuesto_electrico + alquiler_total
+    
+    # 3. IVA
+    iva = base_iva * iva_pct
+    
+    # 4. TOTAL
+    total = base_iva + iva
+    
+    return total
+
+
+def calcular_baseline(entrada: FacturaComparable) -> Dict[str, Any]:
+    """
+    ⭐ MÉTODO PO/NODOÁMBAR: Calcular subtotal sin impuestos de factura ACTUAL
+    mediante BACKSOLVE desde los importes totales (NO inventar precios).
+    """
+    current_total = entrada.current_total
+    total_factura = current_total  # Ya validado antes
+    iva_importe = entrada.iva_importe
+    iee_importe = entrada.iee_importe
+    alquiler_importe = entrada.alquiler_importe
+    iva_pct_reconstruccion = entrada.iva_pct
+    
+    # BACKSOLVE: Calcular subtotal sin impuestos
+    baseline_method = "backsolve_subtotal_si"
+    
+    if iva_importe is not None and iva_importe > 0:
+        # Método principal: usar importes directos
+        base_iva = total_factura - iva_importe
+        iee_used = iee_importe if iee_importe is not None else 0.0
+        subtotal_si_actual = base_iva - iee_used - alquiler_importe
+        
+        logger.info(
+            f"[PO] Backsolve: total={total_factura:.2f} iva_imp={iva_importe:.2f} "
+            f"base_iva={base_iva:.2f} iee={iee_used:.2f} alq={alquiler_importe:.2f} "
+            f"subtotal_si={subtotal_si_actual:.2f}"
+        )
+    else:
+        # Fallback: calcular IVA desde porcentaje
+        base_iva = total_factura / (1 + iva_pct_reconstruccion)
+        iva_importe = total_factura - base_iva
+        iee_used = iee_importe if iee_importe is not None else 0.0
+        subtotal_si_actual = base_iva - iee_used - alquiler_importe
+        
+        logger.info(
+            f"[PO] Backsolve (desde %): total={total_factura:.2f} iva_pct={iva_pct_reconstruccion} "
+            f"base_iva={base_iva:.2f} iee={iee_used:.2f} alq={alquiler_importe:.2f} "
+            f"subtotal_si={subtotal_si_actual:.2f}"
+        )
+    
+    # Validación: si subtotal resultante es negativo o muy bajo, usar fallback
+    if subtotal_si_actual < 0 or subtotal_si_actual < (total_factura * 0.3):
+        logger.warning(
+            f"[PO] Subtotal backsolve sospechoso ({subtotal_si_actual:.2f}€), "
+            f"activando fallback a current_total"
+        )
+        baseline_method = "fallback_current_total"
+        total_actual_reconstruido = current_total
+    else:
+        # Reconstruir factura actual con la MISMA lógica que ofertas
+        total_actual_reconstruido = reconstruir_factura(
+            subtotal_sin_impuestos=subtotal_si_actual,
+            iva_pct=iva_pct_reconstruccion,
+            alquiler_total=alquiler_importe,
+            impuesto_electrico_pct=0.0511269632
+        )
+        
+        diff_vs_original = abs(total_actual_reconstruido - current_total)
+        logger.info(
+            f"[PO] Factura actual reconstruida: {total_actual_reconstruido:.2f}€ "
+            f"vs original: {current_total:.2f}€ (diff: {diff_vs_original:.2f}€) "
+            f"method={baseline_method}"
+        )
+    
+    return {
+        "baseline_method": baseline_method,
+        "subtotal_si_actual": subtotal_si_actual,
+        "total_actual_reconstruido": total_actual_reconstruido,
+    }
+
+
+def referencia_ahorro(baseline: Dict[str, Any], current_total: float):
+    """(subtotal actual, total de referencia) contra los que se miden los ahorros."""
+    # ⭐ MÉTODO PO: Comparar reconstrucción actual vs reconstrucción oferta
+    # Si el backsolve falla, estimación del subtotal actual desde current_total
+    if baseline["baseline_method"] == "fallback_current_total":
+        return current_total / 1.25, current_total
+    return baseline["subtotal_si_actual"], baseline["total_actual_reconstruido"]
+
+
+def calcular_comparacion(entrada: FacturaComparable, catalogo, top_k: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Calcula y ordena las ofertas de una factura contra un snapshot del catálogo.
+    Función pura: no toca BD (comparativa_id queda a None hasta persistir) y
+    solo depende de sus argumentos, así que se puede repartir entre procesos.
+    
+    top_k: solo las K mejores ofertas (mismo orden que la lista completa).
+    Descarta las versiones dominadas por K o más y usa selección parcial en
+    vez de construir y ordenar todas. None = lista completa (auditoría).
+    """
+    current_total = entrada.current_total
+    periodo_dias = entrada.periodo_dias
+    consumos = entrada.consumos
+    potencias = entrada.potencias
+    alquiler_equipo = entrada.alquiler_equipo
+    tarifas = catalogo.tarifas
+    
+    baseline = calcular_baseline(entrada)
+    subtotal_actual, total_referencia = referencia_ahorro(baseline, current_total)
+
+    # ⭐ MOTOR VECTORIZADO: todas las versiones del catálogo en una pasada
+    # (mismas fórmulas y mismo orden de operaciones que reconstruir_factura)
+    matrices = catalogo.matrices
+    if top_k:
+        filas = _filas_candidatas_top_k(matrices, consumos, potencias, periodo_dias, top_k)
+        matrices_calculo = matrices.filas(filas)
+    else:
+        filas = None
+        matrices_calculo = matrices
+    calculo = calcular_ofertas_vectorizado(
+        matrices_calculo,
+        consumos=consumos,
+        potencias=potencias,
+        periodo_dias=periodo_dias,
+        iva_pct=entrada.iva_pct,
+        alquiler=alquiler_equipo,
+        total_referencia=total_referencia,
+        subtotal_actual=subtotal_actual,
+        factor_anual=entrada.factor_anual,
+    )
+    
+    sin_precios = int(matrices.sin_precios.sum())
+    sin_p1 = int((~matrices.valida).sum()) - sin_precios
+    if sin_precios or sin_p1:
+        logger.warning(f"[VERSIONADO] Skip {sin_precios} versiones sin precios y {sin_p1} sin precio P1 ({catalogo.atr})")
+    
+    # Flag de comparabilidad estructural
+    # Se considera comparable si existen coste_energia_actual y coste_potencia_actual
+    is_structural_comparable = (
+        entrada.coste_energia_actual is not None and entrada.coste_potencia_actual is not None
+    )
+    modo_energia = f"{entrada.num_periodos_energia}p_dinamico"
+    
+    # Conversión a float de Python antes de round() (np.round no redondea igual)
+    columnas = {k: v.tolist() for k, v in calculo.items()}
+    potencia_boe = matrices_calculo.potencia_boe.tolist()
+    
+    posiciones = np.flatnonzero(matrices_calculo.valida)
+    if top_k:
+        posiciones = _seleccion_top_k(calculo["total"], matrices_calculo.potencia_boe, posiciones, top_k)
+    indices_catalogo = filas.tolist() if filas is not None else None
+    
+    offers = []
+    for pos in posiciones.tolist():
+        idx = indices_catalogo[pos] if indices_catalogo is not None else pos
+        tarifa = tarifas[idx]
+        coste_energia = columnas["coste_energia"][pos]
+        coste_potencia = columnas["coste_potencia"][pos]
+        estimated_total_periodo = columnas["total"][pos]
+        ahorro_periodo = columnas["ahorro_periodo"][pos]
+        
+        # Determinar modo de potencia (fallback BOE 2025 solo en 2.0TD)
+        modo_potencia = "boe_2025_regulado" if potencia_boe[pos] else "tarifa"
+        
+        # ⭐ VERSIONADO: Mapeo desde dict de versiones
+        tarifa_version_id = tarifa['tarifa_version_id']
+        tarifa_id = tarifa.get("id") or tarifa.get("tarifa_id") or tarifa_version_id  # Legacy compat
+        provider = tarifa.get("comercializadora") or "Proveedor genérico"
+        plan_name = tarifa.get("nombre") or "Tarifa 2.0TD"
+
+        # ⭐ DEBUG: Logs especiales para factura 287
+        if entrada.factura_id == 287:
+            logger.warning(f"[DEBUG-287] Oferta {provider}/{plan_name}: periodo={periodo_dias}d, consumos={consumos}, potencias={potencias}")
+            logger.warning(f"[DEBUG-287] coste_energia={coste_energia:.4f}, coste_potencia={coste_potencia:.4f}, total_est={estimated_total_periodo:.2f}")
+
+        offer = {
+            "tarifa_id": tarifa_id,
+            "tarifa_version_id": tarifa_version_id,  # ⭐ NUEVO
+            "provider": provider,
+            "plan_name": plan_name,
+            "estimated_total": round(estimated_total_periodo, 2),
+            "estimated_total_periodo": round(estimated_total_periodo, 2), # Requerido para sorting
+            "saving_amount": round(ahorro_periodo, 2),  # ahorro en el periodo factura
+            "ahorro_periodo": round(ahorro_periodo, 2), # Requerido para tags
+            "saving_amount_annual": round(columnas["ahorro_anual"][pos], 2), # CIFRA REINA
+            "saving_amount_monthly": round(columnas["ahorro_mensual"][pos], 2),
+            "is_structural_comparable": is_structural_comparable,
+            "saving_percent": round(columnas["saving_percent"][pos], 2),
+            "commission": 0,
+            "tag": "balanced",
+            "breakdown": {
+                "periodo_dias": int(periodo_dias),
+                "consumo_p1": round(consumos[0], 2),
+                "consumo_p2": round(consumos[1], 2),
+                "consumo_p3": round(consumos[2], 2),
+                "consumo_p4": round(consumos[3], 2) if len(consumos) > 3 else 0,
+                "consumo_p5": round(consumos[4], 2) if len(consumos) > 4 else 0,
+                "consumo_p6": round(consumos[5], 2) if len(consumos) > 5 else 0,
+                "potencia_p1": round(potencias[0], 4),
+                "potencia_p2": round(potencias[1], 4),
+                "coste_energia": round(coste_energia, 2),
+                "coste_potencia": round(coste_potencia, 2),
+                "impuestos": round(columnas["impuestos"][pos], 2),
+                "alquiler_contador": round(alquiler_equipo, 2),
+                "modo_energia": modo_energia,
+                "modo_potencia": modo_potencia,
+                "is_structural_comparable": is_structural_comparable,
+                "precio_medio_estructural": round(columnas["precio_medio_estructural"][pos], 4) if is_structural_comparable else None,
+                "ahorro_estructural": round(columnas["ahorro_estructural"][pos], 2) if is_structural_comparable else None,
+            },
+        }
+
+        offers.append(offer)
+
+    offers = ordenar_ofertas(offers)
+
+    return componer_resultado(entrada, baseline, offers)
+
+
+def ordenar_ofertas(offers: list) -> list:
+    """
+    Ranking final: completas antes que parciales (fallback BOE), cada grupo por
+    total estimado (sort estable: a igualdad, orden de entrada) y tags.
+    """
+    completas = [item for item in offers if item["breakdown"]["modo_potencia"] == "tarifa"]
+    parciales = [item for item in offers if item["breakdown"]["modo_potencia"] != "tarifa"]
+
+    # Ordenar por precio total estimado
+    completas.sort(key=lambda item: item["estimated_total"])
+    parciales.sort(key=lambda item: item["estimated_total"])
+
+    for item in parciales:
+        item["tag"] = "partial"
+
+    if completas:
+        max_saving = max(item["ahorro_periodo"] for item in completas)
+        for item in completas:
+            if item["ahorro_periodo"] == max_saving:
+                item["tag"] = "best_saving"
+            else:
+                item["tag"] = "balanced"
+
+    return completas + parciales
+
+
+def reajustar_ahorros(entrada: FacturaComparable, baseline: Dict[str, Any], offers: list) -> list:
+    """
+    Ahorros de ofertas ya calculadas contra un nuevo total base (Step 2).
+
+    Los totales estimados no dependen del total de la factura: solo cambian la
+    referencia del backsolve y con ella ahorros, porcentajes y tags. Mismas
+    fórmulas que calcular_ofertas_vectorizado sobre estimated_total (al céntimo).
+    """
+    subtotal_actual, total_referencia = referencia_ahorro(baseline, entrada.current_total)
+    for offer in offers:
+        ahorro_periodo = total_referencia - offer["estimated_total"]
+        if entrada.factor_anual is None:
+            ahorro_mensual = ahorro_periodo * (30.0 / float(entrada.periodo_dias))
+            ahorro_anual = ahorro_mensual * 12.0
+        else:
+            ahorro_anual = ahorro_periodo * entrada.factor_anual
+            ahorro_mensual = ahorro_anual / 12.0
+        offer["saving_amount"] = offer["ahorro_periodo"] = round(ahorro_periodo, 2)
+        offer["saving_amount_annual"] = round(ahorro_anual, 2)
+        offer["saving_amount_monthly"] = round(ahorro_mensual, 2)
+        offer["saving_percent"] = round(ahorro_periodo / total_referencia * 100, 2) if total_referencia > 0 else 0.0
+        breakdown = offer["breakdown"]
+        if breakdown.get("ahorro_estructural") is not None:
+            subtotal = breakdown["coste_energia"] + breakdown["coste_potencia"]
+            breakdown["ahorro_estructural"] = round(subtotal_actual - subtotal, 2)
+    return ordenar_ofertas(offers)
+
+
+def _filas_candidatas_top_k(matrices, consumos, potencias, periodo_dias, top_k: int) -> np.ndarray:
+    """
+    Filas del catálogo que pueden entrar en un top-K: válidas con menos de K
+    versiones que las dominan (capa de dominancia <= K). La poda solo es segura
+    con consumos, potencias y días no negativos.
+    """
+    if (
+        top_k > CAPAS_DOMINANCIA_MAX
+        or min(consumos) < 0 or min(potencias) < 0 or periodo_dias <= 0
+    ):
+        return np.flatnonzero(matrices.valida)
+    return np.flatnonzero(matrices.valida & (matrices.capa_dominancia <= top_k))
+
+
+def _menores(total: np.ndarray, posiciones: np.ndarray, k: int) -> np.ndarray:
+    if k <= 0:
+        return posiciones[:0]
+    if len(posiciones) <= k:
+        return posiciones
+    return posiciones[np.argpartition(total[posiciones], k - 1)[:k]]
+
+
+def _seleccion_top_k(total: np.ndarray, potencia_boe: np.ndarray, posiciones: np.ndarray, k: int) -> np.ndarray:
+    """
+    K posiciones con menor total, completas antes que parciales (BOE), con
+    argpartition en vez de ordenar. Se devuelven en orden de catálogo para que
+    el sort estable posterior desempate igual que con la lista completa (salvo
+    empates exactos del total redondeado justo en la frontera K).
+    """
+    completas = posiciones[~potencia_boe[posiciones]]
+    parciales = posiciones[potencia_boe[posiciones]]
+    seleccion = _menores(total, completas, k)
+    if len(seleccion) < k:
+        seleccion = np.concatenate([seleccion, _menores(total, parciales, k - len(seleccion))])
+    return np.sort(seleccion)
+
+
+def componer_resultado(entrada: FacturaComparable, baseline: Dict[str, Any], offers: list) -> Dict[str, Any]:
+    """Respuesta del comparador (misma forma para resultado nuevo o memoizado)."""
+    current_total = entrada.current_total
+    periodo_dias = entrada.periodo_dias
+    baseline_method = baseline["baseline_method"]
+    subtotal_si_actual = baseline["subtotal_si_actual"]
+    total_actual_reconstruido = baseline["total_actual_reconstruido"]
+
+    # DETERMINAR EL "BASELINE" REAL PARA LA UI
+    # Si hemos reconstruido la factura (IVA 21%), ese debe ser el baseline visual
+    # para que la resta (Baseline - Oferta) coincida con lo que el usuario ve.
+    ui_current_total = total_actual_reconstruido if baseline_method == "backsolve_subtotal_si" else current_total
+
+    return {
+        "factura_id": entrada.factura_id,
+        "comparativa_id": None,
+        "periodo_dias": periodo_dias,
+        "current_total": round(ui_current_total, 2),  # ← Baseline alineado para la UI
+        "total_actual_reconstruido": round(total_actual_reconstruido, 2) if baseline_method != "fallback_current_total" else None,
+        "subtotal_si_actual": round(subtotal_si_actual, 2) if baseline_method != "fallback_current_total" else None,
+        "coste_energia_actual": entrada.coste_energia_actual,
+        "coste_potencia_actual": entrada.coste_potencia_actual,
+        "baseline_method": baseline_method,
+        "metodo_calculo": "PO/NodoAmbar" if baseline_method == "backsolve_subtotal_si" else "Fallback",
+        "diff_vs_current_total": round(abs(total_actual_reconstruido - current_total), 2) if baseline_method != "fallback_current_total" else 0.0,
+        "anualizacion": "estacional" if entrada.factor_anual is not None else "lineal",
+        "offers": offers,
+    }
@@ -0,0 +1,280 @@
+"""
+Comparación masiva offline de puntos de suministro (campañas de prospección).
+
+Lee un CSV/Parquet con una fila por CUPS (atr, consumos P1-P6, potencias P1-P2,
+días y total actual), valida cada fila con las mismas reglas que una factura,
+la valora contra el catálogo vigente con el núcleo puro del comparador
+repartido en procesos y escribe las K mejores ofertas por fila en CSV/Parquet.
+No crea facturas ni comparativas: solo lee el catálogo de BD.
+
+Parquet necesita pyarrow (dependencia opcional, no está en requirements.txt).
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from app.exceptions import DomainError
+from app.services.comparador import _preparar_entrada
+from app.services.comparador_core import FacturaComparable, calcular_comparacion
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_NUMERICOS = (
+    "consumo_p1_kwh", "consumo_p2_kwh", "consumo_p3_kwh",
+    "consumo_p4_kwh", "consumo_p5_kwh", "consumo_p6_kwh",
+    "potencia_p1_kw", "potencia_p2_kw",
+    "total_factura", "iva", "iva_porcentaje", "impuesto_electrico", "alquiler_contador",
+)
+
+COLUMNAS_SALIDA = (
+    "fila", "cups", "atr", "ranking", "provider", "plan_name", "tarifa_id", "tarifa_version_id",
+    "estimated_total", "current_total", "saving_amount", "saving_amount_annual", "saving_percent",
+    "tag", "error_code", "error",
+)
+
+MASIVO_TAMANO_TROZO = 500
+
+
+def _numero(valor) -> Optional[float]:
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        valor = valor.strip().replace(",", ".")
+        if not valor:
+            return None
+    return float(valor)
+
+
+def _dias(valor) -> Optional[int]:
+    numero = _numero(valor)
+    if numero is None:
+        return None
+    if numero != int(numero):
+        raise ValueError(f"periodo_dias no entero: {valor}")
+    return int(numero)
+
+
+def fila_a_entrada(numero: int, fila: Dict[str, Any]) -> FacturaComparable:
+    """
+    Convierte una fila del fichero en inputs del comparador con las mismas
+    validaciones que una factura (ATR por potencia si falta, campos obligatorios
+    por ATR, periodo > 0). Lanza DomainError o ValueError si no es comparable.
+    """
+    datos = {campo: None for campo in CAMPOS_NUMERICOS}
+    for campo in CAMPOS_NUMERICOS:
+        if campo in fila:
+            datos[campo] = _numero(fila[campo])
+    if not datos["total_factura"] or datos["total_factura"] <= 0:
+        raise DomainError("TOTAL_INVALID", "La fila no tiene un total_factura válido para comparar")
+    factura = SimpleNamespace(
+        id=numero,
+        cliente_id=None,
+        cups=(fila.get("cups") or "").strip() or None,
+        atr=(fila.get("atr") or "").strip() or None,
+        periodo_dias=_dias(fila.get("periodo_dias")),
+        fecha_inicio=None,
+        fecha_fin=None,
+        validado_step2=False,
+        total_ajustado=None,
+        **datos,
+    )
+    return _preparar_entrada(factura)
+
+
+def leer_filas(ruta: str) -> Iterator[Dict[str, Any]]:
+    """Filas del fichero como dicts, en streaming (CSV con , o ; / Parquet por lotes)."""
+    if ruta.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for lote in pq.ParquetFile(ruta).iter_batches(batch_size=MASIVO_TAMANO_TROZO):
+            yield from lote.to_pylist()
+        return
+
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        delimitador = ";" if muestra.count(";") > muestra.count(",") else ","
+        for fila in csv.DictReader(f, delimiter=delimitador):
+            yield {(k or "").strip().lower(): v for k, v in fila.items()}
+
+
+class EscritorResultados:
+    """Escribe las filas de salida a CSV o Parquet (por lotes) según la extensión."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.parquet = ruta.lower().endswith(".parquet")
+        self._pendientes: List[Dict[str, Any]] = []
+        self._writer = None
+        if self.parquet:
+            import pyarrow as pa
+
+            self._pa = pa
+            self._schema = pa.schema(
+                [(c, pa.int64()) for c in ("fila", "ranking", "tarifa_id", "tarifa_version_id")]
+                + [(c, pa.float64()) for c in ("estimated_total", "current_total", "saving_amount",
+                                               "saving_amount_annual", "saving_percent")]
+                + [(c, pa.string()) for c in ("cups", "atr", "provider", "plan_name", "tag", "error_code", "error")]
+            )
+        else:
+            self._f = open(ruta, "w", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._f, fieldnames=COLUMNAS_SALIDA)
+            self._writer.writeheader()
+
+    def escribir(self, filas: Iterable[Dict[str, Any]]) -> None:
+        if not self.parquet:
+            self._writer.writerows(filas)
+            return
+        self._pendientes.extend(filas)
+        if len(self._pendientes) >= MASIVO_TAMANO_TROZO:
+            self._volcar()
+
+    def _volcar(self) -> None:
+        if not self._pendientes:
+            return
+        import pyarrow.parquet as pq
+
+        tabla = self._pa.Table.from_pylist(self._pendientes, schema=self._schema)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.ruta, self._schema)
+        self._writer.write_table(tabla)
+        self._pendientes = []
+
+    def cerrar(self) -> None:
+        if self.parquet:
+            self._volcar()
+            if self._writer is not None:
+                self._writer.close()
+        else:
+            self._f.close()
+
+
+def _filas_resultado(numero: int, entrada: FacturaComparable, resultado: Dict[str, Any]) -> List[Dict[str, Any]]:
+    cups = entrada.inputs_snapshot.get("cups")
+    if not resultado["offers"]:
+        return [_fila_error(numero, cups, "ZERO_OFFERS", "Ninguna tarifa del catálogo tiene precios completos")]
+    return [
+        {
+            "fila": numero,
+            "cups": cups,
+            "atr": entrada.atr,
+            "ranking": ranking,
+            "provider": offer["provider"],
+            "plan_name": offer["plan_name"],
+            "tarifa_id": offer["tarifa_id"],
+            "tarifa_version_id": offer["tarifa_version_id"],
+            "estimated_total": offer["estimated_total"],
+            "current_total": resultado["current_total"],
+            "saving_amount": offer["saving_amount"],
+            "saving_amount_annual": offer["saving_amount_annual"],
+            "saving_percent": offer["saving_percent"],
+            "tag": offer["tag"],
+            "error_code": None,
+            "error": None,
+        }
+        for ranking, offer in enumerate(resultado["offers"], start=1)
+    ]
+
+
+def _fila_error(numero: int, cups: Optional[str], codigo: str, mensaje: str) -> Dict[str, Any]:
+    fila = {c: None for c in COLUMNAS_SALIDA}
+    fila.update({"fila": numero, "cups": cups, "error_code": codigo, "error": mensaje})
+    return fila
+
+
+# Estado de cada proceso worker: catálogos recibidos una vez en el initializer
+_catalogos_worker: Dict[str, Any] = {}
+
+
+def _init_worker(catalogos: Dict[str, Any]) -> None:
+    _catalogos_worker.clear()
+    _catalogos_worker.update(catalogos)
+    logging.getLogger("app.services.comparador_core").setLevel(logging.WARNING)
+
+
+def _valorar_trozo(trozo: List[Tuple[int, Any]], top_k: Optional[int]) -> List[Dict[str, Any]]:
+    """Valora un trozo de (fila, FacturaComparable | fila de error ya resuelta)."""
+    salida = []
+    for numero, entrada in trozo:
+        if isinstance(entrada, dict):
+            salida.append(entrada)
+            continue
+        catalogo = _catalogos_worker.get(entrada.atr)
+        if catalogo is None or not catalogo.tarifas:
+            salida.append(_fila_error(numero, entrada.inputs_snapshot.get("cups"), "NO_TARIFAS_VIGENTES",
+                                      f"No hay tarifas disponibles para {entrada.atr}"))
+            continue
+        salida.extend(_filas_resultado(numero, entrada, calcular_comparacion(entrada, catalogo, top_k)))
+    return salida
+
+
+def _trozos(filas: Iterable[Dict[str, Any]], tamano: int) -> Iterator[List[Tuple[int, Any]]]:
+    trozo = []
+    for numero, fila in enumerate(filas, start=1):
+        try:
+            trozo.append((numero, fila_a_entrada(numero, fila)))
+        except (DomainError, ValueError, TypeError) as e:
+            codigo = getattr(e, "code", "FILA_INVALIDA")
+            trozo.append((numero, _fila_error(numero, fila.get("cups") or None, codigo, getattr(e, "message", str(e)))))
+        if len(trozo) >= tamano:
+            yield trozo
+            trozo = []
+    if trozo:
+        yield trozo
+
+
+def comparar_filas(
+    filas: Iterable[Dict[str, Any]],
+    catalogos: Dict[str, Any],
+    escribir,
+    top_k: Optional[int] = 3,
+    procesos: Optional[int] = None,
+    tamano_trozo: int = MASIVO_TAMANO_TROZO,
+) -> Dict[str, Any]:
+    """
+    Valora `filas` contra `catalogos` ({atr: CatalogoTarifas}) y pasa las filas de
+    salida a `escribir` en el orden de entrada (una fila de error por fila no
+    comparable, sin abortar).
+
+    procesos: None = todos los cores; 1 = en este proceso (sin pool). Como mucho
+    hay 2 trozos por proceso en vuelo, así que la memoria no crece con el fichero.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    stats = {"filas": 0, "ofertas": 0, "errores": 0}
+    t0 = time.perf_counter()
+
+    def emitir(salida):
+        stats["filas"] += len({fila["fila"] for fila in salida})
+        stats["errores"] += sum(1 for fila in salida if fila["error_code"])
+        stats["ofertas"] += sum(1 for fila in salida if not fila["error_code"])
+        escribir(salida)
+
+    trozos = _trozos(filas, tamano_trozo)
+    if procesos <= 1:
+        _init_worker(catalogos)
+        for trozo in trozos:
+            emitir(_valorar_trozo(trozo, top_k))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_init_worker, initargs=(catalogos,)) as pool:
+            en_vuelo = deque()
+            for trozo in trozos:
+                en_vuelo.append(pool.submit(_valorar_trozo, trozo, top_k))
+                if len(en_vuelo) >= 2 * procesos:
+                    emitir(en_vuelo.popleft().result())
+            while en_vuelo:
+                emitir(en_vuelo.popleft().result())
+
+    segundos = time.perf_counter() - t0
+    stats["segundos"] = round(segundos, 3)
+    stats["filas_por_segundo"] = round(stats["filas"] / segundos, 1) if segundos > 0 else None
+    logger.info(
+        f"[MASIVO] {stats['filas']} filas ({stats['errores']} con error), {stats['ofertas']} ofertas "
+        f"en {segundos:.2f}s ({stats['filas_por_segundo']} filas/s, procesos={procesos})"
+    )
+    return stats
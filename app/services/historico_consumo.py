@@ -0,0 +1,175 @@
+"""
+Histórico de consumo por CUPS y anualización estacional del ahorro.
+
+Cada factura aporta sus kWh a los meses naturales que cubre (prorrateo por
+días) en consumo_cups_mensual. La tabla se reescribe por factura al subirla o
+editarla, así que el comparador no recorre las facturas del CUPS: lee como
+mucho 12 meses por CUPS con un índice (cups, mes), y para un lote en una sola
+consulta.
+
+Anualización: consumo anual estimado = meses reales de la ventana de 12 meses
+que termina en la factura (escalados a mes completo si la cobertura es parcial)
++ el resto de meses con PESOS_MENSUALES_CONSUMO. El ahorro anual es el ahorro
+del periodo × consumo anual estimado / consumo del periodo, en lugar de
+30 / periodo_dias × 12 (que sobreestima con facturas de invierno y subestima
+con las de primavera).
+"""
+
+from datetime import date, timedelta
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, text
+
+from app.db.models import ConsumoCupsMensual
+
+logger = logging.getLogger(__name__)
+
+# Reparto mensual típico del consumo anual de un suministro doméstico (suma 1)
+PESOS_MENSUALES_CONSUMO = (
+    0.0975, 0.0860, 0.0850, 0.0760, 0.0740, 0.0760,
+    0.0880, 0.0870, 0.0770, 0.0760, 0.0830, 0.0945,
+)
+
+MESES_VENTANA = 12
+
+
+def _mes(dia: date) -> date:
+    return dia.replace(day=1)
+
+
+def _sumar_meses(mes: date, n: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _dias_mes(mes: date) -> int:
+    return (_sumar_meses(mes, 1) - mes).days
+
+
+def reparto_mensual(inicio: date, dias: int, kwh: float) -> List[Tuple[date, float, int]]:
+    """[(mes, kWh, días)] de un periodo [inicio, inicio + dias), prorrateado por días."""
+    fin = inicio + timedelta(days=dias)
+    reparto = []
+    dia = inicio
+    while dia < fin:
+        corte = min(fin, _sumar_meses(_mes(dia), 1))
+        dias_mes = (corte - dia).days
+        reparto.append((_mes(dia), kwh * dias_mes / dias, dias_mes))
+        dia = corte
+    return reparto
+
+
+def _periodo_factura(factura) -> Optional[Tuple[str, date, int, float]]:
+    """(cups, inicio, días, kWh) de una factura, o None si no da para el histórico."""
+    from app.services.comparador import _to_float, _ventana_factura
+
+    cups = (factura.cups or "").strip().upper()
+    dias = factura.periodo_dias
+    inicio, _ = _ventana_factura(factura, dias)
+    if not cups or not dias or dias <= 0 or inicio is None:
+        return None
+    consumos = [_to_float(getattr(factura, f"consumo_p{i}_kwh", None)) for i in range(1, 7)]
+    kwh = sum(c for c in consumos if c) or (_to_float(factura.consumo_kwh) or 0.0)
+    if kwh <= 0:
+        return None
+    return cups, inicio, dias, kwh
+
+
+def actualizar_historico_factura(db, factura) -> int:
+    """
+    Reescribe la aportación de la factura al histórico de su CUPS (sin commit).
+    Devuelve los meses escritos (0 si la factura no tiene CUPS, fechas o consumo).
+    """
+    db.query(ConsumoCupsMensual).filter(ConsumoCupsMensual.factura_id == factura.id).delete(
+        synchronize_session=False
+    )
+    periodo = _periodo_factura(factura)
+    if periodo is None:
+        return 0
+    cups, inicio, dias, kwh = periodo
+    filas = [
+        ConsumoCupsMensual(cups=cups, mes=mes, factura_id=factura.id, kwh=kwh_mes, dias=dias_mes)
+        for mes, kwh_mes, dias_mes in reparto_mensual(inicio, dias, kwh)
+    ]
+    db.add_all(filas)
+    logger.info(f"[HISTORICO] factura_id={factura.id} CUPS={cups}: {kwh:.0f} kWh en {len(filas)} meses")
+    return len(filas)
+
+
+def cargar_historico(db, cups: Sequence[str], desde: date) -> Dict[str, Dict[date, Tuple[float, int]]]:
+    """{cups: {mes: (kWh, días cubiertos)}} desde `desde`, sumando las facturas de cada mes."""
+    cups = sorted({c for c in cups if c})
+    if not cups:
+        return {}
+    query = text(
+        """
+        SELECT cups, mes, SUM(kwh) AS kwh, SUM(dias) AS dias
+        FROM consumo_cups_mensual
+        WHERE cups IN :cups AND mes >= :desde
+        GROUP BY cups, mes
+        """
+    ).bindparams(bindparam("cups", expanding=True))
+    historico: Dict[str, Dict[date, Tuple[float, int]]] = {}
+    for fila in db.execute(query, {"cups": cups, "desde": desde}).mappings():
+        mes = fila["mes"]
+        if not isinstance(mes, date):
+            mes = date.fromisoformat(str(mes)[:10])
+        historico.setdefault(fila["cups"], {})[mes] = (float(fila["kwh"]), int(fila["dias"]))
+    return historico
+
+
+def _ventana(fin: date) -> List[date]:
+    """Los 12 meses naturales que terminan en el mes del último día facturado."""
+    ultimo = _mes(fin - timedelta(days=1))
+    return [_sumar_meses(ultimo, -i) for i in range(MESES_VENTANA - 1, -1, -1)]
+
+
+def factor_anual_estacional(
+    meses: Dict[date, Tuple[float, int]],
+    fin: date,
+    consumo_periodo: float,
+) -> Optional[float]:
+    """
+    Consumo anual estimado / consumo del periodo, o None si no hay meses con
+    datos en la ventana (se mantiene la anualización lineal).
+    """
+    if consumo_periodo <= 0:
+        return None
+    consumo_real = 0.0
+    peso_real = 0.0
+    for mes in _ventana(fin):
+        kwh, dias = meses.get(mes, (0.0, 0))
+        if dias <= 0:
+            continue
+        # Cobertura parcial (o facturas solapadas): escalar a mes completo
+        consumo_real += kwh * _dias_mes(mes) / dias
+        peso_real += PESOS_MENSUALES_CONSUMO[mes.month - 1]
+    if peso_real <= 0:
+        return None
+    consumo_resto = consumo_real / peso_real * (1.0 - peso_real)
+    return (consumo_real + consumo_resto) / consumo_periodo
+
+
+def anotar_anualizacion(db, entradas) -> None:
+    """
+    Rellena entrada.factor_anual (FacturaComparable) con el histórico de su CUPS:
+    una consulta para todas las entradas. Sin CUPS, sin fechas o sin histórico
+    se queda en None (anualización lineal).
+    """
+    con_ventana = [e for e in entradas if e.cups and e.fecha_fin]
+    if not con_ventana:
+        return
+    desde = min(_ventana(e.fecha_fin)[0] for e in con_ventana)
+    try:
+        # Savepoint: un fallo de lectura no deshace el trabajo pendiente del llamador
+        with db.begin_nested():
+            historico = cargar_historico(db, [e.cups for e in con_ventana], desde)
+    except Exception as e:
+        # Sin tabla de histórico (migración pendiente): anualización lineal
+        logger.warning(f"[HISTORICO] No se pudo leer consumo_cups_mensual: {e}")
+        return
+    for entrada in con_ventana:
+        entrada.factor_anual = factor_anual_estacional(
+            historico.get(entrada.cups, {}), entrada.fecha_fin, sum(entrada.consumos)
+        )
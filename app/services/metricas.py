@@ -0,0 +1,177 @@
+"""
+Tiempos por etapa del comparador (spans) y sus histogramas en proceso.
+
+Cada etapa instrumentada (`with span("catalogo"):`) suma su duración a:
+- la traza de la petición en curso (ContextVar), que el middleware devuelve en
+  la cabecera Server-Timing si la petición lleva X-Debug-Tiempos: 1;
+- un histograma por etapa (buckets fijos en ms), por worker como la caché de
+  catálogo: GET /debug/metricas (JSON) y /debug/metricas/prometheus (texto).
+
+Con METRICAS_TIEMPOS=0 span() devuelve un context manager nulo compartido: ni
+reloj, ni lock, ni contextvar; y main.py no registra MiddlewareTiempos.
+"""
+
+from contextlib import nullcontext
+from contextvars import ContextVar
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+METRICAS_ACTIVAS = os.getenv("METRICAS_TIEMPOS", "1") != "0"
+
+# Límites superiores de los buckets (ms); el último bucket (+Inf) es implícito
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+CABECERA_DEBUG = "X-Debug-Tiempos"
+
+_NULO = nullcontext()
+_traza: ContextVar[Optional["Traza"]] = ContextVar("traza_tiempos", default=None)
+_lock = threading.Lock()
+_histogramas: Dict[str, "_Histograma"] = {}
+
+
+class _Histograma:
+    __slots__ = ("buckets", "suma", "n")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.suma = 0.0
+        self.n = 0
+
+    def observar(self, ms: float) -> None:
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.suma += ms
+        self.n += 1
+
+
+class Traza:
+    """Tiempos acumulados por etapa de una petición (ms, en orden de primera aparición)."""
+
+    __slots__ = ("etapas",)
+
+    def __init__(self):
+        self.etapas: Dict[str, float] = {}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{nombre};dur={ms:.1f}" for nombre, ms in self.etapas.items())
+
+    def resumen(self) -> str:
+        return " ".join(f"{nombre}={ms:.1f}ms" for nombre, ms in self.etapas.items())
+
+
+def registrar(etapa: str, ms: float) -> None:
+    traza = _traza.get()
+    if traza is not None:
+        traza.etapas[etapa] = traza.etapas.get(etapa, 0.0) + ms
+    with _lock:
+        histograma = _histogramas.get(etapa)
+        if histograma is None:
+            histograma = _histogramas[etapa] = _Histograma()
+        histograma.observar(ms)
+
+
+class _Span:
+    __slots__ = ("etapa", "t0")
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registrar(self.etapa, (time.perf_counter() - self.t0) * 1000)
+        return False
+
+
+def span(etapa: str):
+    """Context manager que mide la etapa (también si lanza excepción)."""
+    if not METRICAS_ACTIVAS:
+        return _NULO
+    return _Span(etapa)
+
+
+def iniciar_traza() -> Optional[Traza]:
+    """Nueva traza para el contexto actual (None si las métricas están desactivadas)."""
+    if not METRICAS_ACTIVAS:
+        return None
+    traza = Traza()
+    _traza.set(traza)
+    return traza
+
+
+def traza_actual() -> Optional[Traza]:
+    return _traza.get()
+
+
+def metricas_stats() -> Dict[str, Any]:
+    """Histogramas por etapa: buckets no acumulados, n, suma y media (ms)."""
+    with _lock:
+        etapas = {
+            etapa: {
+                "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], h.buckets)),
+                "n": h.n,
+                "suma_ms": round(h.suma, 3),
+                "media_ms": round(h.suma / h.n, 3) if h.n else 0.0,
+            }
+            for etapa, h in _histogramas.items()
+        }
+    return {"activas": METRICAS_ACTIVAS, "etapas": etapas}
+
+
+def metricas_prometheus() -> str:
+    """Formato de exposición de texto de Prometheus (histograma comparador_etapa_ms)."""
+    lineas: List[str] = [
+        "# HELP comparador_etapa_ms Duración de cada etapa del comparador en milisegundos",
+        "# TYPE comparador_etapa_ms histogram",
+    ]
+    with _lock:
+        for etapa, h in sorted(_histogramas.items()):
+            acumulado = 0
+            for limite, count in zip([str(b) for b in BUCKETS_MS] + ["+Inf"], h.buckets):
+                acumulado += count
+                lineas.append(f'comparador_etapa_ms_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+            lineas.append(f'comparador_etapa_ms_sum{{etapa="{etapa}"}} {h.suma:.3f}')
+            lineas.append(f'comparador_etapa_ms_count{{etapa="{etapa}"}} {h.n}')
+    return "\n".join(lineas) + "\n"
+
+
+def reiniciar_metricas() -> None:
+    with _lock:
+        _histogramas.clear()
+
+
+class MiddlewareTiempos:
+    """
+    Middleware ASGI puro: traza por petición y, con la cabecera X-Debug-Tiempos: 1,
+    Server-Timing con los tiempos por etapa (visible en las devtools del navegador).
+    Sin BaseHTTPMiddleware: no crea tarea extra ni envuelve el cuerpo, así que las
+    respuestas NDJSON/SSE pasan tal cual. main.py solo lo registra con métricas activas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        traza = iniciar_traza() if scope["type"] == "http" else None
+        if traza is None:
+            await self.app(scope, receive, send)
+            return
+        cabecera = CABECERA_DEBUG.lower().encode()
+        if (cabecera, b"1") not in scope.get("headers", ()):
+            await self.app(scope, receive, send)
+            return
+
+        async def _send(message):
+            if message["type"] == "http.response.start" and traza.etapas:
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", traza.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, _send)
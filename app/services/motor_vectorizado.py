@@ -0,0 +1,391 @@
+"""
+Motor de precios vectorizado (NumPy) para el comparador.
+
+Cada versión de tarifa se normaliza una vez al cargarla (PreciosVersion: arrays
+fijos con las reglas 24H / solo-P1 ya resueltas) y el catálogo de un ATR se
+guarda como matrices densas:
+- energia: versiones × 6 periodos (€/kWh)
+- potencia: versiones × 2 periodos (€/kW/día), con el fallback BOE 2025 ya aplicado
+- máscaras de precios ausentes y de versiones que usan el fallback BOE
+
+Todas las ofertas de una factura se calculan en una pasada. Las sumas se acumulan
+columna a columna, en el mismo orden que el sum() escalar del método PO, para que
+los resultados coincidan bit a bit con comparador_core.reconstruir_factura.
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Any, List, Optional, Sequence, Union
+
+import numpy as np
+
+IEE_PCT = 0.0511269632
+PERIODOS_ENERGIA = 6
+PERIODOS_POTENCIA = 2
+
+# Fallback BOE 2025 SOLO para 2.0TD si la tarifa no trae precio de potencia
+BOE_2025_POTENCIA_2_0TD = (0.073777, 0.001911)
+
+# Capas de dominancia que se distinguen (= mayor top-K que se puede podar)
+CAPAS_DOMINANCIA_MAX = 100
+
+
+def num_periodos_atr(atr: str):
+    """(periodos energía, periodos potencia) que usa el comparador para el ATR."""
+    if atr == "3.0TD":
+        return 6, 2
+    return 3, 2
+
+
+class MatricesCatalogo:
+    """
+    Catálogo de un ATR en forma matricial. Las filas siguen el orden de
+    catalogo.tarifas; las versiones no válidas (sin precios o sin energía P1)
+    se mantienen con valida=False para no desalinear índices.
+
+    capa_dominancia: capa Pareto de cada versión (índice de dominancia, ver
+    calcular_capas_dominancia). En modo top-K se descartan las de capa > K.
+    """
+
+    def __init__(
+        self,
+        energia: np.ndarray,
+        energia_ausente: np.ndarray,
+        potencia: np.ndarray,
+        potencia_ausente: np.ndarray,
+        potencia_boe: np.ndarray,
+        sin_precios: np.ndarray,
+        valida: np.ndarray,
+        capa_dominancia: Optional[np.ndarray] = None,
+    ):
+        self.energia = energia
+        self.energia_ausente = energia_ausente
+        self.potencia = potencia
+        self.potencia_ausente = potencia_ausente
+        self.potencia_boe = potencia_boe
+        self.sin_precios = sin_precios
+        self.valida = valida
+        self.capa_dominancia = (
+            capa_dominancia if capa_dominancia is not None else valida.astype(np.int32)
+        )
+
+    def __len__(self) -> int:
+        return self.energia.shape[0]
+
+    def filas(self, indices: np.ndarray) -> "MatricesCatalogo":
+        """Submatriz con las filas indicadas (mismo cálculo fila a fila, bit a bit)."""
+        return MatricesCatalogo(
+            self.energia[indices],
+            self.energia_ausente[indices],
+            self.potencia[indices],
+            self.potencia_ausente[indices],
+            self.potencia_boe[indices],
+            self.sin_precios[indices],
+            self.valida[indices],
+            self.capa_dominancia[indices],
+        )
+
+
+class ModoEnergia(str, Enum):
+    """Cómo trae la versión sus precios de energía."""
+    PLANA_24H = "24h"        # un precio '24H' para todos los periodos
+    SOLO_P1 = "solo_p1"      # solo 'P1': se aplica a todos los periodos
+    PERIODOS = "periodos"    # 'P1'..'P6' por periodo (los ausentes quedan sin precio)
+    SIN_ENERGIA = "sin_energia"
+
+
+@dataclass(slots=True, eq=False)
+class PreciosVersion:
+    """
+    Precios de una versión de tarifa en formato fijo.
+
+    energia: 6 periodos (€/kWh) con el fallback 24H / solo-P1 ya aplicado.
+    potencia: 2 periodos (€/kW/día) tal como vienen (sin fallback BOE, que depende del ATR).
+    NaN = precio ausente.
+    """
+    energia: np.ndarray
+    potencia: np.ndarray
+    modo: ModoEnergia
+
+    def como_dict(self) -> Dict[str, Dict[str, float]]:
+        """Forma {'energia': {'P1': ...}, 'potencia': {...}} (huella del catálogo, depuración)."""
+        if self.modo is ModoEnergia.PLANA_24H:
+            energia = {'24H': float(self.energia[0])}
+        elif self.modo is ModoEnergia.SOLO_P1:
+            energia = {'P1': float(self.energia[0])}
+        else:
+            energia = {f'P{i + 1}': float(v) for i, v in enumerate(self.energia) if not np.isnan(v)}
+        potencia = {f'P{i + 1}': float(v) for i, v in enumerate(self.potencia) if not np.isnan(v)}
+        return {'energia': energia, 'potencia': potencia}
+
+
+def normalizar_precios(precios_dict: Dict[str, Dict[str, float]]) -> PreciosVersion:
+    """{'energia': {...}, 'potencia': {...}} → PreciosVersion (una vez por versión)."""
+    energia_dict = precios_dict.get('energia') or {}
+    potencia_dict = precios_dict.get('potencia') or {}
+
+    energia = np.full(PERIODOS_ENERGIA, np.nan)
+    for i in range(PERIODOS_ENERGIA):
+        precio = _precio_energia(energia_dict, i + 1)
+        if precio is not None:
+            energia[i] = precio
+    if '24H' in energia_dict:
+        modo = ModoEnergia.PLANA_24H
+    elif set(energia_dict) == {'P1'}:
+        modo = ModoEnergia.SOLO_P1
+    elif energia_dict:
+        modo = ModoEnergia.PERIODOS
+    else:
+        modo = ModoEnergia.SIN_ENERGIA
+
+    potencia = np.full(PERIODOS_POTENCIA, np.nan)
+    for i in range(PERIODOS_POTENCIA):
+        precio = potencia_dict.get(f'P{i + 1}')
+        if precio is not None:
+            potencia[i] = precio
+    return PreciosVersion(energia, potencia, modo)
+
+
+def _precio_energia(precios_dict: Dict, periodo_idx: int):
+    # Mismas reglas que comparador._get_precio_energia: 24H > Pn > solo-P1
+    if not precios_dict:
+        return None
+    if '24H' in precios_dict:
+        return precios_dict['24H']
+    periodo_key = f'P{periodo_idx}'
+    if periodo_key in precios_dict:
+        return precios_dict[periodo_key]
+    if periodo_idx > 1 and 'P1' in precios_dict and len(precios_dict) == 1:
+        return precios_dict['P1']
+    return None
+
+
+def construir_matrices(
+    tarifas: Sequence[Dict[str, Any]],
+    precios_map: Dict[int, Union[PreciosVersion, Dict[str, Any]]],
+    atr: str,
+) -> MatricesCatalogo:
+    """
+    Apila los precios del catálogo en matrices (una sola vez por snapshot).
+    Admite también el formato dict ({'energia': {...}, 'potencia': {...}}).
+    """
+    n = len(tarifas)
+    num_energia, num_potencia = num_periodos_atr(atr)
+
+    energia = np.full((n, PERIODOS_ENERGIA), np.nan)
+    potencia = np.full((n, PERIODOS_POTENCIA), np.nan)
+    sin_precios = np.zeros(n, dtype=bool)
+
+    for row, tarifa in enumerate(tarifas):
+        precios_version = precios_map.get(tarifa["tarifa_version_id"])
+        if not precios_version:
+            sin_precios[row] = True
+            continue
+        if isinstance(precios_version, dict):
+            precios_version = normalizar_precios(precios_version)
+        energia[row] = precios_version.energia
+        potencia[row] = precios_version.potencia
+
+    # Solo cuentan los periodos que usa el ATR
+    energia[:, num_energia:] = np.nan
+    potencia[:, num_potencia:] = np.nan
+    energia_ausente = np.isnan(energia)
+    potencia_ausente = np.isnan(potencia)
+    energia[energia_ausente] = 0.0
+    potencia[potencia_ausente] = 0.0
+
+    potencia_boe = np.zeros(n, dtype=bool)
+    if atr == "2.0TD":
+        # ⭐ Fallback BOE 2025 por periodo en las versiones con datos y sin precio de potencia
+        faltan = potencia_ausente[:, :num_potencia] & ~sin_precios[:, None]
+        potencia[:, :num_potencia] = np.where(faltan, np.array(BOE_2025_POTENCIA_2_0TD), potencia[:, :num_potencia])
+        potencia_boe = faltan.any(axis=1)
+
+    valida = ~sin_precios & ~energia_ausente[:, 0]
+    precios = np.hstack([energia[:, :num_energia], potencia[:, :num_potencia]])
+    capa_dominancia = calcular_capas_dominancia(precios, potencia_boe, valida)
+    return MatricesCatalogo(
+        energia, energia_ausente, potencia, potencia_ausente, potencia_boe, sin_precios, valida, capa_dominancia
+    )
+
+
+class _Frente:
+    """Filas de precios de una capa de dominancia (buffer que crece por duplicación)."""
+
+    def __init__(self, num_precios: int):
+        self.filas = np.empty((8, num_precios), dtype=np.float64)
+        self.tam = 0
+
+    def domina(self, fila: np.ndarray) -> bool:
+        actual = self.filas[:self.tam]
+        return bool(((actual <= fila).all(axis=1) & (actual < fila).any(axis=1)).any())
+
+    def anadir(self, fila: np.ndarray) -> None:
+        if self.tam == len(self.filas):
+            self.filas = np.concatenate([self.filas, np.empty_like(self.filas)])
+        self.filas[self.tam] = fila
+        self.tam += 1
+
+
+def calcular_capas_dominancia(
+    precios: np.ndarray,
+    grupo: np.ndarray,
+    valida: np.ndarray,
+    max_capas: int = CAPAS_DOMINANCIA_MAX,
+) -> np.ndarray:
+    """
+    Capa de dominancia Pareto de cada versión válida (0 = no válida).
+
+    j domina a i si, dentro del mismo grupo, tiene precio <= en todos los
+    periodos de energía y potencia y < en al menos uno: con consumos, potencias
+    y días >= 0 su total nunca es mayor. Capa 1 = frente de Pareto; una versión
+    en la capa c tiene al menos c-1 versiones que la dominan (una por capa
+    anterior), así que con capa > K nunca entra en un top-K.
+
+    Los grupos (potencia de la tarifa vs fallback BOE) no se comparan entre sí
+    porque el comparador siempre ordena las completas antes que las parciales.
+    Precios idénticos no se dominan mutuamente. Las versiones más allá de
+    max_capas quedan en max_capas + 1.
+
+    Recorrido por suma de precios ascendente (quien domina siempre suma menos o
+    igual) con búsqueda binaria sobre las capas: si la capa l contiene a alguien
+    que domina la fila, por transitividad también todas las anteriores.
+    """
+    n, num_precios = precios.shape
+    capa = np.zeros(n, dtype=np.int32)
+    for valor_grupo in (False, True):
+        filas = np.flatnonzero(valida & (grupo == valor_grupo))
+        if not len(filas):
+            continue
+        orden = filas[np.argsort(precios[filas].sum(axis=1), kind="stable")]
+        frentes: List[_Frente] = []
+        for idx in orden.tolist():
+            fila = precios[idx]
+            lo, hi = 0, len(frentes)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if frentes[mid].domina(fila):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            capa[idx] = lo + 1
+            if lo < max_capas:
+                if lo == len(frentes):
+                    frentes.append(_Frente(num_precios))
+                frentes[lo].anadir(fila)
+    return capa
+
+
+def calcular_ofertas_vectorizado(
+    matrices: MatricesCatalogo,
+    consumos: List[float],
+    potencias: List[float],
+    periodo_dias: int,
+    iva_pct: float,
+    alquiler: float,
+    total_referencia: float,
+    subtotal_actual: float,
+    factor_anual: Optional[float] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Calcula costes, totales PO y ahorros de todas las versiones en una pasada.
+
+    total_referencia: total actual contra el que se mide el ahorro (reconstruido
+    o current_total en fallback). subtotal_actual: subtotal sin impuestos actual
+    para el ahorro estructural. factor_anual: ahorro anual / ahorro del periodo
+    según el histórico del CUPS (ver historico_consumo); None = 30/días × 12.
+    """
+    num_energia = len(consumos)
+    num_potencia = min(len(potencias), PERIODOS_POTENCIA)
+
+    coste_energia = consumos[0] * matrices.energia[:, 0]
+    for i in range(1, num_energia):
+        coste_energia = coste_energia + consumos[i] * matrices.energia[:, i]
+
+    suma_potencia = potencias[0] * matrices.potencia[:, 0]
+    for i in range(1, num_potencia):
+        suma_potencia = suma_potencia + potencias[i] * matrices.potencia[:, i]
+    coste_potencia = periodo_dias * suma_potencia
+
+    # Método PO: misma secuencia de operaciones que reconstruir_factura
+    subtotal = coste_energia + coste_potencia
+    iee = subtotal * IEE_PCT
+    base_iva = subtotal + iee + alquiler
+    iva = base_iva * iva_pct
+    total = base_iva + iva
+
+    ahorro_periodo = total_referencia - total
+    if factor_anual is None:
+        factor_normalizacion = 30.0 / float(periodo_dias)
+        ahorro_mensual = ahorro_periodo * factor_normalizacion
+        ahorro_anual = ahorro_mensual * 12.0
+    else:
+        ahorro_anual = ahorro_periodo * factor_anual
+        ahorro_mensual = ahorro_anual / 12.0
+
+    if total_referencia > 0:
+        saving_percent = ahorro_periodo / total_referencia * 100
+    else:
+        saving_percent = np.zeros_like(total)
+
+    total_kwh = sum(consumos)
+    if total_kwh > 0:
+        precio_medio = subtotal / total_kwh
+    else:
+        precio_medio = np.zeros_like(total)
+
+    return {
+        "coste_energia": coste_energia,
+        "coste_potencia": coste_potencia,
+        "subtotal": subtotal,
+        "impuestos": iee + iva,
+        "total": total,
+        "ahorro_periodo": ahorro_periodo,
+        "ahorro_mensual": ahorro_mensual,
+        "ahorro_anual": ahorro_anual,
+        "ahorro_estructural": subtotal_actual - subtotal,
+        "saving_percent": saving_percent,
+        "precio_medio_estructural": precio_medio,
+    }
+
+
+def calcular_totales_suministros(
+    matrices: MatricesCatalogo,
+    consumos: np.ndarray,
+    potencias: np.ndarray,
+    periodo_dias: np.ndarray,
+    iva_pct: np.ndarray,
+    alquiler: np.ndarray,
+    total_referencia: np.ndarray,
+    factor_anual: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Totales PO y ahorro anual de versiones × suministros en una sola pasada.
+
+    consumos (S × periodos de energía) y potencias (S × periodos de potencia)
+    van por filas; el resto son vectores de S. factor_anual: ahorro anual /
+    ahorro del periodo de cada suministro (30/días × 12 si no hay histórico).
+    Misma secuencia de operaciones que calcular_ofertas_vectorizado, con los
+    suministros en el segundo eje.
+    """
+    num_energia = consumos.shape[1]
+    num_potencia = min(potencias.shape[1], PERIODOS_POTENCIA)
+
+    coste_energia = matrices.energia[:, 0:1] * consumos[:, 0]
+    for i in range(1, num_energia):
+        coste_energia = coste_energia + matrices.energia[:, i:i + 1] * consumos[:, i]
+
+    suma_potencia = matrices.potencia[:, 0:1] * potencias[:, 0]
+    for i in range(1, num_potencia):
+        suma_potencia = suma_potencia + matrices.potencia[:, i:i + 1] * potencias[:, i]
+    coste_potencia = periodo_dias * suma_potencia
+
+    subtotal = coste_energia + coste_potencia
+    iee = subtotal * IEE_PCT
+    base_iva = subtotal + iee + alquiler
+    total = base_iva + base_iva * iva_pct
+
+    return {
+        "total": total,
+        "ahorro_anual": (total_referencia - total) * factor_anual,
+    }
@@ -1,6 +1,5 @@
 import os
 import json
-import re
 import io
 import unicodedata
 import base64
@@ -10,7 +9,31 @@ import pypdf
 import google.generativeai as genai
 # from openai import OpenAI  # NO USADO - solo pypdf + Vision API
 import logging
+import threading
 import traceback
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.services.ocr_patrones import (
+    ALIAS_PERIODO, ATR, CONSUMOS, CUPS, FECHAS, IDENTIFICACION, PALABRAS_CLAVE, PLEGADO, POTENCIAS, TEXTO,
+    TOTALES, LineasFactura, escanear_lineas,
+)
+from app.services.ocr_comercializadoras import clasificar_comercializadora, registrar_parseo
+
+# ⭐ Versión del parser para la caché de extracción (ocr_cache): subirla al cambiar
+# parse_invoice_text o sus estrategias. Invalida los resultados guardados, no los
+# textos de pypdf/Vision, que se re-parsean sin volver a llamar a los motores.
+OCR_PARSER_VERSION = "2026.10.18"
+
+# ⭐ Concurrencia máxima por motor dentro de un proceso (la cola de subidas, ocr_jobs,
+# ejecuta varias extracciones a la vez): pypdf es CPU local, Vision es una RPC con cuota
+CONCURRENCIA_MOTOR = {
+    "pypdf": int(os.getenv("OCR_CONCURRENCIA_PYPDF", "4")),
+    "vision": int(os.getenv("OCR_CONCURRENCIA_VISION", "2")),
+}
+_semaforos_motor = {motor: threading.BoundedSemaphore(max(1, n)) for motor, n in CONCURRENCIA_MOTOR.items()}
 
 
 def _shield_concepts(result: dict):
@@ -53,7 +76,7 @@ def normalize_text(raw: str) -> str:
         return ""
     text = unicodedata.normalize("NFKC", raw)
     text = text.replace("\u00a0", " ")
-    text = re.sub(r"[ \t]+", " ", text)
+    text = TEXTO["espacios"].sub(" ", text)
     return text.strip()
 
 
@@ -69,24 +92,74 @@ def _preprocess_fragmented_text(text: str) -> str:
         return text
     
     # Pattern 1: Dates fragmented (1\n7/09/2025 → 17/09/2025)
-    text = re.sub(r'(\d)\s*[\n\r]\s*(\d+[\/\-\.](\d+))', r'\1\2', text)
+    text = TEXTO["fragmento_fecha"].sub(r'\1\2', text)
     
     # Pattern 2: Numbers fragmented in middle (8\n3,895 → 83,895)
-    text = re.sub(r'(\d)\s*[\n\r]\s*(\d)', r'\1\2', text)
+    text = TEXTO["fragmento_numero"].sub(r'\1\2', text)
     
     # Pattern 3: Numbers separated by spaces in numeric contexts (precio: 12 3,45 → 123,45)
-    text = re.sub(r'(\d)\s+(\d[\d\.,]*(?:\s+kWh|\s+€|\s+EUR|\s*x\s|\s*/\s))', r'\1\2', text, flags=re.IGNORECASE)
+    text = TEXTO["numero_espaciado"].sub(r'\1\2', text)
     
     return text
 
 
+@dataclass(slots=True, eq=False)
+class InvoiceDocument:
+    """
+    Texto de una factura preprocesado una sola vez y compartido por todas las estrategias.
+
+    - texto: normalize_text del original (tras _preprocess_fragmented_text si viene de Vision)
+    - lower: vista en minúsculas plegada (misma longitud y offsets que texto)
+    - upper: vista en mayúsculas (ATR)
+    - escaneo: líneas con offsets y cubetas por extractor (ocr_patrones.escanear_lineas)
+    - indice: posiciones de PALABRAS_CLAVE en lower
+
+    Las funciones públicas (extract_atr, _extract_consumo_safe, ...) siguen aceptando
+    un str; con un InvoiceDocument no vuelven a normalizar, partir ni pasar a minúsculas.
+    """
+    texto: str
+    lower: str
+    upper: str
+    escaneo: LineasFactura
+    indice: Dict[str, List[int]]
+
+    @classmethod
+    def desde_texto(cls, raw: str, fragmentado: bool = False) -> "InvoiceDocument":
+        if fragmentado:
+            raw = _preprocess_fragmented_text(raw)
+        texto = normalize_text(raw)
+        lower = texto.translate(PLEGADO).lower()
+        indice = {}
+        for palabra in PALABRAS_CLAVE:
+            posiciones = []
+            pos = lower.find(palabra)
+            while pos != -1:
+                posiciones.append(pos)
+                pos = lower.find(palabra, pos + 1)
+            indice[palabra] = posiciones
+        return cls(texto=texto, lower=lower, upper=texto.upper(), escaneo=escanear_lineas(texto), indice=indice)
+
+    def contiene(self, palabra: str) -> bool:
+        posiciones = self.indice.get(palabra)
+        return bool(posiciones) if posiciones is not None else palabra in self.lower
+
+    def lineas_con(self, *palabras: str) -> List[int]:
+        """Índices (en escaneo.lineas) de las líneas que contienen alguna de las palabras indexadas."""
+        offsets = self.escaneo.offsets
+        return sorted({bisect_right(offsets, pos) - 1 for palabra in palabras for pos in self.indice[palabra]})
+
+
+def _documento(text) -> InvoiceDocument:
+    return text if isinstance(text, InvoiceDocument) else InvoiceDocument.desde_texto(text)
+
+
 def _parse_date_flexible(date_str):
     if not date_str or not isinstance(date_str, str):
         return None
     date_str = date_str.lower().strip()
     
     # 1. DD/MM/YY, DD.MM.YYYY o DD-MM-YYYY (soporta dots, slashes, dashes)
-    match = re.search(r"(\d{1,2})[.\/-](\d{1,2})[.\/-](\d{2,4})", date_str)
+    match = FECHAS["numerica"].search(date_str)
     if match:
         from datetime import date
         try:
@@ -101,8 +174,7 @@ def _parse_date_flexible(date_str):
         "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
         "julio": 7, "agosto": 8, "septiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12
     }
-    meses_regex = "|".join(meses_map.keys())
-    match = re.search(rf"(\d{{1,2}})\s+de\s+({meses_regex})\s+de\s+(\d{{2,4}})", date_str)
+    match = FECHAS["texto"].search(date_str)
     if match:
         from datetime import date
         try:
@@ -120,7 +192,7 @@ def parse_es_number(value: str):
     text = normalize_text(str(value))
     if not text:
         return None
-    cleaned = re.sub(r"[^\d,.\-]", "", text)
+    cleaned = TEXTO["no_numerico"].sub("", text)
     if cleaned in ("", "-", ".", ","):
         return None
 
@@ -255,15 +327,21 @@ def _sanity_energy(result: dict) -> dict:
     return result
 
 
-def _extract_consumo_safe(full_text: str) -> dict:
+def _extract_consumo_safe(full_text) -> dict:
     """
     P0 Extracción segura de consumo_total con 3 patrones prioritarios (A, B, C).
     Retorna {'value': float, 'pattern': str} o {'value': None, 'pattern': None}
     """
+    doc = full_text if isinstance(full_text, InvoiceDocument) else None
+    if doc is not None:
+        full_text = doc.texto
+    # A y C exigen "consumo", B exige "€": sin ellos en el documento no hace falta buscar
+    con_consumo = doc is None or doc.contiene("consumo")
+    con_euro = doc is None or doc.contiene("€")
+
     # Pattern A: "Su consumo en el periodo facturado ha sido XXX kWh" (Naturgy/Regulada)
     # Tolerante a newlines/espacios en números
-    pattern_a = r"su\s+consumo\s+en\s+(?:el\s+)?periodo\s+(?:facturado\s+)?ha\s+sido\s+([\d.,\s]+)\s*(?:kw)?h"
-    m = re.search(pattern_a, full_text, re.IGNORECASE)
+    m = CONSUMOS["seguro_a"].search(full_text) if con_consumo else None
     if m:
         num_str = m.group(1).replace(' ', '').replace('\n', '')
         val = parse_es_number(num_str)
@@ -271,8 +349,7 @@ def _extract_consumo_safe(full_text: str) -> dict:
             return {'value': val, 'pattern': 'A (su consumo en el periodo)'}
     
     # Pattern B: "XXX kWh x 0,xxxxx €/kWh = Energía" (CHC/facturas tablas)
-    pattern_b = r"([\d.,\s]+)\s*(?:kw)?h\s*x\s*[\d.,]+\s*[€€]\s*/\s*(?:kw)?h"
-    m = re.search(pattern_b, full_text, re.IGNORECASE)
+    m = CONSUMOS["seguro_b"].search(full_text) if con_euro else None
     if m:
         num_str = m.group(1).replace(' ', '').replace('\n', '')
         val = parse_es_number(num_str)
@@ -280,8 +357,7 @@ def _extract_consumo_safe(full_text: str) -> dict:
             return {'value': val, 'pattern': 'B (consumo × tarifa)'}
     
     # Pattern C: "Total consumo" genérico como fallback
-    pattern_c = r"(?:consumo\s+total|total\s+consumo|consumo\s+(?:facturado|del\s+periodo))[^0-9\n]{0,50}([\d.,\s]+)\s*(?:kw)?h"
-    m = re.search(pattern_c, full_text, re.IGNORECASE)
+    m = CONSUMOS["seguro_c"].search(full_text) if con_consumo else None
     if m:
         num_str = m.group(1).replace(' ', '').replace('\n', '')
         val = parse_es_number(num_str)
@@ -291,88 +367,54 @@ def _extract_consumo_safe(full_text: str) -> dict:
     return {'value': None, 'pattern': None}
 
 
-def extract_atr(text: str):
+def extract_atr(text):
     if not text:
         return None
-    normalized = normalize_text(text).upper()
+    normalized = text.upper if isinstance(text, InvoiceDocument) else normalize_text(text).upper()
     
     # Pattern 1: Directo "2.0TD" o "3.0TD"
-    if re.search(r"2\s*[.,]?\s*[0O]\s*TD", normalized) or "USO LUZ" in normalized:
+    if ATR["2_0td"].search(normalized) or "USO LUZ" in normalized:
         return "2.0TD"
-    if re.search(r"3\s*[.,]?\s*[0O]\s*TD", normalized):
+    if ATR["3_0td"].search(normalized):
         return "3.0TD"
     
     # Pattern 2: "Tarifa 2.0" o "Acceso 2.0TD"
-    match = re.search(r"(?:tarifa|acceso|peaje)\s*[:\-]?\s*([236]\s*\.\s*[0O]\s*TD?)", normalized, re.IGNORECASE)
+    match = ATR["tarifa"].search(normalized)
     if match:
         return match.group(1).replace(" ", "").upper().replace("O", "0")
     
     # Pattern 3: Fallback - buscar en contexto de PEAJE
-    match = re.search(r"PEAJE[\s\S]{0,100}?([236]\.?[0O]\s*TD)", normalized, re.IGNORECASE)
+    match = ATR["peaje"].search(normalized)
     if match:
         return match.group(1).replace(" ", "").upper().replace("O", "0")
     
     # Pattern 4: Buscar "2.0" seguido de "TD" en diferentes líneas
-    match = re.search(r"([236])\s*\.\s*[0O][\s\n]{0,20}TD", normalized, re.IGNORECASE)
+    match = ATR["multilinea"].search(normalized)
     if match:
         return f"{match.group(1)}.0TD"
     
     return None
 
 
-def _extract_potencias_with_sources(text: str):
+def _extract_potencias_with_sources(text):
     if not text:
         return {"p1": None, "p2": None, "p1_source": None, "p2_source": None, "warnings": []}
-    normalized = normalize_text(text)
+    normalized = text.texto if isinstance(text, InvoiceDocument) else normalize_text(text)
 
     # MEJORADO: Priorizar "Potencia Contratada" explícita, luego punta/valle
     # Pero EVITAR capturar consumos (que dicen "kwh" no "kw")
-    p1_patterns = [
-        ("table", r"P1\s+P2\s+P3\s+P4\s+P5\s+P6\s+([\d.,]+)\s+([\d.,]+)"),
-        # Direct "P1: X kW" after "Potencia Contratada"
-        ("contratada_p1", r"potencia\s+contratada[^0-9]*?p1\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # Specific punta patterns with "kw" NOT "kwh"
-        ("punta", r"potencia\s+(?:contratada\s+)?en\s+punta\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        ("punta", r"p1\s+\(punta\)\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        ("punta", r"punta\s+\(potencia\)\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # P1 explicit notation
-        ("p1", r"potencia\s+(?:contratada\s+)?(?:en\s+)?p1\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # Standalone "P1: X kW"
-        ("p1_direct", r"\bp1\s*[:\-]?\s*([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)"),
-        # Table labels
-        ("grid", r"potencia\s*\(kw\)[^0-9]{0,20}([\d.,]+)"),
-        # Last resort: standalone "punta X kW" (BUT NOT kWh)
-        ("punta", r"\bpunta\b[^0-9]{0,20}([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)"),
-    ]
-    p2_patterns = [
-        # Direct "P2: X kW" after "Potencia Contratada"
-        ("contratada_p2", r"potencia\s+contratada[^0-9]*?p2\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # Specific valle patterns with "kw" NOT "kwh"
-        ("valle", r"potencia\s+(?:contratada\s+)?en\s+valle\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        ("valle", r"p2\s+\(valle\)\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        ("valle", r"valle\s+\(potencia\)\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # P2 explicit notation
-        ("p2", r"potencia\s+(?:contratada\s+)?(?:en\s+)?p2\s*[:\-]?\s*([\d.,]+)\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"),
-        # Standalone "P2: X kW"
-        ("p2_direct", r"\bp2\s*[:\-]?\s*([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)"),
-        # Last resort: standalone "valle X kW" (BUT NOT kWh)
-        ("valle", r"\bvalle\b[^0-9]{0,20}([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)"),
-    ]
-
     def _match(patterns):
         for source, pat in patterns:
-            match = re.search(pat, normalized, re.IGNORECASE)
+            match = pat.search(normalized)
             if match:
                 return parse_es_number(match.group(1)), source
         return None, None
 
-    p1_value, p1_source = _match(p1_patterns)
-    p2_value, p2_source = _match(p2_patterns)
+    p1_value, p1_source = _match(POTENCIAS["p1"])
+    p2_value, p2_source = _match(POTENCIAS["p2"])
     warnings = []
 
-    generic_match = re.search(
-        r"potencia\s+contratada[^0-9]{0,20}([\d.,]+)\s*k?w", normalized, re.IGNORECASE
-    )
+    generic_match = POTENCIAS["generica"].search(normalized)
     if generic_match and p1_value is None and p2_value is None:
         warnings.append("Potencia detectada sin contexto punta/valle")
 
@@ -497,57 +539,53 @@ def get_vision_client():
 
 from app.utils.cups import normalize_cups, is_valid_cups
 
-def _extract_table_consumos(raw_text: str) -> dict:
-    """
-    🔍 MEJORADO: Extrae consumos desde tablas de facturas
-    Maneja múltiples formatos:
-    - Consumos desagregados con etiquetas (punta/llano/valle)
-    - Tablas con columnas P1/P2/P3
-    - Listas con período y consumo en líneas separadas
-    """
-    result = {
-        "consumo_p1_kwh": None,
-        "consumo_p2_kwh": None,
-        "consumo_p3_kwh": None,
-        "consumo_p4_kwh": None,
-        "consumo_p5_kwh": None,
-        "consumo_p6_kwh": None,
-    }
-    
-    lines = raw_text.split('\n')
-    
+def _consumos_vacios() -> dict:
+    return {f"consumo_p{i}_kwh": None for i in range(1, 7)}
+
+
+def _periodos_completos(result: dict) -> bool:
+    return all(result[f"consumo_p{i}_kwh"] is not None for i in range(1, 4))
+
+
+@dataclass(slots=True)
+class _TablaConsumos:
+    """Estado compartido por las estrategias de consumos de una factura."""
+    doc: Optional[InvoiceDocument]
+    lines: List[str]
+    lower_lines: List[str]
+    result: dict
+
+    def candidatas(self, *palabras):
+        return self.doc.lineas_con(*palabras) if self.doc is not None else range(len(self.lines))
+
+
+# Cada estrategia rellena t.result y devuelve True si la cascada debe terminar ahí
+
+def _consumos_explicitos(t: _TablaConsumos) -> bool:
     # Strategy 0A: Look for "Consumo P1:", "Consumo P2:", "Consumo P3:" directly (table format)
     # Handles multiple formats:
     # 1. "Consumo P1:     17 kWh" (separate line)
     # 2. "Punta: 1111 kWh ... Consumo P1: 17 kWh" (same line)
     # 3. "Lectura Punta: 1111 Consumo: 17" (adjacent text)
-    for line in lines:
-        lower_line = line.lower()
-        
-        for p_num in range(1, 7):
-            period_aliases = {
-                1: ["p1", "punta"],
-                2: ["p2", "llano"],
-                3: ["p3", "valle"],
-                4: ["p4"],
-                5: ["p5"],
-                6: ["p6"],
-            }
-            
-            for alias in period_aliases.get(p_num, []):
-                # Pattern 1: "Consumo P1: 17" or "Consumo Punta: 17" (explicit consumo)
-                pattern1 = rf"(?:consumo|lectora?)\s+(?:{alias}|p{p_num})\s*[:\-]?\s*([\d.,]+)"
-                # Pattern 2: "Punta: 1111 ... Consumo: 17" (punta line followed by consumo value)
-                pattern2 = rf"(?:{alias})\s*[:\-]?\s*[\d.,]+\s+.*?(?:consumo)\s*[:\-]?\s*([\d.,]+)"
-                # Pattern 3: Just "Consumo: 17" after we detect the section is about this period
-                pattern3 = rf"consumo\s*[:\-]?\s*([\d.,]+)(?:\s*kWh)?" if alias in lower_line else None
-                # Pattern 4: Simple table "P1: 123" or "P1 123 kWh" (Naturgy format)
-                pattern4 = rf"\b(?:{alias}|p{p_num})\s*[:\-]?\s*([\d.,]+)\s*(?:kWh)?" if len(alias) <= 6 else None
+    result = t.result
+    for idx in t.candidatas("p1", "p2", "p3", "p4", "p5", "p6", "punta", "llano", "valle"):
+        lower_line = t.lower_lines[idx]
+        for p_num, aliases in ALIAS_PERIODO.items():
+            etiqueta = f"p{p_num}"
+            for alias in aliases:
+                # Todos los patrones exigen el alias o la etiqueta pN en la línea
+                if alias not in lower_line and etiqueta not in lower_line:
+                    continue
+                # 1: "Consumo P1: 17" / 2: "Punta: 1111 ... Consumo: 17"
+                # 3: "Consumo: 17" si la línea habla de este periodo / 4: "P1: 123" o "P1 123 kWh" (Naturgy)
+                pattern1, pattern2, pattern3, pattern4 = CONSUMOS["tabla_linea"][(p_num, alias)]
+                if alias not in lower_line:
+                    pattern3 = None
                 
                 for pattern in [pattern1, pattern2, pattern3, pattern4]:
                     if not pattern:
                         continue
-                    m = re.search(pattern, lower_line)
+                    m = pattern.search(lower_line)
                     if m:
                         try:
                             val = parse_es_number(m.group(1))
@@ -558,17 +596,20 @@ def _extract_table_consumos(raw_text: str) -> dict:
                             pass
     
     # If we found all P1/P2/P3 in this strategy, return early
-    if all(result[f"consumo_p{i}_kwh"] is not None for i in range(1, 4)):
-        return result
-    
+    return _periodos_completos(result)
+
+
+def _consumos_tabla_hc(t: _TablaConsumos) -> bool:
     # Strategy 0B: HC Energía table format "Consumo(kWh) 101,00 129,00 275,00 505,00"
     # Buscar línea que contenga "consumo" + "kwh" + 3-4 números seguidos
-    for line in lines:
-        lower_line = line.lower()
+    result = t.result
+    numero = TEXTO["numero"]
+    for idx in t.candidatas("consumo"):
+        line, lower_line = t.lines[idx], t.lower_lines[idx]
         if "consumo" in lower_line and "kwh" in lower_line:
             # Pattern: "Consumo(kWh) 101,00 129,00 275,00 505,00"
             # Extraer todos los números de la línea
-            numbers = re.findall(r"([\d.,]+)", line)
+            numbers = numero.findall(line)
             if len(numbers) >= 3:
                 # Parsear los primeros 3-4 números como P1, P2, P3 (ignorar TOTAL)
                 try:
@@ -578,17 +619,22 @@ def _extract_table_consumos(raw_text: str) -> dict:
                         result["consumo_p2_kwh"] = vals[1]
                         result["consumo_p3_kwh"] = vals[2]
                         # Si encontramos los 3, retornamos
-                        return result
+                        return True
                 except:
                     pass
-    
+    return False
+
+
+def _consumos_tabla_endesa(t: _TablaConsumos) -> bool:
     # Strategy 0C: Endesa table format "Punta 168,46 190,22 1,00 0,00 21,76"
     # Buscar líneas con "Punta", "Llano", "Valle" seguido de 5 números (último = consumo)
-    for line in lines:
-        lower_line = line.lower()
+    result = t.result
+    numero = TEXTO["numero"]
+    for idx in t.candidatas("punta", "llano", "valle"):
+        line, lower_line = t.lines[idx], t.lower_lines[idx]
         if "punta" in lower_line or "llano" in lower_line or "valle" in lower_line:
             # Extraer todos los números de la línea
-            numbers = re.findall(r"([\d.,]+)", line)
+            numbers = numero.findall(line)
             if len(numbers) >= 5:
                 # Último número = consumo
                 try:
@@ -604,140 +650,172 @@ def _extract_table_consumos(raw_text: str) -> dict:
                     pass
     
     # Si encontramos los 3, retornamos
-    if all(result[f"consumo_p{i}_kwh"] is not None for i in range(1, 4)):
-        return result
-    
+    return _periodos_completos(result)
+
+
+def _consumos_desagregados(t: _TablaConsumos) -> bool:
     # Strategy 0: Look for "Consumos desagregados:" line with inline values
     # Pattern: "Consumos desagregados: punta: 59 kWh; llano: 55,99 kWh; valle 166,72 kWh"
-    for line in lines:
-        lower_line = line.lower()
+    result = t.result
+    for idx in t.candidatas("consumo"):
+        lower_line = t.lower_lines[idx]
         if "consumos" in lower_line and "desagregados" in lower_line:
             # Extract all period:value pairs from this line
             # Look for patterns like "punta: 59" or "llano: 55,99" or "valle 166,72"
-            
-            # Punta
-            m_punta = re.search(r"(?:punta|p1)\s*[:\-]?\s*([\d.,]+)", lower_line)
-            if m_punta:
-                try:
-                    val = parse_es_number(m_punta.group(1))
-                    if val is not None and 0 <= val <= 5000:
-                        result["consumo_p1_kwh"] = val
-                except:
-                    pass
-            
-            # Llano
-            m_llano = re.search(r"(?:llano|p2)\s*[:\-]?\s*([\d.,]+)", lower_line)
-            if m_llano:
-                try:
-                    val = parse_es_number(m_llano.group(1))
-                    if val is not None and 0 <= val <= 5000:
-                        result["consumo_p2_kwh"] = val
-                except:
-                    pass
-            
-            # Valle
-            m_valle = re.search(r"(?:valle|p3)\s*[:\-]?\s*([\d.,]+)", lower_line)
-            if m_valle:
-                try:
-                    val = parse_es_number(m_valle.group(1))
-                    if val is not None and 0 <= val <= 5000:
-                        result["consumo_p3_kwh"] = val
-                except:
-                    pass
+            for p_num, patron in CONSUMOS["desagregado"].items():  # Punta, Llano, Valle
+                m = patron.search(lower_line)
+                if m:
+                    try:
+                        val = parse_es_number(m.group(1))
+                        if val is not None and 0 <= val <= 5000:
+                            result[f"consumo_p{p_num}_kwh"] = val
+                    except:
+                        pass
             
             # If any found in this line, return early
             if any(result.values()):
-                return result
-    
+                return True
+    return False
+
+
+def _consumos_secciones(t: _TablaConsumos) -> bool:
     # Strategy 1: Look for section headers with various titles
     # Titles contemplados: CONSUMOS DESAGREGADOS, CONSUMOS DE FACTURA, DETALLES DE FACTURA, DATOS DE FACTURA, INFORMACIÓN DE CONSUMO
-    in_consumo_section = False
-    for i, line in enumerate(lines):
-        lower_line = line.lower()
-        
+    # Las ventanas de 30 líneas se solapan: el valor de cada (línea, alias) se calcula una vez
+    result, lines, lower_lines = t.result, t.lines, t.lower_lines
+    valores_linea = {}
+
+    def _valor_alias(j, alias):
+        clave = (j, alias)
+        if clave not in valores_linea:
+            valores_linea[clave] = None
+            next_line = lines[j]
+            if alias in lower_lines[j]:
+                for pattern in CONSUMOS["tabla_seccion"][alias]:
+                    m = pattern.search(next_line)
+                    if m:
+                        try:
+                            val = parse_es_number(m.group(1))
+                            if val is not None and 0 <= val <= 5000:  # Allow zero values
+                                valores_linea[clave] = val
+                                break  # Found this P_num, move to next
+                        except:
+                            pass
+        return valores_linea[clave]
+
+    for i, lower_line in enumerate(lower_lines):
         # Detect consumo section start - múltiples variantes de títulos
-        if re.search(
-            r"(consumo|detalle|dato|información).*?(factura|consumo|desagregad|período|detalle|energía)",
-            lower_line,
-            re.IGNORECASE
-        ):
-            in_consumo_section = True
-            
+        if CONSUMOS["cabecera_seccion"].search(lower_line):
             # Parse the next 30 lines looking for P1/P2/P3 or PUNTA/LLANO/VALLE with values
+            # "Consumo P1: 59 kWh" or "P1 59" or "Punta 59" or "P1 (PUNTA): 0 kWh"
             for j in range(i, min(i+30, len(lines))):
-                next_line = lines[j]
-                next_lower = next_line.lower()
-                
-                # Look for patterns like:
-                # "Consumo P1: 59 kWh" or "P1 59" or "Punta 59" or "P1 (PUNTA): 0 kWh"
-                for p_num in range(1, 7):
-                    period_aliases = {
-                        1: ["p1", "punta"],
-                        2: ["p2", "llano"],
-                        3: ["p3", "valle"],
-                        4: ["p4"],
-                        5: ["p5"],
-                        6: ["p6"],
-                    }
-                    
-                    for alias in period_aliases.get(p_num, []):
-                        # Look for pattern: "P1 (PUNTA): NUMBER" or "p1 59" or "punta 304" or "punta    123,45 kWh"
-                        # Permite parentheses, colons, múltiples espacios, con/sin kWh
-                        patterns = [
-                            rf"(?i){alias}\s*\([^)]*\)\s*[:\-]?\s*([\d.,]+)",       # "P1 (PUNTA): 0"
-                            rf"(?i){alias}\s+[\-:]*\s*([\d.,]+)\s*(?:kwh|kWh)?",    # "P1: 0 kWh" o "punta 59"
-                            rf"(?i){alias}\s+.*?:\s*([\d.,]+)\s*(?:kwh|kWh)?",      # "P1 PUNTA: 123"
-                            rf"(?i){alias}\s*[,;]?\s*([\d.,]+)(?:\s|$)",             # "P1, 123" o "P1 123"
-                        ]
-                        
-                        for pattern in patterns:
-                            m = re.search(pattern, next_line)
-                            if m:
-                                try:
-                                    val = parse_es_number(m.group(1))
-                                    if val is not None and 0 <= val <= 5000:  # Allow zero values
-                                        result[f"consumo_p{p_num}_kwh"] = val
-                                        break  # Found this P_num, move to next
-                                except:
-                                    pass
+                for p_num, aliases in ALIAS_PERIODO.items():
+                    for alias in aliases:
+                        val = _valor_alias(j, alias)
+                        if val is not None:
+                            result[f"consumo_p{p_num}_kwh"] = val
                         
                         if result[f"consumo_p{p_num}_kwh"] is not None:
                             break  # Already found this P_num
-    
+    return False
+
+
+def _consumos_p_sueltos(t: _TablaConsumos) -> bool:
     # Strategy 2: Look for lines that start with "P1", "P2", etc. standalone
+    result = t.result
+    for line in t.lines:
+        stripped = line.strip()
+        if not stripped or len(stripped) > 100:
+            continue
+        
+        # Pattern: "P1 59" or "P1: 59" or "P1  59" or "P1 (PUNTA): 59"
+        match = CONSUMOS["linea_p_suelta"].match(stripped)
+        if match:
+            p_num = int(match.group(1))
+            try:
+                val = parse_es_number(match.group(2))
+                if val is not None and 0 <= val <= 5000:  # Allow zero values
+                    result[f"consumo_p{p_num}_kwh"] = val
+            except:
+                pass
+    return False
+
+
+# ⭐ Juego de estrategias por comercializadora (ocr_comercializadoras.clasificar_comercializadora).
+# Si el juego no completa P1-P3 se repite la cascada genérica desde cero.
+_ESTRATEGIAS_PROVEEDOR = {
+    "iberdrola": (_consumos_desagregados,),
+    "naturgy": (_consumos_explicitos,),
+    "endesa": (_consumos_tabla_endesa,),
+    "hc_energia": (_consumos_tabla_hc,),
+}
+
+
+def _extract_table_consumos(raw_text, proveedor: Optional[str] = None, resumen: Optional[dict] = None) -> dict:
+    """
+    🔍 MEJORADO: Extrae consumos desde tablas de facturas
+    Maneja múltiples formatos:
+    - Consumos desagregados con etiquetas (punta/llano/valle)
+    - Tablas con columnas P1/P2/P3
+    - Listas con período y consumo en líneas separadas
+
+    Con un InvoiceDocument reutiliza sus líneas y solo visita las que contienen
+    las palabras clave de cada estrategia (índice del documento).
+    Con proveedor prueba primero su juego de estrategias; resumen["consumos_estrategia"]
+    indica si bastó ("especifica") o hizo falta la cascada ("generica").
+    """
+    doc = raw_text if isinstance(raw_text, InvoiceDocument) else None
+    escaneo = doc.escaneo if doc is not None else escanear_lineas(raw_text)
+
+    def _tabla():
+        return _TablaConsumos(doc, escaneo.lineas, escaneo.lineas_lower, _consumos_vacios())
+
+    if proveedor in _ESTRATEGIAS_PROVEEDOR:
+        t = _tabla()
+        for estrategia in _ESTRATEGIAS_PROVEEDOR[proveedor]:
+            if estrategia(t):
+                break
+        if _periodos_completos(t.result):
+            if resumen is not None:
+                resumen["consumos_estrategia"] = "especifica"
+            return t.result
+        logging.info(f"[OCR][COMERCIALIZADORA] {proveedor}: juego específico incompleto, cascada genérica")
+
+    if resumen is not None:
+        resumen["consumos_estrategia"] = "generica"
+
+    t = _tabla()
+    for estrategia in (_consumos_explicitos, _consumos_tabla_hc, _consumos_tabla_endesa, _consumos_desagregados, _consumos_secciones):
+        if estrategia(t):
+            return t.result
+
     # Only if we haven't found consumos via section headers
-    if not any(result.values()):
-        for line in lines:
-            stripped = line.strip()
-            if not stripped or len(stripped) > 100:
-                continue
-            
-            # Pattern: "P1 59" or "P1: 59" or "P1  59" or "P1 (PUNTA): 59"
-            match = re.match(r"^P(\d)\s*(?:\([^)]*\))?\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?$", stripped, re.IGNORECASE)
-            if match:
-                p_num = int(match.group(1))
-                try:
-                    val = parse_es_number(match.group(2))
-                    if val is not None and 0 <= val <= 5000:  # Allow zero values
-                        result[f"consumo_p{p_num}_kwh"] = val
-                except:
-                    pass
+    if not any(t.result.values()):
+        _consumos_p_sueltos(t)
     
-    return result
+    return t.result
 
 
-def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
-    full_text = normalize_text(full_text)
+def parse_invoice_text(full_text, is_image: bool = False) -> dict:
+    """Acepta el texto crudo o un InvoiceDocument ya construido (p.ej. con el preproceso de Vision)."""
+    t0 = time.perf_counter()
+    doc = _documento(full_text)
+    full_text = doc.texto
     result = _empty_result(full_text)
     parsed_fields = {}
+    # ⭐ Huella de comercializadora (cabecera + CIF): elige el juego de estrategias de consumos
+    proveedor = clasificar_comercializadora(doc)
     extraction_summary = {
         "atr_source": None,
         "potencia_p1_source": None,
         "potencia_p2_source": None,
+        "comercializadora": proveedor,
         "parse_warnings": [],
     }
 
-    def parse_structured_fields(raw_text: str) -> dict:
+    def parse_structured_fields(doc: InvoiceDocument) -> dict:
+        raw_text = doc.texto
+        escaneo = doc.escaneo
         data = {
             "fecha_inicio_consumo": None,
             "fecha_fin_consumo": None,
@@ -766,8 +844,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         # Regex: ES followed by exactly 16 digits and 2 letters, with optional separators
         
         # Pattern 1: Strict - exactly as format should be
-        strict_pattern = r"ES[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*([A-Z]{2})"
-        strict_matches = re.finditer(strict_pattern, raw_text, re.IGNORECASE)
+        strict_matches = list(CUPS["estricto"].finditer(raw_text))
         
         for match in strict_matches:
             # Reconstruct without spaces/dashes
@@ -785,10 +862,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         # Pattern 2: Fallback - if MOD529 fails, accept best match anyway
         if not valid_cups_found:
             print("[FALLBACK] Trying without strict MOD529...")
-            fallback_matches = list(re.finditer(strict_pattern, raw_text, re.IGNORECASE))
-            if fallback_matches:
+            if strict_matches:
                 # Take the first one even if MOD529 fails
-                match = fallback_matches[0]
+                match = strict_matches[0]
                 cups_candidate = "ES" + "".join(match.groups())
                 print(f"[WARN] Accepting without MOD529 validation: {cups_candidate}")
                 valid_cups_found = cups_candidate
@@ -799,50 +875,37 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         detected_pf["cups"] = data["cups"] is not None
 
         # 2. Fechas range - MEJORADO (Múltiples estrategias)
-        meses = "enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre"
-        
         # PRIORIDAD Format 5: FASE 5 - "05 de agosto de 2025 - 01 de septiembre de 2025" (HC_Energia)
         # Ejecutar PRIMERO para evitar que dd.mm.yyyy incorrecto matchee antes
-        hc_pattern = r'(\d{1,2}\s+de\s+(' + meses + r')\s+de\s+\d{4})\s*-\s*(\d{1,2}\s+de\s+(' + meses + r')\s+de\s+\d{4})'
-        match_hc = re.search(hc_pattern, raw_text, re.IGNORECASE)
+        match_hc = FECHAS["rango_hc"].search(raw_text)
         if match_hc:
             data["fecha_inicio_consumo"] = match_hc.group(1).strip()
             data["fecha_fin_consumo"] = match_hc.group(3).strip()  # Group 3 (grupo 2 es el mes)
         
         # Format 1: "31 de agosto de 2025 a 30 de septiembre de 2025"
         if not data["fecha_inicio_consumo"]:
-            rango_text = re.search(
-                rf"(\d{{1,2}}[\s\w]{{1,8}}(?:{meses})[\s\w]{{1,8}}\d{{4}})[\s\S]{{0,100}}?\b(?:a|al|hasta)\b[\s\S]{{0,100}}?(\d{{1,2}}[\s\w]{{1,8}}(?:{meses})[\s\w]{{1,8}}\d{{4}})",
-                raw_text,
-                re.IGNORECASE,
-            )
+            rango_text = FECHAS["rango_meses"].search(raw_text)
             if rango_text:
                 data["fecha_inicio_consumo"] = rango_text.group(1)
                 data["fecha_fin_consumo"] = rango_text.group(2)
 
         # Format 2: "dd/mm/yyyy - dd/mm/yyyy" o "dd.mm.yyyy a dd.mm.yyyy"
         if not data["fecha_inicio_consumo"]:
-            rango_fechas = re.search(
-                r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})[\s\S]{0,80}?(?:-|al|a|hasta)[\s\S]{0,80}?(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})", 
-                raw_text, 
-                re.IGNORECASE
-            )
+            rango_fechas = FECHAS["rango_numerico"].search(raw_text)
             if rango_fechas:
                 data["fecha_inicio_consumo"] = rango_fechas.group(1)
                 data["fecha_fin_consumo"] = rango_fechas.group(2)
 
         # Format 3: NUEVO - "Periodo de consumo: 5 de junio al 9 de agosto de 2024"
         if not data["fecha_inicio_consumo"]:
-            periodo_pattern = rf"(?:periodo|período)\s+(?:de\s+)?consumo\s*[:\-]?\s*(\d{{1,2}}[\s\w]{{0,8}}(?:{meses})[\w\s]{{0,20}})[\s\S]{{0,100}}?(?:a|al|hasta)\s+(\d{{1,2}}[\s\w]{{0,8}}(?:{meses})[\w\s]{{0,30}})"
-            match = re.search(periodo_pattern, raw_text, re.IGNORECASE)
+            match = FECHAS["periodo_consumo"].search(raw_text)
             if match:
                 data["fecha_inicio_consumo"] = match.group(1).strip()
                 data["fecha_fin_consumo"] = match.group(2).strip()
         
         # Format 4: NUEVO - "del DD de MES al DD de MES de YYYY"
         if not data["fecha_inicio_consumo"]:
-            del_pattern = rf"del\s+(\d{{1,2}})\s+de\s+({meses})\s+al\s+(\d{{1,2}})\s+de\s+({meses})(?:\s+de\s+(\d{{4}}))?"
-            match = re.search(del_pattern, raw_text, re.IGNORECASE)
+            match = FECHAS["del_al"].search(raw_text)
             if match:
                 groups = match.groups()
                 year = groups[4] if groups[4] else "2025"  # Default year if not found
@@ -853,34 +916,12 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         detected_pf["fecha_fin_consumo"] = data["fecha_fin_consumo"] is not None
 
         # 2b. Dias Facturados (Improved - Multiple strategies)
-        dias_facturados = None
-        
-        # Strategy 1: Look for explicit "días" keyword
-        for ln in raw_text.splitlines():
-            linea = normalize_text(ln)
-            if not linea: 
-                continue
-            low = linea.lower()
-            
-            # Pattern: "30 dias" or "días: 30" 
-            m = re.search(r"(?:d[íi]as[\s:]*(\d+)|(\d+)\s*d[íi]as)", low)
-            if m:
-                val = m.group(1) or m.group(2)
-                try:
-                    val_int = int(val)
-                    # Sanity range for days (1-120)
-                    if 1 <= val_int <= 120:
-                        dias_facturados = val_int
-                        break
-                except:
-                    continue
+        # Strategy 1: Look for explicit "días" keyword ("30 dias" o "días: 30", rango 1-120, del escáner)
+        dias_facturados = escaneo.dias
         
         # Strategy 2: Look for "Período" o "periodo" followed by dates or days
         if dias_facturados is None:
-            periodo_match = re.search(
-                r"(?i)per[íi]odo[\s\S]{0,100}?(\d{1,2})\s+(?:d[íi]as|days)",
-                raw_text
-            )
+            periodo_match = FECHAS["dias_periodo"].search(raw_text)
             if periodo_match:
                 try:
                     val = int(periodo_match.group(1))
@@ -910,127 +951,37 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         # 3. Importe Factura (High Priority)
         # Look for explicit "TOTAL FACTURA" or "TOTAL A PAGAR" to avoid "Base Imponible"
         # BUG C FIX: TOTAL A PAGAR tiene máxima prioridad
-        total_pagar_match = re.search(
-            r"TOTAL[\s\S]{0,50}?A[\s\S]{0,50}?PAGAR[\s\S]{0,50}?([\d.,]+)\s*(?:€|EUR)", 
-            raw_text, 
-            re.IGNORECASE
-        )
+        total_pagar_match = TOTALES["total_a_pagar"].search(raw_text) if doc.contiene("pagar") else None
         if total_pagar_match:
             data["importe_factura"] = parse_es_number(total_pagar_match.group(1))
             detected_pf["importe_factura"] = True
         else:
             # Luego TOTAL IMPORTE FACTURA o TOTAL FACTURA
-            high_prio_match = re.search(
-                r"(?:TOTAL\s+IMPORTE\s+FACTURA|TOTAL\s+FACTURA)[^0-9\n]{0,20}([\d.,]+)\s*(?:€|EUR)", 
-                raw_text, 
-                re.IGNORECASE
-            )
+            high_prio_match = TOTALES["total_factura"].search(raw_text) if doc.contiene("factura") else None
             if high_prio_match:
                 data["importe_factura"] = parse_es_number(high_prio_match.group(1))
                 detected_pf["importe_factura"] =True
             else:
                 # Fallback to "IMPORTE FACTURA"
-                importe_match = re.search(r"IMPORTE\s+FACTURA[:\s]*[\r\n\s]*([\d.,]+)", raw_text, re.IGNORECASE)
+                importe_match = TOTALES["importe_factura"].search(raw_text) if doc.contiene("factura") else None
                 if importe_match:
                     data["importe_factura"] = parse_es_number(importe_match.group(1))
                     detected_pf["importe_factura"] = data["importe_factura"] is not None
                 else:
                     detected_pf["importe_factura"] = False
 
-        data["atr"] = extract_atr(raw_text)
+        data["atr"] = atr_texto
         detected_pf["atr"] = data["atr"] is not None
 
         # 5. Consumption (Expanded mapping)
         # P1 = Punta, P2 = Llano, P3 = Valle (Generic approach)
 
-        filtered_keywords = ["acumulada", "actual", "anterior", "último año", "año anterior"]
-        consumo_lines = []
-        for ln in raw_text.splitlines():
-            clean = ln.strip()
-            if not clean:
-                continue
-            lower = clean.lower()
-            # [PATCH] Allow lines with "consumo" OR specific period keywords
-            if "consumo" not in lower and not re.search(r"\b(p[1-6]|punta|llano|valle)\b", lower):
-                continue
-            if any(bad in lower for bad in filtered_keywords):
-                continue
-            consumo_lines.append(clean)
-
-        consumo_source = "\n".join(consumo_lines) if consumo_lines else raw_text
+        # Líneas con "consumo" o un periodo (P1-P6/punta/llano/valle), sin lecturas acumuladas ni históricos
+        consumo_source = "\n".join(escaneo.consumo) if escaneo.consumo else raw_text
         normalized_consumo_text = normalize_text(consumo_source)
 
-        consume_patterns = {
-            "p1": [
-                # PRIORITY 0: Frase larga Iberdrola "consumos desagregados han sido punta: X kWh"
-                r"(?i)consumos\s+desagregados\s+han\s+sido\s+punta[:\s]+([\d.,]+)\s*kwh",
-                # PRIORITY 1: Consumos desagregados + punta (Iberdrola format)
-                r"(?i)consumos\s+desagregados.*?punta[:\s]+([\d.,]+)",
-                # PRIORITY 2: Consumo punta explícito (with "consumo" keyword)
-                r"(?i)consumo\s+punta[\s\S]{0,50}?([\d.,]+)",
-                # PRIORITY 3: Consumo + P1 with kwh
-                r"(?i)consumo\s+(?:de\s+)?(?:energía\s+)?.*?\bP1\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 4: P1 solo seguido de número
-                r"(?i)\bP1\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 5: punta after "consumo" keyword (to avoid Potencia punta)
-                r"(?i)(?:consumo\s+)?punta\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?",
-                # LAST RESORT: Punta alone (but will match "Potencia punta" too)
-                r"(?i)\bpunta\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # Tabla format: "P1 XXX" (números grandes, típicamente > 50)
-                r"\bP1\b\s+([\d.,]+)(?:\s|$)",
-            ],
-            "p2": [
-                # PRIORITY 0: Frase larga Iberdrola "consumos desagregados han sido... llano: X kWh"
-                r"(?i)consumos\s+desagregados\s+han\s+sido.*?llano[:\s]+([\d.,]+)\s*kwh",
-                # PRIORITY 1: Consumos desagregados + llano (Iberdrola format)
-                r"(?i)consumos\s+desagregados.*?llano[:\s]+([\d.,]+)",
-                # PRIORITY 2: Consumo llano explícito
-                r"(?i)consumo\s+llano[\s\S]{0,50}?([\d.,]+)",
-                # PRIORITY 3: Consumo + P2 with kwh
-                r"(?i)consumo\s+(?:de\s+)?(?:energía\s+)?.*?\bP2\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 4: P2 solo seguido de número
-                r"(?i)\bP2\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 5: llano after "consumo" keyword
-                r"(?i)(?:consumo\s+)?llano\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?",
-                # LAST RESORT: Llano alone
-                r"(?i)\bllano\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # Tabla format
-                r"\bP2\b\s+([\d.,]+)(?:\s|$)",
-            ],
-            "p3": [
-                # PRIORITY 0: Frase larga Iberdrola "consumos desagregados han sido... valle X kWh"
-                r"(?i)consumos\s+desagregados\s+han\s+sido.*?valle[:\s]+([\d.,]+)\s*kwh",
-                # PRIORITY 1: Consumos desagregados + valle (Iberdrola format)
-                r"(?i)consumos\s+desagregados.*?valle[:\s]+([\d.,]+)",
-                # PRIORITY 2: Consumo valle explícito
-                r"(?i)consumo\s+valle[\s\S]{0,50}?([\d.,]+)",
-                # PRIORITY 3: Consumo + P3 with kwh
-                r"(?i)consumo\s+(?:de\s+)?(?:energía\s+)?.*?\bP3\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 4: P3 solo seguido de número
-                r"(?i)\bP3\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # PRIORITY 5: valle after "consumo" keyword
-                r"(?i)(?:consumo\s+)?valle\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?",
-                # LAST RESORT: Valle alone
-                r"(?i)\bvalle\b[\s\S]{0,100}?([\d.,]+)\s*(?:kwh)?",
-                # Tabla format
-                r"\bP3\b\s+([\d.,]+)(?:\s|$)",
-            ],
-            "p4": [
-                r"(?i)consumo.*?P4.*?[:\-]?\s*([\d.,]+)",
-                r"(?i)\bP4\b\s+([\d.,]+)",
-            ],
-            "p5": [
-                r"(?i)consumo.*?P5.*?[:\-]?\s*([\d.,]+)",
-                r"(?i)\bP5\b\s+([\d.,]+)",
-            ],
-            "p6": [
-                r"(?i)consumo.*?P6.*?[:\-]?\s*([\d.,]+)",
-                r"(?i)\bP6\b\s+([\d.,]+)",
-            ],
-        }
-
         # PRIMERA ESTRATEGIA: Usar la función mejorada de extracción de tablas
-        table_consumos = _extract_table_consumos(raw_text)
+        table_consumos = _extract_table_consumos(doc, proveedor, extraction_summary)
         for p_num in range(1, 7):
             key = f"consumo_p{p_num}_kwh"
             if key in table_consumos and table_consumos[key]:
@@ -1039,13 +990,8 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
 
         # ESTRATEGIA 3B: Búsqueda en líneas de tabla PRIMERO (más precisa - filtra por kwh)
         # Common pattern in Spanish invoices: table with columns P1, P2, P3, etc.
-        # IMPORTANTE: Filtrar solo líneas que tengan "kwh" para evitar capturar potencias (kW)
-        table_lines = []
-        for ln in raw_text.splitlines():
-            clean = ln.strip()
-            # Lines que contienen P1, P2, P3 Y "kwh" (para asegurar son consumos, no potencias)
-            if re.search(r"\b(?:kwh|kWh)\b", clean, re.IGNORECASE) and re.search(r"\bP[1-6]\b|punta|llano|valle", clean, re.IGNORECASE):
-                table_lines.append(clean)
+        # IMPORTANTE: el escáner solo guarda líneas con "kwh" para evitar capturar potencias (kW)
+        table_lines = escaneo.tabla_kwh
         
         # Try to extract consumos from table lines when not found yet
         for p_num in range(1, 7):
@@ -1053,24 +999,14 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             if data[key] is not None:
                 continue  # Ya fue encontrado
             
-            # Buscar en líneas específicas
-            period_names = {
-                1: ["punta", "p1"],
-                2: ["llano", "p2"],
-                3: ["valle", "p3"],
-                4: ["p4"],
-                5: ["p5"],
-                6: ["p6"],
-            }
-            
             for line in table_lines:
                 line_lower = line.lower()
                 # Check if this line contains the period label
-                if not any(name in line_lower for name in period_names.get(p_num, [])):
+                if not any(name in line_lower for name in ALIAS_PERIODO[p_num]):
                     continue
                 
                 # Try to extract a number from this line - but skip the first match if it's tiny (like "2" from "P2")
-                nums = re.findall(r"([\d.,]+)", line)
+                nums = TEXTO["numero"].findall(line)
                 # Skip first match if it's less than 5 (likely the period number like "2" in "P2")
                 if nums and len(nums) > 1 and parse_es_number(nums[0]) is not None and parse_es_number(nums[0]) < 5:
                     nums = nums[1:]  # Skip the period marker
@@ -1089,7 +1025,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                     break
 
         # SEGUNDA ESTRATEGIA: Patrones regex tradicionales (para consumos no encontrados)
-        for p_key, patterns in consume_patterns.items():
+        # Por prioridad: frase Iberdrola "consumos desagregados han sido...", consumo + punta/P1, P1 suelto,
+        # punta suelta y por último formato tabla "P1 XXX" (ver ocr_patrones._consumo_periodo)
+        for p_key, patterns in CONSUMOS["periodo"].items():
             key = f"consumo_{p_key}_kwh"
             if data[key] is not None:
                 continue  # Ya fue encontrado en estrategia 1 o 3
@@ -1097,7 +1035,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             value_found = None
             
             for pat in patterns:
-                m = re.search(pat, normalized_consumo_text, re.IGNORECASE)
+                m = pat.search(normalized_consumo_text)
                 if m:
                     try:
                         candidate = parse_es_number(m.group(1))
@@ -1113,20 +1051,13 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
 
         # ESTRATEGIA 3.5: Búsqueda explícita de PUNTA/LLANO/VALLE sin P[1-6]
         # Cuando la factura usa nombres españoles pero sin etiquetas P1/P2/P3
-        spanish_period_map = {
-            "punta": "p1",
-            "llano": "p2", 
-            "valle": "p3"
-        }
-        
-        for spanish_name, p_key in spanish_period_map.items():
-            key = f"consumo_{p_key}_kwh"
+        for p_num, (spanish_name, pattern) in enumerate(CONSUMOS["nombre_periodo"].items(), start=1):
+            key = f"consumo_p{p_num}_kwh"
             if data[key] is not None:
                 continue  # Ya fue encontrado
             
             # Buscar líneas con "Punta: 123" o "LLANO 456 kWh" etc
-            pattern = rf"(?i)(?:consumo\s+)?{spanish_name}\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?"
-            m = re.search(pattern, raw_text)
+            m = pattern.search(raw_text)
             if m:
                 try:
                     val = parse_es_number(m.group(1))
@@ -1142,31 +1073,26 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             data.get(f"consumo_p{i}_kwh") is not None for i in range(1, 7)
         )
         if has_any_consumo:
-            lines = [ln.strip() for ln in raw_text.splitlines() if ln.strip()]
-            for ln in lines:
-                low = ln.lower()
-                if "potencia" in low or re.search(r"\bkw\b", low):
-                    continue
-                # Match "P1: 123" or "P1 123"
-                m = re.match(r"^p\s*([1-6])\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?\b", low, re.IGNORECASE)
-                if not m:
-                    m = re.match(r"^p\s*([1-6])\s+([\d.,]+)\s*(?:kwh)?\b", low, re.IGNORECASE)
-                if not m:
-                    continue
-                pnum = int(m.group(1))
+            # Líneas "P1: 123" / "P1 123" sin "potencia" ni "kW" (el escáner ya guardó (periodo, valor))
+            for pnum, valor in escaneo.periodo_suelto:
                 key = f"consumo_p{pnum}_kwh"
                 if data.get(key) is None:
-                    data[key] = parse_es_number(m.group(2))
+                    data[key] = parse_es_number(valor)
                     detected_pf[key] = data[key] is not None
 
-        bono = re.search(r"\bbono\s+social\b", raw_text, re.IGNORECASE)
+        bono = bono_match
         data["bono_social"] = True if bono else None
         detected_pf["bono_social"] = bono is not None
 
         data["parsed_fields"] = detected_pf
         return data
 
-    structured = parse_structured_fields(full_text)
+    # ATR y bono social se buscan una vez (parse_structured_fields y el merge trabajan sobre el mismo texto)
+    escaneo = doc.escaneo
+    atr_texto = extract_atr(doc)
+    bono_match = TOTALES["bono_social"].search(full_text)
+
+    structured = parse_structured_fields(doc)
     parsed_fields.update(structured.get("parsed_fields", {}))
 
     # Merge strategies
@@ -1174,15 +1100,15 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         result["cups"] = structured.get("cups")
     else:
         # Fallback regex (Improved to capture full Iberdrola CUPS)
-        cups_match = re.search(r"(ES[ \t0-9A-Z\-]{18,28})", full_text, re.IGNORECASE)
+        cups_match = CUPS["fallback"].search(full_text)
         if cups_match:
             raw_cups = cups_match.group(1).upper().splitlines()[0]
-            cleaned_cups = re.sub(r"[\s\-]", "", raw_cups)
+            cleaned_cups = CUPS["separadores"].sub("", raw_cups)
             # Re-verify Mod529 or at least length
-            valid_cups = re.search(r"ES[0-9A-Z]{18,22}", cleaned_cups)
+            valid_cups = CUPS["limpio"].search(cleaned_cups)
             result["cups"] = valid_cups.group(0) if valid_cups else cleaned_cups[:22]
 
-    atr_value = extract_atr(full_text)
+    atr_value = atr_texto
     if atr_value:
         result["atr"] = atr_value
         extraction_summary["atr_source"] = "raw_text"
@@ -1219,7 +1145,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         else:
             forced_period_missing = False
 
-    potencias = _extract_potencias_with_sources(full_text)
+    potencias = _extract_potencias_with_sources(doc)
     if potencias["p1"] is not None:
         result["potencia_p1_kw"] = potencias["p1"]
         extraction_summary["potencia_p1_source"] = potencias["p1_source"] or "raw_text"
@@ -1230,17 +1156,17 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         extraction_summary["parse_warnings"].extend(potencias["warnings"])
 
     # Generic total consumption - VERY STRICT to avoid period-specific values
-    consumo_match = re.search(r"(?i)(?:consumo\s+total|total\s+consumo|consumo\s+(?:facturado|del\s+periodo))[^0-9\n]{0,50}([\d.,]+)\s*kwh", full_text)
+    consumo_match = CONSUMOS["total"].search(full_text) if doc.contiene("consumo") else None
     
     # FASE 5: HC_Energia - Pattern alternativo "XXX,XX kWh x precio" (línea de facturación)
     if not consumo_match:
-        hc_consumo_match = re.search(r"\(\d{2}\.\d{2}\.\d{4}\s*-\s*\d{2}\.\d{2}\.\d{4}\)\s*([\d.,]+)\s*kWh\s*x\s*[\d.,]+\s*€/kWh", full_text)
+        hc_consumo_match = CONSUMOS["total_hc"].search(full_text) if doc.contiene("€") else None
         if hc_consumo_match:
             consumo_match = hc_consumo_match
     
     if consumo_match:
         # [P0] Use safe extraction with priority patterns A→B→C
-        safe_result = _extract_consumo_safe(full_text)
+        safe_result = _extract_consumo_safe(doc)
         if safe_result['value'] is not None:
             result["consumo_kwh"] = safe_result['value']
             extraction_summary["consumo_safe_pattern"] = safe_result['pattern']
@@ -1252,7 +1178,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             detected["consumo_kwh"] = True
     else:
         # [P0] Try safe extraction even without initial regex match
-        safe_result = _extract_consumo_safe(full_text)
+        safe_result = _extract_consumo_safe(doc)
         if safe_result['value'] is not None:
             result["consumo_kwh"] = safe_result['value']
             extraction_summary["consumo_safe_pattern"] = safe_result['pattern']
@@ -1268,14 +1194,14 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         detected["importe"] = True
     else:
         # Fallback strategy
-        total_match = re.search(r"TOTAL.*?\s+(\d+[.,]?\d*)\s*(?:€|EUR)", full_text, re.IGNORECASE)
+        total_match = TOTALES["total"].search(full_text)
         if total_match:
             result["importe"] = parse_es_number(total_match.group(1))
             detected["importe"] = result["importe"] is not None
         
         if result["importe"] is None:
             # Find max money value
-            matches = re.findall(r"(\d+[.,]?\d*)\s*(?:€|EUR)", full_text, re.IGNORECASE)
+            matches = TOTALES["euros"].findall(full_text)
             if matches:
                 vals = [parse_es_number(m) for m in matches]
                 vals = [v for v in vals if v is not None]
@@ -1290,7 +1216,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         detected["importe"] = False
 
     # Dates
-    date_matches = re.findall(r"(\d{4}[/-]\d{2}[/-]\d{2}|\d{2}[/-]\d{2}[/-]\d{4})", full_text)
+    date_matches = FECHAS["fecha"].findall(full_text)
     if date_matches:
         result["fecha"] = date_matches[0]
         detected["fecha"] = True
@@ -1310,16 +1236,12 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     _check_periodo()
 
     # Extraer Numero de Factura
-    num_fact_match = re.search(
-        r"(?:n[º°].?|num\.?|numero|número)\s*(?:de)?\s*factura\s*[:\-]?\s*([A-Z0-9\-\/]{3,30})", 
-        full_text, 
-        re.IGNORECASE
-    )
+    num_fact_match = IDENTIFICACION["numero_factura"].search(full_text)
     if num_fact_match:
         result["numero_factura"] = num_fact_match.group(1).strip()
     else:
         # Fallback simple: busca "Factura: XXXXX"
-        simple_match = re.search(r"factura\s*[:]\s*([A-Z0-9\-\/]{3,30})", full_text, re.IGNORECASE)
+        simple_match = IDENTIFICACION["numero_factura_simple"].search(full_text)
         result["numero_factura"] = simple_match.group(1).strip() if simple_match else None
 
 
@@ -1329,7 +1251,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         cleaned = candidate.strip(" :,-\t\r\n")
         if not cleaned:
             return False
-        if re.search(r"\d", cleaned):
+        if TEXTO["digito"].search(cleaned):
             return False
         # Extended keywords filter as requested
         keywords = [
@@ -1350,7 +1272,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     def _clean_name(candidate: str) -> str:
         if not candidate:
             return None
-        candidate = re.sub(r"\s{2,}", " ", candidate)
+        candidate = TEXTO["blancos_dobles"].sub(" ", candidate)
         return candidate.strip(" :,-\t\r\n")
 
     def _is_address_candidate(line: str) -> bool:
@@ -1362,14 +1284,14 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             return False
         if len(line.strip()) < 6:
             return False
-        has_letter = re.search(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]", line)
-        has_number = re.search(r"\d", line)
+        has_letter = IDENTIFICACION["letra"].search(line)
+        has_number = TEXTO["digito"].search(line)
         return bool(has_letter and has_number)
 
     titular = None
     name_line_index = None
 
-    raw_lines = [ln.strip() for ln in full_text.splitlines() if ln.strip()]
+    raw_lines = escaneo.no_vacias
     
     # === ESTRATEGIA ROBUSTA MULTI-FORMATO ===
     # Análisis: Iberdrola (línea 11), Naturgy (línea 1), Endesa (línea 2), HC Energía (línea 4)
@@ -1421,7 +1343,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                         next_words = next_candidate.split()
                         if len(next_words) >= 2 and all(w[0].isupper() for w in next_words if len(w) > 0):
                             # Validar que NO sea dirección (no debe tener "Calle", números al inicio, etc.)
-                            if not re.match(r'^(Calle|C/|AV|Paseo|Plaza|\d)', next_candidate):
+                            if not IDENTIFICACION["inicio_direccion"].match(next_candidate):
                                 if _is_valid_name(next_candidate):
                                     titular = next_candidate
                                     name_line_index = idx+1
@@ -1429,7 +1351,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                 continue
             
             # Validación adicional: NO debe tener números (excepto "Sª", "3º" al final)
-            if re.search(r'\d', candidate) and not re.search(r'[Ss]ª|[0-9]º$', candidate):
+            if TEXTO["digito"].search(candidate) and not IDENTIFICACION["ordinal"].search(candidate):
                 continue
             
             # VALIDACIÓN FINAL: Debe ser nombre válido
@@ -1440,43 +1362,39 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     
     # Strategy 2 (FALLBACK): Buscar patrón explícito "Titular:" o "Cliente:"
     if not titular:
-        titular_pattern = re.search(
-            r"(?:titular|nombre\s+del\s+titular|cliente|nombre\s+y\s+apellidos)[:\s]+([A-ZÁÉÍÓÚÜÑ][A-Za-zÁÉÍÓÚÜÑáéíóúüñ ,.'´`\-]{10,80})",
-            full_text,
-            re.IGNORECASE
-        )
+        titular_pattern = IDENTIFICACION["titular"].search(full_text)
         if titular_pattern:
             candidate = _clean_name(titular_pattern.group(1))
             # Validar que NO sea keyword empresarial
-            if not re.search(r"\b(potencia|direccion|contrato|plan|datos|del|de|www)\b", candidate, re.IGNORECASE):
+            if not IDENTIFICACION["titular_excluido"].search(candidate):
                 if _is_valid_name(candidate):
                     titular = candidate
 
     result["titular"] = titular
 
-    match_dni = re.search(r"(?:dni|cif|nif)?\s*[:\-]?\s*([0-9]{8}[A-Z])", full_text, re.IGNORECASE)
+    match_dni = IDENTIFICACION["dni"].search(full_text)
     if match_dni:
-        result["dni"] = re.sub(r"\s+", "", match_dni.group(1)).strip()
+        result["dni"] = TEXTO["blancos"].sub("", match_dni.group(1)).strip()
 
     # FASE 1: Extracción robusta de dirección (línea por línea)
     result["direccion"] = None
-    raw_lines = [ln.strip() for ln in full_text.splitlines() if ln.strip()]
     
-    for i, line in enumerate(raw_lines):
+    # Ambas ramas exigen "direcci" en la línea
+    for i, line in enumerate(raw_lines if doc.contiene("direcci") else ()):
         line_lower = line.lower()
         
         # Buscar "Dirección de suministro" o similar
-        if re.search(r'direcci[oó]n\s+(?:de\s+)?suministro', line_lower):
+        if IDENTIFICACION["direccion_suministro"].search(line_lower):
             # Estrategia 1: Capturar después de ":" en misma línea
-            match_same = re.search(r'direcci[oó]n[^:]*:\s*(.+)$', line, re.IGNORECASE)
+            match_same = IDENTIFICACION["direccion_misma_linea"].search(line)
             if match_same:
                 addr = match_same.group(1).strip()
                 
                 # CASO ESPECIAL NATURGY: "VELAZQUEZ" solo, número en siguiente línea
-                if re.match(r'^[A-ZÁÉÍÓÚÜÑ]{3,}$', addr) and i+1 < len(raw_lines):
+                if IDENTIFICACION["calle_mayusculas"].match(addr) and i+1 < len(raw_lines):
                     next_line = raw_lines[i+1].strip()
                     # Si siguiente línea empieza con número: combinar
-                    number_match = re.match(r'^(\d{1,4})\s', next_line)
+                    number_match = IDENTIFICACION["numero_portal"].match(next_line)
                     if number_match:
                         result["direccion"] = f"{addr} {number_match.group(1)}"
                         break
@@ -1485,9 +1403,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                         break
                 
                 # Validar que no sea basura (mínimo 5 chars, no keywords)
-                elif len(addr) > 5 and not re.search(r'Plan\s+A\s+Tu\s+Medida|Contratado|Mercantil|Tarifa\s+One|mercado\s+libre', addr, re.IGNORECASE):
+                elif len(addr) > 5 and not IDENTIFICACION["direccion_basura"].search(addr):
                     # Limpiar código postal al final: "C/ GALICIA, 7 04430" -> "C/ GALICIA, 7"
-                    addr_clean = re.sub(r'\s+\d{5}.*$', '', addr).strip()
+                    addr_clean = IDENTIFICACION["codigo_postal_final"].sub('', addr).strip()
                     if len(addr_clean) > 5:
                         result["direccion"] = addr_clean
                         break
@@ -1497,13 +1415,13 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                 next_line = raw_lines[i+1].strip()
                 
                 # Caso A: Siguiente línea es solo número (Naturgy: "21")
-                if re.match(r'^\d{1,3}\s*$', next_line) and i+2 < len(raw_lines):
+                if IDENTIFICACION["solo_numero"].match(next_line) and i+2 < len(raw_lines):
                     # Buscar nombre de calle en línea ANTERIOR o contexto
                     street_name = None
                     # Buscar hacia atrás palabra en mayúsculas que sea calle
                     for j in range(max(0, i-3), i):
                         prev = raw_lines[j].strip()
-                        if re.match(r'^[A-ZÁÉÍÓÚ]{3,}$', prev):  # "VELAZQUEZ"
+                        if IDENTIFICACION["calle_previa"].match(prev):  # "VELAZQUEZ"
                             street_name = prev
                             break
                     
@@ -1518,20 +1436,20 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                             result["direccion"] = next_line  # Al menos el número
                 
                 # Caso B: Siguiente línea es dirección completa
-                elif len(next_line) > 5 and not re.search(r'N\\.?º|Fecha|Contrato|Tipo|factura', next_line, re.IGNORECASE):
+                elif len(next_line) > 5 and not IDENTIFICACION["no_direccion"].search(next_line):
                     # Limpiar código postal al final
-                    addr_clean = re.sub(r'\s+\d{5}.*$', '', next_line).strip()
+                    addr_clean = IDENTIFICACION["codigo_postal_final"].sub('', next_line).strip()
                     if len(addr_clean) > 5:
                         result["direccion"] = addr_clean
                         break
         
         # Fallback: "Dirección:" sin "de suministro" (HC Energía)
-        elif re.search(r'^direcci[oó]n\s*:', line_lower) and not result.get("direccion"):
-            match_same = re.search(r'direcci[oó]n\s*:\s*(.+)$', line, re.IGNORECASE)
+        elif IDENTIFICACION["direccion"].search(line_lower) and not result.get("direccion"):
+            match_same = IDENTIFICACION["direccion_valor"].search(line)
             if match_same:
                 addr = match_same.group(1).strip()
                 # Limpiar código postal: "Calle Minerva 35 - 2 C 04770" -> "Calle Minerva 35 - 2 C"
-                addr_clean = re.sub(r'\s+\d{5}.*$', '', addr).strip()
+                addr_clean = IDENTIFICACION["codigo_postal_final"].sub('', addr).strip()
                 if len(addr_clean) > 5:
                     result["direccion"] = addr_clean
                     break
@@ -1544,9 +1462,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             if titular_name[:20] in line and i+1 < len(raw_lines):
                 next_line = raw_lines[i+1].strip()
                 # Validar que sea dirección (inicia con C/, AV, CALLE, etc. o palabra + número)
-                if re.match(r'^(C/|AV|CALLE|PASEO|PLAZA|[A-ZÁÉÍÓÚ]+ [A-ZÁÉÍÓÚ]+.*\d|[A-ZÁÉÍÓÚ].*\d{1,4})', next_line, re.IGNORECASE):
+                if IDENTIFICACION["direccion_tras_titular"].match(next_line):
                     # Limpiar CP
-                    addr_clean = re.sub(r'\s+\d{5}.*$', '', next_line).strip()
+                    addr_clean = IDENTIFICACION["codigo_postal_final"].sub('', next_line).strip()
                     if len(addr_clean) > 5:
                         result["direccion"] = addr_clean
                         break
@@ -1563,7 +1481,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                     next_line = raw_lines[i+1].strip()
                     
                     # Pattern: "04738 Vícar" o "21 04738 Vícar" (puede incluir número al inicio)
-                    cp_match = re.search(r'(\d{5}\s+[A-ZÁÉÍÓÚÜÑa-záéíóúüñ][^\n]{2,40})', next_line)
+                    cp_match = IDENTIFICACION["cp_localidad"].search(next_line)
                     if cp_match:
                         localidad = cp_match.group(1).strip()
                         
@@ -1571,7 +1489,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                         if i+2 < len(raw_lines):
                             provincia_line = raw_lines[i+2].strip()
                             # Validar que sea provincia (palabra sola, 5-15 chars)
-                            if re.match(r'^[A-ZÁÉÍÓÚÜÑa-záéíóúüñ]{5,15}$', provincia_line):
+                            if IDENTIFICACION["provincia_linea"].match(provincia_line):
                                 localidad = f"{localidad} {provincia_line}"
                         
                         # Normalizar: quitar acentos, unificar formato
@@ -1589,12 +1507,8 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     
     # Fallback: buscar patrón "CP + Localidad + Provincia" en full_text
     if not result.get("localidad"):
-        localidad_patterns = [
-            r"(\d{5}\s+[A-ZÁÉÍÓÚÜÑ][A-Za-zÁÉÍÓÚÜÑáéíóúüñ\s]{3,40}(?:ALMERIA|ALMERÍA|GRANADA|MADRID|BARCELONA))",
-            r"\n\s*(\d{5}\s+[A-Za-zÁÉÍÓÚÜÑáéíóúüñ][^\n]{5,50})\s*$"
-        ]
-        for pattern in localidad_patterns:
-            match = re.search(pattern, full_text, re.IGNORECASE | re.MULTILINE)
+        for pattern in IDENTIFICACION["localidad"]:
+            match = pattern.search(full_text)
             if match:
                 localidad = match.group(1).strip()
                 # Normalizar acentos
@@ -1609,7 +1523,6 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
             
     # Enprint(f"[DEBUG] Entering heuristic address search (name_line_index={name_line_index})")
     if name_line_index is not None:
-        raw_lines = [ln.strip() for ln in full_text.splitlines() if ln.strip()]
         for forward in range(1, 3):
             if name_line_index + forward < len(raw_lines):
                 candidate_dir = raw_lines[name_line_index + forward]
@@ -1617,13 +1530,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
                     result["direccion"] = candidate_dir.strip()
                     break
 
-    match_tel = re.search(
-        r"(?:tel(?:efono)?|phone)?[^\d]{0,12}(\b[6789]\d{2}[.\s\-]?\d{3}[.\s\-]?\d{3}\b)",
-        full_text,
-        re.IGNORECASE,
-    )
+    match_tel = IDENTIFICACION["telefono"].search(full_text)
     if match_tel:
-        telefono = re.sub(r"[.\s\-]", "", match_tel.group(1))
+        telefono = IDENTIFICACION["separadores_telefono"].sub("", match_tel.group(1))
         if not telefono.startswith(("800", "900", "901", "902", "905")):
             result["telefono"] = telefono
             detected["telefono"] = True
@@ -1634,7 +1543,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
 
     def _extract_number(patterns):
         for pat in patterns:
-            m = re.search(pat, full_text, re.IGNORECASE)
+            m = pat.search(full_text)
             if m:
                 val = parse_es_number(m.group(1))
                 if val is not None:
@@ -1643,13 +1552,9 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
         return None
 
     if result["potencia_p1_kw"] is None:
-        result["potencia_p1_kw"] = _extract_number(
-            [r"potencia\s*p1[^0-9]{0,10}([\d.,]+)\s*k?w", r"potencia\s+punta[^0-9]{0,10}([\d.,]+)\s*k?w"]
-        )
+        result["potencia_p1_kw"] = _extract_number(POTENCIAS["p1_fallback"])
     if result["potencia_p2_kw"] is None:
-        result["potencia_p2_kw"] = _extract_number(
-            [r"potencia\s*p2[^0-9]{0,10}([\d.,]+)\s*k?w", r"potencia\s+valle[^0-9]{0,10}([\d.,]+)\s*k?w"]
-        )
+        result["potencia_p2_kw"] = _extract_number(POTENCIAS["p2_fallback"])
     
     # Fallback: En tarifa 2.0TD con solo P1, asumir P2 = P1 (potencia simétrica común)
     if result.get("atr") == "2.0TD":
@@ -1680,36 +1585,21 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
              result[field] = structured.get(field)
              detected[field] = True
     
-    bono_match = re.search(r"\bbono\s+social\b", full_text, re.IGNORECASE)
     result["bono_social"] = True if bono_match else None
     detected["bono_social"] = bono_match is not None
 
-    sv_match = re.search(r"\bservicios\s+vinculados\b", full_text, re.IGNORECASE)
+    sv_match = TOTALES["servicios_vinculados"].search(full_text)
     result["servicios_vinculados"] = True if sv_match else None
     detected["servicios_vinculados"] = sv_match is not None
 
     # FASE 3: Alquiler contador - Incluir "SERVICIOS Y OTROS CONCEPTOS" (Iberdrola)
-    result["alquiler_contador"] = _extract_number(
-        [
-            r"SERVICIOS\s+Y\s+OTROS\s+CONCEPTOS[^\d]+([\d.,]+)\s*€",  # Iberdrola - PRIMERO
-            r"alquiler\s+(?:de\s+)?(?:equipos|contador|medida)[^0-9]{0,20}([\d.,]+)", 
-            r"equipos\s+de\s+medida[^0-9]{0,20}([\d.,]+)",
-            r"contador\s+alquiler[^0-9]{0,10}([\d.,]+)"
-        ]
-    )
+    result["alquiler_contador"] = _extract_number(TOTALES["alquiler_contador"])
     detected["alquiler_contador"] = result["alquiler_contador"] is not None
 
-    result["impuesto_electrico"] = _extract_number(
-        [
-            r"impuesto\s+(?:sobre\s+la\s+)?electricidad[^0-9]{0,40}([\d.,]+)",
-            r"impuesto\s+(?:eléctrico|el[eé]ctrico)[^0-9]{0,40}([\d.,]+)",
-            r"(?:IEE|impuesto\s+sobre\s+electricidad)[^0-9]{0,40}([\d.,]+)",
-            r"impuesto\s+.*?\b([\d.,]+)\s*€\s*$",
-        ]
-    )
+    result["impuesto_electrico"] = _extract_number(TOTALES["impuesto_electrico"])
     detected["impuesto_electrico"] = result["impuesto_electrico"] is not None
 
-    result["iva"] = _extract_number([r"\biva\b[^0-9]{0,10}([\d.,]+)"])
+    result["iva"] = _extract_number(TOTALES["iva"])
     detected["iva"] = result["iva"] is not None
 
     # ⭐ IVA SIEMPRE AL 21% (Fiscalidad actual española)
@@ -1757,17 +1647,15 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     # Strategy 2: Si no encontró, buscar en líneas que contengan un código postal (típicamente junto a provincia)
     # Patrón: "XXXXX" (5 dígitos) suele ir con provincia en España
     if not result.get("provincia"):
-        lines = full_text.split('\n')
-        for line in lines:
-            # Buscar líneas con patrón: número + provincia
-            if re.search(r'\d{4,5}', line):  # Contiene código postal
-                line_lower = line.lower()
-                for prov in provincias:
-                    if prov.lower() in line_lower:
-                        result["provincia"] = prov
-                        break
-                if result.get("provincia"):
+        # Líneas con código postal (4-5 dígitos), ya filtradas por el escáner
+        for line in escaneo.con_codigo_postal:
+            line_lower = line.lower()
+            for prov in provincias:
+                if prov.lower() in line_lower:
+                    result["provincia"] = prov
                     break
+            if result.get("provincia"):
+                break
     
     # Si sigue sin provincia, deixar como None
     if not result.get("provincia"):
@@ -1919,7 +1807,7 @@ def parse_invoice_text(full_text: str, is_image: bool = False) -> dict:
     result["extraction_summary"] = extraction_summary
     result["missing_fields"] = missing_fields
 
-
+    registrar_parseo(proveedor, (time.perf_counter() - t0) * 1000, extraction_summary.get("consumos_estrategia"))
     return result
 
 
@@ -2173,8 +2061,82 @@ Procesa TODAS las páginas de la factura si es multipágina."""
         return None
 
 
-def extract_data_from_pdf(file_bytes: bytes) -> dict:
-    is_pdf = file_bytes.startswith(b"%PDF")
+def _resultado_vision(full_text: str, pypdf_result: Optional[dict]) -> dict:
+    """Parseo del texto de Vision y fusión con el resultado parcial de pypdf."""
+    # PREPROCESADO: Unir números fragmentados
+    documento = InvoiceDocument.desde_texto(full_text, fragmentado=True)
+    print("[Vision] Preprocesado aplicado")
+
+    vision_result = parse_invoice_text(documento, is_image=True)
+
+    # FUSIÓN: pypdf + Vision (PRIORIZAR pypdf siempre que tenga valor válido)
+    if pypdf_result:
+        print("[Vision] Fusionando pypdf + Vision...")
+        all_fields = ['cups', 'atr', 'consumo_kwh', 'dias_facturados', 'fecha_inicio_consumo', 'fecha_fin_consumo',
+                     'total_factura', 'cliente', 'potencia_p1_kw', 'potencia_p2_kw', 
+                     'consumo_p1_kwh', 'consumo_p2_kwh', 'consumo_p3_kwh',
+                     'iva', 'iva_porcentaje', 'impuesto_electrico', 'alquiler_contador']
+
+        for field in all_fields:
+            pypdf_val = pypdf_result.get(field)
+            # Si pypdf tiene valor, SIEMPRE usar pypdf (más confiable que Vision)
+            if pypdf_val:
+                vision_result[field] = pypdf_val
+                if not vision_result.get(field) or vision_result.get(field) != pypdf_val:
+                    print(f"[Vision] OK {field} recuperado/forzado desde pypdf")
+
+        # Mapeo de aliases: Vision trae 'fecha_inicio'/'fecha_fin', mapear a 'fecha_inicio_consumo'/'fecha_fin_consumo'
+        if pypdf_result.get('fecha_inicio_consumo') and not vision_result.get('fecha_inicio_consumo'):
+            vision_result['fecha_inicio_consumo'] = pypdf_result['fecha_inicio_consumo']
+        if pypdf_result.get('fecha_fin_consumo') and not vision_result.get('fecha_fin_consumo'):
+            vision_result['fecha_fin_consumo'] = pypdf_result['fecha_fin_consumo']
+
+        # También mapear desde Vision aliases si existen
+        if vision_result.get('fecha_inicio') and not vision_result.get('fecha_inicio_consumo'):
+            vision_result['fecha_inicio_consumo'] = vision_result['fecha_inicio']
+        if vision_result.get('fecha_fin') and not vision_result.get('fecha_fin_consumo'):
+            vision_result['fecha_fin_consumo'] = vision_result['fecha_fin']
+
+    # Validación final
+    consumo = vision_result.get('consumo_kwh')
+    if consumo and consumo < 10:
+        print(f"[Vision] ⚠️ Consumo sospechoso: {consumo} kWh")
+
+    print(f"[Vision] OK Extraccion completada")
+    # Mapear titular → cliente para compatibilidad con frontend
+    if vision_result.get("titular"):
+        vision_result["cliente"] = vision_result["titular"]
+    # Mapear consumo_kwh → consumo_total_kwh
+    if vision_result.get("consumo_kwh"):
+        vision_result["consumo_total_kwh"] = vision_result["consumo_kwh"]
+    return vision_result
+
+
+def _fallback_pypdf(pypdf_result: Optional[dict], critical_count: int, e: Exception) -> dict:
+    """Resultado parcial de pypdf (o vacío) cuando Vision falla."""
+    if pypdf_result:
+        print(f"[Vision] Devolviendo pypdf parcial ({critical_count}/4 campos)")
+        # Mapear titular → cliente
+        if pypdf_result.get("titular"):
+            pypdf_result["cliente"] = pypdf_result["titular"]
+        # Mapear consumo_kwh → consumo_total_kwh
+        if pypdf_result.get("consumo_kwh"):
+            pypdf_result["consumo_total_kwh"] = pypdf_result["consumo_kwh"]
+        return pypdf_result
+    return _empty_result(f"Error procesando OCR: {str(e)}")
+
+
+def extract_data_from_pdf(file_bytes: Optional[bytes], textos: Optional[dict] = None) -> dict:
+    """
+    pypdf y, si no basta, Google Vision. `textos` (ver ocr_cache) hace de caché de
+    entrada/salida de los motores: las claves "pypdf" / "vision" que ya traiga se
+    reutilizan en vez de volver a leer el archivo o llamar a Vision, y las que se
+    obtengan se guardan. "motor" solo se fija si la extracción terminó sin error.
+    Sin file_bytes (re-parseo desde caché) solo se usan los textos recibidos.
+    """
+    textos = {} if textos is None else textos
+    is_pdf = textos["es_pdf"] if "es_pdf" in textos else file_bytes.startswith(b"%PDF")
+    textos["es_pdf"] = is_pdf
     
     # [CUPS-AUDIT] LOG #1: Motor OCR previsto
     import os
@@ -2187,14 +2149,20 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
     pypdf_result = None
     critical_count = 0
     
-    if is_pdf:
+    if is_pdf and ("pypdf" in textos or file_bytes is not None):
         try:
-            reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-            full_text = ""
-            for page in reader.pages:
-                text = page.extract_text()
-                if text:
-                    full_text += text + "\n"
+            if "pypdf" in textos:
+                full_text = textos["pypdf"]
+                print("[pypdf] Texto reutilizado de la caché de extracción")
+            else:
+                with _semaforos_motor["pypdf"]:
+                    reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+                    full_text = ""
+                    for page in reader.pages:
+                        text = page.extract_text()
+                        if text:
+                            full_text += text + "\n"
+                textos["pypdf"] = full_text
 
             if len(full_text.strip()) > 50:
                 print("[pypdf] Extrayendo texto...")
@@ -2220,6 +2188,7 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
                     # Mapear consumo_kwh → consumo_total_kwh
                     if pypdf_result.get("consumo_kwh"):
                         pypdf_result["consumo_total_kwh"] = pypdf_result["consumo_kwh"]
+                    textos["motor"] = "pypdf"
                     return pypdf_result
                 else:
                     print(f"[pypdf] ⚠️ Incompleto ({critical_count}/5), intentando Vision API...")
@@ -2227,6 +2196,21 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
             print(f"[pypdf] Error: {e}")
 
     # STEP 2: Vision API (fallback para PDFs escaneados)
+    if textos.get("vision"):
+        print("[Vision] Texto reutilizado de la caché de extracción (sin llamada a la API)")
+        try:
+            vision_result = _resultado_vision(textos["vision"], pypdf_result)
+            textos["motor"] = "vision"
+            return vision_result
+        except Exception as e:
+            print(f"[Vision] ERROR: {e}")
+            return _fallback_pypdf(pypdf_result, critical_count, e)
+
+    if file_bytes is None:
+        if pypdf_result:
+            return pypdf_result
+        return _empty_result("Sin archivo ni texto de Vision en caché")
+
     client, auth_log = get_vision_client()
     if not client:
         print(f"[Vision] ERROR Credenciales no disponibles")
@@ -2245,7 +2229,8 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
             import io as io_module
             
             print("[Vision] Convirtiendo PDF a imagen...")
-            images = convert_from_bytes(file_bytes, first_page=1, last_page=1, dpi=200)
+            with _semaforos_motor["vision"]:
+                images = convert_from_bytes(file_bytes, first_page=1, last_page=1, dpi=200)
             
             if not images:
                 print("[Vision] ERROR No se pudo convertir PDF a imagen")
@@ -2271,7 +2256,8 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
         image = vision.Image(content=file_bytes)
 
     try:
-        response = client.text_detection(image=image)
+        with _semaforos_motor["vision"]:
+            response = client.text_detection(image=image)
         
         # Debug: verificar respuesta de Vision API
         if response.error and response.error.message:
@@ -2291,64 +2277,11 @@ def extract_data_from_pdf(file_bytes: bytes) -> dict:
             return _empty_result("El OCR no detecto texto.")
 
         full_text = texts[0].description
-        
-        # PREPROCESADO: Unir números fragmentados
-        full_text = _preprocess_fragmented_text(full_text)
-        print("[Vision] Preprocesado aplicado")
-        
-        vision_result = parse_invoice_text(full_text, is_image=True)
-        
-        # FUSIÓN: pypdf + Vision (PRIORIZAR pypdf siempre que tenga valor válido)
-        if pypdf_result:
-            print("[Vision] Fusionando pypdf + Vision...")
-            all_fields = ['cups', 'atr', 'consumo_kwh', 'dias_facturados', 'fecha_inicio_consumo', 'fecha_fin_consumo',
-                         'total_factura', 'cliente', 'potencia_p1_kw', 'potencia_p2_kw', 
-                         'consumo_p1_kwh', 'consumo_p2_kwh', 'consumo_p3_kwh',
-                         'iva', 'iva_porcentaje', 'impuesto_electrico', 'alquiler_contador']
-            
-            for field in all_fields:
-                pypdf_val = pypdf_result.get(field)
-                # Si pypdf tiene valor, SIEMPRE usar pypdf (más confiable que Vision)
-                if pypdf_val:
-                    vision_result[field] = pypdf_val
-                    if not vision_result.get(field) or vision_result.get(field) != pypdf_val:
-                        print(f"[Vision] OK {field} recuperado/forzado desde pypdf")
-            
-            # Mapeo de aliases: Vision trae 'fecha_inicio'/'fecha_fin', mapear a 'fecha_inicio_consumo'/'fecha_fin_consumo'
-            if pypdf_result.get('fecha_inicio_consumo') and not vision_result.get('fecha_inicio_consumo'):
-                vision_result['fecha_inicio_consumo'] = pypdf_result['fecha_inicio_consumo']
-            if pypdf_result.get('fecha_fin_consumo') and not vision_result.get('fecha_fin_consumo'):
-                vision_result['fecha_fin_consumo'] = pypdf_result['fecha_fin_consumo']
-            
-            # También mapear desde Vision aliases si existen
-            if vision_result.get('fecha_inicio') and not vision_result.get('fecha_inicio_consumo'):
-                vision_result['fecha_inicio_consumo'] = vision_result['fecha_inicio']
-            if vision_result.get('fecha_fin') and not vision_result.get('fecha_fin_consumo'):
-                vision_result['fecha_fin_consumo'] = vision_result['fecha_fin']
-        
-        # Validación final
-        consumo = vision_result.get('consumo_kwh')
-        if consumo and consumo < 10:
-            print(f"[Vision] ⚠️ Consumo sospechoso: {consumo} kWh")
-        
-        print(f"[Vision] OK Extraccion completada")
-        # Mapear titular → cliente para compatibilidad con frontend
-        if vision_result.get("titular"):
-            vision_result["cliente"] = vision_result["titular"]
-        # Mapear consumo_kwh → consumo_total_kwh
-        if vision_result.get("consumo_kwh"):
-            vision_result["consumo_total_kwh"] = vision_result["consumo_kwh"]
+        textos["vision"] = full_text
+        vision_result = _resultado_vision(full_text, pypdf_result)
+        textos["motor"] = "vision"
         return vision_result
 
     except Exception as e:
         print(f"[Vision] ERROR: {e}")
-        if pypdf_result:
-            print(f"[Vision] Devolviendo pypdf parcial ({critical_count}/4 campos)")
-            # Mapear titular → cliente
-            if pypdf_result.get("titular"):
-                pypdf_result["cliente"] = pypdf_result["titular"]
-            # Mapear consumo_kwh → consumo_total_kwh
-            if pypdf_result.get("consumo_kwh"):
-                pypdf_result["consumo_total_kwh"] = pypdf_result["consumo_kwh"]
-            return pypdf_result
-        return _empty_result(f"Error procesando OCR: {str(e)}")
+        return _fallback_pypdf(pypdf_result, critical_count, e)
@@ -0,0 +1,148 @@
+"""
+Caché persistente de extracción OCR direccionada por contenido (sha256 del archivo).
+
+ocr_extracciones guarda por (file_hash, OCR_PARSER_VERSION) los textos de los
+motores y el resultado de extract_data_from_pdf:
+- misma versión: se devuelve el resultado guardado (ni pypdf, ni pdf2image, ni Vision);
+- otra versión: se re-parsean los textos guardados de la fila más reciente del hash
+  (sin volver a llamar a Vision) y se guarda una fila para la versión actual;
+- sin fila: extracción completa.
+Solo se guardan extracciones que terminaron bien (textos["motor"] fijado): un
+fallo de credenciales o de Vision no se cachea y se reintenta en la siguiente.
+Las escrituras van en savepoints y sin commit: el llamador decide cuándo persistir
+y un fallo de la caché nunca deshace su trabajo pendiente.
+
+La caché no depende de facturas: resubir un archivo cuya factura se borró,
+re-parsear o scripts/repair_invoices.py reutilizan lo ya pagado.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+
+from app.db.models import OcrExtraccion
+from app.services.ocr import OCR_PARSER_VERSION, extract_data_from_pdf
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "reparseos": 0, "misses": 0, "guardados": 0, "errores_guardado": 0}
+
+
+def _contar(clave: str) -> None:
+    with _lock:
+        _stats[clave] += 1
+
+
+def _textos(fila: OcrExtraccion) -> Dict[str, Any]:
+    """Textos de motores de una fila en el formato de extract_data_from_pdf(textos=...)."""
+    textos: Dict[str, Any] = {"es_pdf": fila.es_pdf}
+    if fila.texto_pypdf is not None:
+        textos["pypdf"] = fila.texto_pypdf
+    if fila.texto_vision is not None:
+        textos["vision"] = fila.texto_vision
+    return textos
+
+
+def _buscar(db, file_hash: str) -> Optional[OcrExtraccion]:
+    """Fila de la versión actual o, si no hay, la más reciente del hash."""
+    filas = (
+        db.query(OcrExtraccion)
+        .filter(OcrExtraccion.file_hash == file_hash)
+        .order_by(OcrExtraccion.id.desc())
+        .all()
+    )
+    for fila in filas:
+        if fila.parser_version == OCR_PARSER_VERSION:
+            return fila
+    return filas[0] if filas else None
+
+
+def _guardar(db, file_hash: str, textos: Dict[str, Any], resultado: dict) -> None:
+    """
+    Persiste la extracción en un savepoint, sin commit: la fila se guarda con el
+    commit del llamador. Nunca tumba la subida ni deshace lo pendiente del llamador.
+    """
+    try:
+        with db.begin_nested():
+            db.add(OcrExtraccion(
+                file_hash=file_hash,
+                parser_version=OCR_PARSER_VERSION,
+                es_pdf=bool(textos.get("es_pdf")),
+                motor=textos["motor"],
+                texto_pypdf=textos.get("pypdf"),
+                texto_vision=textos.get("vision"),
+                resultado=json.dumps(resultado, ensure_ascii=False, default=str),
+            ))
+        _contar("guardados")
+    except IntegrityError:
+        # Otra petición guardó el mismo (hash, versión) a la vez
+        logger.info(f"[OCR-CACHE] Extracción {file_hash[:12]} ya guardada por otra petición")
+    except Exception as e:
+        _contar("errores_guardado")
+        logger.warning(f"[OCR-CACHE] No se pudo guardar la extracción {file_hash[:12]}: {e}")
+
+
+def _resolver(db, file_hash: str, file_bytes: Optional[bytes]) -> Optional[dict]:
+    fila = _buscar(db, file_hash)
+    if fila is not None and fila.parser_version == OCR_PARSER_VERSION:
+        try:
+            with db.begin_nested():
+                fila.hits = (fila.hits or 0) + 1
+                fila.last_hit_at = func.now()
+        except Exception as e:
+            logger.warning(f"[OCR-CACHE] No se pudo anotar el hit de {file_hash[:12]}: {e}")
+        _contar("hits")
+        logger.info(f"[OCR-CACHE] HIT {file_hash[:12]} (parser {OCR_PARSER_VERSION}, motor={fila.motor})")
+        return json.loads(fila.resultado)
+
+    if fila is None and file_bytes is None:
+        return None
+
+    if fila is not None:
+        textos = _textos(fila)
+        _contar("reparseos")
+        logger.info(f"[OCR-CACHE] Re-parseo {file_hash[:12]} con textos de parser {fila.parser_version}")
+    else:
+        textos = {}
+        _contar("misses")
+        logger.info(f"[OCR-CACHE] MISS {file_hash[:12]}: extracción completa")
+
+    resultado = extract_data_from_pdf(file_bytes, textos)
+    if textos.get("motor"):
+        _guardar(db, file_hash, textos, resultado)
+    return resultado
+
+
+def extraer_con_cache(db, file_bytes: bytes, file_hash: Optional[str] = None) -> dict:
+    """extract_data_from_pdf con la caché persistente (file_hash = sha256 del archivo)."""
+    file_hash = file_hash or hashlib.sha256(file_bytes).hexdigest()
+    return _resolver(db, file_hash, file_bytes)
+
+
+def extraer_desde_cache(db, file_hash: str) -> Optional[dict]:
+    """Resultado para la versión actual del parser sin el archivo (re-parseo de textos guardados), o None."""
+    return _resolver(db, file_hash, None)
+
+
+def ocr_cache_stats() -> Dict[str, Any]:
+    """Contadores del proceso para /debug/ocr/cache."""
+    with _lock:
+        total = _stats["hits"] + _stats["reparseos"] + _stats["misses"]
+        return {
+            **_stats,
+            "parser_version": OCR_PARSER_VERSION,
+            "hit_ratio": round(_stats["hits"] / total, 4) if total else 0.0,
+            "motores_evitados_ratio": round((_stats["hits"] + _stats["reparseos"]) / total, 4) if total else 0.0,
+        }
+
+
+def reiniciar_stats_ocr_cache() -> None:
+    with _lock:
+        for clave in _stats:
+            _stats[clave] = 0
@@ -0,0 +1,107 @@
+"""
+Clasificador de comercializadora para el parser OCR y estadísticas por proveedor.
+
+clasificar_comercializadora() mira dos huellas baratas sobre el InvoiceDocument:
+- CIF de la comercializadora (aparece en cabecera o pie, peso 3);
+- tokens de marca en la cabecera (primeras líneas, peso 1 por token), para no
+  confundir la comercializadora con la distribuidora que figura más abajo
+  (i-DE, UFD, e-distribución...).
+Si gana un único proveedor se usa su juego de estrategias de consumos
+(ocr._ESTRATEGIAS_PROVEEDOR); si no, la cascada genérica de siempre.
+
+Las estadísticas (facturas, aciertos del juego específico, fallback a la
+cascada y latencia del parseo) son por worker, como la caché de catálogo:
+GET /debug/ocr/comercializadoras.
+"""
+
+import threading
+from typing import Any, Dict, Optional
+
+from app.services.ocr_patrones import IDENTIFICACION
+
+# Líneas (split('\n')) que se consideran cabecera para los tokens de marca
+LINEAS_CABECERA = 20
+
+HUELLAS = {
+    "iberdrola": {
+        "cifs": ("A95758389", "A95554630"),  # Iberdrola Clientes, Curenergía (COR)
+        "tokens": ("iberdrola", "curenergía", "curenergia"),
+    },
+    "naturgy": {
+        "cifs": ("A08431090",),  # Naturgy Iberia
+        "tokens": ("naturgy", "comercializadora regulada", "gas & power"),
+    },
+    "endesa": {
+        "cifs": ("A81948077", "B82846825"),  # Endesa Energía, Energía XXI (COR)
+        "tokens": ("endesa", "energía xxi", "energia xxi"),
+    },
+    "hc_energia": {
+        "cifs": (),
+        "tokens": ("hc energía", "hc energia", "hcenergía", "hcenergia"),
+    },
+}
+
+_CIF_PROVEEDOR = {cif: proveedor for proveedor, huella in HUELLAS.items() for cif in huella["cifs"]}
+
+SIN_CLASIFICAR = "desconocida"
+
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def clasificar_comercializadora(doc) -> Optional[str]:
+    """Proveedor de la factura (clave de HUELLAS) o None si no hay un ganador claro."""
+    puntos = dict.fromkeys(HUELLAS, 0)
+
+    for match in IDENTIFICACION["cif"].finditer(doc.upper):
+        proveedor = _CIF_PROVEEDOR.get(match.group(1) + match.group(2))
+        if proveedor:
+            puntos[proveedor] += 3
+
+    offsets = doc.escaneo.offsets
+    cabecera = doc.lower[:offsets[LINEAS_CABECERA]] if len(offsets) > LINEAS_CABECERA else doc.lower
+    for proveedor, huella in HUELLAS.items():
+        puntos[proveedor] += sum(1 for token in huella["tokens"] if token in cabecera)
+
+    mejor = max(puntos.values())
+    if mejor == 0:
+        return None
+    ganadores = [proveedor for proveedor, p in puntos.items() if p == mejor]
+    return ganadores[0] if len(ganadores) == 1 else None
+
+
+def registrar_parseo(proveedor: Optional[str], ms: float, estrategia: Optional[str]) -> None:
+    """Suma una factura parseada: estrategia = 'especifica' | 'generica' (consumos por periodo)."""
+    clave = proveedor or SIN_CLASIFICAR
+    with _lock:
+        stats = _stats.get(clave)
+        if stats is None:
+            stats = _stats[clave] = {"facturas": 0, "especifica": 0, "fallback_generico": 0, "ms_total": 0.0, "ms_max": 0.0}
+        stats["facturas"] += 1
+        if estrategia == "especifica":
+            stats["especifica"] += 1
+        elif proveedor is not None:
+            stats["fallback_generico"] += 1
+        stats["ms_total"] += ms
+        stats["ms_max"] = max(stats["ms_max"], ms)
+
+
+def comercializadoras_stats() -> Dict[str, Any]:
+    """Contadores por proveedor para /debug/ocr/comercializadoras."""
+    with _lock:
+        return {
+            proveedor: {
+                "facturas": int(s["facturas"]),
+                "especifica": int(s["especifica"]),
+                "fallback_generico": int(s["fallback_generico"]),
+                "acierto_especifica": round(s["especifica"] / s["facturas"], 4) if s["facturas"] else 0.0,
+                "media_ms": round(s["ms_total"] / s["facturas"], 3) if s["facturas"] else 0.0,
+                "max_ms": round(s["ms_max"], 3),
+            }
+            for proveedor, s in _stats.items()
+        }
+
+
+def reiniciar_stats_comercializadoras() -> None:
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,146 @@
+"""
+Cola de subidas de facturas: el OCR (pypdf, pdf2image a 200 dpi, RPC de Vision)
+y los commits síncronos de SQLAlchemy salen del event loop.
+
+- encolar_job(): crea la fila en factura_jobs (en_cola) y manda la tarea al pool;
+  la ruta responde 202 con el job_id al instante.
+- _ejecutar_job(): corre en un hilo del pool con su propia sesión, marca
+  procesando y guarda el resultado (completado) o el status/detail que habría
+  devuelto /upload (error: 409 duplicada, 500...).
+- ejecutar_en_pool(): para rutas async que siguen respondiendo en la misma
+  petición (/upload): await sin bloquear el loop, con el mismo límite de hilos.
+  La tarea recibe una sesión abierta en el hilo del pool: la Session de la
+  petición no es thread-safe y no debe cruzar al pool.
+
+Concurrencia: UPLOAD_WORKERS hilos por proceso; dentro de la extracción,
+ocr.CONCURRENCIA_MOTOR limita pypdf y Vision por separado.
+El archivo solo vive en memoria del proceso que aceptó la subida: si el proceso
+muere, el job queda en en_cola/procesando y el frontend debe volver a subirlo.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.sql import func
+
+from app.db.conn import SessionLocal
+from app.db.models import FacturaJob
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+ESTADOS_FINALES = ("completado", "error")
+
+# Fábrica de sesiones de los hilos del pool (los tests la sustituyen)
+SESION_JOBS: Callable = SessionLocal
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS), thread_name_prefix="ocr-job")
+        return _pool
+
+
+def ejecutar_en_pool(tarea: Callable, *args) -> "asyncio.Future":
+    """Ejecuta tarea(db, *args) en el pool de subidas con su propia sesión; se puede await desde una ruta async."""
+    return asyncio.wrap_future(_executor().submit(_ejecutar_con_sesion, tarea, *args))
+
+
+def _ejecutar_con_sesion(tarea: Callable, *args) -> Any:
+    db = SESION_JOBS()
+    try:
+        return tarea(db, *args)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def encolar_job(db, filename: str, file_hash: Optional[str], user_id: Optional[int], tarea: Callable) -> FacturaJob:
+    """Registra el job y lo manda al pool. tarea(db) -> dict (respuesta de /upload)."""
+    job = FacturaJob(id=uuid.uuid4().hex, estado="en_cola", filename=filename, file_hash=file_hash, user_id=user_id)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _executor().submit(_ejecutar_job, job.id, tarea)
+    logger.info(f"[OCR-JOBS] Job {job.id} en cola ({filename})")
+    return job
+
+
+def _ejecutar_job(job_id: str, tarea: Callable) -> None:
+    db = SESION_JOBS()
+    try:
+        job = db.get(FacturaJob, job_id)
+        job.estado = "procesando"
+        job.started_at = func.now()
+        db.commit()
+
+        try:
+            resultado = tarea(db)
+        except Exception as e:
+            db.rollback()
+            # HTTPException conserva el contrato de /upload (409 con detail de duplicado)
+            status = getattr(e, "status_code", None)
+            detail = getattr(e, "detail", None)
+            if status is None:
+                logger.error(f"[OCR-JOBS] Job {job_id} falló: {e}\n{traceback.format_exc()}")
+                status, detail = 500, str(e)
+            job = db.get(FacturaJob, job_id)
+            job.estado = "error"
+            job.error_status = status
+            job.error = json.dumps(detail, ensure_ascii=False, default=str)
+        else:
+            job = db.get(FacturaJob, job_id)
+            job.estado = "completado"
+            job.factura_id = resultado.get("id")
+            job.resultado = json.dumps(resultado, ensure_ascii=False, default=str)
+        job.finished_at = func.now()
+        db.commit()
+        logger.info(f"[OCR-JOBS] Job {job_id} {job.estado}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[OCR-JOBS] No se pudo actualizar el job {job_id}: {e}")
+    finally:
+        db.close()
+
+
+def estado_job(job: FacturaJob) -> Dict[str, Any]:
+    """Respuesta de GET /webhook/upload/jobs/{id}."""
+    data: Dict[str, Any] = {
+        "job_id": job.id,
+        "estado": job.estado,
+        "filename": job.filename,
+        "factura_id": job.factura_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.estado == "completado" and job.resultado:
+        data["resultado"] = json.loads(job.resultado)
+    if job.estado == "error":
+        data["error"] = {"status_code": job.error_status, "detail": json.loads(job.error) if job.error else None}
+    return data
+
+
+def leer_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """estado_job() con una sesión propia (stream SSE, que sobrevive a la petición)."""
+    db = SESION_JOBS()
+    try:
+        job = db.get(FacturaJob, job_id)
+        return estado_job(job) if job is not None else None
+    finally:
+        db.close()
@@ -0,0 +1,389 @@
+"""
+Registro de patrones del parser OCR (precompilados) y escáner de líneas.
+
+Todos los regex de parse_invoice_text y sus helpers viven aquí, compilados una
+vez al importar y agrupados por campo: CUPS, ATR, POTENCIAS, CONSUMOS, FECHAS,
+TOTALES, IDENTIFICACION (titular, dirección, contacto) y TEXTO (normalización).
+Los patrones son literalmente los que usaba ocr.py (mismos flags), así que los
+campos extraídos no cambian; lo que cambia es que ya no se pasa por la caché
+de `re` en cada llamada (~5.000 búsquedas por factura en las tablas de consumo).
+
+escanear_lineas() recorre el texto normalizado UNA vez y reparte cada línea a
+los extractores que trabajan por líneas (días facturados, líneas de consumo,
+líneas de tabla con kWh, "P2: 18", códigos postales), en lugar de que cada uno
+vuelva a hacer splitlines + lower sobre el texto completo.
+"""
+
+from dataclasses import dataclass, field
+import re
+from typing import Dict, List, Optional, Pattern, Tuple
+
+_I = re.IGNORECASE
+
+MESES = "enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre"
+
+# Alias de periodo en tablas de consumo (P1 = Punta, P2 = Llano, P3 = Valle)
+ALIAS_PERIODO = {
+    1: ["p1", "punta"],
+    2: ["p2", "llano"],
+    3: ["p3", "valle"],
+    4: ["p4"],
+    5: ["p5"],
+    6: ["p6"],
+}
+
+# --- Normalización de texto y números ---
+TEXTO = {
+    "espacios": re.compile(r"[ \t]+"),
+    "no_numerico": re.compile(r"[^\d,.\-]"),
+    "fragmento_fecha": re.compile(r'(\d)\s*[\n\r]\s*(\d+[\/\-\.](\d+))'),
+    "fragmento_numero": re.compile(r'(\d)\s*[\n\r]\s*(\d)'),
+    "numero_espaciado": re.compile(r'(\d)\s+(\d[\d\.,]*(?:\s+kWh|\s+€|\s+EUR|\s*x\s|\s*/\s))', _I),
+    "numero": re.compile(r"([\d.,]+)"),
+    "digito": re.compile(r"\d"),
+    "blancos": re.compile(r"\s+"),
+    "blancos_dobles": re.compile(r"\s{2,}"),
+}
+
+# --- CUPS ---
+CUPS = {
+    # ES + 16 dígitos + 2 letras, admite espacios/guiones entre grupos
+    "estricto": re.compile(r"ES[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*(\d{4})[\s\-]*([A-Z]{2})", _I),
+    "fallback": re.compile(r"(ES[ \t0-9A-Z\-]{18,28})", _I),
+    "separadores": re.compile(r"[\s\-]"),
+    "limpio": re.compile(r"ES[0-9A-Z]{18,22}"),
+}
+
+# --- ATR ---
+ATR = {
+    "2_0td": re.compile(r"2\s*[.,]?\s*[0O]\s*TD"),
+    "3_0td": re.compile(r"3\s*[.,]?\s*[0O]\s*TD"),
+    "tarifa": re.compile(r"(?:tarifa|acceso|peaje)\s*[:\-]?\s*([236]\s*\.\s*[0O]\s*TD?)", _I),
+    "peaje": re.compile(r"PEAJE[\s\S]{0,100}?([236]\.?[0O]\s*TD)", _I),
+    "multilinea": re.compile(r"([236])\s*\.\s*[0O][\s\n]{0,20}TD", _I),
+}
+
+# --- Potencias contratadas ---
+_KW = r"\s*(?:kw|k\s*w|kilovatio)(?!\s*h)"
+POTENCIAS = {
+    # (source, patrón) en orden de prioridad
+    "p1": [
+        ("table", re.compile(r"P1\s+P2\s+P3\s+P4\s+P5\s+P6\s+([\d.,]+)\s+([\d.,]+)", _I)),
+        ("contratada_p1", re.compile(r"potencia\s+contratada[^0-9]*?p1\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("punta", re.compile(r"potencia\s+(?:contratada\s+)?en\s+punta\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("punta", re.compile(r"p1\s+\(punta\)\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("punta", re.compile(r"punta\s+\(potencia\)\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("p1", re.compile(r"potencia\s+(?:contratada\s+)?(?:en\s+)?p1\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("p1_direct", re.compile(r"\bp1\s*[:\-]?\s*([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)", _I)),
+        ("grid", re.compile(r"potencia\s*\(kw\)[^0-9]{0,20}([\d.,]+)", _I)),
+        ("punta", re.compile(r"\bpunta\b[^0-9]{0,20}([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)", _I)),
+    ],
+    "p2": [
+        ("contratada_p2", re.compile(r"potencia\s+contratada[^0-9]*?p2\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("valle", re.compile(r"potencia\s+(?:contratada\s+)?en\s+valle\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("valle", re.compile(r"p2\s+\(valle\)\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("valle", re.compile(r"valle\s+\(potencia\)\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("p2", re.compile(r"potencia\s+(?:contratada\s+)?(?:en\s+)?p2\s*[:\-]?\s*([\d.,]+)" + _KW, _I)),
+        ("p2_direct", re.compile(r"\bp2\s*[:\-]?\s*([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)", _I)),
+        ("valle", re.compile(r"\bvalle\b[^0-9]{0,20}([\d.,]+)\s*(?:kw|kilovatio)(?!\s*h)", _I)),
+    ],
+    "generica": re.compile(r"potencia\s+contratada[^0-9]{0,20}([\d.,]+)\s*k?w", _I),
+    # Último recurso en parse_invoice_text si las anteriores no encuentran nada
+    "p1_fallback": [
+        re.compile(r"potencia\s*p1[^0-9]{0,10}([\d.,]+)\s*k?w", _I),
+        re.compile(r"potencia\s+punta[^0-9]{0,10}([\d.,]+)\s*k?w", _I),
+    ],
+    "p2_fallback": [
+        re.compile(r"potencia\s*p2[^0-9]{0,10}([\d.,]+)\s*k?w", _I),
+        re.compile(r"potencia\s+valle[^0-9]{0,10}([\d.,]+)\s*k?w", _I),
+    ],
+}
+
+
+def _tabla_linea(alias: str, p_num: int) -> List[Optional[Pattern]]:
+    """Patrones 1-4 de la estrategia 0A de _extract_table_consumos (sobre la línea en minúsculas)."""
+    return [
+        re.compile(rf"(?:consumo|lectora?)\s+(?:{alias}|p{p_num})\s*[:\-]?\s*([\d.,]+)"),
+        re.compile(rf"(?:{alias})\s*[:\-]?\s*[\d.,]+\s+.*?(?:consumo)\s*[:\-]?\s*([\d.,]+)"),
+        re.compile(r"consumo\s*[:\-]?\s*([\d.,]+)(?:\s*kWh)?"),  # solo si el alias está en la línea
+        re.compile(rf"\b(?:{alias}|p{p_num})\s*[:\-]?\s*([\d.,]+)\s*(?:kWh)?") if len(alias) <= 6 else None,
+    ]
+
+
+def _tabla_seccion(alias: str) -> List[Pattern]:
+    """Patrones de la estrategia 1 (líneas tras una cabecera de sección de consumos)."""
+    return [
+        re.compile(rf"(?i){alias}\s*\([^)]*\)\s*[:\-]?\s*([\d.,]+)"),       # "P1 (PUNTA): 0"
+        re.compile(rf"(?i){alias}\s+[\-:]*\s*([\d.,]+)\s*(?:kwh|kWh)?"),    # "P1: 0 kWh" o "punta 59"
+        re.compile(rf"(?i){alias}\s+.*?:\s*([\d.,]+)\s*(?:kwh|kWh)?"),      # "P1 PUNTA: 123"
+        re.compile(rf"(?i){alias}\s*[,;]?\s*([\d.,]+)(?:\s|$)"),             # "P1, 123" o "P1 123"
+    ]
+
+
+def _consumo_periodo(nombre: str, etiqueta: str) -> List[Pattern]:
+    """Patrones por prioridad para P1-P3 (nombre = punta/llano/valle) sobre las líneas de consumo."""
+    if nombre == "punta":
+        frase = r"(?i)consumos\s+desagregados\s+han\s+sido\s+punta[:\s]+([\d.,]+)\s*kwh"
+    else:
+        frase = rf"(?i)consumos\s+desagregados\s+han\s+sido.*?{nombre}[:\s]+([\d.,]+)\s*kwh"
+    return [re.compile(p, _I) for p in (
+        frase,
+        rf"(?i)consumos\s+desagregados.*?{nombre}[:\s]+([\d.,]+)",
+        rf"(?i)consumo\s+{nombre}[\s\S]{{0,50}}?([\d.,]+)",
+        rf"(?i)consumo\s+(?:de\s+)?(?:energía\s+)?.*?\b{etiqueta}\b[\s\S]{{0,100}}?([\d.,]+)\s*(?:kwh)?",
+        rf"(?i)\b{etiqueta}\b[\s\S]{{0,100}}?([\d.,]+)\s*(?:kwh)?",
+        rf"(?i)(?:consumo\s+)?{nombre}\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?",
+        rf"(?i)\b{nombre}\b[\s\S]{{0,100}}?([\d.,]+)\s*(?:kwh)?",
+        rf"\b{etiqueta}\b\s+([\d.,]+)(?:\s|$)",
+    )]
+
+
+# --- Consumos (total y por periodo) ---
+CONSUMOS = {
+    # _extract_consumo_safe: A (frase Naturgy/regulada), B (kWh × €/kWh), C (total genérico)
+    "seguro_a": re.compile(r"su\s+consumo\s+en\s+(?:el\s+)?periodo\s+(?:facturado\s+)?ha\s+sido\s+([\d.,\s]+)\s*(?:kw)?h", _I),
+    "seguro_b": re.compile(r"([\d.,\s]+)\s*(?:kw)?h\s*x\s*[\d.,]+\s*[€€]\s*/\s*(?:kw)?h", _I),
+    "seguro_c": re.compile(r"(?:consumo\s+total|total\s+consumo|consumo\s+(?:facturado|del\s+periodo))[^0-9\n]{0,50}([\d.,\s]+)\s*(?:kw)?h", _I),
+    "total": re.compile(r"(?i)(?:consumo\s+total|total\s+consumo|consumo\s+(?:facturado|del\s+periodo))[^0-9\n]{0,50}([\d.,]+)\s*kwh"),
+    "total_hc": re.compile(r"\(\d{2}\.\d{2}\.\d{4}\s*-\s*\d{2}\.\d{2}\.\d{4}\)\s*([\d.,]+)\s*kWh\s*x\s*[\d.,]+\s*€/kWh"),
+    # Filtros de línea del escáner
+    "linea_periodo": re.compile(r"\b(p[1-6]|punta|llano|valle)\b"),
+    "linea_kwh": re.compile(r"\b(?:kwh|kWh)\b", _I),
+    "linea_tabla": re.compile(r"\bP[1-6]\b|punta|llano|valle", _I),
+    "linea_kw": re.compile(r"\bkw\b"),
+    "linea_p": re.compile(r"^p\s*([1-6])\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?\b", _I),
+    "linea_p_espacio": re.compile(r"^p\s*([1-6])\s+([\d.,]+)\s*(?:kwh)?\b", _I),
+    # _extract_table_consumos
+    "tabla_linea": {
+        (p_num, alias): _tabla_linea(alias, p_num)
+        for p_num, aliases in ALIAS_PERIODO.items() for alias in aliases
+    },
+    "tabla_seccion": {alias: _tabla_seccion(alias) for aliases in ALIAS_PERIODO.values() for alias in aliases},
+    "cabecera_seccion": re.compile(
+        r"(consumo|detalle|dato|información).*?(factura|consumo|desagregad|período|detalle|energía)", _I
+    ),
+    "desagregado": {
+        1: re.compile(r"(?:punta|p1)\s*[:\-]?\s*([\d.,]+)"),
+        2: re.compile(r"(?:llano|p2)\s*[:\-]?\s*([\d.,]+)"),
+        3: re.compile(r"(?:valle|p3)\s*[:\-]?\s*([\d.,]+)"),
+    },
+    "linea_p_suelta": re.compile(r"^P(\d)\s*(?:\([^)]*\))?\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?$", _I),
+    # Regex tradicionales por periodo (sobre las líneas de consumo)
+    "periodo": {
+        "p1": _consumo_periodo("punta", "P1"),
+        "p2": _consumo_periodo("llano", "P2"),
+        "p3": _consumo_periodo("valle", "P3"),
+        "p4": [re.compile(r"(?i)consumo.*?P4.*?[:\-]?\s*([\d.,]+)", _I), re.compile(r"(?i)\bP4\b\s+([\d.,]+)", _I)],
+        "p5": [re.compile(r"(?i)consumo.*?P5.*?[:\-]?\s*([\d.,]+)", _I), re.compile(r"(?i)\bP5\b\s+([\d.,]+)", _I)],
+        "p6": [re.compile(r"(?i)consumo.*?P6.*?[:\-]?\s*([\d.,]+)", _I), re.compile(r"(?i)\bP6\b\s+([\d.,]+)", _I)],
+    },
+    # Estrategia 3.5: PUNTA/LLANO/VALLE sin etiqueta P[1-6], sobre el texto completo
+    "nombre_periodo": {
+        nombre: re.compile(rf"(?i)(?:consumo\s+)?{nombre}\s*[:\-]?\s*([\d.,]+)\s*(?:kwh)?")
+        for nombre in ("punta", "llano", "valle")
+    },
+}
+
+# --- Fechas y días facturados ---
+FECHAS = {
+    "numerica": re.compile(r"(\d{1,2})[.\/-](\d{1,2})[.\/-](\d{2,4})"),
+    "texto": re.compile(rf"(\d{{1,2}})\s+de\s+({MESES})\s+de\s+(\d{{2,4}})"),
+    # "05 de agosto de 2025 - 01 de septiembre de 2025" (HC Energía), va PRIMERO
+    "rango_hc": re.compile(
+        r'(\d{1,2}\s+de\s+(' + MESES + r')\s+de\s+\d{4})\s*-\s*(\d{1,2}\s+de\s+(' + MESES + r')\s+de\s+\d{4})', _I
+    ),
+    "rango_meses": re.compile(
+        rf"(\d{{1,2}}[\s\w]{{1,8}}(?:{MESES})[\s\w]{{1,8}}\d{{4}})[\s\S]{{0,100}}?\b(?:a|al|hasta)\b[\s\S]{{0,100}}?(\d{{1,2}}[\s\w]{{1,8}}(?:{MESES})[\s\w]{{1,8}}\d{{4}})",
+        _I,
+    ),
+    "rango_numerico": re.compile(
+        r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})[\s\S]{0,80}?(?:-|al|a|hasta)[\s\S]{0,80}?(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})", _I
+    ),
+    "periodo_consumo": re.compile(
+        rf"(?:periodo|período)\s+(?:de\s+)?consumo\s*[:\-]?\s*(\d{{1,2}}[\s\w]{{0,8}}(?:{MESES})[\w\s]{{0,20}})[\s\S]{{0,100}}?(?:a|al|hasta)\s+(\d{{1,2}}[\s\w]{{0,8}}(?:{MESES})[\w\s]{{0,30}})",
+        _I,
+    ),
+    "del_al": re.compile(
+        rf"del\s+(\d{{1,2}})\s+de\s+({MESES})\s+al\s+(\d{{1,2}})\s+de\s+({MESES})(?:\s+de\s+(\d{{4}}))?", _I
+    ),
+    "dias_linea": re.compile(r"(?:d[íi]as[\s:]*(\d+)|(\d+)\s*d[íi]as)"),
+    "dias_periodo": re.compile(r"(?i)per[íi]odo[\s\S]{0,100}?(\d{1,2})\s+(?:d[íi]as|days)"),
+    "fecha": re.compile(r"(\d{4}[/-]\d{2}[/-]\d{2}|\d{2}[/-]\d{2}[/-]\d{4})"),
+}
+
+# --- Importes (total factura e impuestos/servicios) ---
+TOTALES = {
+    "total_a_pagar": re.compile(r"TOTAL[\s\S]{0,50}?A[\s\S]{0,50}?PAGAR[\s\S]{0,50}?([\d.,]+)\s*(?:€|EUR)", _I),
+    "total_factura": re.compile(r"(?:TOTAL\s+IMPORTE\s+FACTURA|TOTAL\s+FACTURA)[^0-9\n]{0,20}([\d.,]+)\s*(?:€|EUR)", _I),
+    "importe_factura": re.compile(r"IMPORTE\s+FACTURA[:\s]*[\r\n\s]*([\d.,]+)", _I),
+    "total": re.compile(r"TOTAL.*?\s+(\d+[.,]?\d*)\s*(?:€|EUR)", _I),
+    "euros": re.compile(r"(\d+[.,]?\d*)\s*(?:€|EUR)", _I),
+    "bono_social": re.compile(r"\bbono\s+social\b", _I),
+    "servicios_vinculados": re.compile(r"\bservicios\s+vinculados\b", _I),
+    "alquiler_contador": [
+        re.compile(r"SERVICIOS\s+Y\s+OTROS\s+CONCEPTOS[^\d]+([\d.,]+)\s*€", _I),  # Iberdrola - PRIMERO
+        re.compile(r"alquiler\s+(?:de\s+)?(?:equipos|contador|medida)[^0-9]{0,20}([\d.,]+)", _I),
+        re.compile(r"equipos\s+de\s+medida[^0-9]{0,20}([\d.,]+)", _I),
+        re.compile(r"contador\s+alquiler[^0-9]{0,10}([\d.,]+)", _I),
+    ],
+    "impuesto_electrico": [
+        re.compile(r"impuesto\s+(?:sobre\s+la\s+)?electricidad[^0-9]{0,40}([\d.,]+)", _I),
+        re.compile(r"impuesto\s+(?:eléctrico|el[eé]ctrico)[^0-9]{0,40}([\d.,]+)", _I),
+        re.compile(r"(?:IEE|impuesto\s+sobre\s+electricidad)[^0-9]{0,40}([\d.,]+)", _I),
+        re.compile(r"impuesto\s+.*?\b([\d.,]+)\s*€\s*$", _I),
+    ],
+    "iva": [re.compile(r"\biva\b[^0-9]{0,10}([\d.,]+)", _I)],
+}
+
+# --- Titular, dirección, localidad y contacto ---
+IDENTIFICACION = {
+    "numero_factura": re.compile(
+        r"(?:n[º°].?|num\.?|numero|número)\s*(?:de)?\s*factura\s*[:\-]?\s*([A-Z0-9\-\/]{3,30})", _I
+    ),
+    "numero_factura_simple": re.compile(r"factura\s*[:]\s*([A-Z0-9\-\/]{3,30})", _I),
+    "letra": re.compile(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]"),
+    "inicio_direccion": re.compile(r'^(Calle|C/|AV|Paseo|Plaza|\d)'),
+    "ordinal": re.compile(r'[Ss]ª|[0-9]º$'),
+    "titular": re.compile(
+        r"(?:titular|nombre\s+del\s+titular|cliente|nombre\s+y\s+apellidos)[:\s]+([A-ZÁÉÍÓÚÜÑ][A-Za-zÁÉÍÓÚÜÑáéíóúüñ ,.'´`\-]{10,80})",
+        _I,
+    ),
+    "titular_excluido": re.compile(r"\b(potencia|direccion|contrato|plan|datos|del|de|www)\b", _I),
+    "dni": re.compile(r"(?:dni|cif|nif)?\s*[:\-]?\s*([0-9]{8}[A-Z])", _I),
+    "direccion_suministro": re.compile(r'direcci[oó]n\s+(?:de\s+)?suministro'),
+    "direccion_misma_linea": re.compile(r'direcci[oó]n[^:]*:\s*(.+)$', _I),
+    "calle_mayusculas": re.compile(r'^[A-ZÁÉÍÓÚÜÑ]{3,}$'),
+    "numero_portal": re.compile(r'^(\d{1,4})\s'),
+    "direccion_basura": re.compile(r'Plan\s+A\s+Tu\s+Medida|Contratado|Mercantil|Tarifa\s+One|mercado\s+libre', _I),
+    "codigo_postal_final": re.compile(r'\s+\d{5}.*$'),
+    "solo_numero": re.compile(r'^\d{1,3}\s*$'),
+    "calle_previa": re.compile(r'^[A-ZÁÉÍÓÚ]{3,}$'),
+    "no_direccion": re.compile(r'N\\.?º|Fecha|Contrato|Tipo|factura', _I),
+    "direccion": re.compile(r'^direcci[oó]n\s*:'),
+    "direccion_valor": re.compile(r'direcci[oó]n\s*:\s*(.+)$', _I),
+    "direccion_tras_titular": re.compile(
+        r'^(C/|AV|CALLE|PASEO|PLAZA|[A-ZÁÉÍÓÚ]+ [A-ZÁÉÍÓÚ]+.*\d|[A-ZÁÉÍÓÚ].*\d{1,4})', _I
+    ),
+    "cp_localidad": re.compile(r'(\d{5}\s+[A-ZÁÉÍÓÚÜÑa-záéíóúüñ][^\n]{2,40})'),
+    "provincia_linea": re.compile(r'^[A-ZÁÉÍÓÚÜÑa-záéíóúüñ]{5,15}$'),
+    "localidad": [
+        re.compile(
+            r"(\d{5}\s+[A-ZÁÉÍÓÚÜÑ][A-Za-zÁÉÍÓÚÜÑáéíóúüñ\s]{3,40}(?:ALMERIA|ALMERÍA|GRANADA|MADRID|BARCELONA))",
+            _I | re.MULTILINE,
+        ),
+        re.compile(r"\n\s*(\d{5}\s+[A-Za-zÁÉÍÓÚÜÑáéíóúüñ][^\n]{5,50})\s*$", _I | re.MULTILINE),
+    ],
+    "telefono": re.compile(r"(?:tel(?:efono)?|phone)?[^\d]{0,12}(\b[6789]\d{2}[.\s\-]?\d{3}[.\s\-]?\d{3}\b)", _I),
+    "separadores_telefono": re.compile(r"[.\s\-]"),
+    "codigo_postal": re.compile(r'\d{4,5}'),
+    # CIF de persona jurídica (letra + 8 dígitos), tolera "A-95758389" / "A 95758389"
+    "cif": re.compile(r"\b([ABG])[\s\-.]?(\d{8})\b"),
+}
+
+# Palabras clave indexadas por InvoiceDocument (posiciones en la vista en minúsculas)
+PALABRAS_CLAVE = (
+    "p1", "p2", "p3", "p4", "p5", "p6", "punta", "llano", "valle",
+    "consumo", "kwh", "€", "pagar", "factura", "direcci",
+)
+
+# Caracteres que IGNORECASE empareja con una letra ASCII pero lower() no convierte en ella
+# ('ı' e 'İ' con i, 'ſ' con s, el signo Kelvin con k): la vista plegada los lleva a la
+# letra ASCII, así que "palabra ausente en la vista" implica "ningún patrón que la exija casa"
+PLEGADO = str.maketrans({"ı": "i", "İ": "i", "ſ": "s", "\u212a": "k"})
+
+REGISTRO = {
+    "texto": TEXTO,
+    "cups": CUPS,
+    "atr": ATR,
+    "potencias": POTENCIAS,
+    "consumos": CONSUMOS,
+    "fechas": FECHAS,
+    "totales": TOTALES,
+    "identificacion": IDENTIFICACION,
+}
+
+# Líneas con estas palabras no se usan para consumos por periodo (lecturas, históricos)
+_CONSUMO_EXCLUIDAS = ["acumulada", "actual", "anterior", "último año", "año anterior"]
+
+
+@dataclass(slots=True, eq=False)
+class LineasFactura:
+    """Resultado del recorrido único de escanear_lineas(), por extractor."""
+    lineas: List[str] = field(default_factory=list)          # split('\n') tal cual (tablas de consumo)
+    offsets: List[int] = field(default_factory=list)         # posición de inicio de cada línea en el texto
+    lineas_lower: List[str] = field(default_factory=list)
+    no_vacias: List[str] = field(default_factory=list)       # splitlines(), strip, sin vacías (titular, dirección)
+    consumo: List[str] = field(default_factory=list)         # mencionan consumo o un periodo (sin históricos)
+    tabla_kwh: List[str] = field(default_factory=list)       # periodo + kWh en la misma línea
+    periodo_suelto: List[Tuple[int, str]] = field(default_factory=list)  # "P2: 18" → (2, "18")
+    con_codigo_postal: List[str] = field(default_factory=list)
+    dias: Optional[int] = None                               # primer "30 días" / "días: 30" en rango 1-120
+
+
+def _dias_en_linea(low: str) -> Optional[int]:
+    m = FECHAS["dias_linea"].search(low)
+    if not m:
+        return None
+    val_int = int(m.group(1) or m.group(2))
+    return val_int if 1 <= val_int <= 120 else None
+
+
+def escanear_lineas(texto: str) -> LineasFactura:
+    """
+    Recorre el texto normalizado una sola vez y reparte cada línea a sus extractores.
+
+    Las líneas "crudas" son las de split('\\n') (las usan las tablas de consumo y
+    la provincia); dentro de cada una, splitlines() da las mismas líneas no vacías
+    que splitlines() sobre el texto completo (\\r, \\x0c, ... también cortan).
+    """
+    escaneo = LineasFactura()
+    linea_periodo = CONSUMOS["linea_periodo"]
+    linea_kwh = CONSUMOS["linea_kwh"]
+    linea_tabla = CONSUMOS["linea_tabla"]
+    codigo_postal = IDENTIFICACION["codigo_postal"]
+
+    inicio = 0
+    for linea in texto.split("\n"):
+        escaneo.lineas.append(linea)
+        escaneo.offsets.append(inicio)
+        inicio += len(linea) + 1
+        escaneo.lineas_lower.append(linea.lower())
+        if codigo_postal.search(linea):
+            escaneo.con_codigo_postal.append(linea)
+
+        for trozo in linea.splitlines():
+            clean = trozo.strip()
+            if not clean:
+                continue
+            low = clean.lower()
+            escaneo.no_vacias.append(clean)
+
+            if escaneo.dias is None:
+                escaneo.dias = _dias_en_linea(low)
+
+            if ("consumo" in low or linea_periodo.search(low)) and not any(bad in low for bad in _CONSUMO_EXCLUIDAS):
+                escaneo.consumo.append(clean)
+
+            if linea_kwh.search(clean) and linea_tabla.search(clean):
+                escaneo.tabla_kwh.append(clean)
+
+            if low[0] == "p" and "potencia" not in low and not CONSUMOS["linea_kw"].search(low):
+                m = CONSUMOS["linea_p"].match(low) or CONSUMOS["linea_p_espacio"].match(low)
+                if m:
+                    escaneo.periodo_suelto.append((int(m.group(1)), m.group(2)))
+
+    return escaneo
+
+
+def patrones_registrados() -> Dict[str, int]:
+    """Número de patrones compilados por grupo."""
+    def _contar(valor) -> int:
+        if isinstance(valor, re.Pattern):
+            return 1
+        if isinstance(valor, dict):
+            return sum(_contar(v) for v in valor.values())
+        if isinstance(valor, (list, tuple)):
+            return sum(_contar(v) for v in valor)
+        return 0
+
+    return {grupo: _contar(patrones) for grupo, patrones in REGISTRO.items()}
@@ -0,0 +1,250 @@
+"""
+Optimizador de potencia contratada (2.0TD).
+
+El comparador valora todas las ofertas con la potencia contratada de la factura,
+así que nunca muestra el ahorro de ajustarla. Aquí se busca, para cada versión
+del catálogo, la pareja de potencias (P1, P2) que minimiza el total con SUS
+precios de potencia: todas las versiones × todas las parejas candidatas en una
+sola multiplicación de matrices, y los totales finales con el mismo motor
+vectorizado (fórmula PO) que el comparador.
+
+Potencia facturada por periodo:
+- Con lectura de maxímetro: regla de REGLAS_MAXIMETRO para el ATR. Por defecto
+  la banda del RD 1164/2001 (art. 9.1.1, término de potencia con maxímetro):
+  lectura entre el 85 % y el 105 % de la contratada → se factura la lectura;
+  por debajo del 85 % → el 85 % de la contratada; por encima del 105 % →
+  lectura + 2 × (lectura − 105 % de la contratada). La Circular CNMC 3/2020
+  no la mantiene para 2.0TD, por eso es configurable por ATR
+  (MAXIMETRO_REGLA_2_0TD="inferior,superior,recargo"; "0,100,0" = se factura
+  la lectura tal cual).
+- Sin maxímetro (control por ICP): se factura la contratada y no se propone
+  bajar de la actual, porque sin lecturas no se sabe si el ICP saltaría.
+
+Candidatas: escalones normalizados de ICP (monofásicos 230 V o trifásicos 400 V
+según la potencia actual) más la potencia actual, P1 y P2 independientes: la
+regla P1 <= P2 <= ... <= P6 es de 3.0TD/6.xTD y 2.0TD admite P1 > P2.
+"""
+
+from datetime import date
+import logging
+import os
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.exceptions import DomainError
+from app.services.catalogo_tarifas import get_catalogo
+from app.services.comparador import _preparar_entrada, _sin_tarifas_vigentes, _to_float
+from app.services.comparador_core import (
+    FacturaComparable,
+    calcular_baseline,
+    componer_resultado,
+    referencia_ahorro,
+)
+from app.services.motor_vectorizado import calcular_ofertas_vectorizado
+from app.services.historico_consumo import anotar_anualizacion
+
+logger = logging.getLogger(__name__)
+
+# Escalones normalizados de ICP hasta 15 kW: 230 V × In (5-63 A) y √3 × 400 V × In (5-20 A)
+ESCALONES_MONOFASICO = (1.15, 1.725, 2.3, 3.45, 4.6, 5.75, 6.9, 8.05, 9.2, 10.35, 11.5, 14.49)
+ESCALONES_TRIFASICO = (3.464, 5.196, 6.928, 10.392, 13.856)
+
+
+def _regla_maximetro(variable: str, defecto: str) -> Tuple[float, float, float]:
+    inferior, superior, recargo = (float(v) for v in os.getenv(variable, defecto).split(","))
+    return inferior, superior, recargo
+
+
+# (banda inferior, banda superior, recargo por exceso) de la potencia facturada por ATR
+REGLAS_MAXIMETRO: Dict[str, Tuple[float, float, float]] = {
+    "2.0TD": _regla_maximetro("MAXIMETRO_REGLA_2_0TD", "0.85,1.05,2.0"),
+}
+
+_TOLERANCIA_KW = 0.01
+
+
+def escalones_potencia(potencias_actuales: Sequence[float]) -> Tuple[float, ...]:
+    """Trifásicos si todas las potencias actuales son escalones trifásicos; si no, monofásicos."""
+    positivas = [p for p in potencias_actuales if p and p > 0]
+    if positivas and all(
+        any(abs(p - e) < _TOLERANCIA_KW for e in ESCALONES_TRIFASICO) for p in positivas
+    ):
+        return ESCALONES_TRIFASICO
+    return ESCALONES_MONOFASICO
+
+
+def potencia_facturada(
+    contratada: np.ndarray,
+    maximetro: Optional[float],
+    atr: str = "2.0TD",
+) -> np.ndarray:
+    """kW facturados por periodo para cada potencia contratada (regla del maxímetro del ATR)."""
+    contratada = np.asarray(contratada, dtype=np.float64)
+    if maximetro is None:
+        return contratada
+    if atr not in REGLAS_MAXIMETRO:
+        raise DomainError("POTENCIA_SIN_REGLA_MAXIMETRO", f"No hay regla de maxímetro configurada para {atr}")
+    banda_inferior, banda_superior, recargo_exceso = REGLAS_MAXIMETRO[atr]
+    limite_superior = banda_superior * contratada
+    return np.where(
+        maximetro > limite_superior,
+        maximetro + recargo_exceso * (maximetro - limite_superior),
+        np.maximum(maximetro, banda_inferior * contratada),
+    )
+
+
+def _candidatas(escalones: Sequence[float], actual: float, maximetro: Optional[float]) -> np.ndarray:
+    valores = np.unique(np.append(np.asarray(escalones, dtype=np.float64), actual))
+    if maximetro is None:
+        valores = valores[valores >= actual - 1e-9]
+    return valores
+
+
+def _parejas(
+    potencias: Sequence[float],
+    maximetro: Sequence[Optional[float]],
+    escalones: Sequence[float],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parejas (P1, P2) candidatas (producto completo, 2.0TD no exige P1 <= P2)
+    como dos vectores alineados, de mayor a menor potencia: a igualdad de coste,
+    argmin se queda con la de más margen.
+    """
+    c1 = _candidatas(escalones, potencias[0], maximetro[0])
+    c2 = _candidatas(escalones, potencias[1], maximetro[1])
+    p1, p2 = (m.ravel() for m in np.meshgrid(c1, c2, indexing="ij"))
+    orden = np.lexsort((-p1, -p2))
+    return p1[orden], p2[orden]
+
+
+def optimizar_potencia(
+    entrada: FacturaComparable,
+    catalogo,
+    maximetro: Optional[Sequence[Optional[float]]] = None,
+    top_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Potencia contratada que minimiza el total de cada oferta del catálogo (2.0TD).
+
+    maximetro: lecturas (P1, P2) en kW del periodo facturado; None o un periodo
+    a None = ese periodo sin maxímetro. Función pura: misma respuesta que el
+    comparador (baseline PO) con la recomendación por oferta en "offers",
+    ordenadas por total con la potencia óptima (completas antes que parciales).
+    """
+    maximetro = list(maximetro or (None, None))
+    periodo_dias = entrada.periodo_dias
+    potencias = [float(p) for p in entrada.potencias[:2]]
+    escalones = escalones_potencia(potencias)
+    p1, p2 = _parejas(potencias, maximetro, escalones)
+    f1 = potencia_facturada(p1, maximetro[0], entrada.atr)
+    f2 = potencia_facturada(p2, maximetro[1], entrada.atr)
+
+    baseline = calcular_baseline(entrada)
+    subtotal_actual, total_referencia = referencia_ahorro(baseline, entrada.current_total)
+
+    # ⭐ BÚSQUEDA VECTORIZADA: coste de potencia (€/día) de versiones × parejas
+    matrices = catalogo.matrices
+    coste_parejas = matrices.potencia @ np.vstack([f1, f2])
+    mejor = np.argmin(coste_parejas, axis=1)
+
+    def _calculo(potencias_facturadas):
+        return calcular_ofertas_vectorizado(
+            matrices,
+            consumos=entrada.consumos,
+            potencias=potencias_facturadas,
+            periodo_dias=periodo_dias,
+            iva_pct=entrada.iva_pct,
+            alquiler=entrada.alquiler_equipo,
+            total_referencia=total_referencia,
+            subtotal_actual=subtotal_actual,
+            factor_anual=entrada.factor_anual,
+        )
+
+    actual = _calculo([float(potencia_facturada(potencias[i], maximetro[i], entrada.atr)) for i in range(2)])
+    optimo = _calculo([f1[mejor], f2[mejor]])
+
+    columnas_actual = {k: v.tolist() for k, v in actual.items()}
+    columnas_optimo = {k: v.tolist() for k, v in optimo.items()}
+    potencia_p1, potencia_p2 = p1[mejor].tolist(), p2[mejor].tolist()
+    facturada_p1, facturada_p2 = f1[mejor].tolist(), f2[mejor].tolist()
+    potencia_boe = matrices.potencia_boe.tolist()
+    # Misma anualización que ahorro_anual (estacional con histórico, si no lineal)
+    factor_anual = entrada.factor_anual if entrada.factor_anual is not None else 30.0 / float(periodo_dias) * 12.0
+
+    offers: List[Dict[str, Any]] = []
+    for pos in np.flatnonzero(matrices.valida).tolist():
+        tarifa = catalogo.tarifas[pos]
+        tarifa_version_id = tarifa["tarifa_version_id"]
+        ahorro_potencia = columnas_actual["total"][pos] - columnas_optimo["total"][pos]
+        offers.append({
+            "tarifa_id": tarifa.get("id") or tarifa.get("tarifa_id") or tarifa_version_id,
+            "tarifa_version_id": tarifa_version_id,
+            "provider": tarifa.get("comercializadora") or "Proveedor genérico",
+            "plan_name": tarifa.get("nombre") or "Tarifa 2.0TD",
+            "modo_potencia": "boe_2025_regulado" if potencia_boe[pos] else "tarifa",
+            "potencia_p1_kw": round(potencia_p1[pos], 3),
+            "potencia_p2_kw": round(potencia_p2[pos], 3),
+            "potencia_facturada_p1_kw": round(facturada_p1[pos], 3),
+            "potencia_facturada_p2_kw": round(facturada_p2[pos], 3),
+            "coste_potencia": round(columnas_optimo["coste_potencia"][pos], 2),
+            "coste_potencia_actual": round(columnas_actual["coste_potencia"][pos], 2),
+            "estimated_total": round(columnas_optimo["total"][pos], 2),
+            "estimated_total_potencia_actual": round(columnas_actual["total"][pos], 2),
+            "ahorro_potencia_periodo": round(ahorro_potencia, 2),
+            "ahorro_potencia_anual": round(ahorro_potencia * factor_anual, 2),
+            "saving_amount": round(columnas_optimo["ahorro_periodo"][pos], 2),
+            "saving_amount_annual": round(columnas_optimo["ahorro_anual"][pos], 2),
+        })
+
+    # Completas antes que parciales (fallback BOE), cada grupo por total (sort estable)
+    offers.sort(key=lambda item: (item["modo_potencia"] != "tarifa", item["estimated_total"]))
+    if top_k:
+        offers = offers[:top_k]
+
+    resultado = componer_resultado(entrada, baseline, offers)
+    resultado["preview"] = True
+    resultado["optimizacion_potencia"] = {
+        "potencia_actual": {"p1_kw": potencias[0], "p2_kw": potencias[1]},
+        "maximetro": {"p1_kw": maximetro[0], "p2_kw": maximetro[1]},
+        "escalones": list(escalones),
+        "parejas_evaluadas": int(len(p1)),
+    }
+    return resultado
+
+
+def optimizar_potencia_factura(
+    factura,
+    db,
+    maximetro_p1_kw: Optional[float] = None,
+    maximetro_p2_kw: Optional[float] = None,
+    top_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Recomendación de potencia contratada por oferta para una factura 2.0TD (sin
+    persistir). Las lecturas de maxímetro se toman de los argumentos o, si no
+    vienen, de la factura (maximetro_p1_kw/maximetro_p2_kw) cuando existan.
+    """
+    entrada = _preparar_entrada(factura)
+    if entrada.atr != "2.0TD":
+        raise DomainError("POTENCIA_SOLO_2_0TD", f"La optimización de potencia solo está disponible para 2.0TD (factura {entrada.atr})")
+    maximetro = [
+        maximetro_p1_kw if maximetro_p1_kw is not None else _to_float(getattr(factura, "maximetro_p1_kw", None)),
+        maximetro_p2_kw if maximetro_p2_kw is not None else _to_float(getattr(factura, "maximetro_p2_kw", None)),
+    ]
+
+    catalogo = get_catalogo(db, entrada.atr, date.today())
+    if not catalogo.tarifas:
+        return _sin_tarifas_vigentes(entrada.factura_id, entrada.atr)
+
+    # Ahorro anual comparable con /comparar (anualización estacional por CUPS)
+    anotar_anualizacion(db, [entrada])
+    resultado = optimizar_potencia(entrada, catalogo, maximetro, top_k)
+    if resultado["offers"]:
+        mejor = resultado["offers"][0]
+        logger.info(
+            f"[POTENCIA] factura_id={entrada.factura_id}: {entrada.potencias[:2]} kW → "
+            f"{[mejor['potencia_p1_kw'], mejor['potencia_p2_kw']]} kW en la mejor oferta "
+            f"(ahorro potencia {mejor['ahorro_potencia_anual']} €/año, maxímetro={maximetro})"
+        )
+    return resultado
@@ -0,0 +1,199 @@
+"""
+Perfiles de consumo estándar (REE) y calendario horario de periodos 2.0TD.
+
+Las tablas horarias (coeficientes de perfil, precios horarios) se leen de CSV
+locales con columnas mes;dia;hora;<columna...> (hora 1-24, formato REE) y se
+guardan como años de 24 × días slots (8760/8784) en hora de reloj. En el cambio de
+horario (días de 23 y 25 horas numeradas 1-23 / 1-25, como REE) las horas se
+recolocan en su slot: la 2:00-3:00 que no existe en marzo repite la anterior y
+las dos 2:00-3:00 de octubre se promedian en un slot (aproximación: el reparto
+por periodo renormaliza el perfil y el precio de esa hora es la media).
+Tras la primera lectura se escribe un .npy junto al CSV y se abre memory-mapped;
+en memoria se cachea por (ruta, columnas).
+
+Periodos 2.0TD (Circular CNMC 3/2020, península): P1 10-14 y 18-22, P2 8-10,
+14-18 y 22-24, P3 0-8; fines de semana y festivos nacionales de fecha fija, todo P3.
+"""
+
+import csv
+from datetime import date, timedelta
+from functools import lru_cache
+import logging
+import os
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PERFILES_CONSUMO_DIR = os.getenv("PERFILES_CONSUMO_DIR", os.path.join(_RAIZ, "tarifas", "perfiles"))
+
+# Columna del perfil 2.0TD en los ficheros de perfiles iniciales de REE
+COLUMNA_PERFIL_2_0TD = "p2.0td"
+
+FESTIVOS_NACIONALES_FIJOS = ((1, 1), (1, 6), (5, 1), (8, 15), (10, 12), (11, 1), (12, 6), (12, 8), (12, 25))
+
+_PERIODO_HORA_LABORABLE = np.array([3] * 8 + [2] * 2 + [1] * 4 + [2] * 4 + [1] * 4 + [2] * 2, dtype=np.int8)
+
+
+def horas_anio(anio: int) -> int:
+    return (date(anio + 1, 1, 1) - date(anio, 1, 1)).days * 24
+
+
+def _normalizar(nombre: str) -> str:
+    nombre = unicodedata.normalize("NFKD", nombre or "").encode("ascii", "ignore").decode()
+    return nombre.strip().lower().replace(" ", "")
+
+
+def leer_tabla_horaria(ruta: str, anio: int, columnas: Sequence[str], parcial: bool = False) -> np.ndarray:
+    """
+    Matriz len(columnas) × horas del año desde un CSV mes;dia;hora;... (, o ;,
+    decimales con coma o punto). Usa/crea el .npy hermano como caché en disco.
+
+    Las columnas se buscan por nombre normalizado exacto (precios: t1 no casa con
+    t10). parcial=True admite que el nombre esté contenido en la cabecera, para
+    ficheros de REE con cabeceras decoradas ("Coef. P2.0TD"). Columna ausente o
+    ambigua: ValueError.
+    """
+    return _leer_tabla_horaria(ruta, anio, tuple(_normalizar(c) for c in columnas), parcial)
+
+
+def _indice_columna(ruta: str, cabecera: List[str], columna: str, parcial: bool) -> int:
+    indices = [i for i, c in enumerate(cabecera) if c == columna or (parcial and columna in c)]
+    if len(indices) != 1:
+        estado = "no está" if not indices else f"aparece {len(indices)} veces"
+        raise ValueError(f"{ruta}: la columna {columna!r} {estado} en la cabecera {cabecera}")
+    return indices[0]
+
+
+def _slot_en_dia(hora: int, horas_dia: int) -> int:
+    """
+    Slot (0-23, hora de reloj) de la hora REE `hora` en un día de `horas_dia` horas.
+    Marzo (23 h): de la 3 en adelante saltan la 2:00-3:00, que se rellena después
+    repitiendo la anterior. Octubre (25 h): las horas 3 y 4 son las dos 2:00-3:00
+    y comparten slot (se promedian); de la 4 en adelante corren un slot.
+    """
+    if horas_dia == 23 and hora >= 3:
+        return hora
+    if horas_dia == 25 and hora >= 4:
+        return hora - 2
+    return hora - 1
+
+
+@lru_cache(maxsize=32)
+def _leer_tabla_horaria(ruta: str, anio: int, columnas: Tuple[str, ...], parcial: bool = False) -> np.ndarray:
+    # v2: horas recolocadas en el cambio de horario (invalida cachés anteriores)
+    ruta_npy = f"{os.path.splitext(ruta)[0]}.{'_'.join(columnas)}{'.parcial' if parcial else ''}.v2.npy"
+    if os.path.exists(ruta_npy) and os.path.getmtime(ruta_npy) >= os.path.getmtime(ruta):
+        return np.load(ruta_npy, mmap_mode="r")
+
+    horas = horas_anio(anio)
+    dias: Dict[date, Dict[int, List[float]]] = {}
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        lector = csv.reader(f, delimiter=";" if muestra.count(";") > muestra.count(",") else ",")
+        cabecera = [_normalizar(c) for c in next(lector)]
+        try:
+            i_mes, i_dia, i_hora = cabecera.index("mes"), cabecera.index("dia"), cabecera.index("hora")
+        except ValueError:
+            raise ValueError(f"{ruta}: se esperaban columnas mes, dia, hora y {list(columnas)}; hay {cabecera}")
+        indices = [_indice_columna(ruta, cabecera, col, parcial) for col in columnas]
+        for fila in lector:
+            if not fila or not fila[i_mes].strip():
+                continue
+            hora = int(fila[i_hora])
+            if not 1 <= hora <= 25:
+                continue
+            dia = date(anio, int(fila[i_mes]), int(fila[i_dia]))
+            dias.setdefault(dia, {})[hora] = [float(fila[i].replace(",", ".")) for i in indices]
+
+    tabla = np.full((len(columnas), horas), np.nan)
+    inicio = date(anio, 1, 1)
+    for dia, filas in dias.items():
+        base = (dia - inicio).days * 24
+        horas_dia = max(filas)
+        acumulado: Dict[int, List[List[float]]] = {}
+        for hora, valores in filas.items():
+            acumulado.setdefault(_slot_en_dia(hora, horas_dia), []).append(valores)
+        for slot, valores in acumulado.items():
+            tabla[:, base + slot] = np.mean(valores, axis=0)
+
+    # Huecos (hora que no existe en el cambio de horario): repetir la anterior
+    huecos = np.isnan(tabla)
+    if huecos.any():
+        for fila in tabla:
+            vacios = np.flatnonzero(np.isnan(fila))
+            for slot in vacios:
+                fila[slot] = fila[slot - 1] if slot > 0 else 0.0
+        logger.info(f"[PERFILES] {ruta}: {int(huecos.sum() / len(columnas))} horas sin dato rellenadas")
+
+    try:
+        np.save(ruta_npy, tabla)
+        return np.load(ruta_npy, mmap_mode="r")
+    except OSError as e:
+        logger.warning(f"[PERFILES] No se pudo escribir la caché {ruta_npy}: {e}")
+        return tabla
+
+
+def perfil_2_0td(anio: int, directorio: str = None) -> np.ndarray:
+    """Coeficientes horarios del perfil 2.0TD del año (perfiles_<anio>.csv)."""
+    ruta = os.path.join(directorio or PERFILES_CONSUMO_DIR, f"perfiles_{anio}.csv")
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No hay perfil de consumo para {anio} ({ruta})")
+    return leer_tabla_horaria(ruta, anio, [COLUMNA_PERFIL_2_0TD], parcial=True)[0]
+
+
+@lru_cache(maxsize=16)
+def periodos_2_0td(anio: int) -> np.ndarray:
+    """Periodo (1, 2 o 3) de cada hora del año en 2.0TD."""
+    dias = horas_anio(anio) // 24
+    periodos = np.tile(_PERIODO_HORA_LABORABLE, dias)
+    festivos = {date(anio, m, d) for m, d in FESTIVOS_NACIONALES_FIJOS}
+    inicio = date(anio, 1, 1)
+    for n in range(dias):
+        dia = inicio + timedelta(days=n)
+        if dia.weekday() >= 5 or dia in festivos:
+            periodos[n * 24:(n + 1) * 24] = 3
+    periodos.flags.writeable = False
+    return periodos
+
+
+def ventana_horaria(inicio: date, dias: int, tabla_por_anio) -> np.ndarray:
+    """
+    Concatena las horas [inicio, inicio + dias) de `tabla_por_anio(anio)` (arrays
+    con las horas en el último eje), aunque la ventana cruce de año.
+    """
+    trozos: List[np.ndarray] = []
+    dia = inicio
+    fin = inicio + timedelta(days=dias)
+    while dia < fin:
+        corte = min(fin, date(dia.year + 1, 1, 1))
+        desde = (dia - date(dia.year, 1, 1)).days * 24
+        hasta = desde + (corte - dia).days * 24
+        trozos.append(np.asarray(tabla_por_anio(dia.year))[..., desde:hasta])
+        dia = corte
+    return np.concatenate(trozos, axis=-1)
+
+
+def repartir_consumo_2_0td(consumos: Sequence[float], inicio: date, dias: int, directorio: str = None) -> np.ndarray:
+    """
+    kWh por hora de la ventana de facturación: el consumo de cada periodo P1-P3
+    se reparte entre sus horas proporcionalmente al perfil (uniforme si el perfil
+    suma 0 en ese periodo). Si un periodo no tiene horas en la ventana (p. ej.
+    P1 en una ventana de fin de semana), su consumo se reparte por toda la
+    ventana según el perfil. El total coincide siempre con la factura.
+    """
+    coeficientes = ventana_horaria(inicio, dias, lambda anio: perfil_2_0td(anio, directorio))
+    periodos = ventana_horaria(inicio, dias, periodos_2_0td)
+    horario = np.zeros(len(periodos))
+    for p in range(1, 4):
+        mascara = periodos == p
+        if not mascara.any():
+            mascara = np.ones(len(periodos), dtype=bool)
+        pesos = coeficientes[mascara]
+        total = pesos.sum()
+        horario[mascara] += consumos[p - 1] * (pesos / total if total > 0 else 1.0 / mascara.sum())
+    return horario
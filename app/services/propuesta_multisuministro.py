@@ -0,0 +1,205 @@
+"""
+Propuesta agregada para clientes con varios suministros (CUPS).
+
+Carga la última factura de cada CUPS del cliente y valora el conjunto contra el
+catálogo vigente sin pasar por el comparador factura a factura (ni por N
+transacciones): por ATR, una matriz versiones × suministros con el mismo motor
+vectorizado (fórmula PO) y la suma por versión es el coste del lote.
+
+Una versión de tarifa solo cubre un ATR, así que la propuesta se agrupa por
+comercializadora: para cada ATR del cliente se elige su versión más barata para
+el conjunto de CUPS de ese ATR, y solo se proponen las comercializadoras que
+cubren todos los ATR del cliente. No persiste nada.
+"""
+
+from datetime import date
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.db.models import Factura
+from app.exceptions import DomainError
+from app.services.catalogo_tarifas import get_catalogo
+from app.services.comparador import _preparar_entrada
+from app.services.comparador_core import FacturaComparable, calcular_baseline, referencia_ahorro
+from app.services.historico_consumo import anotar_anualizacion
+from app.services.motor_vectorizado import calcular_totales_suministros
+
+logger = logging.getLogger(__name__)
+
+
+def ultimas_facturas_por_cups(db, cliente_id: int) -> Tuple[List[Factura], int]:
+    """(última factura de cada CUPS del cliente, facturas sin CUPS ignoradas)."""
+    facturas = (
+        db.query(Factura)
+        .filter(Factura.cliente_id == cliente_id)
+        .order_by(Factura.id.desc())
+        .all()
+    )
+    ultimas: Dict[str, Factura] = {}
+    sin_cups = 0
+    for factura in facturas:
+        cups = (factura.cups or "").strip().upper()
+        if not cups:
+            sin_cups += 1
+            continue
+        ultimas.setdefault(cups, factura)
+    return sorted(ultimas.values(), key=lambda f: f.id), sin_cups
+
+
+def _totales_atr(entradas: List[FacturaComparable], catalogo) -> Dict[str, np.ndarray]:
+    """
+    Totales y ahorro anual de versiones × suministros de un mismo ATR: los
+    consumos, potencias y días de todos los suministros como matrices contra
+    las del catálogo en una sola llamada al motor (sin bucle por suministro).
+    """
+    referencias = [referencia_ahorro(calcular_baseline(entrada), entrada.current_total)[1] for entrada in entradas]
+    # Mismo ATR = mismos periodos de energía y potencia en todas las filas
+    consumos = np.array([entrada.consumos for entrada in entradas], dtype=float)
+    potencias = np.array([entrada.potencias for entrada in entradas], dtype=float)
+    dias = np.array([float(entrada.periodo_dias) for entrada in entradas])
+    factor_anual = np.array([
+        entrada.factor_anual if entrada.factor_anual is not None else 30.0 / float(entrada.periodo_dias) * 12.0
+        for entrada in entradas
+    ])
+
+    calculo = calcular_totales_suministros(
+        catalogo.matrices,
+        consumos=consumos,
+        potencias=potencias,
+        periodo_dias=dias,
+        iva_pct=np.array([entrada.iva_pct for entrada in entradas]),
+        alquiler=np.array([entrada.alquiler_equipo for entrada in entradas]),
+        total_referencia=np.array(referencias),
+        factor_anual=factor_anual,
+    )
+    return {**calculo, "referencia": np.array(referencias)}
+
+
+def _mejor_version_por_comercializadora(catalogo, suma: np.ndarray) -> Dict[str, int]:
+    """
+    Fila del catálogo más barata para el lote por comercializadora (completas
+    antes que parciales BOE, como en el ranking del comparador).
+    """
+    matrices = catalogo.matrices
+    filas = np.flatnonzero(matrices.valida)
+    if not len(filas):
+        return {}
+    proveedores = np.array([catalogo.tarifas[i].get("comercializadora") or "Proveedor genérico" for i in filas])
+    orden = np.lexsort((filas, suma[filas], matrices.potencia_boe[filas], proveedores))
+    nombres, primeras = np.unique(proveedores[orden], return_index=True)
+    return {str(nombre): int(filas[orden[i]]) for nombre, i in zip(nombres.tolist(), primeras.tolist())}
+
+
+def calcular_propuesta(
+    suministros: List[Tuple[str, FacturaComparable]],
+    catalogos: Dict[str, Any],
+    top_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Ranking de propuestas por comercializadora para un lote de suministros
+    [(cups, entrada)] ya validados. catalogos: snapshot por ATR. Función pura.
+    """
+    por_atr: Dict[str, List[Tuple[str, FacturaComparable]]] = {}
+    for cups, entrada in suministros:
+        por_atr.setdefault(entrada.atr, []).append((cups, entrada))
+
+    # ⭐ MOTOR VECTORIZADO: versiones × suministros por ATR, suma por versión
+    grupos = {}
+    for atr, items in por_atr.items():
+        catalogo = catalogos[atr]
+        totales = _totales_atr([entrada for _, entrada in items], catalogo)
+        grupos[atr] = (catalogo, items, totales, _mejor_version_por_comercializadora(catalogo, totales["total"].sum(axis=1)))
+
+    proveedores = set.intersection(*(set(g[3]) for g in grupos.values())) if grupos else set()
+    current_total = sum(float(g[2]["referencia"].sum()) for g in grupos.values())
+
+    offers = []
+    for provider in proveedores:
+        planes, detalle, parcial = [], [], False
+        for atr, (catalogo, items, totales, mejores) in grupos.items():
+            fila = mejores[provider]
+            tarifa = catalogo.tarifas[fila]
+            parcial = parcial or bool(catalogo.matrices.potencia_boe[fila])
+            planes.append({
+                "atr": atr,
+                "tarifa_id": tarifa.get("id") or tarifa.get("tarifa_id") or tarifa["tarifa_version_id"],
+                "tarifa_version_id": tarifa["tarifa_version_id"],
+                "plan_name": tarifa.get("nombre") or f"Tarifa {atr}",
+            })
+            for j, (cups, entrada) in enumerate(items):
+                total = float(totales["total"][fila, j])
+                referencia = float(totales["referencia"][j])
+                detalle.append({
+                    "factura_id": entrada.factura_id,
+                    "cups": cups,
+                    "atr": atr,
+                    "tarifa_version_id": tarifa["tarifa_version_id"],
+                    "estimated_total": round(total, 2),
+                    "current_total": round(referencia, 2),
+                    "saving_amount": round(referencia - total, 2),
+                    "saving_amount_annual": round(float(totales["ahorro_anual"][fila, j]), 2),
+                })
+        estimated_total = sum(item["estimated_total"] for item in detalle)
+        offers.append({
+            "provider": provider,
+            "estimated_total": round(estimated_total, 2),
+            "current_total": round(current_total, 2),
+            "saving_amount": round(current_total - estimated_total, 2),
+            "saving_amount_annual": round(sum(item["saving_amount_annual"] for item in detalle), 2),
+            "saving_percent": round((current_total - estimated_total) / current_total * 100, 2) if current_total > 0 else 0.0,
+            "modo_potencia": "boe_2025_regulado" if parcial else "tarifa",
+            "planes": planes,
+            "suministros": sorted(detalle, key=lambda item: item["factura_id"]),
+        })
+
+    # Completas antes que parciales, cada grupo por total del lote
+    offers.sort(key=lambda item: (item["modo_potencia"] != "tarifa", item["estimated_total"], item["provider"]))
+    if top_k:
+        offers = offers[:top_k]
+
+    return {
+        "num_suministros": len(suministros),
+        "atrs": sorted(grupos),
+        "current_total": round(current_total, 2),
+        "offers": offers,
+    }
+
+
+def propuesta_cliente(db, cliente_id: int, top_k: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Propuesta agregada de un cliente: última factura por CUPS, validadas como en
+    el comparador (las que no se pueden comparar van a "errores" sin abortar).
+    """
+    facturas, sin_cups = ultimas_facturas_por_cups(db, cliente_id)
+    hoy = date.today()
+
+    suministros: List[Tuple[str, FacturaComparable]] = []
+    catalogos: Dict[str, Any] = {}
+    errores = []
+    for factura in facturas:
+        cups = factura.cups.strip().upper()
+        try:
+            entrada = _preparar_entrada(factura)
+        except DomainError as e:
+            errores.append({"factura_id": factura.id, "cups": cups, "error_code": e.code, "message": e.message})
+            continue
+        if entrada.atr not in catalogos:
+            catalogos[entrada.atr] = get_catalogo(db, entrada.atr, hoy)
+        if not catalogos[entrada.atr].tarifas:
+            errores.append({
+                "factura_id": factura.id, "cups": cups, "error_code": "NO_TARIFAS_VIGENTES",
+                "message": f"No hay tarifas disponibles para {entrada.atr}",
+            })
+            continue
+        suministros.append((cups, entrada))
+
+    anotar_anualizacion(db, [entrada for _, entrada in suministros])
+    resultado = calcular_propuesta(suministros, catalogos, top_k)
+    resultado.update({"cliente_id": cliente_id, "preview": True, "errores": errores, "facturas_sin_cups": sin_cups})
+    logger.info(
+        f"[MULTICUPS] cliente_id={cliente_id}: {len(suministros)} suministros "
+        f"({', '.join(resultado['atrs']) or '-'}), {len(resultado['offers'])} propuestas, {len(errores)} errores"
+    )
+    return resultado
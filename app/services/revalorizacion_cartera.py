@@ -0,0 +1,244 @@
+"""
+Revalorización de cartera tras publicar nuevas versiones de tarifas.
+
+Cuando se carga una tarifa_versiones nueva (o se corrigen precios de una versión),
+el ahorro guardado en la última comparativa de cada factura queda obsoleto. Este
+job revisa solo las facturas afectadas (ATR de las versiones cambiadas, o cuya
+última comparativa incluía alguna de esas tarifas) y guarda una comparativa nueva
+por factura, en bloque y por trozos:
+
+- Incremental: si la última comparativa es una lista completa calculada con los
+  mismos inputs, se conservan las ofertas de versiones que siguen vigentes y no
+  han cambiado y solo se valoran las versiones nuevas/cambiadas; después se
+  vuelve a ordenar igual que el comparador.
+- Completa: listas top-K, inputs distintos o comparativas antiguas sin snapshot
+  de cálculo se recalculan contra todo el catálogo.
+
+Devuelve los clientes cuya mejor oferta ha cambiado.
+"""
+
+import json
+import logging
+import time
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, or_, text
+
+from app.db.models import Factura, OfertaCalculada
+from app.exceptions import DomainError
+from app.services.catalogo_tarifas import get_catalogo, invalidar_catalogo
+from app.services.comparador import (
+    _fetch_comisiones_cliente,
+    _inputs_calculo,
+    _persistir_lote,
+    _preparar_entrada,
+    _resumen_oferta,
+    _sellar_entrada,
+    _tarifa_ids_catalogo,
+    _ultimas_comparativas,
+)
+from app.services.comparador_core import calcular_comparacion, ordenar_ofertas
+from app.services.historico_consumo import anotar_anualizacion
+
+logger = logging.getLogger(__name__)
+
+
+def _versiones_cambiadas(db, version_ids) -> Dict[int, Tuple[int, str]]:
+    """{tarifa_version_id: (tarifa_id, atr)} de las versiones indicadas."""
+    if not version_ids:
+        return {}
+    rows = db.execute(
+        text("""
+            SELECT tv.id, t.id, t.atr
+            FROM tarifa_versiones tv
+            JOIN tarifas t ON tv.tarifa_id = t.id
+            WHERE tv.id IN :version_ids
+        """).bindparams(bindparam("version_ids", expanding=True)),
+        {"version_ids": list(version_ids)},
+    ).fetchall()
+    return {row[0]: (row[1], (row[2] or "").strip().upper()) for row in rows}
+
+
+def _facturas_candidatas(db, atrs, tarifa_ids, desde_id: int, limite: int) -> List[Factura]:
+    """
+    Facturas con comparativa cuyo ATR coincide (o se infiere por potencia) o cuya
+    última comparativa incluía alguna tarifa cambiada. Paginación por id.
+    """
+    incluia_tarifa = Factura.ultima_comparativa_id.in_(
+        db.query(OfertaCalculada.comparativa_id).filter(OfertaCalculada.tarifa_id.in_(list(tarifa_ids)))
+    )
+    return (
+        db.query(Factura)
+        .filter(
+            Factura.ultima_comparativa_id.isnot(None),
+            Factura.id > desde_id,
+            or_(
+                func.upper(func.trim(Factura.atr)).in_(list(atrs)),
+                Factura.atr.is_(None),
+                func.trim(Factura.atr) == "",
+                incluia_tarifa,
+            ),
+        )
+        .order_by(Factura.id)
+        .limit(limite)
+        .all()
+    )
+
+
+def _calculo_guardado(comparativa) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(comparativa.inputs_json or "{}").get("calculo")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _revalorizar(entrada, catalogo, comparativa, ofertas_previas, versiones_cambiadas) -> Tuple[Dict[str, Any], bool, Optional[int]]:
+    """
+    Nuevo resultado para la factura. Devuelve (resultado, incremental, top_k).
+    """
+    calculo = _calculo_guardado(comparativa)
+    top_k = calculo.get("top_k") if calculo else None
+    mismos_inputs = (
+        calculo is not None
+        and comparativa.status == "ok"
+        and calculo == json.loads(json.dumps(_inputs_calculo(entrada, top_k), default=str))
+    )
+    if not mismos_inputs or top_k:
+        return calcular_comparacion(entrada, catalogo, top_k), False, top_k
+
+    vigentes = set(catalogo.version_ids)
+    conservadas = [
+        o for o in ofertas_previas
+        if o.get("tarifa_version_id") in vigentes and o.get("tarifa_version_id") not in versiones_cambiadas
+    ]
+    ids_conservadas = {o["tarifa_version_id"] for o in conservadas}
+    resultado = calcular_comparacion(
+        entrada, catalogo.subcatalogo(vid for vid in catalogo.version_ids if vid not in ids_conservadas)
+    )
+    # Orden de catálogo antes del sort estable: mismos desempates que la lista completa
+    posicion = {vid: i for i, vid in enumerate(catalogo.version_ids)}
+    offers = sorted(conservadas + resultado["offers"], key=lambda o: posicion[o["tarifa_version_id"]])
+    resultado["offers"] = ordenar_ofertas(offers)
+    return resultado, True, None
+
+
+def revalorizar_cartera(
+    db,
+    tarifa_version_ids,
+    fecha: Optional[date] = None,
+    tamano_trozo: int = 500,
+) -> Dict[str, Any]:
+    """
+    Revaloriza las facturas afectadas por `tarifa_version_ids` contra el catálogo
+    vigente en `fecha` (un snapshot por ATR para todo el job). Un commit por trozo:
+    si un trozo falla se hace rollback solo de ese trozo y se sigue.
+    """
+    t0 = time.perf_counter()
+    fecha = fecha or date.today()
+    # Publica la invalidación: los workers web dejan de servir el catálogo anterior
+    # y /comparar coincide con la cartera revalorizada (commit de lo ya cargado)
+    invalidar_catalogo("revalorizacion_cartera", db)
+
+    versiones = _versiones_cambiadas(db, tarifa_version_ids)
+    stats = {
+        "ok": True,
+        "versiones": sorted(versiones),
+        "revisadas": 0,
+        "revalorizadas": 0,
+        "incrementales": 0,
+        "completas": 0,
+        "errores": [],
+        "cambios_mejor_oferta": [],
+    }
+    if not versiones:
+        logger.warning(f"[REVALORIZACION] Ninguna versión encontrada en {list(tarifa_version_ids)}")
+        return stats
+
+    versiones_cambiadas = set(versiones)
+    tarifa_ids = {tid for tid, _ in versiones.values()}
+    atrs = {atr for _, atr in versiones.values()}
+    catalogos: Dict[str, Any] = {}
+    logger.info(f"[REVALORIZACION] versiones={sorted(versiones)} tarifas={sorted(tarifa_ids)} atrs={sorted(atrs)}")
+
+    desde_id = 0
+    while True:
+        facturas = _facturas_candidatas(db, atrs, tarifa_ids, desde_id, tamano_trozo)
+        if not facturas:
+            break
+        desde_id = facturas[-1].id
+        stats["revisadas"] += len(facturas)
+        ultimas = _ultimas_comparativas(db, [f.id for f in facturas])
+
+        preparadas = []
+        for factura in facturas:
+            comparativa = ultimas.get(factura.id)
+            if comparativa is None:
+                continue
+            try:
+                entrada = _preparar_entrada(factura)
+            except DomainError as e:
+                stats["errores"].append({"factura_id": factura.id, "error_code": e.code, "message": e.message})
+                continue
+            ofertas_previas = json.loads(comparativa.offers_json or "[]")
+            if entrada.atr not in atrs and not any(o.get("tarifa_id") in tarifa_ids for o in ofertas_previas):
+                continue
+            if entrada.atr not in catalogos:
+                catalogos[entrada.atr] = get_catalogo(db, entrada.atr, fecha)
+            preparadas.append((entrada, catalogos[entrada.atr], comparativa, ofertas_previas))
+
+        anotar_anualizacion(db, [entrada for entrada, _, _, _ in preparadas])
+        comisiones_cliente_map = _fetch_comisiones_cliente(
+            db,
+            [entrada.cliente_id for entrada, _, _, _ in preparadas],
+            {tid for _, catalogo, _, _ in preparadas for tid in _tarifa_ids_catalogo(catalogo)},
+        )
+
+        items, cambios, incrementales = [], [], 0
+        for entrada, catalogo, comparativa, ofertas_previas in preparadas:
+            resultado, incremental, top_k = _revalorizar(
+                entrada, catalogo, comparativa, ofertas_previas, versiones_cambiadas
+            )
+            if not resultado["offers"]:
+                stats["errores"].append({"factura_id": entrada.factura_id, "error_code": "ZERO_OFFERS",
+                                         "message": "Ninguna tarifa del catálogo tiene precios completos"})
+                continue
+            _sellar_entrada(entrada, catalogo, comisiones_cliente_map, top_k)
+            items.append((entrada, resultado, catalogo))
+            incrementales += incremental
+
+            antes = _resumen_oferta(ofertas_previas[0]) if ofertas_previas else None
+            despues = _resumen_oferta(resultado["offers"][0])
+            if antes is None or (antes["tarifa_version_id"], antes["saving_amount"]) != (despues["tarifa_version_id"], despues["saving_amount"]):
+                cambios.append({"cliente_id": entrada.cliente_id, "factura_id": entrada.factura_id,
+                                "antes": antes, "despues": despues})
+
+        if items:
+            try:
+                _persistir_lote(db, items, comisiones_cliente_map)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"[REVALORIZACION] ROLLBACK trozo de {len(items)} facturas: {e}", exc_info=True)
+                stats["errores"].extend(
+                    {"factura_id": entrada.factura_id, "error_code": "PERSIST_ERROR", "message": str(e)}
+                    for entrada, _, _ in items
+                )
+                continue
+            stats["revalorizadas"] += len(items)
+            stats["incrementales"] += incrementales
+            stats["completas"] += len(items) - incrementales
+            comparativa_ids = {entrada.factura_id: resultado["comparativa_id"] for entrada, resultado, _ in items}
+            for cambio in cambios:
+                cambio["comparativa_id"] = comparativa_ids[cambio["factura_id"]]
+            stats["cambios_mejor_oferta"].extend(cambios)
+
+    segundos = time.perf_counter() - t0
+    stats["segundos"] = round(segundos, 3)
+    logger.info(
+        f"[REVALORIZACION] {stats['revalorizadas']}/{stats['revisadas']} facturas revalorizadas "
+        f"({stats['incrementales']} incrementales, {stats['completas']} completas, "
+        f"{len(stats['errores'])} errores) en {segundos:.2f}s; "
+        f"{len(stats['cambios_mejor_oferta'])} con nueva mejor oferta"
+    )
+    return stats
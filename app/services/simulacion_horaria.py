@@ -0,0 +1,181 @@
+"""
+Simulación horaria 2.0TD: ofertas indexadas/horarias sobre un perfil de consumo.
+
+El consumo P1-P3 de la factura se reparte por horas con el perfil estándar de REE
+(ver perfiles_consumo) y se valora contra tarifas con precio de energía horario
+(€/kWh todo incluido), todas a la vez como matriz tarifas × horas. Para cada
+tarifa, el coste horario por periodo se convierte en un precio efectivo P1-P3
+(coste del periodo / kWh del periodo) y a partir de ahí se reutiliza el núcleo
+del comparador (baseline PO, impuestos, ranking y top-K). Solo lee BD para la
+anualización estacional (histórico del CUPS); no escribe.
+
+Ficheros en TARIFAS_HORARIAS_DIR:
+- tarifas.json: [{"codigo", "nombre", "comercializadora", "potencia": {"P1", "P2"}}]
+  (potencia en €/kW/día)
+- precios_<anio>.csv: mes;dia;hora;<codigo>;<codigo>;... (€/kWh; cabecera = código exacto)
+"""
+
+from datetime import date
+from functools import lru_cache
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from app.exceptions import DomainError
+from app.services.catalogo_tarifas import CatalogoTarifas
+from app.services.comparador import _parse_date, _preparar_entrada
+from app.services.comparador_core import FacturaComparable, calcular_comparacion
+from app.services.historico_consumo import anotar_anualizacion
+from app.services.motor_vectorizado import PERIODOS_ENERGIA, PERIODOS_POTENCIA, MatricesCatalogo
+from app.services.perfiles_consumo import (
+    leer_tabla_horaria,
+    periodos_2_0td,
+    repartir_consumo_2_0td,
+    ventana_horaria,
+)
+
+logger = logging.getLogger(__name__)
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TARIFAS_HORARIAS_DIR = os.getenv("TARIFAS_HORARIAS_DIR", os.path.join(_RAIZ, "tarifas", "horarias"))
+
+
+class TarifasHorarias:
+    """Tarifas con precio horario: metadatos, potencia (N × 2) y precios por año (N × horas)."""
+
+    def __init__(self, directorio: str, tarifas: List[Dict[str, Any]]):
+        self.directorio = directorio
+        self.tarifas = tarifas
+        self.codigos = [str(t["codigo"]) for t in tarifas]
+        self.potencia = np.array(
+            [[float((t.get("potencia") or {}).get(f"P{i + 1}") or 0.0) for i in range(PERIODOS_POTENCIA)]
+             for t in tarifas],
+            dtype=np.float64,
+        ).reshape(len(tarifas), PERIODOS_POTENCIA)
+
+    def precios(self, anio: int) -> np.ndarray:
+        ruta = os.path.join(self.directorio, f"precios_{anio}.csv")
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No hay precios horarios para {anio} ({ruta})")
+        return leer_tabla_horaria(ruta, anio, self.codigos)
+
+
+@lru_cache(maxsize=4)
+def cargar_tarifas_horarias(directorio: Optional[str] = None) -> TarifasHorarias:
+    directorio = directorio or TARIFAS_HORARIAS_DIR
+    with open(os.path.join(directorio, "tarifas.json"), encoding="utf-8") as f:
+        tarifas = json.load(f)
+    logger.info(f"[HORARIA] {len(tarifas)} tarifas horarias en {directorio}")
+    return TarifasHorarias(directorio, tarifas)
+
+
+def catalogo_horario(
+    tarifas: TarifasHorarias,
+    consumos: List[float],
+    consumo_horario: np.ndarray,
+    inicio: date,
+    dias: int,
+) -> CatalogoTarifas:
+    """
+    Catálogo 2.0TD de una sola factura con los precios efectivos P1-P3 de cada
+    tarifa horaria para su consumo horario (una multiplicación matriz × vector
+    por periodo).
+    """
+    precios = ventana_horaria(inicio, dias, tarifas.precios)
+    periodos = ventana_horaria(inicio, dias, periodos_2_0td)
+    n = len(tarifas.tarifas)
+
+    energia = np.zeros((n, PERIODOS_ENERGIA), dtype=np.float64)
+    for p in range(1, 4):
+        mascara = periodos == p
+        if not mascara.any():
+            continue
+        if consumos[p - 1] > 0:
+            energia[:, p - 1] = (precios[:, mascara] @ consumo_horario[mascara]) / consumos[p - 1]
+        else:
+            energia[:, p - 1] = precios[:, mascara].mean(axis=1)
+
+    energia_ausente = np.zeros((n, PERIODOS_ENERGIA), dtype=bool)
+    energia_ausente[:, 3:] = True
+    matrices = MatricesCatalogo(
+        energia,
+        energia_ausente,
+        tarifas.potencia.copy(),
+        np.zeros((n, PERIODOS_POTENCIA), dtype=bool),
+        np.zeros(n, dtype=bool),
+        np.zeros(n, dtype=bool),
+        np.ones(n, dtype=bool),
+    )
+    filas = [
+        {
+            "tarifa_version_id": None,
+            "tarifa_id": t["codigo"],
+            "nombre": t.get("nombre"),
+            "comercializadora": t.get("comercializadora"),
+            "atr": "2.0TD",
+            "tipo": "horaria",
+        }
+        for t in tarifas.tarifas
+    ]
+    catalogo = CatalogoTarifas("2.0TD", inicio, filas, {}, {}, 0)
+    catalogo._matrices = matrices
+    return catalogo
+
+
+def simular_entrada_horaria(
+    entrada: FacturaComparable,
+    inicio: date,
+    tarifas: TarifasHorarias,
+    top_k: Optional[int] = None,
+    directorio_perfiles: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Resultado del comparador para una entrada 2.0TD contra las tarifas horarias."""
+    t0 = time.perf_counter()
+    consumo_horario = repartir_consumo_2_0td(entrada.consumos, inicio, entrada.periodo_dias, directorio_perfiles)
+    catalogo = catalogo_horario(tarifas, entrada.consumos, consumo_horario, inicio, entrada.periodo_dias)
+    resultado = calcular_comparacion(entrada, catalogo, top_k)
+    resultado["preview"] = True
+    resultado["simulacion_horaria"] = {
+        "perfil": "REE 2.0TD",
+        "inicio": inicio.isoformat(),
+        "horas": int(len(consumo_horario)),
+        "tarifas": len(tarifas.tarifas),
+        "ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    return resultado
+
+
+def simular_factura_horaria(
+    factura,
+    top_k: Optional[int] = None,
+    directorio_tarifas: Optional[str] = None,
+    directorio_perfiles: Optional[str] = None,
+    db=None,
+) -> Dict[str, Any]:
+    """
+    Simulación horaria de una factura 2.0TD (sin persistir). Necesita fecha_inicio
+    para situar las horas en el calendario. DomainError si no es simulable.
+    Con `db` el ahorro anual usa la anualización estacional del CUPS, como /comparar.
+    """
+    entrada = _preparar_entrada(factura)
+    if entrada.atr != "2.0TD":
+        raise DomainError("HORARIA_SOLO_2_0TD", f"La simulación horaria solo está disponible para 2.0TD (factura {entrada.atr})")
+    inicio = _parse_date(getattr(factura, "fecha_inicio", None))
+    if inicio is None:
+        raise DomainError("PERIOD_DATES_REQUIRED", "La simulación horaria necesita la fecha de inicio del periodo")
+    if db is not None:
+        anotar_anualizacion(db, [entrada])
+    try:
+        tarifas = cargar_tarifas_horarias(directorio_tarifas)
+        resultado = simular_entrada_horaria(entrada, inicio, tarifas, top_k, directorio_perfiles)
+    except FileNotFoundError as e:
+        raise DomainError("PERFIL_NO_DISPONIBLE", str(e))
+    logger.info(
+        f"[HORARIA] factura_id={entrada.factura_id}: {len(resultado['offers'])} ofertas horarias "
+        f"en {resultado['simulacion_horaria']['ms']} ms"
+    )
+    return resultado
@@ -0,0 +1,66 @@
+"""
+Job: Backfill del histórico mensual de consumo por CUPS (consumo_cups_mensual)
+Ejecutar una vez tras la migración 20261018_consumo_cups_mensual.sql; después
+lo mantienen la subida y la edición de facturas.
+
+Uso:
+    python backfill_historico_consumo.py
+    python backfill_historico_consumo.py --trozo 1000
+"""
+import argparse
+import os
+import sys
+
+# Asegurarse de que el path incluye el directorio raíz
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.conn import SessionLocal
+from app.db.models import Factura
+from app.services.historico_consumo import actualizar_historico_factura
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logging.getLogger("app.services.historico_consumo").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruir consumo_cups_mensual desde las facturas")
+    parser.add_argument("--trozo", type=int, default=500, help="facturas por commit")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    facturas = meses = 0
+    desde_id = 0
+    try:
+        while True:
+            trozo = (
+                db.query(Factura)
+                .filter(Factura.id > desde_id, Factura.cups.isnot(None))
+                .order_by(Factura.id)
+                .limit(args.trozo)
+                .all()
+            )
+            if not trozo:
+                break
+            for factura in trozo:
+                meses += actualizar_historico_factura(db, factura)
+            db.commit()
+            facturas += len(trozo)
+            desde_id = trozo[-1].id
+            logger.info(f"   {facturas} facturas procesadas ({meses} meses)")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"💥 EXCEPCIÓN NO CONTROLADA: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        db.close()
+
+    logger.info(f"✅ Histórico reconstruido: {facturas} facturas, {meses} meses")
+
+
+if __name__ == "__main__":
+    main()
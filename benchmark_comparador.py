@@ -0,0 +1,378 @@
+"""
+Benchmark del comparador con catálogos y facturas sintéticos
+Mide compare_factura de punta a punta (SQLite y Postgres local) y el núcleo
+puro (calcular_comparacion) por ATR y tamaño de catálogo, y guarda cada
+ejecución en un histórico JSONL para detectar regresiones.
+
+Escenarios por (ATR, versiones):
+    carga_catalogo     invalidar + get_catalogo (versiones, precios, índice)
+    nucleo             calcular_comparacion, lista completa (sin BD)
+    nucleo_top3        calcular_comparacion con top_k=3 (poda por dominancia)
+    compare_factura    facturas distintas: valoración + INSERT ofertas + commit
+    compare_memo       mismas facturas otra vez: camino memoizado
+
+Uso:
+    python benchmark_comparador.py
+    python benchmark_comparador.py --tamanos 10,100 --repeticiones 10
+    python benchmark_comparador.py --postgres postgresql://localhost/rapidenergy_bench
+    python benchmark_comparador.py --estricto          (exit 1 si hay regresión)
+
+Postgres: solo localhost y una base de datos con "bench" en el nombre; las
+tablas del benchmark se vacían en cada tamaño.
+"""
+import argparse
+from datetime import date, datetime, timezone
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlparse
+
+# Asegurarse de que el path incluye el directorio raíz
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import Column, Date, Integer, MetaData, Numeric, Table, Text, create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.conn import Base
+from app.db import models  # noqa: F401 (registra tablas)
+from app.db.models import Comparativa, ConsumoCupsMensual, Factura, OfertaCalculada
+from app.services.catalogo_tarifas import get_catalogo, invalidar_catalogo
+from app.services.comparador import _preparar_entrada, compare_factura
+from app.services.comparador_core import calcular_comparacion
+from app.services.metricas import iniciar_traza
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Los logs por factura del comparador falsearían los tiempos
+LOGGERS_SILENCIADOS = (
+    "app.services.comparador", "app.services.comparador_core",
+    "app.services.catalogo_tarifas", "app.services.historico_consumo",
+)
+
+TAMANOS = (10, 100, 1000, 10000)
+ATRS = ("2.0TD", "3.0TD")
+HISTORICO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "comparador.jsonl")
+UMBRAL_REGRESION = 0.25  # +25 % de mediana sobre la ejecución anterior
+FECHA_CATALOGO = date(2026, 1, 1)
+
+COMERCIALIZADORAS = ("Endesa", "Iberdrola", "Naturgy", "Repsol", "TotalEnergies", "Octopus", "Holaluz", "Factor")
+
+# Tablas del catálogo que en producción gestiona Neon (no están en models.py)
+catalogo_metadata = MetaData()
+tabla_tarifas = Table(
+    "tarifas", catalogo_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("nombre", Text), Column("comercializadora", Text), Column("atr", Text), Column("tipo", Text),
+)
+tabla_versiones = Table(
+    "tarifa_versiones", catalogo_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("tarifa_id", Integer, nullable=False),
+    Column("vigente_desde", Date, nullable=False),
+    Column("vigente_hasta", Date),
+)
+tabla_precios = Table(
+    "tarifa_precios", catalogo_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("tarifa_version_id", Integer, nullable=False, index=True),
+    Column("concepto", Text, nullable=False),
+    Column("periodo", Text, nullable=False),
+    Column("valor", Numeric, nullable=False),
+)
+
+
+# ════════════════════════════════════════════════════════════
+# DATOS SINTÉTICOS
+# ════════════════════════════════════════════════════════════
+
+def catalogo_sintetico(rng: random.Random, atr: str, n: int, primer_id: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Filas de tarifas / tarifa_versiones / tarifa_precios para `n` versiones del
+    ATR, con la mezcla de formatos que hay en producción (por periodos, 24H,
+    solo P1 y sin precio de potencia → fallback BOE en 2.0TD).
+    """
+    num_energia = 6 if atr == "3.0TD" else 3
+    filas = {"tarifas": [], "versiones": [], "precios": []}
+    for i in range(n):
+        vid = primer_id + i
+        filas["tarifas"].append({
+            "id": vid, "nombre": f"Plan {atr} {i}", "comercializadora": rng.choice(COMERCIALIZADORAS),
+            "atr": atr, "tipo": "fija",
+        })
+        filas["versiones"].append({"id": vid, "tarifa_id": vid, "vigente_desde": date(2025, 1, 1), "vigente_hasta": None})
+
+        forma = rng.choices(["periodos", "24h", "solo_p1", "sin_potencia"], weights=[6, 2, 1, 1])[0]
+        if forma == "24h":
+            energia = {"24H": rng.uniform(0.10, 0.20)}
+        elif forma == "solo_p1":
+            energia = {"P1": rng.uniform(0.10, 0.20)}
+        else:
+            energia = {f"P{p}": rng.uniform(0.06, 0.28) for p in range(1, num_energia + 1)}
+        potencia = {} if forma == "sin_potencia" else {"P1": rng.uniform(0.05, 0.12), "P2": rng.uniform(0.002, 0.05)}
+        for concepto, precios in (("energia", energia), ("potencia", potencia)):
+            for periodo, valor in precios.items():
+                filas["precios"].append({
+                    "id": len(filas["precios"]) + primer_id * 10, "tarifa_version_id": vid,
+                    "concepto": concepto, "periodo": periodo, "valor": round(valor, 6),
+                })
+    return filas
+
+
+def factura_sintetica(rng: random.Random, atr: str, cliente_id: Optional[int] = None) -> Factura:
+    """Factura validada en Step 2, coherente con el ATR (consumos, potencias, impuestos)."""
+    if atr == "3.0TD":
+        consumos = [rng.uniform(200, 3000) for _ in range(6)]
+        p1 = rng.uniform(15.0, 50.0)
+        p2 = p1 * rng.uniform(1.0, 1.3)
+    else:
+        consumos = [rng.uniform(40, 400) for _ in range(3)] + [None, None, None]
+        p1 = rng.choice([3.3, 3.45, 4.6, 5.75, 6.9, 9.2])
+        p2 = p1
+    periodo = rng.randint(28, 33)
+    subtotal = sum(c or 0.0 for c in consumos) * 0.15 + (p1 + p2) * 0.05 * periodo
+    iee = subtotal * 0.0511269632
+    alquiler = round(0.027 * periodo, 2)
+    iva = (subtotal + iee + alquiler) * 0.21
+    total = round((subtotal + iee + alquiler + iva) * rng.uniform(0.95, 1.15), 2)
+    return Factura(
+        filename="benchmark.pdf", atr=atr, cliente_id=cliente_id,
+        consumo_p1_kwh=consumos[0], consumo_p2_kwh=consumos[1], consumo_p3_kwh=consumos[2],
+        consumo_p4_kwh=consumos[3], consumo_p5_kwh=consumos[4], consumo_p6_kwh=consumos[5],
+        potencia_p1_kw=round(p1, 3), potencia_p2_kw=round(p2, 3), periodo_dias=periodo,
+        total_factura=total, total_ajustado=total, validado_step2=True,
+        iva=round(iva, 2), impuesto_electrico=round(iee, 2), alquiler_contador=alquiler, iva_porcentaje=21.0,
+    )
+
+
+# ════════════════════════════════════════════════════════════
+# BACKENDS
+# ════════════════════════════════════════════════════════════
+
+def _engine(postgres_url: Optional[str]):
+    if postgres_url is None:
+        return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    url = urlparse(postgres_url)
+    if url.hostname not in ("localhost", "127.0.0.1", "::1") or "bench" not in (url.path or ""):
+        raise SystemExit("❌ --postgres solo admite localhost y una base de datos con 'bench' en el nombre")
+    return create_engine(postgres_url)
+
+
+def _preparar_bd(engine, catalogos: Dict[str, Dict[str, List[Dict[str, Any]]]]) -> None:
+    """Esquema + catálogo sintético; vacía antes las tablas que toca el benchmark."""
+    Base.metadata.create_all(bind=engine)
+    catalogo_metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for tabla in (OfertaCalculada.__table__, ConsumoCupsMensual.__table__, tabla_precios, tabla_versiones, tabla_tarifas):
+            conn.execute(delete(tabla))
+        conn.execute(Factura.__table__.update().values(ultima_comparativa_id=None))
+        conn.execute(delete(Comparativa.__table__))
+        conn.execute(delete(Factura.__table__))
+        for filas in catalogos.values():
+            conn.execute(insert(tabla_tarifas), filas["tarifas"])
+            conn.execute(insert(tabla_versiones), filas["versiones"])
+            conn.execute(insert(tabla_precios), filas["precios"])
+
+
+# ════════════════════════════════════════════════════════════
+# MEDICIÓN
+# ════════════════════════════════════════════════════════════
+
+def _resumen(muestras_ms: List[float]) -> Dict[str, Any]:
+    ordenadas = sorted(muestras_ms)
+    p95 = ordenadas[min(len(ordenadas) - 1, int(round(0.95 * (len(ordenadas) - 1))))]
+    return {
+        "n": len(ordenadas),
+        "mediana_ms": round(statistics.median(ordenadas), 3),
+        "p95_ms": round(p95, 3),
+        "min_ms": round(ordenadas[0], 3),
+    }
+
+
+def _medir(funcion, argumentos) -> List[float]:
+    muestras = []
+    for args in argumentos:
+        t0 = time.perf_counter()
+        funcion(*args)
+        muestras.append((time.perf_counter() - t0) * 1000)
+    return muestras
+
+
+def medir_tamano(backend: str, engine, n: int, repeticiones: int, semilla: int) -> List[Dict[str, Any]]:
+    """Todos los escenarios para un tamaño de catálogo (n versiones por ATR)."""
+    rng = random.Random(semilla + n)
+    catalogos = {atr: catalogo_sintetico(rng, atr, n, primer_id=1 + i * 1_000_000) for i, atr in enumerate(ATRS)}
+    _preparar_bd(engine, catalogos)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    resultados = []
+    try:
+        for atr in ATRS:
+            facturas = [factura_sintetica(rng, atr) for _ in range(repeticiones)]
+            db.add_all(facturas)
+            db.commit()
+
+            def _carga():
+                invalidar_catalogo("benchmark")
+                get_catalogo(db, atr, FECHA_CATALOGO).matrices
+
+            escenarios = {"carga_catalogo": _medir(_carga, [()] * min(repeticiones, 5))}
+            catalogo = get_catalogo(db, atr, FECHA_CATALOGO)
+            entradas = [_preparar_entrada(f) for f in facturas]
+            escenarios["nucleo"] = _medir(calcular_comparacion, [(e, catalogo) for e in entradas])
+            escenarios["nucleo_top3"] = _medir(calcular_comparacion, [(e, catalogo, 3) for e in entradas])
+
+            etapas: Dict[str, List[float]] = {}
+
+            def _compare(factura):
+                traza = iniciar_traza()
+                compare_factura(factura, db)
+                if traza is not None:
+                    for etapa, ms in traza.etapas.items():
+                        etapas.setdefault(etapa, []).append(ms)
+
+            escenarios["compare_factura"] = _medir(_compare, [(f,) for f in facturas])
+            etapas_compare = {etapa: round(statistics.median(v), 3) for etapa, v in etapas.items()}
+            escenarios["compare_memo"] = _medir(_compare, [(f,) for f in facturas])
+
+            for escenario, muestras in escenarios.items():
+                registro = {"backend": backend, "escenario": escenario, "atr": atr, "versiones": n, **_resumen(muestras)}
+                if escenario == "compare_factura":
+                    registro["etapas_mediana_ms"] = etapas_compare
+                resultados.append(registro)
+                logger.info(
+                    f"   {backend:8} {atr:6} n={n:<6} {escenario:15} mediana={registro['mediana_ms']:>9.3f} ms "
+                    f"p95={registro['p95_ms']:>9.3f} ms"
+                )
+    finally:
+        db.close()
+        invalidar_catalogo("benchmark")
+    return resultados
+
+
+# ════════════════════════════════════════════════════════════
+# HISTÓRICO Y REGRESIONES
+# ════════════════════════════════════════════════════════════
+
+def _clave(registro: Dict[str, Any]):
+    return registro["backend"], registro["escenario"], registro["atr"], registro["versiones"]
+
+
+def ultima_ejecucion(ruta: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(ruta):
+        return None
+    ultima = None
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                ultima = json.loads(linea)
+    return ultima
+
+
+def detectar_regresiones(
+    anterior: Optional[Dict[str, Any]],
+    actual: Dict[str, Any],
+    umbral: float = UMBRAL_REGRESION,
+) -> List[Dict[str, Any]]:
+    """Escenarios cuya mediana supera la de la ejecución anterior en más de `umbral`."""
+    if not anterior:
+        return []
+    previos = {_clave(r): r for r in anterior.get("resultados", [])}
+    regresiones = []
+    for registro in actual["resultados"]:
+        previo = previos.get(_clave(registro))
+        if previo is None or previo["mediana_ms"] <= 0:
+            continue
+        ratio = registro["mediana_ms"] / previo["mediana_ms"]
+        if ratio > 1 + umbral:
+            regresiones.append({
+                "backend": registro["backend"], "escenario": registro["escenario"], "atr": registro["atr"],
+                "versiones": registro["versiones"], "antes_ms": previo["mediana_ms"],
+                "ahora_ms": registro["mediana_ms"], "ratio": round(ratio, 2),
+            })
+    return regresiones
+
+
+def _commit_git() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(
+    tamanos=TAMANOS,
+    repeticiones: int = 20,
+    postgres_url: Optional[str] = None,
+    solo_postgres: bool = False,
+    semilla: int = 2026,
+) -> Dict[str, Any]:
+    backends = [] if solo_postgres else [("sqlite", None)]
+    if postgres_url:
+        backends.append(("postgres", postgres_url))
+    resultados = []
+    for backend, url in backends:
+        engine = _engine(url)
+        try:
+            for n in tamanos:
+                resultados.extend(medir_tamano(backend, engine, n, repeticiones, semilla))
+        finally:
+            engine.dispose()
+    return {
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit_git(),
+        "python": platform.python_version(),
+        "maquina": platform.node(),
+        "repeticiones": repeticiones,
+        "resultados": resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del comparador con catálogos sintéticos")
+    parser.add_argument("--tamanos", default=",".join(str(t) for t in TAMANOS), help="versiones por ATR, separadas por comas")
+    parser.add_argument("--repeticiones", type=int, default=20, help="facturas (muestras) por escenario")
+    parser.add_argument("--postgres", default=os.getenv("BENCHMARK_POSTGRES_URL"), help="URL de un Postgres local desechable")
+    parser.add_argument("--solo-postgres", action="store_true", help="no medir SQLite")
+    parser.add_argument("--historico", default=HISTORICO, help="JSONL donde se acumulan las ejecuciones")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION, help="regresión si la mediana crece más de esto")
+    parser.add_argument("--estricto", action="store_true", help="exit 1 si hay alguna regresión")
+    args = parser.parse_args()
+
+    for nombre in LOGGERS_SILENCIADOS:
+        logging.getLogger(nombre).setLevel(logging.WARNING)
+    tamanos = [int(t) for t in args.tamanos.split(",") if t.strip()]
+    anterior = ultima_ejecucion(args.historico)
+    ejecucion = ejecutar(tamanos, args.repeticiones, args.postgres, args.solo_postgres)
+    regresiones = detectar_regresiones(anterior, ejecucion, args.umbral)
+    ejecucion["regresiones"] = regresiones
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.historico)), exist_ok=True)
+    with open(args.historico, "a", encoding="utf-8") as f:
+        f.write(json.dumps(ejecucion, ensure_ascii=False) + "\n")
+    logger.info(f"✅ {len(ejecucion['resultados'])} mediciones guardadas en {args.historico}")
+
+    for r in regresiones:
+        logger.warning(
+            f"⚠️ REGRESIÓN {r['backend']} {r['atr']} n={r['versiones']} {r['escenario']}: "
+            f"{r['antes_ms']} → {r['ahora_ms']} ms (x{r['ratio']})"
+        )
+    if regresiones and args.estricto:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Comparación masiva offline (campañas de prospección)
+
+Valora un CSV/Parquet de puntos de suministro contra el catálogo vigente sin
+pasar por subida/OCR y sin crear facturas. Columnas de entrada:
+cups, atr, consumo_p1_kwh..consumo_p6_kwh, potencia_p1_kw, potencia_p2_kw,
+periodo_dias, total_factura y opcionales iva, iva_porcentaje,
+impuesto_electrico, alquiler_contador.
+
+Uso:
+    python comparar_masivo.py puntos.csv ofertas.csv --top 3 --procesos 8
+    python comparar_masivo.py puntos.parquet ofertas.parquet   (requiere pyarrow)
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+# Asegurarse de que el path incluye el directorio raíz
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.conn import SessionLocal
+from app.services.catalogo_tarifas import get_catalogo
+from app.services.comparador_masivo import EscritorResultados, comparar_filas, leer_filas
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+# Los logs por factura del comparador no aportan nada con miles de filas
+logging.getLogger("app.services.comparador").setLevel(logging.WARNING)
+logging.getLogger("app.services.comparador_core").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparación masiva de puntos de suministro")
+    parser.add_argument("entrada", help="CSV o Parquet con una fila por CUPS")
+    parser.add_argument("salida", help="CSV o Parquet con las ofertas por fila")
+    parser.add_argument("--top", type=int, default=3, help="ofertas por fila (0 = todas)")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos worker (por defecto, todos los cores)")
+    parser.add_argument("--fecha", type=date.fromisoformat, default=None, help="catálogo vigente en YYYY-MM-DD")
+    args = parser.parse_args()
+
+    fecha = args.fecha or date.today()
+    db = SessionLocal()
+    try:
+        catalogos = {atr: get_catalogo(db, atr, fecha) for atr in ("2.0TD", "3.0TD")}
+    finally:
+        db.close()
+    for atr, catalogo in catalogos.items():
+        logger.info(f"Catálogo {atr} @ {fecha.isoformat()}: {len(catalogo.tarifas)} versiones (version={catalogo.version})")
+        catalogo.matrices  # construir antes de repartir a los workers
+
+    escritor = EscritorResultados(args.salida)
+    try:
+        stats = comparar_filas(
+            leer_filas(args.entrada),
+            catalogos,
+            escritor.escribir,
+            top_k=args.top or None,
+            procesos=args.procesos,
+        )
+    finally:
+        escritor.cerrar()
+
+    logger.info(
+        f"✅ {stats['filas']} filas en {stats['segundos']}s ({stats['filas_por_segundo']} filas/s), "
+        f"{stats['errores']} con error → {args.salida}"
+    )
+
+
+if __name__ == "__main__":
+    main()
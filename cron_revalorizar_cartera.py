@@ -0,0 +1,66 @@
+"""
+Job: Revalorización de cartera tras cargar nuevas versiones de tarifas
+Ejecutar después de insertar filas en tarifa_versiones/tarifa_precios.
+
+Uso:
+    python cron_revalorizar_cartera.py 311 312 313
+    python cron_revalorizar_cartera.py 311 --salida cambios.json
+
+Guarda una comparativa nueva para cada factura afectada y lista los clientes
+cuya mejor oferta ha cambiado (por stdout o en --salida).
+"""
+import argparse
+import json
+import os
+import sys
+
+# Asegurarse de que el path incluye el directorio raíz
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.conn import SessionLocal
+from app.services.revalorizacion_cartera import revalorizar_cartera
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+# Los logs por factura del comparador no aportan nada con miles de facturas
+logging.getLogger("app.services.comparador").setLevel(logging.WARNING)
+logging.getLogger("app.services.comparador_core").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revalorizar cartera por nuevas versiones de tarifas")
+    parser.add_argument("tarifa_version_ids", type=int, nargs="+", help="ids de tarifa_versiones nuevas o corregidas")
+    parser.add_argument("--salida", default=None, help="JSON con los clientes cuya mejor oferta ha cambiado")
+    parser.add_argument("--trozo", type=int, default=500, help="facturas por commit")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        resultado = revalorizar_cartera(db, args.tarifa_version_ids, tamano_trozo=args.trozo)
+    except Exception as e:
+        logger.error(f"💥 EXCEPCIÓN NO CONTROLADA: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        db.close()
+
+    cambios = resultado["cambios_mejor_oferta"]
+    logger.info(
+        f"✅ {resultado['revalorizadas']} facturas revalorizadas en {resultado.get('segundos')}s, "
+        f"{len(cambios)} con nueva mejor oferta, {len(resultado['errores'])} errores"
+    )
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(cambios, f, ensure_ascii=False, indent=2, default=str)
+    else:
+        print(json.dumps(cambios, ensure_ascii=False, default=str))
+    if resultado["errores"]:
+        for error in resultado["errores"][:20]:
+            logger.warning(f"   factura_id={error['factura_id']}: {error['error_code']} {error['message']}")
+
+
+if __name__ == "__main__":
+    main()
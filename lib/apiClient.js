@@ -68,7 +68,8 @@ export async function uploadFactura(file) {
   const formData = new FormData();
   formData.append("file", file);
 
-  const res = await fetch(`${API_URL}/webhook/upload`, {
+  // La subida se encola (202 + job_id) y el OCR corre en el backend; se sondea el job
+  const res = await fetch(`${API_URL}/webhook/upload/jobs`, {
     method: "POST",
     headers: {
       'X-User-Id': getUserId().toString(),
@@ -83,7 +84,39 @@ export async function uploadFactura(file) {
     error.status = res.status;
     throw error;
   }
-  return res.json();
+  const { job_id } = await res.json();
+  return esperarJobFactura(job_id);
+}
+
+/**
+ * Sondea GET /webhook/upload/jobs/{id} hasta completado/error.
+ * Devuelve lo mismo que el antiguo POST /webhook/upload y, en error, lanza
+ * un Error con el mismo status y cuerpo ({"detail": ...}) que antes.
+ */
+export async function esperarJobFactura(jobId, { intervaloMs = 1000, timeoutMs = 180000 } = {}) {
+  const limite = Date.now() + timeoutMs;
+  while (Date.now() < limite) {
+    const res = await fetch(`${API_URL}/webhook/upload/jobs/${jobId}`, {
+      headers: getAuthHeaders(),
+      cache: "no-store",
+    });
+    if (!res.ok) {
+      const error = new Error(await res.text().catch(() => "Error consultando la subida"));
+      error.status = res.status;
+      throw error;
+    }
+    const job = await res.json();
+    if (job.estado === "completado") return job.resultado;
+    if (job.estado === "error") {
+      const error = new Error(JSON.stringify({ detail: job.error?.detail }));
+      error.status = job.error?.status_code || 500;
+      throw error;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervaloMs));
+  }
+  const error = new Error("La factura sigue procesándose; revisa el listado en unos minutos");
+  error.status = 504;
+  throw error;
 }
 
 export async function listFacturas() {
@@ -0,0 +1,21 @@
+-- ============================================================
+-- MIGRACIÓN: Generación compartida del catálogo de tarifas
+-- Fecha: 2026-10-18
+-- Descripción: Contador de una sola fila que sube al invalidar la
+-- caché del catálogo (carga de tarifas, comisiones, revalorización).
+-- Cada worker lo consulta cada CATALOGO_GENERACION_CHECK_S y vacía su
+-- caché en proceso si cambió, en lugar de esperar al TTL.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS catalogo_generacion (
+    id INTEGER PRIMARY KEY,
+    generacion BIGINT NOT NULL DEFAULT 0,
+    motivo VARCHAR,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+INSERT INTO catalogo_generacion (id, generacion, motivo)
+VALUES (1, 0, 'migracion')
+ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE catalogo_generacion IS 'Fila única: generación del catálogo de tarifas para invalidar la caché de todos los workers';
@@ -0,0 +1,14 @@
+-- ============================================================
+-- MIGRACIÓN: Huella de comparación en comparativas
+-- Fecha: 2026-10-18
+-- Descripción: Añade fingerprint (sha256 de inputs + versión de
+-- catálogo y comisiones) para reutilizar la última comparativa
+-- cuando se vuelve a comparar una factura sin cambios
+-- ============================================================
+
+ALTER TABLE comparativas
+ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(64) DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_comparativas_factura_fingerprint ON comparativas(factura_id, fingerprint);
+
+COMMENT ON COLUMN comparativas.fingerprint IS 'sha256 de inputs + versión catálogo/comisiones; NULL = comparativas anteriores a la memoización';
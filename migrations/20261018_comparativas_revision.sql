@@ -0,0 +1,12 @@
+-- ============================================================
+-- MIGRACIÓN: Revisión de comparativas (delta de Step 2)
+-- Fecha: 2026-10-18
+-- Descripción: El delta de Step 2 reajusta los ahorros de la última
+-- comparativa en sitio (un UPDATE sobre ofertas_calculadas) y sube
+-- revision; el ETag de GET /webhook/facturas/{id}/comparativa es
+-- id + revision, así que los clientes con la versión anterior reciben 200.
+-- ============================================================
+
+ALTER TABLE comparativas ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN comparativas.revision IS 'Sube con cada reajuste de ahorros del delta de Step 2 (parte del ETag)';
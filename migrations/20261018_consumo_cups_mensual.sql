@@ -0,0 +1,28 @@
+-- ============================================================
+-- MIGRACIÓN: Histórico mensual de consumo por CUPS
+-- Fecha: 2026-10-18
+-- Descripción: Rollup (cups, mes, factura) con los kWh y días que
+-- cada factura aporta a cada mes natural. Lo mantiene la subida y
+-- edición de facturas; el comparador lo usa para anualizar el ahorro
+-- con pesos estacionales en vez de 30/periodo_dias × 12.
+-- Backfill: python backfill_historico_consumo.py
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS consumo_cups_mensual (
+    id SERIAL PRIMARY KEY,
+    cups VARCHAR NOT NULL,
+    mes DATE NOT NULL,  -- Siempre día 1 del mes
+    factura_id INTEGER NOT NULL REFERENCES facturas(id) ON DELETE CASCADE,
+    kwh DOUBLE PRECISION NOT NULL,
+    dias INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    CONSTRAINT unique_consumo_cups_mes_factura UNIQUE (cups, mes, factura_id)
+);
+
+-- Lookup del comparador: WHERE cups IN (...) AND mes >= :desde
+CREATE INDEX IF NOT EXISTS idx_consumo_cups_mensual_cups_mes ON consumo_cups_mensual(cups, mes);
+CREATE INDEX IF NOT EXISTS idx_consumo_cups_mensual_factura ON consumo_cups_mensual(factura_id);
+
+COMMENT ON TABLE consumo_cups_mensual IS 'Consumo mensual por CUPS (aportación de cada factura, prorrateada por días)';
+COMMENT ON COLUMN consumo_cups_mensual.dias IS 'Días del mes cubiertos por la factura';
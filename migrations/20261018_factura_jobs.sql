@@ -0,0 +1,30 @@
+-- ============================================================
+-- MIGRACIÓN: Cola de subidas de facturas
+-- Fecha: 2026-10-18
+-- Descripción: POST /webhook/upload/jobs acepta la factura al
+-- instante y el OCR (pypdf, pdf2image, Vision) corre en el pool de
+-- ocr_jobs. El frontend consulta GET /webhook/upload/jobs/{id} o se
+-- suscribe a /eventos. Configuración: UPLOAD_WORKERS,
+-- OCR_CONCURRENCIA_PYPDF, OCR_CONCURRENCIA_VISION.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS factura_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    estado VARCHAR NOT NULL DEFAULT 'en_cola',
+    filename VARCHAR NOT NULL,
+    file_hash VARCHAR(64),
+    user_id INTEGER REFERENCES users(id),
+    factura_id INTEGER,
+    resultado TEXT,
+    error_status INTEGER,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_factura_jobs_estado ON factura_jobs(estado);
+
+COMMENT ON TABLE factura_jobs IS 'Subidas de factura encoladas (estado y resultado para polling del frontend)';
+COMMENT ON COLUMN factura_jobs.estado IS 'en_cola | procesando | completado | error';
+COMMENT ON COLUMN factura_jobs.error_status IS 'Status HTTP que habría devuelto /upload (409 duplicada, 500...)';
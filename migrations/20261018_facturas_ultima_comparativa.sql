@@ -0,0 +1,27 @@
+-- ============================================================
+-- MIGRACIÓN: Puntero a la última comparativa en facturas
+-- Fecha: 2026-10-18
+-- Descripción: Añade facturas.ultima_comparativa_id para servir
+-- GET /webhook/facturas/{id}/comparativa y la selección de oferta
+-- con un lookup por PK en vez de ORDER BY created_at DESC
+-- ============================================================
+
+ALTER TABLE facturas
+ADD COLUMN IF NOT EXISTS ultima_comparativa_id INTEGER DEFAULT NULL;
+
+ALTER TABLE facturas
+ADD CONSTRAINT fk_facturas_ultima_comparativa
+FOREIGN KEY (ultima_comparativa_id) REFERENCES comparativas(id) ON DELETE SET NULL;
+
+-- Backfill: última comparativa OK de cada factura
+UPDATE facturas f
+SET ultima_comparativa_id = (
+    SELECT c.id
+    FROM comparativas c
+    WHERE c.factura_id = f.id AND c.status = 'ok'
+    ORDER BY c.created_at DESC, c.id DESC
+    LIMIT 1
+)
+WHERE f.ultima_comparativa_id IS NULL;
+
+COMMENT ON COLUMN facturas.ultima_comparativa_id IS 'Última comparativa OK (la mantiene el comparador al hacer commit)';
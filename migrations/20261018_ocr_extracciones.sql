@@ -0,0 +1,32 @@
+-- ============================================================
+-- MIGRACIÓN: Caché de extracción OCR por hash de archivo
+-- Fecha: 2026-10-18
+-- Descripción: Guarda por (file_hash, parser_version) los textos de
+-- pypdf y Google Vision y el resultado del parser. Resubir un archivo
+-- (aunque se haya borrado la factura), re-parsear o reparar facturas
+-- no vuelve a llamar a Vision; al subir OCR_PARSER_VERSION se
+-- re-parsean los textos guardados sin pasar por los motores.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS ocr_extracciones (
+    id SERIAL PRIMARY KEY,
+    file_hash VARCHAR(64) NOT NULL,
+    parser_version VARCHAR NOT NULL,
+    es_pdf BOOLEAN NOT NULL DEFAULT TRUE,
+    motor VARCHAR NOT NULL,
+    texto_pypdf TEXT,
+    texto_vision TEXT,
+    resultado TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_hit_at TIMESTAMP WITH TIME ZONE,
+
+    CONSTRAINT unique_ocr_extraccion_hash_version UNIQUE (file_hash, parser_version)
+);
+
+-- Textos de versiones anteriores del parser: WHERE file_hash = :h ORDER BY id DESC
+CREATE INDEX IF NOT EXISTS idx_ocr_extracciones_file_hash ON ocr_extracciones(file_hash);
+
+COMMENT ON TABLE ocr_extracciones IS 'Caché persistente de OCR: textos de motores + resultado del parser por versión';
+COMMENT ON COLUMN ocr_extracciones.motor IS 'Motor que cerró la extracción: pypdf (suficiente) o vision';
+COMMENT ON COLUMN ocr_extracciones.resultado IS 'JSON de extract_data_from_pdf con parser_version';
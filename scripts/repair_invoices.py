@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from app.db.conn import SessionLocal
 from app.db.models import Factura
 from app.services.ocr import parse_invoice_text
+from app.services.ocr_cache import extraer_desde_cache
 
 def repair_invoices():
     db: Session = SessionLocal()
@@ -31,7 +32,10 @@ def repair_invoices():
                 continue
                 
             print(f"Reparsing Factura #{f.id} ({f.filename})...")
-            new_data = parse_invoice_text(raw_text)
+            # Textos de pypdf/Vision guardados por hash (mismo camino que la subida); si no hay, raw_text
+            new_data = extraer_desde_cache(db, f.file_hash) if f.file_hash else None
+            if new_data is None:
+                new_data = parse_invoice_text(raw_text)
             
             changes = []
             
@@ -87,8 +91,9 @@ def repair_invoices():
             else:
                 print("  [OK] No improved data found.")
                 
+        # También persiste las filas de caché OCR re-parseadas
+        db.commit()
         if updated_count > 0:
-            db.commit()
             print(f"\nSuccessfully repaired {updated_count} invoices.")
         else:
             print("\nNo changes needed.")
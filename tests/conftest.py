@@ -1,5 +1,8 @@
 import os
 import sys
+from datetime import date
+
+import pytest
 
 
 def pytest_configure():
@@ -9,3 +12,110 @@ def pytest_configure():
     if repo_root not in sys.path:
         sys.path.insert(0, repo_root)
 
+
+# Tablas del catálogo que en producción gestiona Neon (no están en models.py)
+CATALOGO_DDL = [
+    """
+    CREATE TABLE tarifas (
+        id INTEGER PRIMARY KEY,
+        nombre TEXT,
+        comercializadora TEXT,
+        atr TEXT,
+        tipo TEXT
+    )
+    """,
+    """
+    CREATE TABLE tarifa_versiones (
+        id INTEGER PRIMARY KEY,
+        tarifa_id INTEGER NOT NULL,
+        vigente_desde DATE NOT NULL,
+        vigente_hasta DATE
+    )
+    """,
+    """
+    CREATE TABLE tarifa_precios (
+        id INTEGER PRIMARY KEY,
+        tarifa_version_id INTEGER NOT NULL,
+        concepto TEXT NOT NULL,
+        periodo TEXT NOT NULL,
+        valor NUMERIC NOT NULL
+    )
+    """,
+]
+
+# (tarifa_id, nombre, comercializadora, atr, energia{periodo: €/kWh}, potencia{periodo: €/kW/día})
+CATALOGO_2_0TD = [
+    (1, "Plan Estable", "Endesa", "2.0TD", {"P1": 0.159, "P2": 0.159, "P3": 0.159}, {"P1": 0.0891, "P2": 0.0447}),
+    (2, "Tarifa Noche", "Iberdrola", "2.0TD", {"P1": 0.198, "P2": 0.132, "P3": 0.089}, {"P1": 0.0862, "P2": 0.0042}),
+    (3, "Por Uso Luz", "Naturgy", "2.0TD", {"24H": 0.134}, {"P1": 0.1082, "P2": 0.0336}),
+    (4, "Solo Energía", "Comercializadora X", "2.0TD", {"P1": 0.141}, {}),
+]
+
+
+@pytest.fixture
+def db_catalogo():
+    """Sesión SQLite en memoria con el esquema ORM y un catálogo 2.0TD vigente."""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.db.conn import Base
+    from app.db import models  # noqa: F401 (registra tablas)
+    from app.services.catalogo_tarifas import invalidar_catalogo
+
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+
+    for ddl in CATALOGO_DDL:
+        session.execute(text(ddl))
+
+    for tarifa_id, nombre, comercializadora, atr, energia, potencia in CATALOGO_2_0TD:
+        session.execute(
+            text("INSERT INTO tarifas (id, nombre, comercializadora, atr, tipo) VALUES (:id, :n, :c, :atr, 'fija')"),
+            {"id": tarifa_id, "n": nombre, "c": comercializadora, "atr": atr},
+        )
+        version_id = 100 + tarifa_id
+        session.execute(
+            text("INSERT INTO tarifa_versiones (id, tarifa_id, vigente_desde) VALUES (:id, :tid, :desde)"),
+            {"id": version_id, "tid": tarifa_id, "desde": date(2025, 1, 1)},
+        )
+        for concepto, precios in (("energia", energia), ("potencia", potencia)):
+            for periodo, valor in precios.items():
+                session.execute(
+                    text(
+                        "INSERT INTO tarifa_precios (tarifa_version_id, concepto, periodo, valor) "
+                        "VALUES (:vid, :concepto, :periodo, :valor)"
+                    ),
+                    {"vid": version_id, "concepto": concepto, "periodo": periodo, "valor": valor},
+                )
+    session.commit()
+
+    invalidar_catalogo("tests")
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+        invalidar_catalogo("tests")
+
+
+@pytest.fixture
+def api_webhook(db_catalogo):
+    """TestClient con el router /webhook sobre la sesión SQLite de db_catalogo."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.db.conn import get_db
+    from app.routes import webhook
+
+    app = FastAPI()
+    app.include_router(webhook.router)
+
+    def _get_db():
+        yield db_catalogo
+
+    app.dependency_overrides[get_db] = _get_db
+    return TestClient(app)
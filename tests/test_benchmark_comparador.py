@@ -0,0 +1,31 @@
+import random
+
+import benchmark_comparador as bench
+
+
+def test_ejecucion_minima_cubre_escenarios():
+    ejecucion = bench.ejecutar(tamanos=[10], repeticiones=2)
+
+    claves = {(r["escenario"], r["atr"]) for r in ejecucion["resultados"]}
+    escenarios = {"carga_catalogo", "nucleo", "nucleo_top3", "compare_factura", "compare_memo"}
+    assert claves == {(e, atr) for e in escenarios for atr in bench.ATRS}
+    compare = next(r for r in ejecucion["resultados"] if r["escenario"] == "compare_factura")
+    assert {"valoracion", "insert_ofertas", "commit"} <= set(compare["etapas_mediana_ms"])
+
+
+def test_catalogo_sintetico_formatos():
+    filas = bench.catalogo_sintetico(random.Random(1), "3.0TD", 200, primer_id=1)
+    assert len(filas["versiones"]) == 200
+    assert len({p["id"] for p in filas["precios"]}) == len(filas["precios"])
+    periodos = {p["periodo"] for p in filas["precios"] if p["concepto"] == "energia"}
+    assert {"24H", "P6"} <= periodos
+
+
+def test_detectar_regresiones():
+    base = {"backend": "sqlite", "escenario": "nucleo", "atr": "2.0TD", "versiones": 100}
+    anterior = {"resultados": [{**base, "mediana_ms": 2.0}]}
+
+    assert bench.detectar_regresiones(None, {"resultados": [{**base, "mediana_ms": 9.0}]}) == []
+    assert bench.detectar_regresiones(anterior, {"resultados": [{**base, "mediana_ms": 2.4}]}) == []
+    regresion = bench.detectar_regresiones(anterior, {"resultados": [{**base, "mediana_ms": 3.0}]})
+    assert [r["ratio"] for r in regresion] == [1.5]
@@ -0,0 +1,100 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from app.services import catalogo_tarifas
+from app.services.catalogo_tarifas import catalogo_stats, get_catalogo, invalidar_catalogo
+from app.services.motor_vectorizado import ModoEnergia
+
+
+HOY = date(2026, 3, 1)
+
+
+def test_catalogo_carga_versiones_y_precios(db_catalogo):
+    catalogo = get_catalogo(db_catalogo, "2.0TD", HOY)
+
+    assert [t["tarifa_id"] for t in catalogo.tarifas] == [4, 1, 2, 3]  # comercializadora, nombre
+    assert catalogo.precios_map[102].como_dict()["energia"] == {"P1": 0.198, "P2": 0.132, "P3": 0.089}
+    assert catalogo.precios_map[103].como_dict()["energia"] == {"24H": 0.134}
+    assert catalogo.precios_map[103].modo is ModoEnergia.PLANA_24H
+    assert catalogo.precios_map[104].energia[:3].tolist() == [0.141] * 3  # solo P1: resuelto al cargar
+    assert catalogo.comisiones_tarifa == {}  # sin tabla comisiones_tarifa en SQLite
+
+
+def test_catalogo_hit_no_consulta_bd(db_catalogo):
+    get_catalogo(db_catalogo, "2.0TD", HOY)
+    antes = catalogo_stats()
+
+    # Si la segunda llamada tocara BD vería la tarifa borrada
+    db_catalogo.execute(text("DELETE FROM tarifa_precios"))
+    catalogo = get_catalogo(db_catalogo, "2.0TD", HOY)
+
+    despues = catalogo_stats()
+    assert despues["hits"] == antes["hits"] + 1
+    assert despues["misses"] == antes["misses"]
+    assert len(catalogo.precios_map) == 4
+
+
+def test_catalogo_clave_por_atr_y_fecha(db_catalogo):
+    get_catalogo(db_catalogo, "2.0TD", HOY)
+    misses = catalogo_stats()["misses"]
+
+    assert get_catalogo(db_catalogo, "3.0TD", HOY).tarifas == []
+    assert get_catalogo(db_catalogo, "2.0TD", date(2024, 6, 1)).tarifas == []  # antes de vigente_desde
+    assert catalogo_stats()["misses"] == misses + 2
+
+
+def test_invalidar_catalogo_recarga(db_catalogo):
+    get_catalogo(db_catalogo, "2.0TD", HOY)
+    db_catalogo.execute(text("UPDATE tarifa_versiones SET vigente_hasta = :h WHERE id = 101"), {"h": date(2025, 12, 31)})
+
+    invalidar_catalogo("test")
+    catalogo = get_catalogo(db_catalogo, "2.0TD", HOY)
+
+    assert 101 not in catalogo.version_ids
+    assert catalogo_stats()["entradas"] == 1
+
+
+def test_invalidacion_de_otro_worker_vacia_la_cache(db_catalogo, monkeypatch):
+    monkeypatch.setattr(catalogo_tarifas, "CATALOGO_GENERACION_CHECK_S", 0.0)
+    get_catalogo(db_catalogo, "2.0TD", HOY)
+    sincronizaciones = catalogo_stats()["sincronizaciones"]
+    db_catalogo.execute(text("UPDATE tarifa_versiones SET vigente_hasta = :h WHERE id = 101"), {"h": date(2025, 12, 31)})
+
+    # Otro worker publica la invalidación: aquí solo cambia la fila compartida
+    db_catalogo.execute(text("INSERT INTO catalogo_generacion (id, generacion, motivo) VALUES (1, 7, 'otro_worker')"))
+    db_catalogo.commit()
+    catalogo = get_catalogo(db_catalogo, "2.0TD", HOY)
+
+    assert 101 not in catalogo.version_ids
+    assert catalogo_stats()["sincronizaciones"] == sincronizaciones + 1
+    assert catalogo_stats()["generacion_compartida"] == 7
+
+
+def test_invalidar_con_db_publica_la_generacion(db_catalogo, monkeypatch):
+    monkeypatch.setattr(catalogo_tarifas, "CATALOGO_GENERACION_CHECK_S", 0.0)
+    sincronizaciones = catalogo_stats()["sincronizaciones"]
+    invalidar_catalogo("test", db_catalogo)
+    invalidar_catalogo("test", db_catalogo)
+    get_catalogo(db_catalogo, "2.0TD", HOY)
+
+    fila = db_catalogo.execute(text("SELECT generacion, motivo FROM catalogo_generacion WHERE id = 1")).first()
+    assert tuple(fila) == (2, "test")
+    # Su propia invalidación no vuelve a vaciar la caché del worker
+    assert catalogo_stats()["sincronizaciones"] == sincronizaciones
+
+
+def test_sin_tabla_de_generacion_cae_al_ttl(db_catalogo, monkeypatch):
+    monkeypatch.setattr(catalogo_tarifas, "CATALOGO_GENERACION_CHECK_S", 0.0)
+    db_catalogo.execute(text("DROP TABLE catalogo_generacion"))
+    db_catalogo.commit()
+
+    # La lectura fallida no aborta la transacción del llamador (savepoint)
+    db_catalogo.execute(text("UPDATE tarifa_versiones SET vigente_hasta = :h WHERE id = 101"), {"h": date(2025, 12, 31)})
+    catalogo_tarifas._sincronizar_generacion(db_catalogo)
+    assert db_catalogo.execute(text("SELECT vigente_hasta FROM tarifa_versiones WHERE id = 101")).scalar() is not None
+
+    # Ni get_catalogo ni la invalidación fallan: la caché sigue solo con el TTL
+    invalidar_catalogo("test", db_catalogo)
+    assert 101 not in get_catalogo(db_catalogo, "2.0TD", HOY).version_ids
+    assert catalogo_stats()["generacion_compartida"] is None
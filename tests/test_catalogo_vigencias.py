@@ -0,0 +1,82 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from app.services.catalogo_tarifas import catalogo_stats, get_catalogo, invalidar_catalogo
+from app.services.comparador import compare_factura
+from tests.test_comparador_lote import _factura
+
+
+@pytest.fixture
+def cambio_precios(db_catalogo):
+    """Endesa sube precios el 1/2/2026 (101 → 111); Naturgy deja de ofertar el 1/3/2026."""
+    db_catalogo.execute(text("UPDATE tarifa_versiones SET vigente_hasta = '2026-01-31' WHERE id = 101"))
+    db_catalogo.execute(text("UPDATE tarifa_versiones SET vigente_hasta = '2026-02-28' WHERE id = 103"))
+    db_catalogo.execute(text("INSERT INTO tarifa_versiones (id, tarifa_id, vigente_desde) VALUES (111, 1, '2026-02-01')"))
+    for concepto, periodo, valor in (("energia", "P1", 0.189), ("energia", "P2", 0.189), ("energia", "P3", 0.189),
+                                     ("potencia", "P1", 0.0891), ("potencia", "P2", 0.0447)):
+        db_catalogo.execute(text(
+            "INSERT INTO tarifa_precios (tarifa_version_id, concepto, periodo, valor) VALUES (111, :c, :p, :v)"
+        ), {"c": concepto, "p": periodo, "v": valor})
+    db_catalogo.commit()
+    invalidar_catalogo("test")
+    return db_catalogo
+
+
+def _versiones_sql(db, fecha):
+    return [fila[0] for fila in db.execute(text("""
+        SELECT tv.id FROM tarifa_versiones tv JOIN tarifas t ON tv.tarifa_id = t.id
+        WHERE t.atr = '2.0TD' AND tv.vigente_desde <= :f AND (tv.vigente_hasta IS NULL OR tv.vigente_hasta >= :f)
+        ORDER BY t.comercializadora, t.nombre
+    """), {"f": fecha})]
+
+
+def test_indice_resuelve_igual_que_sql_en_los_cortes(cambio_precios):
+    cargas = catalogo_stats()["cargas_bd"]
+    fechas = [date(2024, 12, 31), date(2025, 1, 1), date(2026, 1, 31), date(2026, 2, 1),
+              date(2026, 2, 28), date(2026, 3, 1), date(2030, 1, 1)]
+    for fecha in fechas:
+        assert [t["tarifa_version_id"] for t in get_catalogo(cambio_precios, "2.0TD", fecha).tarifas] == \
+            _versiones_sql(cambio_precios, fecha), fecha
+
+    # Una sola carga de BD para todas las fechas del ATR
+    assert catalogo_stats()["cargas_bd"] == cargas + 1
+    assert catalogo_stats()["indices"] == {"2.0TD": 3}  # 2025-01-01, 2026-02-01, 2026-03-01
+
+
+def test_fechas_del_mismo_tramo_comparten_catalogo(cambio_precios):
+    cargas = catalogo_stats()["cargas_bd"]
+    assert get_catalogo(cambio_precios, "2.0TD", date(2025, 3, 1)) is get_catalogo(cambio_precios, "2.0TD", date(2025, 9, 1))
+    invalidar_catalogo("test")
+    get_catalogo(cambio_precios, "2.0TD", date(2025, 3, 1))
+    assert catalogo_stats()["cargas_bd"] == cargas + 2  # la invalidación descarta el índice
+
+
+def test_compare_factura_as_of_no_persiste(cambio_precios):
+    factura = _factura(cambio_precios)
+
+    actual = compare_factura(factura, cambio_precios)
+    historico = compare_factura(factura, cambio_precios, as_of=date(2026, 1, 15))
+
+    assert historico["preview"] is True and historico["as_of"] == "2026-01-15"
+    assert {o["tarifa_version_id"] for o in historico["offers"]} == {101, 102, 103, 104}
+    assert {o["tarifa_version_id"] for o in actual["offers"]} == {111, 102, 104}
+    # La re-comparación histórica no desplaza la última comparativa
+    assert compare_factura(factura, cambio_precios)["comparativa_id"] == actual["comparativa_id"]
+
+
+def test_endpoint_as_of(cambio_precios, api_webhook):
+    factura = _factura(cambio_precios, fecha_fin="2026-01-20")
+    url = f"/webhook/comparar/facturas/{factura.id}"
+
+    r = api_webhook.post(url, params={"as_of": "factura"})
+    assert r.status_code == 200
+    assert r.json()["as_of"] == "2026-01-19"
+    assert 101 in {o["tarifa_version_id"] for o in r.json()["offers"]}
+
+    r = api_webhook.post(url, params={"as_of": "2026-02-10"})
+    assert {o["tarifa_version_id"] for o in r.json()["offers"]} == {111, 102, 103, 104}
+
+    r = api_webhook.post(url, params={"as_of": "ayer"})
+    assert r.status_code == 422 and r.json()["detail"]["code"] == "AS_OF_INVALID"
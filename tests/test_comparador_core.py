@@ -0,0 +1,54 @@
+import pickle
+import random
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.catalogo_tarifas import CatalogoTarifas, get_catalogo
+from app.services.comparador import _preparar_entrada, compare_factura
+from app.services.comparador_core import FacturaComparable, calcular_comparacion
+from tests.test_comparador_lote import _factura
+from tests.test_motor_vectorizado import _catalogo_aleatorio
+
+
+def _entrada():
+    return FacturaComparable(
+        factura_id=7, atr="2.0TD", num_periodos_energia=3, num_periodos_potencia=2,
+        current_total=120.0, periodo_dias=30, consumos=[120.0, 90.0, 150.0], potencias=[4.6, 4.6],
+        iva_pct=0.21, iva_importe=20.83, iee_importe=4.5, alquiler_importe=0.81, alquiler_equipo=0.81,
+    )
+
+
+def _comparar(args):
+    entrada, catalogo = args
+    return calcular_comparacion(entrada, catalogo)
+
+
+def test_nucleo_no_importa_sqlalchemy():
+    codigo = "import sys, app.services.comparador_core; assert 'sqlalchemy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", codigo], check=True)
+
+
+def test_mismo_resultado_en_otro_proceso():
+    tarifas, precios_map = _catalogo_aleatorio(random.Random(3), "2.0TD", 50)
+    catalogo = CatalogoTarifas("2.0TD", None, tarifas, precios_map, {}, 0)
+    entrada = _entrada()
+
+    assert pickle.loads(pickle.dumps(entrada)) == entrada
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        remoto = pool.submit(_comparar, (entrada, catalogo)).result()
+
+    assert remoto == calcular_comparacion(entrada, catalogo)
+
+
+def test_compare_factura_envuelve_el_nucleo(db_catalogo):
+    factura = _factura(db_catalogo)
+    entrada = _preparar_entrada(factura)
+
+    puro = calcular_comparacion(entrada, get_catalogo(db_catalogo, entrada.atr))
+    guardado = compare_factura(factura, db_catalogo)
+
+    assert not hasattr(entrada, "__dict__")
+    assert [o["tarifa_version_id"] for o in puro["offers"]] == [o["tarifa_version_id"] for o in guardado["offers"]]
+    assert puro["current_total"] == guardado["current_total"]
+    assert puro["comparativa_id"] is None and guardado["comparativa_id"] is not None
@@ -0,0 +1,92 @@
+from datetime import date
+
+from app.db.models import Comparativa, Factura, OfertaCalculada
+from app.services.comparador import compare_factura, compare_facturas_lote
+
+
+HOY = date(2026, 3, 1)
+
+
+def _factura(db, **overrides):
+    datos = dict(
+        filename="f.pdf", cups="ES0021000000000001AB", atr="2.0TD",
+        consumo_p1_kwh=120.0, consumo_p2_kwh=95.0, consumo_p3_kwh=210.0,
+        potencia_p1_kw=4.6, potencia_p2_kw=4.6, periodo_dias=30,
+        total_factura=110.0, total_ajustado=110.0, validado_step2=True,
+        iva=19.09, impuesto_electrico=4.5, alquiler_contador=0.81, iva_porcentaje=21.0,
+    )
+    datos.update(overrides)
+    factura = Factura(**datos)
+    db.add(factura)
+    db.commit()
+    return factura
+
+
+def test_compare_factura_persiste_ofertas(db_catalogo):
+    factura = _factura(db_catalogo)
+
+    result = compare_factura(factura, db_catalogo)
+
+    assert result["comparativa_id"] is not None
+    assert [o["tarifa_version_id"] for o in result["offers"]][-1] == 104  # parcial (BOE) al final
+    filas = db_catalogo.query(OfertaCalculada).filter_by(comparativa_id=result["comparativa_id"]).all()
+    assert len(filas) == len(result["offers"]) == 4
+    assert {f.comision_source for f in filas} == {"manual"}
+
+
+def test_lote_errores_en_linea_y_mismo_resultado_que_unitario(db_catalogo):
+    buenas = [_factura(db_catalogo), _factura(db_catalogo, consumo_p1_kwh=300.0)]
+    sin_step2 = _factura(db_catalogo, validado_step2=False)
+    sin_periodo = _factura(db_catalogo, periodo_dias=None)
+
+    items = list(compare_facturas_lote(
+        db_catalogo, [buenas[0], sin_step2, buenas[1], sin_periodo], fecha=HOY, tamano_trozo=2, incluir_ofertas=True
+    ))
+
+    por_id = {item["factura_id"]: item for item in items}
+    assert len(items) == 4
+    assert por_id[sin_step2.id]["error_code"] == "STEP2_REQUIRED"
+    assert por_id[sin_periodo.id]["error_code"] == "PERIOD_REQUIRED"
+
+    for factura in buenas:
+        item = por_id[factura.id]
+        assert item["ok"] and item["ofertas_count"] == 4
+        assert item["mejor_oferta"]["tag"] == "best_saving"
+        assert db_catalogo.get(Comparativa, item["comparativa_id"]).factura_id == factura.id
+        unitario = compare_factura(factura, db_catalogo)
+        assert unitario["comparativa_id"] == item["comparativa_id"]  # misma huella → reutilizada
+        assert [o["estimated_total"] for o in unitario["offers"]] == [o["estimated_total"] for o in item["offers"]]
+
+    assert db_catalogo.query(OfertaCalculada).count() == 2 * 4
+
+
+def test_insert_bloque_pagina_multifila_en_sqlite(db_catalogo):
+    from decimal import Decimal
+    from app.services.comparador import OFERTAS_INSERT_PAGINA, _insert_filas_ofertas
+
+    comparativa = Comparativa(factura_id=_factura(db_catalogo).id, periodo_dias=30, current_total=110.0)
+    db_catalogo.add(comparativa)
+    db_catalogo.flush()
+    filas = [
+        {
+            "comparativa_id": comparativa.id, "tarifa_id": i, "tarifa_version_id": None,
+            "coste_estimado": 100.0 + i, "ahorro_mensual": None, "ahorro_anual": None,
+            "comision_eur": Decimal("12.50"), "comision_source": "tarifa", "detalle_json": "{}",
+        }
+        for i in range(OFERTAS_INSERT_PAGINA * 2 + 7)
+    ]
+
+    assert _insert_filas_ofertas(db_catalogo, filas) == len(filas)
+    guardadas = db_catalogo.query(OfertaCalculada).filter_by(comparativa_id=comparativa.id).all()
+    assert len(guardadas) == len(filas)
+    assert {float(o.comision_eur) for o in guardadas} == {12.5}
+
+
+def test_lote_ceo_sin_company_403(db_catalogo, api_webhook):
+    from app.auth import CurrentUser, get_current_user
+
+    _factura(db_catalogo)
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(3, "ceo@x.es", "Ceo", "ceo", None)
+
+    r = api_webhook.post("/webhook/comparar/batch", json={"estado_factura": "pendiente_datos"})
+    assert r.status_code == 403
@@ -0,0 +1,79 @@
+import csv
+import random
+
+from app.services.catalogo_tarifas import CatalogoTarifas
+from app.services.comparador_masivo import (
+    COLUMNAS_SALIDA,
+    EscritorResultados,
+    comparar_filas,
+    fila_a_entrada,
+    leer_filas,
+)
+from app.services.comparador_core import calcular_comparacion
+from tests.test_motor_vectorizado import _catalogo_aleatorio
+
+
+def _catalogos():
+    catalogos = {}
+    for seed, atr in enumerate(("2.0TD", "3.0TD")):
+        tarifas, precios_map = _catalogo_aleatorio(random.Random(seed), atr, 40)
+        catalogos[atr] = CatalogoTarifas(atr, None, tarifas, precios_map, {}, 0)
+    return catalogos
+
+
+def _filas(n):
+    rng = random.Random(11)
+    filas = []
+    for i in range(n):
+        fila = {
+            "cups": f"ES00{i:04d}",
+            "atr": "3.0TD" if i % 3 == 0 else "2.0TD",
+            "potencia_p1_kw": str(round(rng.uniform(3, 20), 2)),
+            "potencia_p2_kw": str(round(rng.uniform(3, 20), 2)),
+            "periodo_dias": "30",
+            "total_factura": str(round(rng.uniform(60, 500), 2)).replace(".", ","),
+        }
+        for p in range(1, 7):
+            fila[f"consumo_p{p}_kwh"] = str(round(rng.uniform(0, 600), 1))
+        filas.append(fila)
+    return filas
+
+
+def test_mismas_ofertas_que_el_nucleo_con_y_sin_procesos():
+    catalogos = _catalogos()
+    filas = _filas(25)
+    filas[4]["periodo_dias"] = ""
+    filas[7]["atr"] = "6.1TD"
+
+    en_proceso, repartido = [], []
+    stats = comparar_filas(filas, catalogos, en_proceso.extend, top_k=3, procesos=1, tamano_trozo=4)
+    comparar_filas(filas, catalogos, repartido.extend, top_k=3, procesos=2, tamano_trozo=4)
+
+    assert en_proceso == repartido
+    assert [f["fila"] for f in en_proceso] == sorted(f["fila"] for f in en_proceso)
+    assert stats["filas"] == 25 and stats["errores"] == 2 and stats["ofertas"] == 23 * 3
+    assert {f["fila"]: f["error_code"] for f in en_proceso if f["error_code"]} == {5: "PERIOD_REQUIRED", 8: "NO_TARIFAS_VIGENTES"}
+
+    entrada = fila_a_entrada(1, filas[0])
+    esperado = calcular_comparacion(entrada, catalogos[entrada.atr], 3)["offers"]
+    assert [f["tarifa_version_id"] for f in en_proceso if f["fila"] == 1] == [o["tarifa_version_id"] for o in esperado]
+
+
+def test_csv_ida_y_vuelta(tmp_path):
+    entrada = tmp_path / "puntos.csv"
+    filas = _filas(3)
+    with open(entrada, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(filas[0]), delimiter=";")
+        writer.writeheader()
+        writer.writerows(filas)
+
+    salida = tmp_path / "ofertas.csv"
+    escritor = EscritorResultados(str(salida))
+    comparar_filas(leer_filas(str(entrada)), _catalogos(), escritor.escribir, top_k=2, procesos=1)
+    escritor.cerrar()
+
+    with open(salida, newline="", encoding="utf-8") as f:
+        leidas = list(csv.DictReader(f))
+    assert tuple(leidas[0]) == COLUMNAS_SALIDA
+    assert [(r["fila"], r["ranking"]) for r in leidas] == [("1", "1"), ("1", "2"), ("2", "1"), ("2", "2"), ("3", "1"), ("3", "2")]
+    assert leidas[0]["cups"] == "ES000000"
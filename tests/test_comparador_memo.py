@@ -0,0 +1,53 @@
+from sqlalchemy import text
+
+from app.db.models import Comparativa
+from app.services.catalogo_tarifas import invalidar_catalogo
+from app.services.comparador import compare_factura, compare_facturas_lote
+from tests.test_comparador_lote import _factura
+
+
+def test_misma_huella_reutiliza_comparativa(db_catalogo):
+    factura = _factura(db_catalogo)
+
+    primero = compare_factura(factura, db_catalogo)
+    segundo = compare_factura(factura, db_catalogo)
+
+    assert segundo["comparativa_id"] == primero["comparativa_id"]
+    assert segundo == primero
+    assert db_catalogo.query(Comparativa).count() == 1
+
+
+def test_cambio_de_inputs_recalcula(db_catalogo):
+    factura = _factura(db_catalogo)
+    primero = compare_factura(factura, db_catalogo)
+
+    factura.total_ajustado = 125.0
+    db_catalogo.commit()
+    segundo = compare_factura(factura, db_catalogo)
+
+    assert segundo["comparativa_id"] != primero["comparativa_id"]
+    assert segundo["current_total"] != primero["current_total"]
+
+
+def test_cambio_de_catalogo_recalcula(db_catalogo):
+    factura = _factura(db_catalogo)
+    primero = compare_factura(factura, db_catalogo)
+
+    db_catalogo.execute(text("UPDATE tarifa_precios SET valor = 0.101 WHERE tarifa_version_id = 101 AND periodo = 'P1'"))
+    db_catalogo.commit()
+    invalidar_catalogo("test")
+    segundo = compare_factura(factura, db_catalogo)
+
+    assert segundo["comparativa_id"] != primero["comparativa_id"]
+
+
+def test_lote_reutiliza_comparativas_sin_cambios(db_catalogo):
+    facturas = [_factura(db_catalogo), _factura(db_catalogo, consumo_p2_kwh=40.0)]
+
+    primera = list(compare_facturas_lote(db_catalogo, facturas))
+    segunda = list(compare_facturas_lote(db_catalogo, facturas))
+
+    assert [i["reutilizada"] for i in primera] == [False, False]
+    assert [i["reutilizada"] for i in segunda] == [True, True]
+    assert [i["comparativa_id"] for i in segunda] == [i["comparativa_id"] for i in primera]
+    assert db_catalogo.query(Comparativa).count() == 2
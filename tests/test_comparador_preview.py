@@ -0,0 +1,47 @@
+from app.db.models import Comparativa, Factura, OfertaCalculada
+from app.services.comparador import compare_factura, factura_con_cambios
+from tests.test_comparador_lote import _factura
+
+
+def test_preview_no_escribe(db_catalogo):
+    factura = _factura(db_catalogo)
+
+    preview = compare_factura(factura, db_catalogo, persistir=False)
+    guardado = compare_factura(factura, db_catalogo)
+
+    assert preview["preview"] is True and preview["comparativa_id"] is None
+    assert [o["estimated_total"] for o in preview["offers"]] == [o["estimated_total"] for o in guardado["offers"]]
+    assert db_catalogo.query(Comparativa).count() == 1
+    assert db_catalogo.query(OfertaCalculada).count() == 4
+
+
+def test_preview_what_if_sin_tocar_la_factura(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    base = compare_factura(factura, db_catalogo, persistir=False)
+
+    resp = api_webhook.post(
+        f"/webhook/comparar/facturas/{factura.id}?preview=true",
+        json={"cambios": {"total_ajustado": 140.0}},
+    )
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["preview"] is True
+    assert body["offers"][0]["saving_amount"] > base["offers"][0]["saving_amount"]
+    db_catalogo.expire_all()
+    assert db_catalogo.get(Factura, factura.id).total_ajustado == 110.0
+    assert db_catalogo.query(Comparativa).count() == 0
+
+
+def test_cambios_solo_en_preview_y_campos_permitidos(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+
+    sin_preview = api_webhook.post(f"/webhook/comparar/facturas/{factura.id}", json={"cambios": {"total_ajustado": 1.0}})
+    campo_invalido = api_webhook.post(
+        f"/webhook/comparar/facturas/{factura.id}?preview=true", json={"cambios": {"cliente_id": 7}}
+    )
+
+    assert sin_preview.status_code == 400
+    assert campo_invalido.status_code == 400
+    assert campo_invalido.json()["detail"]["code"] == "PREVIEW_FIELDS_INVALID"
+    assert factura_con_cambios(factura).total_ajustado == 110.0
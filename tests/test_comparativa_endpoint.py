@@ -0,0 +1,36 @@
+from app.db.models import Factura
+from app.services.comparador import compare_factura
+from tests.test_comparador_lote import _factura
+
+
+def test_get_comparativa_etag_y_304(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    assert api_webhook.get(f"/webhook/facturas/{factura.id}/comparativa").status_code == 404
+
+    result = compare_factura(factura, db_catalogo)
+    resp = api_webhook.get(f"/webhook/facturas/{factura.id}/comparativa")
+
+    assert resp.status_code == 200
+    assert resp.headers["etag"] == f'"comparativa-{result["comparativa_id"]}-0"'
+    assert resp.json()["offers"] == result["offers"]
+
+    cache = api_webhook.get(
+        f"/webhook/facturas/{factura.id}/comparativa", headers={"If-None-Match": resp.headers["etag"]}
+    )
+    assert cache.status_code == 304
+    assert cache.content == b""
+
+
+def test_puntero_sigue_a_la_ultima_comparativa(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    primero = compare_factura(factura, db_catalogo)
+    etag = api_webhook.get(f"/webhook/facturas/{factura.id}/comparativa").headers["etag"]
+
+    factura.consumo_p1_kwh = 200.0
+    db_catalogo.commit()
+    segundo = compare_factura(factura, db_catalogo)
+
+    assert db_catalogo.get(Factura, factura.id).ultima_comparativa_id == segundo["comparativa_id"] != primero["comparativa_id"]
+    resp = api_webhook.get(f"/webhook/facturas/{factura.id}/comparativa", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json()["comparativa_id"] == segundo["comparativa_id"]
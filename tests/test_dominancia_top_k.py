@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.services.catalogo_tarifas import CatalogoTarifas
+from app.services.comparador_core import FacturaComparable, calcular_comparacion
+from app.services.motor_vectorizado import calcular_capas_dominancia
+from tests.test_motor_vectorizado import _catalogo_aleatorio
+
+
+def _capas_por_pelado(precios, grupo, valida):
+    # Definición directa: capa c = frente de Pareto tras quitar las capas 1..c-1
+    capa = np.zeros(len(precios), dtype=np.int32)
+    pendientes = valida.copy()
+    c = 0
+    while pendientes.any():
+        c += 1
+        frente = []
+        for i in np.flatnonzero(pendientes):
+            rivales = precios[pendientes & (grupo == grupo[i])]
+            if not ((rivales <= precios[i]).all(axis=1) & (rivales < precios[i]).any(axis=1)).any():
+                frente.append(i)
+        capa[frente] = c
+        pendientes[frente] = False
+    return capa
+
+
+def test_capas_coinciden_con_pelado_de_frentes():
+    rng = np.random.default_rng(7)
+    # Precios enteros y discretos para forzar empates y duplicados sin ruido de redondeo
+    precios = rng.choice([1.0, 2.0, 3.0, 4.0], size=(400, 4))
+    grupo = rng.random(400) < 0.3
+    valida = rng.random(400) < 0.9
+
+    capa = calcular_capas_dominancia(precios, grupo, valida)
+
+    assert (capa == _capas_por_pelado(precios, grupo, valida)).all()
+    assert capa.max() > 2
+
+
+def test_capas_no_cruzan_grupos_ni_separan_duplicados():
+    precios = np.array([[0.1, 0.1], [0.2, 0.2], [0.1, 0.1], [0.3, 0.3], [0.3, 0.4]])
+    grupo = np.array([False, False, False, True, False])
+
+    capa = calcular_capas_dominancia(precios, grupo, np.ones(5, dtype=bool))
+
+    assert capa.tolist() == [1, 2, 1, 1, 3]
+
+
+def test_capas_por_encima_del_maximo_quedan_agrupadas():
+    precios = np.arange(10, dtype=np.float64).reshape(10, 1)
+
+    capa = calcular_capas_dominancia(precios, np.zeros(10, dtype=bool), np.ones(10, dtype=bool), max_capas=3)
+
+    assert capa.tolist() == [1, 2, 3] + [4] * 7
+
+
+def _entrada(rng, atr):
+    num_e = 6 if atr == "3.0TD" else 3
+    p1, p2 = rng.uniform(2, 20), rng.uniform(2, 20)
+    return FacturaComparable(
+        factura_id=1, atr=atr, num_periodos_energia=num_e, num_periodos_potencia=2,
+        current_total=rng.uniform(80, 400), periodo_dias=rng.randint(25, 35),
+        consumos=[rng.uniform(0, 800) for _ in range(num_e)],
+        potencias=[p1, p2, p2, p2, p2, p2] if atr == "3.0TD" else [p1, p2],
+        iva_pct=0.0021, alquiler_importe=0.81, alquiler_equipo=0.81,
+    )
+
+
+@pytest.mark.parametrize("atr", ["2.0TD", "3.0TD"])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("k", [1, 3, 10])
+def test_top_k_igual_a_prefijo_de_lista_completa(atr, seed, k):
+    rng = random.Random(seed)
+    tarifas, precios_map = _catalogo_aleatorio(rng, atr, 300)
+    catalogo = CatalogoTarifas(atr, None, tarifas, precios_map, {}, 0)
+    entrada = _entrada(rng, atr)
+
+    completo = calcular_comparacion(entrada, catalogo)
+    top = calcular_comparacion(entrada, catalogo, top_k=k)
+
+    assert (catalogo.matrices.capa_dominancia > 1).any()
+    assert top["offers"] == completo["offers"][:k]
+    assert {key: v for key, v in top.items() if key != "offers"} == {key: v for key, v in completo.items() if key != "offers"}
@@ -0,0 +1,97 @@
+from datetime import date
+
+import pytest
+
+from app.db.models import ConsumoCupsMensual
+from app.services.comparador import compare_factura
+from app.services.historico_consumo import (
+    PESOS_MENSUALES_CONSUMO,
+    actualizar_historico_factura,
+    factor_anual_estacional,
+    reparto_mensual,
+)
+from tests.test_comparador_lote import _factura
+
+
+def test_reparto_mensual_por_dias():
+    reparto = reparto_mensual(date(2026, 1, 15), 45, 450.0)
+    assert [(mes, dias) for mes, _, dias in reparto] == [(date(2026, 1, 1), 17), (date(2026, 2, 1), 28)]
+    assert [round(kwh, 6) for _, kwh, _ in reparto] == [170.0, 280.0]
+
+
+def test_factor_con_historico_completo_y_con_una_sola_factura():
+    # 12 meses completos: el consumo anual es la suma real, sin pesos
+    meses = {date(2025, m, 1): (100.0 + m, (date(2025 + m // 12, m % 12 + 1, 1) - date(2025, m, 1)).days)
+             for m in range(1, 13)}
+    assert factor_anual_estacional(meses, date(2026, 1, 1), 111.0) == pytest.approx(sum(100.0 + m for m in range(1, 13)) / 111.0)
+
+    # Solo una factura de enero: el resto del año sale de los pesos estacionales
+    enero = {date(2026, 1, 1): (400.0, 31)}
+    factor = factor_anual_estacional(enero, date(2026, 2, 1), 400.0)
+    assert factor == pytest.approx(1 / PESOS_MENSUALES_CONSUMO[0])
+    assert factor < 360 / 31  # invierno: menos que la extrapolación lineal
+
+    assert factor_anual_estacional({}, date(2026, 2, 1), 400.0) is None
+
+
+def test_comparador_anualiza_con_historico_y_cambia_la_huella(db_catalogo):
+    sin_fecha = _factura(db_catalogo, cups="ES0099")
+    assert compare_factura(sin_fecha, db_catalogo, persistir=False)["anualizacion"] == "lineal"
+
+    factura = _factura(db_catalogo, fecha_inicio="2026-01-01", periodo_dias=31)
+    assert actualizar_historico_factura(db_catalogo, factura) == 1
+    db_catalogo.commit()
+
+    resultado = compare_factura(factura, db_catalogo)
+    assert resultado["anualizacion"] == "estacional"
+    factor = 1 / PESOS_MENSUALES_CONSUMO[0]
+    for oferta in resultado["offers"]:
+        assert oferta["saving_amount_annual"] == pytest.approx(oferta["ahorro_periodo"] * factor, abs=0.06)
+    assert compare_factura(factura, db_catalogo)["comparativa_id"] == resultado["comparativa_id"]
+
+    # Nueva factura del mismo CUPS (diciembre): cambia el histórico → nueva comparativa
+    anterior = _factura(db_catalogo, fecha_inicio="2025-12-01", periodo_dias=31, file_hash="h-dic")
+    actualizar_historico_factura(db_catalogo, anterior)
+    db_catalogo.commit()
+    nuevo = compare_factura(factura, db_catalogo)
+    assert nuevo["comparativa_id"] != resultado["comparativa_id"]
+    assert nuevo["offers"][0]["saving_amount_annual"] != resultado["offers"][0]["saving_amount_annual"]
+
+
+def test_edicion_reescribe_la_aportacion_de_la_factura(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo, fecha_fin="2026-03-16", periodo_dias=30)
+    r = api_webhook.put(f"/webhook/facturas/{factura.id}", json={"consumo_p1_kwh": 20.0})
+    assert r.status_code == 200
+
+    filas = db_catalogo.query(ConsumoCupsMensual).filter(ConsumoCupsMensual.factura_id == factura.id).all()
+    assert sorted((f.mes, f.dias) for f in filas) == [(date(2026, 2, 1), 15), (date(2026, 3, 1), 15)]
+    assert sum(f.kwh for f in filas) == pytest.approx(20.0 + 95.0 + 210.0)
+
+
+def test_potencia_anualiza_igual_que_el_comparador(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo, fecha_inicio="2026-01-01", periodo_dias=31)
+    actualizar_historico_factura(db_catalogo, factura)
+    db_catalogo.commit()
+
+    comparacion = {o["tarifa_version_id"]: o for o in compare_factura(factura, db_catalogo, persistir=False)["offers"]}
+    potencia = api_webhook.post(f"/webhook/comparar/facturas/{factura.id}/potencia").json()
+
+    assert potencia["anualizacion"] == "estacional"
+    for oferta in potencia["offers"]:
+        # Sin maxímetro la potencia no baja: mismo total y mismo ahorro anual que /comparar
+        assert oferta["saving_amount_annual"] == comparacion[oferta["tarifa_version_id"]]["saving_amount_annual"]
+
+
+def test_rollup_unico_por_cups_mes_factura(db_catalogo):
+    from sqlalchemy.exc import IntegrityError
+
+    factura = _factura(db_catalogo, fecha_inicio="2026-01-01", periodo_dias=31)
+    actualizar_historico_factura(db_catalogo, factura)
+    db_catalogo.commit()
+    fila = db_catalogo.query(ConsumoCupsMensual).one()
+
+    # Mismo esquema que la migración: create_all también tiene la restricción
+    db_catalogo.add(ConsumoCupsMensual(cups=fila.cups, mes=fila.mes, factura_id=fila.factura_id, kwh=1.0, dias=1))
+    with pytest.raises(IntegrityError):
+        db_catalogo.flush()
+    db_catalogo.rollback()
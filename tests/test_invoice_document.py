@@ -0,0 +1,50 @@
+from app.services.ocr import (
+    InvoiceDocument,
+    _extract_consumo_safe,
+    _extract_table_consumos,
+    _preprocess_fragmented_text,
+    extract_atr,
+    extract_potencias,
+    parse_invoice_text,
+)
+
+TEXTO = (
+    "Peaje acceso 2.0TD\n"
+    "Potencia contratada en punta: 4,6 kW\n"
+    "Potencia contratada en valle: 4,6 kW\n"
+    "Su consumo en el periodo facturado ha sido 67 kWh\n"
+    "Consumo P1: 17 kWh\n"
+    "Consumo P2: 18 kWh\n"
+    "Consumo P3: 32 kWh\n"
+    "Total a pagar 26,87 €\n"
+)
+
+
+def test_estrategias_aceptan_documento():
+    doc = InvoiceDocument.desde_texto(TEXTO)
+
+    assert extract_atr(doc) == extract_atr(TEXTO) == "2.0TD"
+    assert extract_potencias(doc) == extract_potencias(TEXTO)
+    assert _extract_consumo_safe(doc) == _extract_consumo_safe(TEXTO)
+    assert _extract_table_consumos(doc) == _extract_table_consumos(TEXTO)
+    assert parse_invoice_text(doc) == parse_invoice_text(TEXTO)
+
+
+def test_indice_de_palabras_y_lineas():
+    doc = InvoiceDocument.desde_texto("Total a pagar 10 €\nCONSUMO P1: 5 kWh\nconsumo p2: 6 kWh")
+
+    assert len(doc.lower) == len(doc.texto)
+    assert doc.contiene("consumo") and doc.contiene("pagar") and not doc.contiene("direcci")
+    assert doc.lineas_con("consumo") == [1, 2]
+    assert doc.lineas_con("p2", "€") == [0, 2]
+    assert [doc.texto[pos:pos + 7] for pos in doc.indice["consumo"]] == ["CONSUMO", "consumo"]
+    # 'İ'/'ı' casan con "i" en los patrones IGNORECASE: la vista plegada también
+    assert InvoiceDocument.desde_texto("DİRECCİÓN: Calle Mayor 1").contiene("direcci")
+
+
+def test_preproceso_vision_en_el_documento():
+    fragmentado = "Fecha 1\n7/09/2025\nConsumo total 8\n3,5 kWh"
+    doc = InvoiceDocument.desde_texto(fragmentado, fragmentado=True)
+
+    assert "17/09/2025" in doc.texto
+    assert parse_invoice_text(doc, is_image=True) == parse_invoice_text(_preprocess_fragmented_text(fragmentado))
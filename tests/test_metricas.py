@@ -0,0 +1,70 @@
+import pytest
+
+from app.services import metricas
+from app.services.comparador import compare_factura
+from app.services.metricas import iniciar_traza, metricas_prometheus, metricas_stats, reiniciar_metricas, span
+from tests.test_comparador_lote import _factura
+
+
+@pytest.fixture(autouse=True)
+def _limpiar():
+    reiniciar_metricas()
+    token = metricas._traza.set(None)
+    yield
+    metricas._traza.reset(token)
+    reiniciar_metricas()
+
+
+def test_span_acumula_en_traza_e_histograma():
+    traza = iniciar_traza()
+    for _ in range(3):
+        with span("etapa"):
+            pass
+    with pytest.raises(ValueError):
+        with span("falla"):
+            raise ValueError("x")
+
+    assert set(traza.etapas) == {"etapa", "falla"}
+    stats = metricas_stats()["etapas"]
+    assert stats["etapa"]["n"] == 3 and stats["falla"]["n"] == 1
+    assert sum(stats["etapa"]["buckets"].values()) == 3
+    assert 'comparador_etapa_ms_bucket{etapa="etapa",le="+Inf"} 3' in metricas_prometheus()
+
+
+def test_desactivadas_sin_registro(monkeypatch):
+    monkeypatch.setattr(metricas, "METRICAS_ACTIVAS", False)
+    assert iniciar_traza() is None
+    with span("etapa"):
+        pass
+    assert metricas_stats()["etapas"] == {}
+
+
+def test_compare_factura_por_etapas(db_catalogo):
+    factura = _factura(db_catalogo)
+    traza = iniciar_traza()
+    compare_factura(factura, db_catalogo)
+
+    assert {"comparar", "preparar", "catalogo", "catalogo_bd", "precios_bd", "memo", "valoracion",
+            "insert_ofertas", "commit"} <= set(traza.etapas)
+    assert traza.etapas["comparar"] >= traza.etapas["valoracion"]
+
+
+def test_cabecera_server_timing(db_catalogo, api_webhook):
+    api_webhook.app.add_middleware(metricas.MiddlewareTiempos)
+    factura = _factura(db_catalogo)
+    url = f"/webhook/comparar/facturas/{factura.id}"
+
+    assert "server-timing" not in api_webhook.post(url).headers
+    r = api_webhook.post(url, headers={"X-Debug-Tiempos": "1"})
+    assert r.status_code == 200
+    assert "comparar;dur=" in r.headers["server-timing"]
+
+
+def test_middleware_sin_metricas_no_toca_la_respuesta(db_catalogo, api_webhook, monkeypatch):
+    monkeypatch.setattr(metricas, "METRICAS_ACTIVAS", False)
+    api_webhook.app.add_middleware(metricas.MiddlewareTiempos)
+    factura = _factura(db_catalogo)
+
+    r = api_webhook.post(f"/webhook/comparar/facturas/{factura.id}", headers={"X-Debug-Tiempos": "1"})
+    assert r.status_code == 200 and "server-timing" not in r.headers
+    assert metricas.traza_actual() is None
@@ -0,0 +1,171 @@
+"""
+El motor vectorizado debe reproducir EXACTAMENTE el bucle escalar del método PO.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from app.services.comparador import _get_precio_energia, _get_precio_potencia, _reconstruir_factura
+from app.services.motor_vectorizado import (
+    calcular_ofertas_vectorizado,
+    calcular_totales_suministros,
+    construir_matrices,
+    normalizar_precios,
+    num_periodos_atr,
+)
+
+
+def _catalogo_aleatorio(rng, atr, n):
+    tarifas, precios_map = [], {}
+    for vid in range(1, n + 1):
+        tarifas.append({"tarifa_version_id": vid, "tarifa_id": vid})
+        forma = rng.choice(["periodos", "24h", "solo_p1", "sin_precios", "sin_potencia", "sin_p1"])
+        if forma == "sin_precios":
+            continue
+        energia = {}
+        if forma == "24h":
+            energia["24H"] = rng.uniform(0.08, 0.25)
+        elif forma == "solo_p1":
+            energia["P1"] = rng.uniform(0.08, 0.25)
+        else:
+            for i in range(1, 7):
+                if forma == "sin_p1" and i == 1:
+                    continue
+                if rng.random() > 0.1:
+                    energia[f"P{i}"] = rng.uniform(0.05, 0.30)
+        potencia = {}
+        if forma != "sin_potencia":
+            for i in (1, 2):
+                if rng.random() > 0.15:
+                    potencia[f"P{i}"] = rng.uniform(0.001, 0.12)
+        precios_map[vid] = {"energia": energia, "potencia": potencia}
+    return tarifas, precios_map
+
+
+def _referencia_escalar(tarifas, precios_map, atr, consumos, potencias, dias, iva_pct, alquiler, total_ref, subtotal_actual):
+    """Bucle original de compare_factura (antes del motor vectorizado)."""
+    num_e, num_p = num_periodos_atr(atr)
+    resultado = {}
+    for tarifa in tarifas:
+        precios_version = precios_map.get(tarifa["tarifa_version_id"])
+        if not precios_version:
+            continue
+        precios_energia = [_get_precio_energia(precios_version["energia"], i) for i in range(1, num_e + 1)]
+        if precios_energia[0] is None:
+            continue
+        coste_energia = sum(consumos[i] * (precios_energia[i] or 0.0) for i in range(num_e))
+        precios_potencia, boe = [], False
+        for i in range(1, num_p + 1):
+            precio = _get_precio_potencia(precios_version["potencia"], i)
+            if precio is None and atr == "2.0TD":
+                precio = 0.073777 if i == 1 else 0.001911
+                boe = True
+            precios_potencia.append(precio or 0.0)
+        coste_potencia = dias * sum(potencias[i] * precios_potencia[i] for i in range(num_p))
+        subtotal = coste_energia + coste_potencia
+        total = _reconstruir_factura(subtotal, iva_pct, alquiler, 0.0511269632)
+        ahorro = total_ref - total
+        factor = 30.0 / float(dias)
+        resultado[tarifa["tarifa_version_id"]] = {
+            "coste_energia": coste_energia,
+            "coste_potencia": coste_potencia,
+            "total": total,
+            "ahorro_periodo": ahorro,
+            "ahorro_anual": ahorro * factor * 12.0,
+            "ahorro_mensual": ahorro * factor,
+            "ahorro_estructural": subtotal_actual - subtotal,
+            "saving_percent": (ahorro / total_ref * 100) if total_ref > 0 else 0.0,
+            "boe": boe,
+        }
+    return resultado
+
+
+@pytest.mark.parametrize("atr", ["2.0TD", "3.0TD"])
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorizado_coincide_con_bucle_escalar(atr, seed):
+    rng = random.Random(seed)
+    tarifas, precios_map = _catalogo_aleatorio(rng, atr, 60)
+    num_e, _ = num_periodos_atr(atr)
+    consumos = [round(rng.uniform(0, 900), 2) for _ in range(num_e)]
+    p1, p2 = round(rng.uniform(2, 20), 3), round(rng.uniform(2, 20), 3)
+    potencias = [p1, p2] if atr == "2.0TD" else [p1, p2, p2, p2, p2, p2]
+    dias = rng.randint(25, 62)
+    args = dict(iva_pct=0.21, alquiler=rng.choice([0.0, 0.81, 1.62]), total_ref=rng.uniform(40, 600), subtotal_actual=rng.uniform(30, 500))
+
+    esperado = _referencia_escalar(tarifas, precios_map, atr, consumos, potencias, dias, **args)
+
+    matrices = construir_matrices(tarifas, precios_map, atr)
+    calculo = calcular_ofertas_vectorizado(
+        matrices, consumos, potencias, dias,
+        iva_pct=args["iva_pct"], alquiler=args["alquiler"],
+        total_referencia=args["total_ref"], subtotal_actual=args["subtotal_actual"],
+    )
+
+    validas = [t["tarifa_version_id"] for t, ok in zip(tarifas, matrices.valida) if ok]
+    assert validas == list(esperado.keys())
+    for row, tarifa in enumerate(tarifas):
+        ref = esperado.get(tarifa["tarifa_version_id"])
+        if ref is None:
+            continue
+        for campo in ("coste_energia", "coste_potencia", "total", "ahorro_periodo", "ahorro_anual",
+                      "ahorro_mensual", "ahorro_estructural", "saving_percent"):
+            assert calculo[campo][row].item() == ref[campo], campo  # igualdad exacta, no aproximada
+        assert bool(matrices.potencia_boe[row]) == ref["boe"]
+
+
+@pytest.mark.parametrize("atr", ["2.0TD", "3.0TD"])
+def test_precios_normalizados_al_cargar(atr):
+    tarifas, precios_map = _catalogo_aleatorio(random.Random(11), atr, 80)
+    normalizados = {vid: normalizar_precios(p) for vid, p in precios_map.items()}
+
+    for vid, precios in precios_map.items():
+        version = normalizados[vid]
+        for i in range(1, 7):
+            esperado = _get_precio_energia(precios["energia"], i)
+            assert (np.isnan(version.energia[i - 1]) if esperado is None else version.energia[i - 1] == esperado)
+        assert version.como_dict() == precios  # sin pérdida (misma huella de catálogo)
+
+    desde_dicts = construir_matrices(tarifas, precios_map, atr)
+    desde_versiones = construir_matrices(tarifas, normalizados, atr)
+    for campo in ("energia", "energia_ausente", "potencia", "potencia_ausente", "potencia_boe", "valida", "capa_dominancia"):
+        assert np.array_equal(getattr(desde_dicts, campo), getattr(desde_versiones, campo)), campo
+
+
+@pytest.mark.parametrize("atr", ["2.0TD", "3.0TD"])
+def test_totales_suministros_igual_que_por_suministro(atr):
+    rng = random.Random(23)
+    tarifas, precios_map = _catalogo_aleatorio(rng, atr, 60)
+    matrices = construir_matrices(tarifas, precios_map, atr)
+    num_e, num_p = (3, 2) if atr == "2.0TD" else (6, 6)
+    suministros = [
+        dict(
+            consumos=[round(rng.uniform(0, 900), 2) for _ in range(num_e)],
+            potencias=[round(rng.uniform(2, 20), 3) for _ in range(num_p)],
+            dias=rng.randint(25, 62), alquiler=rng.choice([0.0, 0.81]), ref=rng.uniform(40, 600),
+            factor=rng.choice([None, 11.3]),
+        )
+        for _ in range(7)
+    ]
+
+    lote = calcular_totales_suministros(
+        matrices,
+        consumos=np.array([s["consumos"] for s in suministros]),
+        potencias=np.array([s["potencias"] for s in suministros]),
+        periodo_dias=np.array([float(s["dias"]) for s in suministros]),
+        iva_pct=np.full(len(suministros), 0.21),
+        alquiler=np.array([s["alquiler"] for s in suministros]),
+        total_referencia=np.array([s["ref"] for s in suministros]),
+        factor_anual=np.array([s["factor"] or 30.0 / s["dias"] * 12.0 for s in suministros]),
+    )
+
+    assert lote["total"].shape == (len(tarifas), len(suministros))
+    for col, s in enumerate(suministros):
+        uno = calcular_ofertas_vectorizado(
+            matrices, s["consumos"], s["potencias"], s["dias"], iva_pct=0.21, alquiler=s["alquiler"],
+            total_referencia=s["ref"], subtotal_actual=0.0, factor_anual=s["factor"],
+        )
+        validas = matrices.valida
+        assert np.array_equal(lote["total"][validas, col], uno["total"][validas])
+        assert np.allclose(lote["ahorro_anual"][validas, col], uno["ahorro_anual"][validas], rtol=1e-12)
@@ -0,0 +1,93 @@
+import hashlib
+from datetime import date
+
+import pytest
+
+from app.db.models import Factura, OcrExtraccion
+from app.services import ocr, ocr_cache
+from app.services.ocr_cache import extraer_con_cache, extraer_desde_cache, ocr_cache_stats, reiniciar_stats_ocr_cache
+
+IMAGEN = b"\x89PNG factura escaneada"
+TEXTO_VISION = (
+    "Peaje acceso 2.0TD\n"
+    "Potencia contratada en punta: 4,6 kW\n"
+    "Consumo P1: 17 kWh\n"
+    "Consumo P2: 18 kWh\n"
+    "Consumo P3: 32 kWh\n"
+    "Total a pagar 26,87 €\n"
+)
+
+
+class _Anotacion:
+    description = TEXTO_VISION
+
+
+class _Respuesta:
+    error = None
+    text_annotations = [_Anotacion()]
+
+
+class _VisionFalso:
+    def __init__(self):
+        self.llamadas = 0
+
+    def text_detection(self, image):
+        self.llamadas += 1
+        return _Respuesta()
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    cliente = _VisionFalso()
+    monkeypatch.setattr(ocr, "get_vision_client", lambda: (cliente, ""))
+    reiniciar_stats_ocr_cache()
+    yield cliente
+    reiniciar_stats_ocr_cache()
+
+
+def test_resubida_no_repite_vision(db_catalogo, vision):
+    primero = extraer_con_cache(db_catalogo, IMAGEN)
+    segundo = extraer_con_cache(db_catalogo, IMAGEN)
+
+    assert vision.llamadas == 1
+    assert segundo == primero and primero["consumo_p1_kwh"] == 17
+    fila = db_catalogo.query(OcrExtraccion).one()
+    assert (fila.motor, fila.texto_vision, fila.hits) == ("vision", TEXTO_VISION, 1)
+    assert fila.file_hash == hashlib.sha256(IMAGEN).hexdigest()
+    stats = ocr_cache_stats()
+    assert (stats["misses"], stats["hits"]) == (1, 1)
+
+
+def test_nueva_version_reparsea_textos_guardados(db_catalogo, vision, monkeypatch):
+    file_hash = hashlib.sha256(IMAGEN).hexdigest()
+    assert extraer_desde_cache(db_catalogo, file_hash) is None
+    original = extraer_con_cache(db_catalogo, IMAGEN, file_hash)
+
+    monkeypatch.setattr(ocr_cache, "OCR_PARSER_VERSION", "siguiente")
+    reparseado = extraer_desde_cache(db_catalogo, file_hash)
+
+    assert vision.llamadas == 1
+    assert reparseado == original
+    assert {f.parser_version for f in db_catalogo.query(OcrExtraccion)} == {ocr.OCR_PARSER_VERSION, "siguiente"}
+    assert ocr_cache_stats()["reparseos"] == 1
+
+
+def test_fallo_de_vision_no_se_cachea(db_catalogo, monkeypatch):
+    monkeypatch.setattr(ocr, "get_vision_client", lambda: (None, "sin credenciales"))
+
+    extraer_con_cache(db_catalogo, IMAGEN)
+
+    assert db_catalogo.query(OcrExtraccion).count() == 0
+
+
+def test_guardar_en_savepoint_no_deshace_al_llamador(db_catalogo):
+    db_catalogo.add(Factura(filename="pendiente.pdf"))
+
+    # Fallo de BD (motor NOT NULL): solo se deshace el savepoint de la caché
+    ocr_cache._guardar(db_catalogo, "a" * 64, {"motor": None}, {})
+    # Tipos no JSON (fechas) se serializan como texto
+    ocr_cache._guardar(db_catalogo, "b" * 64, {"motor": "pypdf"}, {"fecha_inicio": date(2025, 1, 1)})
+    db_catalogo.commit()
+
+    assert db_catalogo.query(Factura).filter_by(filename="pendiente.pdf").count() == 1
+    assert [f.resultado for f in db_catalogo.query(OcrExtraccion)] == ['{"fecha_inicio": "2025-01-01"}']
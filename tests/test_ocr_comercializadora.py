@@ -0,0 +1,63 @@
+import pytest
+
+from app.services.ocr import InvoiceDocument, _extract_table_consumos, parse_invoice_text
+from app.services.ocr_comercializadoras import (
+    clasificar_comercializadora,
+    comercializadoras_stats,
+    reiniciar_stats_comercializadoras,
+)
+
+ENDESA = (
+    "Energía XXI\n"
+    "PEDRO SANCHEZ RUIZ\n"
+    "Periodo de facturación: del 01/01/2025 al 31/01/2025 (30 días)\n"
+    "Potencia contratada en punta: 5,75 kW\n"
+    "Punta 168,46 190,22 1,00 0,00 21,76\n"
+    "Llano 100,00 130,50 1,00 0,00 30,50\n"
+    "Valle 200,00 260,00 1,00 0,00 60,00\n"
+    "Consumo total 112,26 kWh\n"
+    "Total factura 45,60 €\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def _limpiar():
+    reiniciar_stats_comercializadoras()
+    yield
+    reiniciar_stats_comercializadoras()
+
+
+def test_clasificacion_por_cabecera_y_cif():
+    assert clasificar_comercializadora(InvoiceDocument.desde_texto(ENDESA)) == "endesa"
+    # El CIF manda aunque la cabecera no nombre la marca
+    assert clasificar_comercializadora(InvoiceDocument.desde_texto("Factura\nCIF: A-95758389\n")) == "iberdrola"
+    # La distribuidora lejos de la cabecera no clasifica
+    lejos = "Factura\n" + "linea\n" * 30 + "Distribuidora: e-distribución (Endesa)\n"
+    assert clasificar_comercializadora(InvoiceDocument.desde_texto(lejos)) is None
+    # Empate entre marcas: cascada genérica
+    assert clasificar_comercializadora(InvoiceDocument.desde_texto("Naturgy\nEndesa\n")) is None
+
+
+def test_juego_especifico_y_fallback():
+    doc = InvoiceDocument.desde_texto(ENDESA)
+    resumen = {}
+    consumos = _extract_table_consumos(doc, "endesa", resumen)
+    assert resumen["consumos_estrategia"] == "especifica"
+    assert (consumos["consumo_p1_kwh"], consumos["consumo_p2_kwh"], consumos["consumo_p3_kwh"]) == (21.76, 30.5, 60.0)
+
+    # Sin tabla HC el juego específico no completa P1-P3 y se repite la cascada genérica
+    resumen = {}
+    assert _extract_table_consumos(doc, "hc_energia", resumen) == _extract_table_consumos(doc)
+    assert resumen["consumos_estrategia"] == "generica"
+
+
+def test_parseo_registra_stats_por_proveedor():
+    result = parse_invoice_text(ENDESA)
+    parse_invoice_text("Total a pagar 26,87 €\n")
+
+    assert result["extraction_summary"]["comercializadora"] == "endesa"
+    assert result["consumo_p1_kwh"] == 21.76
+    stats = comercializadoras_stats()
+    assert stats["endesa"]["facturas"] == 1 and stats["endesa"]["especifica"] == 1
+    assert stats["desconocida"]["facturas"] == 1 and stats["desconocida"]["fallback_generico"] == 0
+    assert stats["endesa"]["max_ms"] > 0
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import CurrentUser, get_current_user
+from app.db.models import Factura, FacturaJob, User
+from app.services import ocr, ocr_jobs
+from tests.test_ocr_cache import IMAGEN, _VisionFalso
+
+
+@pytest.fixture
+def cola(db_catalogo, api_webhook, monkeypatch):
+    """Pool de un hilo que el test puede drenar, sesiones propias y Vision falso."""
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(ocr_jobs, "_pool", pool)
+    monkeypatch.setattr(ocr_jobs, "SESION_JOBS", sessionmaker(bind=db_catalogo.get_bind(), autoflush=False))
+    monkeypatch.setattr(ocr, "get_vision_client", lambda: (_VisionFalso(), ""))
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(1, "dev@x.es", "Dev", "dev", None)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def _subir(api_webhook, pool):
+    r = api_webhook.post("/webhook/upload/jobs", files={"file": ("factura.png", IMAGEN, "image/png")})
+    assert r.status_code == 202
+    pool.submit(lambda: None).result()  # un solo hilo: el job ya terminó
+    return r.json()
+
+
+def test_job_acepta_y_completa(db_catalogo, api_webhook, cola):
+    encolado = _subir(api_webhook, cola)
+    assert encolado["estado"] == "en_cola"
+
+    estado = api_webhook.get(encolado["status_url"]).json()
+    assert estado["estado"] == "completado"
+    factura = db_catalogo.query(Factura).one()
+    assert estado["factura_id"] == estado["resultado"]["id"] == factura.id
+    assert estado["resultado"]["ocr_preview"]["consumo_p1_kwh"] == 17
+
+    eventos = api_webhook.get(encolado["eventos_url"]).text
+    assert eventos.count("event: estado") == 1 and '"estado": "completado"' in eventos
+
+
+def test_job_duplicado_conserva_409(db_catalogo, api_webhook, cola):
+    _subir(api_webhook, cola)
+    duplicado = _subir(api_webhook, cola)
+
+    estado = api_webhook.get(duplicado["status_url"]).json()
+    assert estado["estado"] == "error"
+    assert estado["error"]["status_code"] == 409
+    assert estado["error"]["detail"]["status"] == "duplicate"
+    assert db_catalogo.query(FacturaJob).count() == 2
+    # Jobs de otro usuario no son visibles
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(2, "c@x.es", "Com", "comercial", None)
+    assert api_webhook.get(duplicado["status_url"]).status_code == 404
+
+
+def test_job_visible_para_ceo_de_la_company(db_catalogo, api_webhook, cola):
+    db_catalogo.add(User(id=5, email="com@x.es", name="Com", role="comercial", company_id=10))
+    db_catalogo.commit()
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(5, "com@x.es", "Com", "comercial", 10)
+    encolado = _subir(api_webhook, cola)
+
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(6, "ceo@y.es", "Ceo", "ceo", 20)
+    assert api_webhook.get(encolado["status_url"]).status_code == 404
+    api_webhook.app.dependency_overrides[get_current_user] = lambda: CurrentUser(7, "ceo@x.es", "Ceo", "ceo", 10)
+    assert api_webhook.get(encolado["status_url"]).json()["estado"] == "completado"
+
+
+def test_upload_directo_en_pool(db_catalogo, api_webhook, cola, monkeypatch):
+    # El hilo del pool abre su propia sesión (la de la petición no cruza hilos)
+    sesiones = []
+    fabrica = ocr_jobs.SESION_JOBS
+    monkeypatch.setattr(ocr_jobs, "SESION_JOBS", lambda: sesiones.append(fabrica()) or sesiones[-1])
+
+    r = api_webhook.post("/webhook/upload", files={"file": ("factura.png", IMAGEN, "image/png")})
+
+    assert r.status_code == 200
+    assert r.json()["id"] == db_catalogo.query(Factura).one().id
+    assert len(sesiones) == 1 and sesiones[0] is not db_catalogo
+    assert api_webhook.post("/webhook/upload", files={"file": ("factura.png", IMAGEN, "image/png")}).status_code == 409
@@ -0,0 +1,53 @@
+import re
+
+from app.services.ocr import _extract_table_consumos, parse_invoice_text
+from app.services.ocr_patrones import REGISTRO, escanear_lineas, patrones_registrados
+
+
+def test_registro_precompilado_por_campo():
+    conteo = patrones_registrados()
+    assert {"cups", "atr", "potencias", "consumos", "fechas", "totales"} <= set(conteo)
+    assert all(n > 0 for n in conteo.values())
+
+    def _hojas(valor):
+        if isinstance(valor, dict):
+            return [h for v in valor.values() for h in _hojas(v)]
+        if isinstance(valor, tuple):  # (source, patrón)
+            return _hojas(valor[-1])
+        if isinstance(valor, list):
+            return [h for v in valor for h in _hojas(v)]
+        return [valor]
+
+    # Todo compilado (None = patrón desactivado en la estrategia 0A de tablas)
+    assert all(h is None or isinstance(h, re.Pattern) for h in _hojas(REGISTRO))
+
+
+def test_escaneo_un_recorrido():
+    texto = (
+        "Periodo de facturación: 30 días\r\n"
+        "Potencia P1 4,6 kW\n"
+        "Consumo P1: 17 kWh\n"
+        "Lectura acumulada punta 15974\n"
+        "P2: 18\n"
+        "\n"
+        "28001 Madrid"
+    )
+    escaneo = escanear_lineas(texto)
+
+    assert escaneo.dias == 30
+    # Sin lecturas acumuladas; la línea de potencia entra porque menciona P1 (como antes)
+    assert escaneo.consumo == ["Potencia P1 4,6 kW", "Consumo P1: 17 kWh", "P2: 18"]
+    assert escaneo.tabla_kwh == ["Consumo P1: 17 kWh"]
+    assert escaneo.periodo_suelto == [(2, "18")]
+    assert escaneo.con_codigo_postal == ["Lectura acumulada punta 15974", "28001 Madrid"]
+    # Mismas líneas no vacías que splitlines() sobre el texto completo
+    assert escaneo.no_vacias == [ln.strip() for ln in texto.splitlines() if ln.strip()]
+    assert len(escaneo.lineas) == texto.count("\n") + 1
+
+
+def test_tabla_consumos_por_secciones():
+    texto = "Información de consumo de la factura\nP1 (PUNTA): 59 kWh\nLlano 55,99\nValle 166,72"
+    assert _extract_table_consumos(texto)["consumo_p1_kwh"] == 59.0
+
+    parsed = parse_invoice_text(texto)
+    assert (parsed["consumo_p1_kwh"], parsed["consumo_p2_kwh"], parsed["consumo_p3_kwh"]) == (59.0, 55.99, 166.72)
@@ -0,0 +1,134 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from app.exceptions import DomainError
+from app.services.catalogo_tarifas import CatalogoTarifas
+from app.services.comparador_core import FacturaComparable, calcular_comparacion, reconstruir_factura
+from app.services.optimizador_potencia import (
+    ESCALONES_MONOFASICO,
+    ESCALONES_TRIFASICO,
+    REGLAS_MAXIMETRO,
+    escalones_potencia,
+    optimizar_potencia,
+    potencia_facturada,
+)
+from tests.test_comparador_lote import _factura
+
+
+def _entrada(potencias=(4.6, 4.6)):
+    return FacturaComparable(
+        factura_id=1, atr="2.0TD", num_periodos_energia=3, num_periodos_potencia=2,
+        current_total=110.0, periodo_dias=31, consumos=[80.0, 95.0, 210.0], potencias=list(potencias),
+        iva_pct=0.21, iva_importe=19.09, iee_importe=4.5, alquiler_importe=0.81, alquiler_equipo=0.81,
+    )
+
+
+def _catalogo(n=300, semilla=3):
+    rng = np.random.default_rng(semilla)
+    tarifas = [{"tarifa_version_id": i, "tarifa_id": i} for i in range(n)]
+    precios = {
+        i: {
+            "energia": {f"P{p}": float(rng.uniform(0.08, 0.25)) for p in (1, 2, 3)},
+            "potencia": {"P1": float(rng.uniform(0.0, 0.12)), "P2": float(rng.uniform(0.0, 0.12))},
+        }
+        for i in range(n)
+    }
+    return CatalogoTarifas("2.0TD", None, tarifas, precios, {}, 0), precios
+
+
+def _facturada(contratada, lectura):
+    # Regla del maxímetro escrita a mano (referencia escalar)
+    if lectura is None:
+        return contratada
+    if lectura > 1.05 * contratada:
+        return lectura + 2 * (lectura - 1.05 * contratada)
+    if lectura < 0.85 * contratada:
+        return 0.85 * contratada
+    return lectura
+
+
+@pytest.mark.parametrize("maximetro", [(None, None), (3.1, 5.9), (6.2, 2.0), (None, 3.0)])
+def test_optimo_igual_que_fuerza_bruta(maximetro):
+    entrada = _entrada()
+    catalogo, precios = _catalogo()
+    resultado = optimizar_potencia(entrada, catalogo, maximetro)
+    por_version = {o["tarifa_version_id"]: o for o in resultado["offers"]}
+    assert len(por_version) == len(catalogo.tarifas)
+
+    candidatas = sorted(set(ESCALONES_MONOFASICO) | {4.6})
+    for version, oferta in por_version.items():
+        p = precios[version]
+        energia = sum(c * p["energia"][f"P{i + 1}"] for i, c in enumerate(entrada.consumos))
+        mejor = min(
+            reconstruir_factura(
+                energia + 31 * (_facturada(a, maximetro[0]) * p["potencia"]["P1"]
+                                + _facturada(b, maximetro[1]) * p["potencia"]["P2"]),
+                0.21, 0.81,
+            )
+            for a, b in itertools.product(candidatas, candidatas)
+            if (maximetro[0] is not None or a >= 4.6)
+            and (maximetro[1] is not None or b >= 4.6)
+        )
+        assert oferta["estimated_total"] == round(mejor, 2)
+        assert oferta["ahorro_potencia_periodo"] >= 0
+
+
+def test_sin_maximetro_no_baja_y_coincide_con_comparador():
+    entrada = _entrada((3.45, 5.75))
+    catalogo, _ = _catalogo(50)
+    resultado = optimizar_potencia(entrada, catalogo)
+    comparacion = {o["tarifa_version_id"]: o for o in calcular_comparacion(entrada, catalogo)["offers"]}
+
+    for oferta in resultado["offers"]:
+        assert oferta["potencia_p1_kw"] == 3.45 and oferta["potencia_p2_kw"] == 5.75
+        assert oferta["estimated_total"] == comparacion[oferta["tarifa_version_id"]]["estimated_total"]
+        assert oferta["ahorro_potencia_periodo"] == 0
+    totales = [o["estimated_total"] for o in resultado["offers"]]
+    assert totales == sorted(totales)
+    assert resultado["optimizacion_potencia"]["parejas_evaluadas"] > 1
+
+
+def test_2_0td_admite_p1_mayor_que_p2():
+    # Maxímetro P1 por encima de P2: cada periodo se ajusta por separado
+    entrada = _entrada()
+    catalogo = CatalogoTarifas("2.0TD", None, [{"tarifa_version_id": 1}, {"tarifa_version_id": 2}], {
+        1: {"energia": {"P1": 0.15}, "potencia": {"P1": 0.10, "P2": 0.001}},
+        2: {"energia": {"P1": 0.15}, "potencia": {"P1": 0.001, "P2": 0.10}},
+    }, {}, 0)
+    for oferta in optimizar_potencia(entrada, catalogo, (6.0, 1.0))["offers"]:
+        # Empate 5.75/6.9 (ambas facturan la lectura): se queda la de más margen
+        assert (oferta["potencia_p1_kw"], oferta["potencia_p2_kw"]) == (6.9, 1.15)
+        assert (oferta["potencia_facturada_p1_kw"], oferta["potencia_facturada_p2_kw"]) == (6.0, 1.0)
+
+    # Sin maxímetro y P1 > P2 actual: se mantiene la actual, no hay que igualar P2
+    sin_maximetro = optimizar_potencia(_entrada((5.75, 3.45)), catalogo)
+    for oferta in sin_maximetro["offers"]:
+        assert (oferta["potencia_p1_kw"], oferta["potencia_p2_kw"]) == (5.75, 3.45)
+
+
+def test_regla_maximetro_por_atr(monkeypatch):
+    monkeypatch.setitem(REGLAS_MAXIMETRO, "2.0TD", (0.0, 100.0, 0.0))
+    assert potencia_facturada(np.array([3.45, 5.75]), 4.0).tolist() == [4.0, 4.0]
+    with pytest.raises(DomainError):
+        potencia_facturada(np.array([3.45]), 4.0, "3.0TD")
+
+
+def test_escalones_trifasicos_si_la_potencia_actual_lo_es():
+    assert escalones_potencia([6.928, 6.928]) == ESCALONES_TRIFASICO
+    assert escalones_potencia([4.6, 6.928]) == ESCALONES_MONOFASICO
+
+
+def test_endpoint_potencia(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    tres_td = _factura(db_catalogo, atr="3.0TD", consumo_p4_kwh=1.0, consumo_p5_kwh=1.0, consumo_p6_kwh=1.0)
+
+    r = api_webhook.post(f"/webhook/comparar/facturas/{factura.id}/potencia",
+                         params={"maximetro_p1_kw": 2.9, "maximetro_p2_kw": 3.0, "top_k": 2})
+    assert r.status_code == 200
+    cuerpo = r.json()
+    assert len(cuerpo["offers"]) == 2
+    assert cuerpo["offers"][0]["potencia_p2_kw"] < 4.6
+    assert cuerpo["offers"][0]["ahorro_potencia_periodo"] > 0
+    assert api_webhook.post(f"/webhook/comparar/facturas/{tres_td.id}/potencia").json()["detail"]["code"] == "POTENCIA_SOLO_2_0TD"
@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import text
+
+from app.db.models import Cliente, Factura
+from app.services.catalogo_tarifas import invalidar_catalogo
+from app.services.comparador import compare_factura
+from app.services.propuesta_multisuministro import propuesta_cliente
+from tests.test_comparador_lote import _factura
+
+
+@pytest.fixture
+def cliente(db_catalogo):
+    cliente = Cliente(nombre="Bodegas Test", cups=None)
+    db_catalogo.add(cliente)
+    db_catalogo.commit()
+
+    c = cliente.id
+    _factura(db_catalogo, cliente_id=c, cups="ES0001", total_factura=90.0, total_ajustado=90.0)  # antigua
+    _factura(db_catalogo, cliente_id=c, cups="ES0001", consumo_p1_kwh=300.0)
+    _factura(db_catalogo, cliente_id=c, cups="es0002 ", potencia_p1_kw=3.45, potencia_p2_kw=3.45, periodo_dias=28,
+             total_factura=70.0, total_ajustado=70.0, iva=12.15)
+    _factura(db_catalogo, cliente_id=c, cups="ES0003", atr="3.0TD", consumo_p4_kwh=1.0, consumo_p5_kwh=1.0, consumo_p6_kwh=1.0)
+    _factura(db_catalogo, cliente_id=c, cups="ES0004", total_factura=None, total_ajustado=None)
+    _factura(db_catalogo, cliente_id=c, cups=None)
+    return cliente
+
+
+def test_lote_igual_que_suma_de_comparaciones_individuales(db_catalogo, cliente):
+    resultado = propuesta_cliente(db_catalogo, cliente.id)
+
+    assert resultado["num_suministros"] == 2 and resultado["facturas_sin_cups"] == 1
+    assert sorted((e["cups"], e["error_code"]) for e in resultado["errores"]) == [
+        ("ES0003", "NO_TARIFAS_VIGENTES"), ("ES0004", "TOTAL_INVALID"),
+    ]
+
+    individuales = {}
+    for detalle in resultado["offers"][0]["suministros"]:
+        factura = db_catalogo.get(Factura, detalle["factura_id"])
+        individuales[factura.id] = {
+            o["tarifa_version_id"]: o for o in compare_factura(factura, db_catalogo, persistir=False)["offers"]
+        }
+    assert {d["cups"] for d in resultado["offers"][0]["suministros"]} == {"ES0001", "ES0002"}
+
+    for oferta in resultado["offers"]:
+        for detalle in oferta["suministros"]:
+            individual = individuales[detalle["factura_id"]][detalle["tarifa_version_id"]]
+            assert detalle["estimated_total"] == individual["estimated_total"]
+            assert detalle["saving_amount_annual"] == individual["saving_amount_annual"]
+        assert oferta["estimated_total"] == round(sum(d["estimated_total"] for d in oferta["suministros"]), 2)
+
+    completas = [o["estimated_total"] for o in resultado["offers"] if o["modo_potencia"] == "tarifa"]
+    assert completas == sorted(completas)
+    assert resultado["offers"][-1]["modo_potencia"] == "boe_2025_regulado"  # "Solo Energía" sin potencia
+    assert len(resultado["offers"]) == 4
+
+
+def test_mejor_version_por_comercializadora(db_catalogo, cliente):
+    # Segunda tarifa de Endesa, más barata: el lote debe usarla
+    db_catalogo.execute(text("INSERT INTO tarifas (id, nombre, comercializadora, atr, tipo) VALUES (9, 'Plan Ahorro', 'Endesa', '2.0TD', 'fija')"))
+    db_catalogo.execute(text("INSERT INTO tarifa_versiones (id, tarifa_id, vigente_desde) VALUES (109, 9, '2025-01-01')"))
+    for periodo, valor in (("P1", 0.10), ("P2", 0.10), ("P3", 0.10)):
+        db_catalogo.execute(text(
+            "INSERT INTO tarifa_precios (tarifa_version_id, concepto, periodo, valor) VALUES (109, 'energia', :p, :v)"
+        ), {"p": periodo, "v": valor})
+    for periodo, valor in (("P1", 0.08), ("P2", 0.04)):
+        db_catalogo.execute(text(
+            "INSERT INTO tarifa_precios (tarifa_version_id, concepto, periodo, valor) VALUES (109, 'potencia', :p, :v)"
+        ), {"p": periodo, "v": valor})
+    db_catalogo.commit()
+    invalidar_catalogo()
+
+    resultado = propuesta_cliente(db_catalogo, cliente.id, top_k=2)
+    assert len(resultado["offers"]) == 2
+    mejor = resultado["offers"][0]
+    assert mejor["provider"] == "Endesa"
+    assert [p["tarifa_version_id"] for p in mejor["planes"]] == [109]
+
+
+def test_endpoint_propuesta(db_catalogo, cliente):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.db.conn import get_db
+    from app.routes import clientes
+
+    app = FastAPI()
+    app.include_router(clientes.router)
+    app.dependency_overrides[get_db] = lambda: db_catalogo
+    api = TestClient(app)
+
+    assert api.post("/api/clientes/999/propuesta").status_code == 404
+    cuerpo = api.post(f"/api/clientes/{cliente.id}/propuesta", params={"top_k": 1}).json()
+    assert len(cuerpo["offers"]) == 1 and cuerpo["preview"] is True
@@ -0,0 +1,64 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from app.db.models import Comparativa
+from app.services.comparador import compare_factura
+from app.services.revalorizacion_cartera import revalorizar_cartera
+from tests.test_comparador_lote import _factura
+
+
+def _nueva_version(db, version_id, tarifa_id, energia, potencia):
+    """Publica una versión nueva de la tarifa y cierra la anterior."""
+    db.execute(text("UPDATE tarifa_versiones SET vigente_hasta = :hasta WHERE tarifa_id = :tid"),
+               {"hasta": date(2025, 1, 1), "tid": tarifa_id})
+    db.execute(text("INSERT INTO tarifa_versiones (id, tarifa_id, vigente_desde) VALUES (:id, :tid, :desde)"),
+               {"id": version_id, "tid": tarifa_id, "desde": date(2025, 1, 2)})
+    for concepto, precios in (("energia", energia), ("potencia", potencia)):
+        for periodo, valor in precios.items():
+            db.execute(
+                text("INSERT INTO tarifa_precios (tarifa_version_id, concepto, periodo, valor) VALUES (:v, :c, :p, :x)"),
+                {"v": version_id, "c": concepto, "p": periodo, "x": valor},
+            )
+    db.commit()
+
+
+def _clave(offers):
+    return [(o["tarifa_version_id"], o["estimated_total"], o["saving_amount"], o["tag"]) for o in offers]
+
+
+def test_revalorizacion_incremental_igual_a_recalcular(db_catalogo):
+    facturas = [_factura(db_catalogo), _factura(db_catalogo, consumo_p3_kwh=20.0)]
+    top = _factura(db_catalogo)
+    antes = {f.id: compare_factura(f, db_catalogo) for f in facturas}
+    compare_factura(top, db_catalogo, top_k=2)
+
+    _nueva_version(db_catalogo, 201, 1, {"P1": 0.101, "P2": 0.101, "P3": 0.101}, {"P1": 0.0791, "P2": 0.0347})
+    stats = revalorizar_cartera(db_catalogo, [201], tamano_trozo=2)
+
+    assert stats["revalorizadas"] == 3 and stats["incrementales"] == 2 and stats["completas"] == 1
+    assert stats["errores"] == []
+    # El resto de workers ve la invalidación del catálogo (generación compartida)
+    assert db_catalogo.execute(text("SELECT motivo FROM catalogo_generacion WHERE id = 1")).scalar() == "revalorizacion_cartera"
+    assert {c["factura_id"] for c in stats["cambios_mejor_oferta"]} == {f.id for f in facturas} | {top.id}
+    assert all(c["despues"]["tarifa_version_id"] == 201 for c in stats["cambios_mejor_oferta"])
+
+    for factura in facturas:
+        db_catalogo.refresh(factura)
+        comparativa = db_catalogo.get(Comparativa, factura.ultima_comparativa_id)
+        assert comparativa.id != antes[factura.id]["comparativa_id"]
+        recalculado = compare_factura(factura, db_catalogo, persistir=False)
+        assert _clave(recalculado["offers"]) == _clave(compare_factura(factura, db_catalogo)["offers"])
+        assert compare_factura(factura, db_catalogo)["comparativa_id"] == comparativa.id  # misma huella
+
+    db_catalogo.refresh(top)
+    assert len(compare_factura(top, db_catalogo, top_k=2)["offers"]) == 2
+
+
+def test_version_desconocida_no_toca_nada(db_catalogo):
+    compare_factura(_factura(db_catalogo), db_catalogo)
+
+    stats = revalorizar_cartera(db_catalogo, [999])
+
+    assert stats["revisadas"] == 0 and stats["versiones"] == []
+    assert db_catalogo.query(Comparativa).count() == 1
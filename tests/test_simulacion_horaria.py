@@ -0,0 +1,126 @@
+import json
+import time
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.services.catalogo_tarifas import CatalogoTarifas
+from app.services.comparador_core import FacturaComparable, calcular_comparacion
+from app.services.perfiles_consumo import horas_anio, periodos_2_0td, repartir_consumo_2_0td
+from app.services.simulacion_horaria import TarifasHorarias, simular_entrada_horaria
+from tests.test_comparador_lote import _factura
+
+ANIO = 2026
+
+
+def _escribir_tabla(ruta, columnas, valores):
+    """CSV formato REE (mes;dia;hora 1-24) con una columna por nombre."""
+    inicio = date(ANIO, 1, 1)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(";".join(["Mes", "Día", "Hora"] + columnas) + "\n")
+        for slot in range(horas_anio(ANIO)):
+            dia = date.fromordinal(inicio.toordinal() + slot // 24)
+            celdas = [f"{v[slot]:.6f}".replace(".", ",") for v in valores]
+            f.write(";".join([str(dia.month), str(dia.day), str(slot % 24 + 1)] + celdas) + "\n")
+
+
+@pytest.fixture
+def ficheros(tmp_path):
+    rng = np.random.default_rng(5)
+    horas = horas_anio(ANIO)
+    perfiles = tmp_path / "perfiles"
+    perfiles.mkdir()
+    _escribir_tabla(perfiles / f"perfiles_{ANIO}.csv", ["Coef P2.0TD"], [rng.uniform(0.5, 1.5, horas) / horas])
+
+    horarias = tmp_path / "horarias"
+    horarias.mkdir()
+    codigos = [f"IDX{i:02d}" for i in range(50)]
+    # La última tarifa tiene precio plano: debe coincidir con una tarifa fija equivalente
+    precios = [rng.uniform(0.08, 0.25, horas) for _ in codigos[:-1]] + [np.full(horas, 0.15)]
+    _escribir_tabla(horarias / f"precios_{ANIO}.csv", codigos, precios)
+    (horarias / "tarifas.json").write_text(json.dumps([
+        {"codigo": c, "nombre": f"Indexada {c}", "comercializadora": "Test", "potencia": {"P1": 0.09, "P2": 0.04}}
+        for c in codigos
+    ]))
+    return str(perfiles), str(horarias)
+
+
+def _entrada():
+    return FacturaComparable(
+        factura_id=1, atr="2.0TD", num_periodos_energia=3, num_periodos_potencia=2,
+        current_total=110.0, periodo_dias=31, consumos=[80.0, 95.0, 210.0], potencias=[4.6, 4.6],
+        iva_pct=0.21, iva_importe=19.09, iee_importe=4.5, alquiler_importe=0.81, alquiler_equipo=0.81,
+    )
+
+
+def test_reparto_conserva_consumo_por_periodo(ficheros):
+    perfiles, _ = ficheros
+    inicio = date(ANIO, 12, 15)  # cruza de año: el perfil de 2027 no existe
+    with pytest.raises(FileNotFoundError):
+        repartir_consumo_2_0td([80.0, 95.0, 210.0], inicio, 31, perfiles)
+
+    horario = repartir_consumo_2_0td([80.0, 95.0, 210.0], date(ANIO, 3, 1), 31, perfiles)
+    periodos = periodos_2_0td(ANIO)[59 * 24:90 * 24]
+    assert len(horario) == 31 * 24
+    assert [round(horario[periodos == p].sum(), 9) for p in (1, 2, 3)] == [80.0, 95.0, 210.0]
+    assert (periodos_2_0td(ANIO)[:24] == 3).all()  # 1 de enero: festivo
+
+
+def test_precio_plano_igual_que_tarifa_fija_y_rapido(ficheros):
+    perfiles, horarias = ficheros
+    with open(f"{horarias}/tarifas.json") as f:
+        tarifas = TarifasHorarias(horarias, json.load(f))
+    entrada, inicio = _entrada(), date(ANIO, 3, 1)
+
+    simular_entrada_horaria(entrada, inicio, tarifas, directorio_perfiles=perfiles)  # lee CSV y crea caché .npy
+    t0 = time.perf_counter()
+    resultado = simular_entrada_horaria(entrada, inicio, tarifas, directorio_perfiles=perfiles)
+    assert time.perf_counter() - t0 < 0.1
+
+    assert len(resultado["offers"]) == 50 and resultado["simulacion_horaria"]["horas"] == 31 * 24
+    plana = next(o for o in resultado["offers"] if o["tarifa_id"] == "IDX49")
+
+    fija = CatalogoTarifas("2.0TD", inicio, [{"tarifa_version_id": 1, "tarifa_id": 1}], {
+        1: {"energia": {"P1": 0.15, "P2": 0.15, "P3": 0.15}, "potencia": {"P1": 0.09, "P2": 0.04}},
+    }, {}, 0)
+    assert calcular_comparacion(entrada, fija)["offers"][0]["estimated_total"] == plana["estimated_total"]
+
+
+def test_endpoint_solo_2_0td_con_fechas(db_catalogo, api_webhook):
+    sin_fecha = _factura(db_catalogo)
+    tres_td = _factura(db_catalogo, atr="3.0TD", fecha_inicio="2026-03-01", consumo_p4_kwh=1.0,
+                       consumo_p5_kwh=1.0, consumo_p6_kwh=1.0)
+
+    assert api_webhook.post(f"/webhook/comparar/facturas/{sin_fecha.id}/horaria").json()["detail"]["code"] == "PERIOD_DATES_REQUIRED"
+    assert api_webhook.post(f"/webhook/comparar/facturas/{tres_td.id}/horaria").json()["detail"]["code"] == "HORARIA_SOLO_2_0TD"
+
+
+def test_columnas_exactas_y_cambio_de_hora(tmp_path):
+    from app.services.perfiles_consumo import leer_tabla_horaria
+
+    # t1 no casa con t10 / t11; columna ausente o repetida: error claro
+    ruta = tmp_path / "precios.csv"
+    _escribir_tabla(ruta, ["t10", "t1", "t11"], [np.full(horas_anio(ANIO), v) for v in (0.10, 0.01, 0.11)])
+    assert set(leer_tabla_horaria(str(ruta), ANIO, ["t1"])[0]) == {0.01}
+    with pytest.raises(ValueError, match="no está"):
+        leer_tabla_horaria(str(ruta), ANIO, ["a"])
+    repetida = tmp_path / "repetida.csv"
+    _escribir_tabla(repetida, ["t1", "T 1"], [np.zeros(horas_anio(ANIO))] * 2)
+    with pytest.raises(ValueError, match="2 veces"):
+        leer_tabla_horaria(str(repetida), ANIO, ["t1"])
+
+    # Días de 23 y 25 horas numeradas como REE: cada hora en su slot de reloj
+    cambios = tmp_path / "cambios.csv"
+    with open(cambios, "w", encoding="utf-8") as f:
+        f.write("Mes;Día;Hora;t1\n")
+        for n in range(horas_anio(ANIO) // 24):
+            dia = date.fromordinal(date(ANIO, 1, 1).toordinal() + n)
+            horas = {date(ANIO, 3, 29): 23, date(ANIO, 10, 25): 25}.get(dia, 24)
+            for hora in range(1, horas + 1):
+                f.write(f"{dia.month};{dia.day};{hora};{hora}\n")
+    tabla = leer_tabla_horaria(str(cambios), ANIO, ["t1"])[0]
+    marzo = (date(ANIO, 3, 29) - date(ANIO, 1, 1)).days * 24
+    octubre = (date(ANIO, 10, 25) - date(ANIO, 1, 1)).days * 24
+    assert tabla[marzo:marzo + 24].tolist() == [1, 2, 2] + list(range(3, 24))
+    assert tabla[octubre:octubre + 24].tolist() == [1, 2, 3.5] + list(range(5, 26))
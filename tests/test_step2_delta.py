@@ -0,0 +1,88 @@
+import pytest
+
+from app.db.models import Comparativa, Factura, OfertaCalculada
+from app.services.comparador import compare_factura
+from tests.test_comparador_lote import _factura
+
+
+def _validar(api, factura_id, descuento):
+    body = {"ajustes_comerciales": {"descuento_comercial": {"importe": descuento}}}
+    return api.put(f"/webhook/facturas/{factura_id}/validar", json=body)
+
+
+def test_step2_reajusta_ahorros_sin_duplicar_filas(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    original = compare_factura(factura, db_catalogo)
+    filas_antes = db_catalogo.query(OfertaCalculada).count()
+
+    r = _validar(api_webhook, factura.id, 8.0)
+    assert r.status_code == 200
+    delta = r.json()["comparativa_actualizada"]
+    # Misma comparativa con revision + 1 y las mismas filas de ofertas
+    assert delta["comparativa_id"] == original["comparativa_id"]
+    assert db_catalogo.query(Comparativa).count() == 1
+    assert db_catalogo.query(OfertaCalculada).count() == filas_antes
+    db_catalogo.expire_all()
+    assert db_catalogo.get(Comparativa, original["comparativa_id"]).revision == 1
+    assert db_catalogo.get(Factura, factura.id).ultima_comparativa_id == delta["comparativa_id"]
+
+    # Mismo resultado que una comparación completa con el nuevo total (al céntimo)
+    db_catalogo.refresh(factura)
+    completa = compare_factura(factura, db_catalogo, persistir=False)
+    assert delta["current_total"] == completa["current_total"]
+    for nueva, esperada in zip(delta["offers"], completa["offers"]):
+        assert nueva["tarifa_version_id"] == esperada["tarifa_version_id"]
+        assert nueva["estimated_total"] == esperada["estimated_total"]
+        assert nueva["tag"] == esperada["tag"]
+        assert nueva["saving_amount"] == pytest.approx(esperada["saving_amount"], abs=0.011)
+        assert nueva["saving_amount_annual"] == pytest.approx(esperada["saving_amount_annual"], abs=0.13)
+        assert nueva["saving_amount"] > next(
+            o for o in original["offers"] if o["tarifa_version_id"] == nueva["tarifa_version_id"]
+        )["saving_amount"]
+
+    # Ahorros de ofertas_calculadas reescritos por el UPDATE de conjunto
+    filas = db_catalogo.query(OfertaCalculada).filter_by(comparativa_id=delta["comparativa_id"]).all()
+    assert len(filas) == len(delta["offers"])
+    por_version = {f.tarifa_version_id: f for f in filas}
+    for oferta in delta["offers"]:
+        fila = por_version[oferta["tarifa_version_id"]]
+        assert fila.ahorro_anual == pytest.approx(oferta["saving_amount_annual"], abs=0.011)
+        assert fila.ahorro_mensual == pytest.approx(oferta["saving_amount_monthly"], abs=0.011)
+
+    # La huella re-sellada sirve la comparativa actualizada por memoización
+    db_catalogo.expire_all()
+    memo = compare_factura(factura, db_catalogo)
+    assert memo["comparativa_id"] == delta["comparativa_id"]
+    assert [o["saving_amount"] for o in memo["offers"]] == [o["saving_amount"] for o in delta["offers"]]
+
+
+def test_step2_invalida_etag_de_ultima_comparativa(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    compare_factura(factura, db_catalogo)
+    url = f"/webhook/facturas/{factura.id}/comparativa"
+    antes = api_webhook.get(url)
+    etag = antes.headers["etag"]
+    assert api_webhook.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    delta = _validar(api_webhook, factura.id, 8.0).json()["comparativa_actualizada"]
+
+    despues = api_webhook.get(url, headers={"If-None-Match": etag})
+    assert despues.status_code == 200 and despues.headers["etag"] != etag
+    assert [o["saving_amount"] for o in despues.json()["offers"]] == [o["saving_amount"] for o in delta["offers"]]
+    assert despues.json()["offers"] != antes.json()["offers"]
+
+
+def test_step2_sin_delta_si_cambian_otros_inputs(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    compare_factura(factura, db_catalogo)
+    factura.consumo_p1_kwh = 300.0
+    db_catalogo.commit()
+
+    r = _validar(api_webhook, factura.id, 8.0)
+    assert r.status_code == 200 and r.json()["comparativa_actualizada"] is None
+
+
+def test_step2_sin_comparativa_previa(db_catalogo, api_webhook):
+    factura = _factura(db_catalogo)
+    r = _validar(api_webhook, factura.id, 8.0)
+    assert r.status_code == 200 and r.json()["comparativa_actualizada"] is None